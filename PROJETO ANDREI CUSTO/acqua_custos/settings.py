@@ -43,6 +43,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Primeiro da lista para medir a requisição inteira (ver custos.instrumentacao).
+    'custos.instrumentacao.InstrumentacaoMiddleware',
+    # gzip (e brotli para JSON, se o pacote estiver instalado); ver custos.compressao.
+    'custos.compressao.CompressaoMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -72,6 +76,25 @@ TEMPLATES = [
 WSGI_APPLICATION = 'acqua_custos.wsgi.application'
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# O alias 'analise' guarda o contexto pronto da página de análise. O
+# LocMemCache é por processo; com vários workers, use um backend
+# compartilhado (ex.: FileBasedCache) para que todos aproveitem o cache.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'analise': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'custos-analise',
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 50},
+    },
+}
+
+
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
@@ -79,9 +102,22 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # WAL (ativado uma vez, pela migração 0010_sqlite_wal): as leituras
+            # (análise, status da fila) não esperam a transação de uma ingestão
+            # terminar. Com WAL, synchronous=NORMAL é seguro.
+            'init_command': 'PRAGMA synchronous=NORMAL;',
+            # Transações que vão gravar pegam o lock de escrita já no BEGIN, em
+            # vez de falharem com "database is locked" ao promover uma leitura.
+            'transaction_mode': 'IMMEDIATE',
+            # Tempo (s) de espera por um lock de escrita antes do erro.
+            'timeout': 20,
+        },
     }
 }
 
+# Para produção com PostgreSQL, use DJANGO_SETTINGS_MODULE=acqua_custos.settings_postgres.
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -121,7 +157,135 @@ STATIC_URL = 'static/'
 STATICFILES_DIRS = [
     os.path.join(BASE_DIR, 'static'),
 ]
+
+# Arquivos enviados (uploads aguardando processamento na fila)
+MEDIA_ROOT = BASE_DIR / 'media'
+MEDIA_URL = 'media/'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Configurações do app custos
+
+# Quantidade de linhas gravadas por INSERT em lote durante o upload.
+CUSTOS_INGESTAO_TAMANHO_LOTE = 2000
+
+# Uploads .xlsx/.xlsm são lidos linha a linha (openpyxl read-only) e gravados
+# em lotes, com memória limitada pelo tamanho do lote. Com False, todos os
+# uploads passam por processar_arquivo_excel (pandas).
+CUSTOS_INGESTAO_STREAMING = True
+
+# Pastas .xlsx/.xlsm com várias abas: com True, cada aba vira uma análise
+# ('<nome> - <aba>'), lida em um pool de CUSTOS_INGESTAO_PROCESSOS_ABAS
+# processos (None = um por CPU). Com False, só a primeira aba é lida.
+CUSTOS_INGESTAO_ABAS = False
+CUSTOS_INGESTAO_PROCESSOS_ABAS = None
+
+# Layout de armazenamento dos valores de novos uploads:
+# 'json' (um dicionário por linha em ExpenseData.data) ou
+# 'colunar' (uma matriz float64 por arquivo em ExpenseMatrix).
+CUSTOS_ARMAZENAMENTO = 'json'
+
+# Alias de CACHES usado para o contexto da página de análise.
+CUSTOS_CACHE_ANALISE = 'analise'
+
+# Acima desta quantidade de células (linhas x colunas de dados), a tabela
+# principal da análise é carregada em janelas (modo virtual) em vez de ser
+# renderizada inteira no HTML. ?tabela=virtual|completa força um dos modos.
+CUSTOS_TABELA_VIRTUAL_CELULAS = 200000
+
+# Tamanho máximo de uma janela da tabela principal (endpoint analysis_window).
+CUSTOS_JANELA_MAX_LINHAS = 500
+CUSTOS_JANELA_MAX_COLUNAS = 100
+
+# Uploads processados em segundo plano: o upload só grava o arquivo e cria um
+# UploadJob; a página acompanha o job e abre a análise quando ele termina.
+# Com False, o upload é processado na própria requisição e nenhum despachante
+# é iniciado.
+CUSTOS_UPLOAD_ASSINCRONO = False
+
+# Quantidade máxima de uploads processados ao mesmo tempo por processo. No
+# SQLite as gravações são serializadas, então mais de 1 só ajuda em outros bancos.
+CUSTOS_FILA_TRABALHADORES = 1
+
+# Com True, o despachante da fila roda em uma thread do servidor web. Use False
+# ao rodar o trabalhador em processo separado ('python manage.py processar_fila').
+CUSTOS_FILA_TRABALHADOR_INTERNO = True
+
+# Intervalo (s) entre consultas à fila e tempo (s) após o qual um job ainda
+# em processamento é considerado abandonado e marcado como erro.
+CUSTOS_FILA_INTERVALO = 1.0
+CUSTOS_FILA_TEMPO_LIMITE = 1800
+
+# Quantidade de jobs concluídos considerados nas métricas de tempo da fila.
+CUSTOS_FILA_METRICAS_JANELA = 100
+
+# Quantidade máxima de edições aceitas em um único lote (endpoint update_rows).
+CUSTOS_EDICAO_LOTE_MAXIMO = 5000
+
+# Quantidade máxima de análises em uma comparação (páginas comparison e comparison_data).
+CUSTOS_COMPARACAO_MAX_ARQUIVOS = 60
+
+# Prefixo das ETags da análise, da API de dados e do download (ver
+# custos.condicional). Mude quando uma versão nova do sistema alterar essas
+# respostas sem alterar os dados, para os navegadores e proxies não
+# receberem 304 com a resposta antiga.
+CUSTOS_ETAG_VERSAO = '1'
+
+# Artefatos de exportação (ver custos.artefatos): com True, cada download é
+# gerado uma vez por versão dos dados, guardado em CUSTOS_ARTEFATOS_DIR e
+# enviado do disco; com False, é gerado a cada requisição, sem gravar nada.
+# Acima de CUSTOS_ARTEFATOS_TAMANHO_MAXIMO bytes, os artefatos usados há mais
+# tempo são removidos. O trabalhador da fila gera os formatos de
+# CUSTOS_ARTEFATOS_APOS_UPLOAD logo depois do upload; os demais são gerados
+# no primeiro download. Com CUSTOS_ARTEFATOS_X_ACCEL_REDIRECT (ex.:
+# '/artefatos-internos/', um location 'internal' do nginx com alias para
+# CUSTOS_ARTEFATOS_DIR) o envio do arquivo fica com o nginx.
+CUSTOS_ARTEFATOS = False
+CUSTOS_ARTEFATOS_DIR = BASE_DIR / 'artefatos'
+CUSTOS_ARTEFATOS_TAMANHO_MAXIMO = 1024 ** 3
+CUSTOS_ARTEFATOS_APOS_UPLOAD = ('xlsx',)
+CUSTOS_ARTEFATOS_X_ACCEL_REDIRECT = ''
+
+# Versões assíncronas da análise, da edição de uma linha e do download, para
+# rodar em um servidor ASGI (ex.: 'uvicorn acqua_custos.asgi:application').
+# O trabalho com pandas e a geração do .xlsx vão para um pool com
+# CUSTOS_PROCESSOS_TRABALHADORES processos (0 = em uma thread); com mais de
+# CUSTOS_PROCESSOS_FILA_MAXIMA tarefas pendentes (padrão: 4 por processo) as
+# views respondem 503 com Retry-After de CUSTOS_PROCESSOS_RETRY_AFTER segundos.
+CUSTOS_VIEWS_ASSINCRONAS = False
+CUSTOS_PROCESSOS_TRABALHADORES = 2
+CUSTOS_PROCESSOS_FILA_MAXIMA = None
+CUSTOS_PROCESSOS_RETRY_AFTER = 5
+
+# Instrumentação (custos.instrumentacao): tempos da requisição no cabeçalho
+# Server-Timing, IPs que podem ler o endpoint de métricas do Prometheus e
+# pasta dos perfis gravados com ?perfil=cprofile|pyinstrument (só com DEBUG).
+CUSTOS_SERVER_TIMING = True
+CUSTOS_METRICAS_IPS = ['127.0.0.1', '::1']
+CUSTOS_PERFIL_DIR = BASE_DIR / 'perfis'
+
+# Com True, um log em JSON por requisição (tempos, consultas SQL e trechos)
+# no logger 'custos.instrumentacao'. Com False, o logger só mostra avisos.
+CUSTOS_LOG_REQUISICOES = False
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'mensagem': {'format': '{message}', 'style': '{'},
+    },
+    'handlers': {
+        'instrumentacao': {'class': 'logging.StreamHandler', 'formatter': 'mensagem'},
+    },
+    'loggers': {
+        'custos.instrumentacao': {
+            'handlers': ['instrumentacao'],
+            'level': 'INFO' if CUSTOS_LOG_REQUISICOES else 'WARNING',
+            'propagate': False,
+        },
+    },
+}
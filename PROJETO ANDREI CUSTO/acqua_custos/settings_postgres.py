@@ -0,0 +1,30 @@
+"""
+Perfil de produção com PostgreSQL.
+
+Use com DJANGO_SETTINGS_MODULE=acqua_custos.settings_postgres (requer o
+pacote psycopg). A conexão é configurada pelas variáveis de ambiente
+POSTGRES_DB, POSTGRES_USER, POSTGRES_PASSWORD, POSTGRES_HOST e POSTGRES_PORT.
+"""
+import os
+
+from .settings import *  # noqa: F401,F403
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('POSTGRES_DB', 'acqua_custos'),
+        'USER': os.environ.get('POSTGRES_USER', 'acqua_custos'),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+        'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+        # Conexões persistentes: cada thread do servidor reaproveita a sua
+        # conexão por até CONN_MAX_AGE segundos, em vez de abrir uma por requisição.
+        'CONN_MAX_AGE': int(os.environ.get('CUSTOS_CONN_MAX_AGE', 600)),
+        # Verifica a conexão reaproveitada no início da requisição e reconecta se ela caiu.
+        'CONN_HEALTH_CHECKS': True,
+    }
+}
+
+# No PostgreSQL as ingestões não disputam um lock único do banco, então a
+# fila pode processar mais de um upload ao mesmo tempo.
+CUSTOS_FILA_TRABALHADORES = int(os.environ.get('CUSTOS_FILA_TRABALHADORES', 2))
@@ -0,0 +1,22 @@
+"""
+Benchmarks do app custos.
+
+Os cenários (cenarios) rodam sobre um banco de teste descartável, nunca
+sobre o db.sqlite3 do projeto, e são executados na pasta do projeto com
+
+    python -m benchmarks <cenario> [opções]
+
+Com --json os resultados são gravados em um arquivo (resultados) e com
+--comparar comparados com os de uma execução anterior.
+
+Os cenários medem só o código do commit em que são executados. Para medir
+uma mudança, execute o mesmo cenário no commit anterior e no novo, por
+exemplo com um git worktree do commit anterior:
+
+    git worktree add ../custos-antes <commit>
+    (cd "../custos-antes/PROJETO ANDREI CUSTO" && python -m benchmarks ingestao --json /tmp/antes.json)
+    python -m benchmarks ingestao --comparar /tmp/antes.json
+
+O commit anterior precisa já ter o cenário; as versões anteriores aos
+cenários não são mais reproduzidas aqui.
+"""
@@ -0,0 +1,192 @@
+"""
+Executa um cenário de benchmark: 'python -m benchmarks <cenario> [opções]',
+na pasta do projeto (a do manage.py). 'python -m benchmarks -h' lista os
+cenários e 'python -m benchmarks <cenario> -h' as opções de cada um.
+"""
+import argparse
+import os
+import sys
+
+
+def _linhas(*padrao, ajuda=None):
+    # --linhas com vários valores: um resultado por quantidade de linhas.
+    return '--linhas', {'dest': 'tamanhos', 'type': int, 'nargs': '+', 'default': list(padrao), 'help': ajuda}
+
+
+def _inteiro(nome, padrao, ajuda=None, **opcoes):
+    return nome, {'type': int, 'default': padrao, 'help': ajuda, **opcoes}
+
+
+def _fracao_texto():
+    return '--fracao-texto', {
+        'type': float, 'default': 0.2, 'help': "Fração dos valores gravados como texto em moeda.",
+    }
+
+
+def _armazenamento():
+    return '--armazenamento', {'choices': ['json', 'colunar'], 'default': 'json'}
+
+
+AREAS = _inteiro('--areas', 10)
+COLUNAS_POR_AREA = _inteiro('--colunas-por-area', 4)
+REPETICOES = _inteiro('--repeticoes', 3)
+TAMANHO_LOTE = _inteiro('--tamanho-lote', None)
+
+# Cenário: (função em benchmarks.cenarios, ajuda, argumentos). O destino de
+# cada argumento é o nome do parâmetro da função.
+CENARIOS = {
+    'ingestao': ('benchmark_ingestao', "Tempo de gravação das linhas no upload.", [
+        _linhas(1000, 10000, 100000), AREAS, COLUNAS_POR_AREA, TAMANHO_LOTE,
+    ]),
+    'armazenamento': ('benchmark_armazenamento', "Layout JSON x colunar: tamanho no banco e tempo da análise.", [
+        _linhas(1000, 10000), AREAS, COLUNAS_POR_AREA, REPETICOES,
+    ]),
+    'tabela': ('benchmark_tabela', "Renderização da tabela principal em HTML.", [
+        _inteiro('--linhas', 5000), _inteiro('--colunas', 200),
+    ]),
+    'memoria': ('benchmark_memoria_ingestao', "Pico de memória do upload: pandas x leitura em streaming.", [
+        _linhas(5000, 20000), AREAS, COLUNAS_POR_AREA, TAMANHO_LOTE,
+    ]),
+    'janela': ('benchmark_janela', "Janela da tabela principal (modo virtual) x tabela completa.", [
+        _linhas(1000, 5000, 20000), _inteiro('--areas', 50), COLUNAS_POR_AREA, REPETICOES,
+        _inteiro('--limite', 60, "Linhas por janela."),
+        _inteiro('--colunas-janela', 12, "Colunas de dados por janela."),
+    ]),
+    'exportacao': ('benchmark_exportacao', "Pico de memória do download .xlsx/CSV em streaming.", [
+        _linhas(5000, 20000), AREAS, COLUNAS_POR_AREA,
+    ]),
+    'contas': ('benchmark_contas', "Valores por conta do modal: groupby de todas x uma conta sob demanda.", [
+        _inteiro('--linhas', 20000), _inteiro('--contas', 5000), AREAS, COLUNAS_POR_AREA, REPETICOES,
+    ]),
+    'resumos': ('benchmark_resumos', "Resumos da análise a partir dos agregados materializados.", [
+        _linhas(1000, 10000), _inteiro('--areas', 50), COLUNAS_POR_AREA, REPETICOES,
+    ]),
+    'endpoints': ('benchmark_endpoints', "Consultas SQL e latência dos principais endpoints.", [
+        _inteiro('--linhas', 5000), AREAS, COLUNAS_POR_AREA, _inteiro('--repeticoes', 5),
+    ]),
+    'edicao': ('benchmark_edicao', "Edição de N linhas: uma requisição por linha x lote.", [
+        _inteiro('--linhas', 5000), _inteiro('--lotes', [1, 50, 200], nargs='+'), AREAS, COLUNAS_POR_AREA,
+        _armazenamento(),
+    ]),
+    'redistribuicao': ('benchmark_redistribuicao', "Redistribuição de totais pelo motor vetorizado.", [
+        _linhas(1, 1000, 10000), _inteiro('--colunas', 300), REPETICOES,
+    ]),
+    'conversao': ('benchmark_conversao', "Conversão das células em números, em bloco vetorizado.", [
+        _linhas(10000, 50000), _inteiro('--colunas', 40), _fracao_texto(), REPETICOES,
+    ]),
+    'duplicado': ('benchmark_duplicado', "Upload repetido: processar a planilha de novo x copiar a análise existente.", [
+        _linhas(1000, 10000), AREAS, COLUNAS_POR_AREA, _armazenamento(),
+    ]),
+    'suite': (
+        'benchmark_suite',
+        "Upload, análise, edição e download de uma planilha sintética: tempo e pico de memória.",
+        [
+            _linhas(1000, 10000), AREAS, COLUNAS_POR_AREA,
+            _inteiro('--total-a-cada', 1000, "Uma linha de TOTAL a cada N linhas (0 para nenhuma)."),
+            _fracao_texto(), REPETICOES, _inteiro('--lote', 50, "Edições da etapa de edição em lote."),
+            ('--sem-streaming', {'dest': 'streaming', 'action': 'store_false', 'help': "Upload pelo caminho com pandas."}),
+        ],
+    ),
+    'concorrencia': (
+        'benchmark_concorrencia',
+        "Clientes simultâneos: views síncronas (WSGI) x assíncronas com pool de processos (ASGI).",
+        [
+            _inteiro('--linhas', 10000, "Linhas do arquivo dos downloads."),
+            _inteiro('--linhas-pequeno', 500, "Linhas do arquivo das análises e edições."),
+            AREAS, COLUNAS_POR_AREA, _inteiro('--clientes', [1, 4, 16], nargs='+'),
+            _inteiro('--requisicoes', 40, "Requisições por rodada."),
+            _inteiro('--lentas-a-cada', 5, "Um download .xlsx a cada N requisições (0 para nenhum)."),
+            _inteiro('--trabalhadores', 2, "Processos do pool (0 = thread)."),
+        ],
+    ),
+    'payload': (
+        'benchmark_payload',
+        "Bytes da análise e das edições: HTML do servidor x dados (sem compressão, gzip, brotli).",
+        [_inteiro('--linhas', 5000), AREAS, COLUNAS_POR_AREA, _inteiro('--lote', 50, "Edições da edição em lote.")],
+    ),
+    'comparacao': ('benchmark_comparacao', "Comparação entre N análises, sobre os agregados empilhados.", [
+        _inteiro('--arquivos', [2, 12, 24], "Análises comparadas.", nargs='+'),
+        _inteiro('--linhas', 10000, "Linhas de cada análise."), _inteiro('--contas', 2000), AREAS, COLUNAS_POR_AREA,
+        REPETICOES,
+    ]),
+    'abas': ('benchmark_abas', "Pasta com várias abas: leitura em sequência x pool de processos, e ingestão.", [
+        _inteiro('--abas', 20), _inteiro('--linhas', 2000, "Linhas de cada aba."), AREAS, COLUNAS_POR_AREA,
+        _inteiro('--processos', [1, 2, 4], nargs='+'), _fracao_texto(),
+    ]),
+    'condicional': (
+        'benchmark_condicional',
+        "Análise, API de dados e download: resposta completa x 304 (If-None-Match).",
+        [_inteiro('--linhas', 5000), AREAS, COLUNAS_POR_AREA, _inteiro('--repeticoes', 5)],
+    ),
+    'artefatos': (
+        'benchmark_artefatos',
+        "Download: planilha gerada a cada vez x artefato gerado uma vez e enviado do disco.",
+        [_inteiro('--linhas', 5000), AREAS, COLUNAS_POR_AREA, _inteiro('--repeticoes', 5)],
+    ),
+}
+
+
+def criar_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description="Executa os benchmarks do app custos em um banco de teste descartável.",
+    )
+    subparsers = parser.add_subparsers(dest='cenario', required=True)
+    for cenario, (_, ajuda, argumentos) in CENARIOS.items():
+        subparser = subparsers.add_parser(cenario, help=ajuda)
+        for nome, opcoes in argumentos:
+            subparser.add_argument(nome, **opcoes)
+        subparser.add_argument('--json', metavar='ARQUIVO', help="Grava os resultados neste arquivo JSON.")
+        subparser.add_argument(
+            '--comparar', metavar='ARQUIVO', help="Compara com os resultados gravados por um --json anterior.",
+        )
+    return parser
+
+
+def imprimir_tabela(resultados):
+    if not resultados:
+        return
+    colunas = list(resultados[0].keys())
+    larguras = {c: max(len(c), *(len(str(r[c])) for r in resultados)) for c in colunas}
+    print('  '.join(c.ljust(larguras[c]) for c in colunas))
+    for r in resultados:
+        print('  '.join(str(r[c]).ljust(larguras[c]) for c in colunas))
+
+
+def main(argv=None):
+    parser = criar_parser()
+    parametros = vars(parser.parse_args(argv))
+    cenario = parametros.pop('cenario')
+    arquivo_json = parametros.pop('json')
+    arquivo_comparado = parametros.pop('comparar')
+
+    # O Django só é carregado depois dos argumentos, para que o -h não dependa dele.
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'acqua_custos.settings')
+    import django
+    django.setup()
+    from . import cenarios, resultados as arquivo_resultados
+
+    anteriores = None
+    if arquivo_comparado:
+        try:
+            anteriores = arquivo_resultados.carregar_resultados(arquivo_comparado)
+        except (OSError, ValueError) as e:
+            parser.error(f"Não foi possível ler '{arquivo_comparado}': {e}")
+
+    funcao = getattr(cenarios, CENARIOS[cenario][0])
+    with cenarios.banco_temporario():
+        resultados = funcao(**parametros)
+        if arquivo_json:
+            arquivo_resultados.salvar_resultados(arquivo_json, cenario, parametros, resultados)
+
+    imprimir_tabela(resultados)
+    if arquivo_json:
+        print(f"Resultados gravados em {arquivo_json}.")
+    if anteriores is not None:
+        print()
+        print(f"Comparação com {arquivo_comparado} ({anteriores.get('data', 'sem data')}):")
+        imprimir_tabela(arquivo_resultados.comparar_resultados(anteriores.get('resultados', []), resultados))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,1243 @@
+"""
+Cenários de benchmark do app custos.
+
+Cada cenário mede o código atual sobre dados sintéticos (ver dados) em um
+banco de teste descartável (banco_temporario) e retorna uma lista de
+linhas de resultado. Os cenários são executados por 'python -m benchmarks'.
+"""
+import asyncio
+import importlib
+import json
+import logging
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+from django.db import connection, connections, transaction
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+from custos.armazenamento import ARMAZENAMENTO_COLUNAR, ARMAZENAMENTO_JSON, carregar_matriz
+from custos.ingestao import ingerir_resultado, ingerir_planilha_streaming
+from custos.models import UploadedFile
+
+from .dados import gerar_planilha_sintetica, gerar_resultado_sintetico, gerar_tabela_sintetica, moeda_suja
+
+
+@contextmanager
+def banco_temporario():
+    """
+    Cria um banco de teste para o benchmark e o destrói ao final.
+
+    No SQLite o banco é gravado em um arquivo temporário (e não em memória)
+    para que o custo de fsync de cada transação apareça nas medições. Os
+    artefatos de exportação também vão para um diretório temporário.
+    """
+    caminho = None
+    if connection.vendor == 'sqlite':
+        caminho = os.path.join(tempfile.mkdtemp(prefix='custos_bench_'), 'bench.sqlite3')
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = caminho
+
+    nome_original = connection.settings_dict['NAME']
+    artefatos = tempfile.mkdtemp(prefix='custos_artefatos_')
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        with override_settings(CUSTOS_ARTEFATOS_DIR=artefatos):
+            yield
+    finally:
+        connection.creation.destroy_test_db(nome_original, verbosity=0)
+        shutil.rmtree(artefatos, ignore_errors=True)
+        if caminho and os.path.exists(caminho):
+            os.remove(caminho)
+
+
+def benchmark_ingestao(tamanhos, areas=10, colunas_por_area=4, tamanho_lote=None):
+    """
+    Mede o tempo de ingestão para cada quantidade de linhas em 'tamanhos'.
+    """
+    resultados = []
+    for linhas in tamanhos:
+        resultado = gerar_resultado_sintetico(linhas, areas, colunas_por_area)
+
+        inicio = time.perf_counter()
+        ingerir_resultado(f'bench {linhas}', resultado, tamanho_lote=tamanho_lote, progresso=lambda *a: None)
+        tempo_lote = time.perf_counter() - inicio
+
+        with transaction.atomic():
+            UploadedFile.objects.all().delete()
+
+        resultados.append({
+            'cenario': 'ingestao',
+            'linhas': linhas,
+            'colunas': len(resultado['colunas_dados']),
+            'tempo_lote_s': round(tempo_lote, 4),
+            'linhas_por_s': round(linhas / tempo_lote) if tempo_lote else None,
+        })
+    return resultados
+
+
+def _tamanho_banco():
+    """
+    Tamanho do banco em bytes após um VACUUM (apenas SQLite; None nos demais).
+    """
+    if connection.vendor != 'sqlite':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('VACUUM')
+        cursor.execute('PRAGMA page_count')
+        paginas = cursor.fetchone()[0]
+        cursor.execute('PRAGMA page_size')
+        return paginas * cursor.fetchone()[0]
+
+
+def _medir(funcao, repeticoes):
+    """
+    Retorna o menor tempo (em segundos) entre 'repeticoes' execuções.
+    """
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return min(tempos)
+
+
+def benchmark_armazenamento(tamanhos, areas=10, colunas_por_area=4, repeticoes=3):
+    """
+    Compara os layouts JSON e colunar: espaço ocupado no banco, tempo de
+    leitura da matriz e tempo total de montagem do contexto da análise.
+    """
+    from custos.views import _get_analysis_context
+
+    resultados = []
+    for linhas in tamanhos:
+        resultado = gerar_resultado_sintetico(linhas, areas, colunas_por_area)
+        for armazenamento in (ARMAZENAMENTO_JSON, ARMAZENAMENTO_COLUNAR):
+            tamanho_inicial = _tamanho_banco()
+            with override_settings(CUSTOS_ARMAZENAMENTO=armazenamento):
+                uploaded_file = ingerir_resultado(f'bench {linhas}', resultado, progresso=lambda *a: None)
+            tamanho_final = _tamanho_banco()
+
+            tempo_leitura = _medir(lambda: carregar_matriz(uploaded_file), repeticoes)
+            tempo_analise = _medir(lambda: _get_analysis_context(uploaded_file), repeticoes)
+
+            with transaction.atomic():
+                UploadedFile.objects.all().delete()
+
+            resultados.append({
+                'cenario': 'armazenamento',
+                'layout': armazenamento,
+                'linhas': linhas,
+                'colunas': len(resultado['colunas_dados']),
+                'bytes_banco': (tamanho_final - tamanho_inicial) if tamanho_final is not None else None,
+                'leitura_s': round(tempo_leitura, 4),
+                'analise_s': round(tempo_analise, 4),
+            })
+    return resultados
+
+
+def benchmark_tabela(linhas=5000, colunas=200):
+    """
+    Tempo da renderização da tabela principal em HTML
+    (preparar_tabela_principal_html) e tamanho do HTML gerado.
+    """
+    from custos.views import preparar_tabela_principal_html
+
+    df, colunas_dados = gerar_tabela_sintetica(linhas, colunas)
+
+    inicio = time.perf_counter()
+    html = preparar_tabela_principal_html(df, colunas_dados)
+    tempo_lote = time.perf_counter() - inicio
+
+    return [{
+        'cenario': 'tabela',
+        'linhas': linhas,
+        'colunas': colunas,
+        'celulas': linhas * colunas,
+        'bytes_html': len(html),
+        'tempo_lote_s': round(tempo_lote, 4),
+    }]
+
+
+def benchmark_janela(tamanhos, areas=50, colunas_por_area=4, limite=60, colunas_janela=12, repeticoes=3):
+    """
+    Compara a resposta do endpoint de janela (modo virtual) com a tabela
+    principal completa: bytes enviados e tempo de geração. A janela deve
+    ficar praticamente constante enquanto a tabela completa cresce.
+    """
+    from custos.views import _get_analysis_context, analysis_window_view
+
+    fabrica = RequestFactory()
+    resultados = []
+    for linhas in tamanhos:
+        resultado = gerar_resultado_sintetico(linhas, areas, colunas_por_area)
+        for armazenamento in (ARMAZENAMENTO_JSON, ARMAZENAMENTO_COLUNAR):
+            with override_settings(CUSTOS_ARMAZENAMENTO=armazenamento):
+                uploaded_file = ingerir_resultado(f'bench {linhas}', resultado, progresso=lambda *a: None)
+
+            # Janela no meio da planilha, como no meio de uma rolagem.
+            request = fabrica.get('/', {
+                'offset': linhas // 2, 'limit': limite, 'col_start': 8, 'col_end': 8 + colunas_janela,
+            })
+            respostas = []
+            tempo_janela = _medir(
+                lambda: respostas.append(analysis_window_view(request, uploaded_file.file_id)), repeticoes
+            )
+            contextos = []
+            tempo_completa = _medir(lambda: contextos.append(_get_analysis_context(uploaded_file)), 1)
+
+            with transaction.atomic():
+                UploadedFile.objects.all().delete()
+
+            resultados.append({
+                'cenario': 'janela',
+                'layout': armazenamento,
+                'linhas': linhas,
+                'colunas': len(resultado['colunas_dados']),
+                'bytes_janela': len(respostas[-1].content),
+                'tempo_janela_s': round(tempo_janela, 4),
+                'bytes_tabela_completa': len(contextos[-1]['df_original']),
+                'tempo_contexto_completo_s': round(tempo_completa, 4),
+            })
+    return resultados
+
+
+def _medir_memoria(funcao):
+    """
+    Executa 'funcao' e retorna (resultado, pico de memória em MB alocado pelo
+    Python durante a execução, segundo o tracemalloc).
+    """
+    tracemalloc.start()
+    try:
+        resultado = funcao()
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return resultado, pico / 1024 / 1024
+
+
+def benchmark_memoria_ingestao(tamanhos, areas=10, colunas_por_area=4, tamanho_lote=None):
+    """
+    Compara o upload com pandas (processar_arquivo_excel + ingerir_resultado)
+    com a ingestão em streaming (ingerir_planilha_streaming) sobre o mesmo
+    .xlsx sintético: pico de memória e tempo, do arquivo até o banco.
+    """
+    from custos.views import processar_arquivo_excel
+
+    resultados = []
+    pasta = tempfile.mkdtemp(prefix='custos_bench_')
+    for linhas in tamanhos:
+        caminho = gerar_planilha_sintetica(
+            os.path.join(pasta, f'planilha_{linhas}.xlsx'), linhas, areas, colunas_por_area,
+        )
+
+        def pandas_():
+            with open(caminho, 'rb') as arquivo:
+                resultado = processar_arquivo_excel(arquivo)
+                return ingerir_resultado(f'bench {linhas}', resultado, tamanho_lote=tamanho_lote, progresso=lambda *a: None)
+
+        def streaming():
+            with open(caminho, 'rb') as arquivo:
+                return ingerir_planilha_streaming(
+                    f'bench {linhas}', arquivo, tamanho_lote=tamanho_lote, progresso=lambda *a: None,
+                )
+
+        medicoes = {}
+        for nome, funcao in (('pandas', pandas_), ('streaming', streaming)):
+            # Com DEBUG o Django guarda o SQL de cada consulta, o que distorce a medição.
+            with override_settings(DEBUG=False):
+                # O tempo é medido sem o tracemalloc, que deixa a execução bem mais lenta.
+                tempo = _medir(funcao, 1)
+                uploaded_file, pico = _medir_memoria(funcao)
+            medicoes[nome] = (tempo, pico, uploaded_file.aggregates.grand_total)
+            with transaction.atomic():
+                UploadedFile.objects.all().delete()
+
+        os.remove(caminho)
+        resultados.append({
+            'cenario': 'memoria',
+            'linhas': linhas,
+            'colunas': areas * colunas_por_area,
+            'pico_pandas_mb': round(medicoes['pandas'][1], 1),
+            'pico_streaming_mb': round(medicoes['streaming'][1], 1),
+            'tempo_pandas_s': round(medicoes['pandas'][0], 3),
+            'tempo_streaming_s': round(medicoes['streaming'][0], 3),
+            'mesmo_total': abs(medicoes['pandas'][2] - medicoes['streaming'][2]) < 0.01,
+        })
+    os.rmdir(pasta)
+    return resultados
+
+
+def benchmark_exportacao(tamanhos, areas=10, colunas_por_area=4):
+    """
+    Download em streaming (.xlsx em constant_memory e CSV): pico de memória,
+    tempo e bytes gerados. O pico deve ficar estável com o número de linhas.
+    """
+    from custos.views import download_file_view
+
+    fabrica = RequestFactory()
+    resultados = []
+    for linhas in tamanhos:
+        resultado = gerar_resultado_sintetico(linhas, areas, colunas_por_area)
+        uploaded_file = ingerir_resultado(f'bench {linhas}', resultado, progresso=lambda *a: None)
+
+        def baixar(formato):
+            def funcao():
+                response = download_file_view(fabrica.get('/', {'formato': formato}), uploaded_file.file_id)
+                try:
+                    return sum(len(bloco) for bloco in response.streaming_content)
+                finally:
+                    response.close()
+            return funcao
+
+        medicoes = {}
+        for nome, funcao in (
+            ('xlsx', baixar('xlsx')),
+            ('csv', baixar('csv')),
+        ):
+            with override_settings(DEBUG=False):
+                tempo = _medir(funcao, 1)
+                tamanho, pico = _medir_memoria(funcao)
+            medicoes[nome] = (tempo, pico, tamanho)
+
+        with transaction.atomic():
+            UploadedFile.objects.all().delete()
+
+        linha = {'cenario': 'exportacao', 'linhas': linhas, 'colunas': areas * colunas_por_area}
+        for nome, (tempo, pico, tamanho) in medicoes.items():
+            linha[f'pico_{nome}_mb'] = round(pico, 1)
+            linha[f'tempo_{nome}_s'] = round(tempo, 3)
+            linha[f'kb_{nome}'] = tamanho // 1024
+        resultados.append(linha)
+    return resultados
+
+
+def benchmark_contas(linhas=20000, contas=5000, areas=10, colunas_por_area=4, repeticoes=3):
+    """
+    Dados do modal por conta: todas as contas com um único groupby x uma
+    conta buscada sob demanda no endpoint, que substitui o JSON de todas as
+    contas embutido na página.
+    """
+    from custos.views import agrupar_valores_por_conta, analysis_account_view
+
+    resultado = gerar_resultado_sintetico(linhas, areas, colunas_por_area, contas=contas)
+    uploaded_file = ingerir_resultado('bench contas', resultado, progresso=lambda *a: None)
+    matriz = carregar_matriz(uploaded_file)
+    colunas = matriz['colunas']
+    df_despesas_only = pd.DataFrame(matriz['valores'], columns=colunas, copy=False)
+
+    agrupados = []
+    tempo_groupby = _medir(
+        lambda: agrupados.append(agrupar_valores_por_conta(matriz['contas'], df_despesas_only, colunas)), repeticoes
+    )
+    linha = {
+        'cenario': 'contas',
+        'linhas': linhas,
+        'contas': len(agrupados[-1]),
+        'colunas': len(colunas),
+        'tempo_groupby_s': round(tempo_groupby, 4),
+    }
+
+    request = RequestFactory().get('/', {'conta': matriz['contas'][len(matriz['contas']) // 2]})
+    respostas = []
+    linha['tempo_uma_conta_s'] = round(
+        _medir(lambda: respostas.append(analysis_account_view(request, uploaded_file.file_id)), repeticoes), 4
+    )
+    linha['kb_uma_conta'] = round(len(respostas[-1].content) / 1024, 1)
+    linha['kb_todas_contas'] = round(len(json.dumps(agrupados[-1])) / 1024, 1)
+
+    with transaction.atomic():
+        UploadedFile.objects.all().delete()
+    return [linha]
+
+
+def benchmark_resumos(tamanhos, areas=50, colunas_por_area=4, repeticoes=3):
+    """
+    Resumos da análise (total geral, análises por área e por conta), lidos
+    dos agregados materializados: tempo e consultas.
+    """
+    from django.test.utils import CaptureQueriesContext
+    from custos.views import _get_analysis_context
+
+    resultados = []
+    for linhas in tamanhos:
+        resultado = gerar_resultado_sintetico(linhas, areas, colunas_por_area)
+        for armazenamento in (ARMAZENAMENTO_JSON, ARMAZENAMENTO_COLUNAR):
+            with override_settings(CUSTOS_ARMAZENAMENTO=armazenamento):
+                uploaded_file = ingerir_resultado(f'bench {linhas}', resultado, progresso=lambda *a: None)
+
+            with CaptureQueriesContext(connection) as consultas:
+                tempo_agregados = _medir(lambda: _get_analysis_context(uploaded_file, tabela_principal=False), repeticoes)
+
+            with transaction.atomic():
+                UploadedFile.objects.all().delete()
+
+            resultados.append({
+                'cenario': 'resumos',
+                'layout': armazenamento,
+                'linhas': linhas,
+                'colunas': len(resultado['colunas_dados']),
+                'tempo_agregados_s': round(tempo_agregados, 4),
+                'consultas_agregados': len(consultas) // repeticoes,
+            })
+    return resultados
+
+
+def benchmark_endpoints(linhas=5000, areas=10, colunas_por_area=4, repeticoes=5):
+    """
+    Consultas SQL e latência (mediana e máxima) dos principais endpoints,
+    chamados pelo cliente de teste do Django (com middlewares e templates).
+    """
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext
+    from django.urls import reverse
+    from custos.cache_analise import remover_contexto
+
+    resultado = gerar_resultado_sintetico(linhas, areas, colunas_por_area)
+    uploaded_file = ingerir_resultado('bench endpoints', resultado, progresso=lambda *a: None)
+    file_id = uploaded_file.file_id
+    rnd = random.Random(42)
+    cliente = Client()
+
+    def conteudo(response):
+        return b''.join(response.streaming_content) if response.streaming else response.content
+
+    def analise_sem_cache(tabela):
+        def funcao():
+            remover_contexto(UploadedFile.objects.get(pk=file_id))
+            return cliente.get(reverse('analyze_data', args=[file_id]), {'tabela': tabela})
+        return funcao
+
+    endpoints = [
+        ('lista_uploads', lambda: cliente.get(reverse('upload_file'))),
+        ('analise_sem_cache', analise_sem_cache('completa')),
+        ('analise_virtual_sem_cache', analise_sem_cache('virtual')),
+        ('analise_com_cache', lambda: cliente.get(reverse('analyze_data', args=[file_id]), {'tabela': 'completa'})),
+        ('janela', lambda: cliente.get(
+            reverse('analysis_window', args=[file_id]), {'offset': linhas // 2, 'limit': 60, 'col_end': 12},
+        )),
+        ('conta', lambda: cliente.get(reverse('analysis_account', args=[file_id]), {'conta': 'CONTA 0042'})),
+        ('edicao_linha', lambda: cliente.post(
+            reverse('update_row_total', args=[file_id]),
+            json.dumps({'id_excel': str(rnd.randint(1, linhas)), 'new_total': round(rnd.uniform(1, 10000), 2)}),
+            content_type='application/json',
+        )),
+        ('download_xlsx', lambda: cliente.get(reverse('download_file_view', args=[file_id]))),
+        ('download_csv', lambda: cliente.get(reverse('download_file_view', args=[file_id]), {'formato': 'csv'})),
+    ]
+
+    resultados = []
+    with override_settings(ALLOWED_HOSTS=['testserver']):
+        for nome, funcao in endpoints:
+            # O log de consultas do Django guarda no máximo 9000 entradas e já
+            # está cheio depois da ingestão; sem limpar, a contagem fica em zero.
+            connection.queries_log.clear()
+            with CaptureQueriesContext(connection) as consultas:
+                response = funcao()
+                conteudo(response)
+            if response.status_code != 200:
+                raise RuntimeError(f"{nome} respondeu {response.status_code}")
+
+            tempos = []
+            for _ in range(repeticoes):
+                inicio = time.perf_counter()
+                conteudo(funcao())
+                tempos.append(time.perf_counter() - inicio)
+
+            resultados.append({
+                'cenario': 'endpoints',
+                'endpoint': nome,
+                'linhas': linhas,
+                'consultas': len(consultas),
+                'latencia_mediana_ms': round(statistics.median(tempos) * 1000, 1),
+                'latencia_max_ms': round(max(tempos) * 1000, 1),
+            })
+
+    with transaction.atomic():
+        UploadedFile.objects.all().delete()
+    return resultados
+
+
+def benchmark_edicao(linhas=5000, lotes=(1, 50, 200), areas=10, colunas_por_area=4, armazenamento=ARMAZENAMENTO_JSON):
+    """
+    Edição de N linhas: N chamadas a update_row_total (uma por linha) x uma
+    única chamada a update_rows com as N edições. Mede tempo total e
+    consultas SQL, pelo cliente de teste do Django.
+    """
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext
+    from django.urls import reverse
+
+    resultado = gerar_resultado_sintetico(linhas, areas, colunas_por_area)
+    with override_settings(CUSTOS_ARMAZENAMENTO=armazenamento):
+        uploaded_file = ingerir_resultado('bench edicao', resultado, progresso=lambda *a: None)
+    file_id = uploaded_file.file_id
+    rnd = random.Random(42)
+    cliente = Client()
+
+    def edicoes(quantidade):
+        ids = rnd.sample(range(1, linhas + 1), quantidade)
+        return [{'id_excel': str(i), 'new_total': round(rnd.uniform(1, 10000), 2)} for i in ids]
+
+    def por_linha(lote):
+        for edicao in lote:
+            response = cliente.post(
+                reverse('update_row_total', args=[file_id]), json.dumps(edicao), content_type='application/json',
+            )
+            if response.status_code != 200:
+                raise RuntimeError(f"update_row_total respondeu {response.status_code}")
+
+    def em_lote(lote):
+        response = cliente.post(
+            reverse('update_rows', args=[file_id]), json.dumps({'edicoes': lote}), content_type='application/json',
+        )
+        if response.status_code != 200:
+            raise RuntimeError(f"update_rows respondeu {response.status_code}")
+
+    resultados = []
+    with override_settings(ALLOWED_HOSTS=['testserver']):
+        for quantidade in lotes:
+            for modo, funcao in (('por_linha', por_linha), ('lote', em_lote)):
+                lote = edicoes(quantidade)
+                connection.queries_log.clear()
+                with CaptureQueriesContext(connection) as consultas:
+                    inicio = time.perf_counter()
+                    funcao(lote)
+                    tempo = time.perf_counter() - inicio
+                resultados.append({
+                    'cenario': 'edicao',
+                    'armazenamento': armazenamento,
+                    'linhas': linhas,
+                    'edicoes': quantidade,
+                    'modo': modo,
+                    'requisicoes': quantidade if modo == 'por_linha' else 1,
+                    'consultas': len(consultas),
+                    'tempo_s': round(tempo, 3),
+                    'ms_por_edicao': round(tempo * 1000 / quantidade, 2),
+                })
+
+    with transaction.atomic():
+        UploadedFile.objects.all().delete()
+    return resultados
+
+
+def benchmark_redistribuicao(tamanhos, colunas=300, repeticoes=3):
+    """
+    Redistribuição de novos totais (redistribuicao.redistribuir) para N
+    linhas de 'colunas' colunas. 'linhas_fecham_%' é a fração de linhas cujos
+    valores, em centavos, somam exatamente o novo total.
+    """
+    from custos.redistribuicao import redistribuir
+
+    rng = np.random.default_rng(42)
+    resultados = []
+
+    for linhas in tamanhos:
+        valores = rng.uniform(0, 1000, (linhas, colunas)).round(2)
+        totais_novos = rng.uniform(1, 1e6, linhas).round(2)
+
+        centavos = np.round(redistribuir(valores, totais_novos) * 100)
+        resultados.append({
+            'cenario': 'redistribuicao',
+            'linhas': linhas,
+            'colunas': colunas,
+            'tempo_s': round(_medir(lambda: redistribuir(valores, totais_novos), repeticoes), 4),
+            'linhas_fecham_%': round(float(np.mean(centavos.sum(axis=1) == np.round(totais_novos * 100))) * 100, 1),
+        })
+
+    return resultados
+
+def benchmark_conversao(tamanhos, colunas=40, fracao_texto=0.2, repeticoes=3, semente=42):
+    """
+    Conversão das células de dados em números (planilha.converter_dataframe)
+    sobre um DataFrame como o do read_excel (números, vazios e textos em
+    moeda, ver dados.moeda_suja). Mede células por segundo e conta as
+    células convertidas com valor errado.
+    """
+    from custos.planilha import converter_dataframe
+
+    rnd = random.Random(semente)
+    resultados = []
+    for linhas in tamanhos:
+        esperado = np.zeros((linhas, colunas))
+        celulas = np.empty((linhas, colunas), dtype=object)
+        textos = 0
+        for i in range(linhas):
+            for j in range(colunas):
+                valor = round(rnd.uniform(1, 99999), 2) if rnd.random() < 0.5 else 0
+                esperado[i, j] = valor
+                if rnd.random() < fracao_texto:
+                    celulas[i, j] = moeda_suja(valor, rnd)
+                    textos += 1
+                else:
+                    celulas[i, j] = valor if valor or rnd.random() < 0.5 else np.nan
+        df = pd.DataFrame(celulas, columns=[f'AREA {j:03d} - C0' for j in range(colunas)])
+
+        tempo = _medir(lambda: converter_dataframe(df), repeticoes)
+        total = linhas * colunas
+        resultados.append({
+            'cenario': 'conversao',
+            'linhas': linhas,
+            'colunas': colunas,
+            'celulas_texto': textos,
+            'tempo_s': round(tempo, 4),
+            'celulas_por_s': int(total / tempo),
+            'erradas': int((np.abs(converter_dataframe(df) - esperado) > 1e-6).sum()),
+        })
+    return resultados
+
+def benchmark_duplicado(tamanhos, areas=10, colunas_por_area=4, armazenamento=ARMAZENAMENTO_JSON):
+    """
+    Upload repetido do mesmo arquivo: processar a planilha de novo
+    (processar_upload) x copiar a análise existente (duplicados.clonar_arquivo).
+    Mede o tempo de cada um, o do hash do arquivo e quanto o banco cresce.
+    """
+    from custos.duplicados import calcular_hash, clonar_arquivo
+    from custos.fila import processar_upload
+
+    resultados = []
+    pasta = tempfile.mkdtemp(prefix='custos_bench_')
+    with override_settings(DEBUG=False, CUSTOS_ARMAZENAMENTO=armazenamento):
+        for linhas in tamanhos:
+            caminho = gerar_planilha_sintetica(
+                os.path.join(pasta, f'planilha_{linhas}.xlsx'), linhas, areas, colunas_por_area,
+            )
+            with open(caminho, 'rb') as arquivo:
+                inicio = time.perf_counter()
+                content_hash = calcular_hash(arquivo)
+                tempo_hash = time.perf_counter() - inicio
+
+                tamanho_inicial = _tamanho_banco()
+                inicio = time.perf_counter()
+                origem = processar_upload(f'bench {linhas}', arquivo, progresso=lambda *a: None,
+                                          content_hash=content_hash)
+                tempo_upload = time.perf_counter() - inicio
+            tamanho_upload = _tamanho_banco()
+
+            inicio = time.perf_counter()
+            clonar_arquivo(origem, f'bench {linhas} (cópia)')
+            tempo_copia = time.perf_counter() - inicio
+            tamanho_copia = _tamanho_banco()
+
+            resultados.append({
+                'cenario': 'duplicado',
+                'armazenamento': armazenamento,
+                'linhas': linhas,
+                'colunas': areas * colunas_por_area,
+                'tempo_hash_s': round(tempo_hash, 4),
+                'tempo_upload_s': round(tempo_upload, 3),
+                'tempo_copia_s': round(tempo_copia, 3),
+                'ganho': round(tempo_upload / tempo_copia, 1),
+                'banco_upload_mb': round((tamanho_upload - tamanho_inicial) / 1024 / 1024, 2) if tamanho_inicial else None,
+                'banco_copia_mb': round((tamanho_copia - tamanho_upload) / 1024 / 1024, 2) if tamanho_inicial else None,
+            })
+            os.remove(caminho)
+            with transaction.atomic():
+                UploadedFile.objects.all().delete()
+    os.rmdir(pasta)
+    return resultados
+
+
+def benchmark_suite(tamanhos, areas=10, colunas_por_area=4, total_a_cada=1000, fracao_texto=0.2, repeticoes=3,
+                    lote=50, streaming=True):
+    """
+    Fluxo completo pelo cliente de teste do Django sobre uma planilha
+    sintética (gerar_planilha_sintetica): upload, análise (sem e com cache),
+    edição de uma linha e de um lote, e download em .xlsx e CSV. Para cada
+    etapa, tempo (mediana e mínimo de 'repeticoes') e pico de memória
+    (tracemalloc, em uma execução à parte).
+    """
+    from django.test import Client
+    from django.urls import resolve, reverse
+    from custos.cache_analise import remover_contexto
+
+    cliente = Client()
+    rnd = random.Random(42)
+    pasta = tempfile.mkdtemp(prefix='custos_bench_')
+
+    def conteudo(response):
+        return b''.join(response.streaming_content) if response.streaming else response.content
+
+    def medir_etapa(nome, funcao, status=200):
+        def executar():
+            response = funcao()
+            corpo = conteudo(response)
+            if response.status_code != status:
+                raise RuntimeError(f"{nome} respondeu {response.status_code}")
+            return response, corpo
+
+        tempos = []
+        for _ in range(repeticoes):
+            inicio = time.perf_counter()
+            executar()
+            tempos.append(time.perf_counter() - inicio)
+        (response, corpo), pico = _medir_memoria(executar)
+        return response, {
+            'tempo_mediano_s': round(statistics.median(tempos), 4),
+            'tempo_min_s': round(min(tempos), 4),
+            'pico_mb': round(pico, 1),
+            'bytes_resposta': len(corpo),
+        }
+
+    resultados = []
+    configuracao = {
+        # Com DEBUG o Django guarda o SQL de cada consulta, o que distorce a medição.
+        'DEBUG': False,
+        'ALLOWED_HOSTS': ['testserver'],
+        'CUSTOS_UPLOAD_ASSINCRONO': False,
+        'CUSTOS_INGESTAO_STREAMING': streaming,
+    }
+    with override_settings(**configuracao):
+        for linhas in tamanhos:
+            caminho = gerar_planilha_sintetica(
+                os.path.join(pasta, f'planilha_{linhas}.xlsx'), linhas, areas, colunas_por_area,
+                total_a_cada=total_a_cada, fracao_texto=fracao_texto,
+            )
+
+            def upload():
+                with open(caminho, 'rb') as arquivo:
+                    # 'reprocessar': cada repetição envia o mesmo arquivo, que seria oferecido como duplicado.
+                    return cliente.post(reverse('upload_file'), {
+                        'name': f'bench {linhas}', 'arquivo_excel': arquivo, 'reprocessar': 'on',
+                    })
+
+            response, medicao = medir_etapa('upload', upload, status=302)
+            etapas = [('upload', medicao)]
+            # Cada upload cria um arquivo; as demais etapas usam o último.
+            file_id = resolve(response['Location']).kwargs['file_id']
+
+            def analise_sem_cache():
+                remover_contexto(UploadedFile.objects.get(file_id=file_id))
+                return cliente.get(reverse('analyze_data', args=[file_id]))
+
+            def edicao_linha():
+                return cliente.post(
+                    reverse('update_row_total', args=[file_id]),
+                    json.dumps({'id_excel': str(rnd.randint(1, linhas)), 'new_total': round(rnd.uniform(1, 10000), 2)}),
+                    content_type='application/json',
+                )
+
+            def edicao_lote():
+                ids = rnd.sample(range(1, linhas + 1), min(lote, linhas))
+                edicoes = [{'id_excel': str(i), 'new_total': round(rnd.uniform(1, 10000), 2)} for i in ids]
+                return cliente.post(
+                    reverse('update_rows', args=[file_id]), json.dumps({'edicoes': edicoes}),
+                    content_type='application/json',
+                )
+
+            for nome, funcao in (
+                ('analise_sem_cache', analise_sem_cache),
+                ('analise_com_cache', lambda: cliente.get(reverse('analyze_data', args=[file_id]))),
+                ('edicao_linha', edicao_linha),
+                ('edicao_lote', edicao_lote),
+                ('download_xlsx', lambda: cliente.get(reverse('download_file_view', args=[file_id]))),
+                ('download_csv', lambda: cliente.get(reverse('download_file_view', args=[file_id]), {'formato': 'csv'})),
+            ):
+                etapas.append((nome, medir_etapa(nome, funcao)[1]))
+
+            for nome, medicao in etapas:
+                resultados.append({
+                    'cenario': 'suite',
+                    'etapa': nome,
+                    'linhas': linhas,
+                    'colunas': areas * colunas_por_area,
+                    **medicao,
+                })
+
+            os.remove(caminho)
+            with transaction.atomic():
+                UploadedFile.objects.all().delete()
+
+    os.rmdir(pasta)
+    return resultados
+
+
+@contextmanager
+def views_assincronas(ativas):
+    """
+    Liga ou desliga CUSTOS_VIEWS_ASSINCRONAS e recarrega as rotas, que
+    escolhem as views quando são importadas. As rotas do projeto também são
+    recarregadas: o include() guarda as rotas do app já resolvidas.
+    """
+    from django.conf import settings
+    from django.urls import clear_url_caches
+    from custos import urls
+
+    def recarregar():
+        importlib.reload(urls)
+        importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+        clear_url_caches()
+
+    try:
+        with override_settings(CUSTOS_VIEWS_ASSINCRONAS=ativas):
+            recarregar()
+            yield
+    finally:
+        recarregar()
+
+
+def _pedidos_concorrencia(requisicoes, lentas_a_cada, arquivo_grande, arquivo_lido, arquivo_editado, linhas_pequeno,
+                          semente=42):
+    """
+    Lista de requisições (tipo, método, url, dados) do benchmark de
+    concorrência: a cada 'lentas_a_cada', um download .xlsx do arquivo
+    grande; as demais alternam a análise (em cache) de um arquivo pequeno e
+    a edição de uma linha de outro. As edições vão para outro arquivo para
+    não invalidar o cache da análise.
+    """
+    from django.urls import reverse
+
+    rnd = random.Random(semente)
+    pedidos = []
+    for numero in range(requisicoes):
+        if lentas_a_cada and numero % lentas_a_cada == 0:
+            pedidos.append(('lenta', 'get', reverse('download_file_view', args=[arquivo_grande]), {}))
+        elif numero % 2:
+            pedidos.append(('rapida', 'get', reverse('analyze_data', args=[arquivo_lido]), {}))
+        else:
+            pedidos.append(('rapida', 'post', reverse('update_row_total', args=[arquivo_editado]), json.dumps({
+                'id_excel': str(rnd.randint(1, linhas_pequeno)), 'new_total': round(rnd.uniform(1, 10000), 2),
+            })))
+    return pedidos
+
+
+def _executar_wsgi(pedidos, clientes):
+    """
+    Executa os pedidos com 'clientes' threads, cada uma com um Client do
+    Django (o caminho WSGI: uma requisição por thread).
+    """
+    from django.test import Client
+
+    fila = deque(pedidos)
+    medicoes = []
+
+    def cliente():
+        client = Client()
+        try:
+            while True:
+                try:
+                    tipo, metodo, url, dados = fila.popleft()
+                except IndexError:
+                    return
+                inicio = time.perf_counter()
+                if metodo == 'post':
+                    response = client.post(url, dados, content_type='application/json')
+                else:
+                    response = client.get(url, dados)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                medicoes.append((tipo, time.perf_counter() - inicio, response.status_code))
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=cliente) for _ in range(clientes)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return medicoes
+
+
+def _executar_asgi(pedidos, clientes):
+    """
+    Executa os pedidos com 'clientes' tarefas no mesmo loop de eventos, cada
+    uma com um AsyncClient do Django (o caminho ASGI).
+    """
+    from django.test import AsyncClient
+
+    fila = deque(pedidos)
+    medicoes = []
+
+    async def cliente():
+        client = AsyncClient()
+        while fila:
+            tipo, metodo, url, dados = fila.popleft()
+            inicio = time.perf_counter()
+            if metodo == 'post':
+                response = await client.post(url, dados, content_type='application/json')
+            else:
+                response = await client.get(url, dados)
+            if response.streaming and response.is_async:
+                async for _ in response.streaming_content:
+                    pass
+            elif response.streaming:
+                b''.join(response.streaming_content)
+            medicoes.append((tipo, time.perf_counter() - inicio, response.status_code))
+
+    async def executar():
+        await asyncio.gather(*(cliente() for _ in range(clientes)))
+
+    asyncio.run(executar())
+    return medicoes
+
+
+def _percentil(valores, percentual):
+    if not valores:
+        return None
+    return round(float(np.percentile(valores, percentual)) * 1000, 1)
+
+
+def benchmark_concorrencia(linhas=10000, linhas_pequeno=500, areas=10, colunas_por_area=4, clientes=(1, 4, 16),
+                           requisicoes=40, lentas_a_cada=5, trabalhadores=2):
+    """
+    Vazão com clientes simultâneos: views síncronas (WSGI, uma thread por
+    cliente) x views assíncronas com o pool de processos (ASGI, um loop de
+    eventos). As requisições misturam downloads .xlsx de um arquivo grande
+    (lentas) com análises em cache e edições de arquivos pequenos
+    (rápidas); para cada tipo, a latência p50/p95, que mostra quanto as
+    lentas atrasam as rápidas. As duas pilhas rodam no processo do benchmark, pelos clientes
+    de teste do Django, sem um servidor HTTP na frente.
+    """
+    from custos import processos
+
+    grande = ingerir_resultado(
+        'bench concorrência', gerar_resultado_sintetico(linhas, areas, colunas_por_area), progresso=lambda *a: None,
+    )
+    pequenos = [
+        ingerir_resultado(
+            f'bench concorrência ({nome})', gerar_resultado_sintetico(linhas_pequeno, areas, colunas_por_area),
+            progresso=lambda *a: None,
+        )
+        for nome in ('análise', 'edição')
+    ]
+
+    resultados = []
+    registro = logging.getLogger('custos.instrumentacao')
+    nivel = registro.level
+    # Um log por requisição não interessa aqui e custaria o mesmo nos dois modos.
+    registro.setLevel(logging.WARNING)
+    configuracao = {
+        'DEBUG': False,
+        'ALLOWED_HOSTS': ['testserver'],
+        'CUSTOS_PROCESSOS_TRABALHADORES': trabalhadores,
+        # Sem limite de fila: o benchmark mede a vazão, não as respostas 503.
+        'CUSTOS_PROCESSOS_FILA_MAXIMA': requisicoes + max(clientes),
+        # O download é a requisição lenta: o .xlsx é gerado a cada vez.
+        'CUSTOS_ARTEFATOS': False,
+    }
+    try:
+        with override_settings(**configuracao):
+            for modo, executar in (('wsgi', _executar_wsgi), ('asgi', _executar_asgi)):
+                with views_assincronas(modo == 'asgi'):
+                    pedidos = _pedidos_concorrencia(
+                        requisicoes, lentas_a_cada, grande.file_id, *(arquivo.file_id for arquivo in pequenos),
+                        linhas_pequeno,
+                    )
+                    # Aquecimento (e criação do pool de processos), fora da medição.
+                    executar(pedidos[:lentas_a_cada or 2], 1)
+                    for quantidade in clientes:
+                        inicio = time.perf_counter()
+                        medicoes = executar(pedidos, quantidade)
+                        duracao = time.perf_counter() - inicio
+                        tempos = {
+                            tipo: [tempo for t, tempo, status in medicoes if t == tipo] for tipo in ('lenta', 'rapida')
+                        }
+                        resultados.append({
+                            'cenario': 'concorrencia',
+                            'modo': modo,
+                            'linhas': linhas,
+                            'clientes': quantidade,
+                            'requisicoes': len(medicoes),
+                            'erros': sum(1 for medicao in medicoes if medicao[2] != 200),
+                            'req_s': round(len(medicoes) / duracao, 2),
+                            'lenta_p50_ms': _percentil(tempos['lenta'], 50),
+                            'lenta_p95_ms': _percentil(tempos['lenta'], 95),
+                            'rapida_p50_ms': _percentil(tempos['rapida'], 50),
+                            'rapida_p95_ms': _percentil(tempos['rapida'], 95),
+                        })
+                processos.encerrar_pool()
+    finally:
+        registro.setLevel(nivel)
+        processos.encerrar_pool()
+
+    with transaction.atomic():
+        UploadedFile.objects.all().delete()
+    return resultados
+
+
+def benchmark_payload(linhas=5000, areas=10, colunas_por_area=4, lote=50):
+    """
+    Bytes transferidos pela página de análise e pelas edições: HTML gerado
+    no servidor x dados numéricos formatados no navegador (modo 'dados' e
+    formato 'dados' dos patches), sem compressão, com gzip e com brotli
+    (None quando o pacote brotli não está instalado). As respostas passam
+    pelos middlewares, pelo cliente de teste do Django.
+    """
+    from django.test import Client
+    from django.urls import reverse
+    from custos.compressao import brotli
+
+    resultado = gerar_resultado_sintetico(linhas, areas, colunas_por_area)
+    uploaded_file = ingerir_resultado('bench payload', resultado, progresso=lambda *a: None)
+    file_id = uploaded_file.file_id
+    rnd = random.Random(42)
+    cliente = Client()
+    codificacoes = {'bytes': 'identity', 'gzip_bytes': 'gzip', 'br_bytes': 'br'}
+
+    def tamanho(pedido, codificacao):
+        metodo, url, dados = pedido
+        if metodo == 'get':
+            response = cliente.get(url, dados, HTTP_ACCEPT_ENCODING=codificacao)
+        else:
+            response = cliente.post(
+                url, json.dumps(dados), content_type='application/json', HTTP_ACCEPT_ENCODING=codificacao,
+            )
+        if response.status_code != 200:
+            raise RuntimeError(f"{url} respondeu {response.status_code}")
+        return len(b''.join(response.streaming_content) if response.streaming else response.content)
+
+    def edicoes(quantidade):
+        ids = rnd.sample(range(1, linhas + 1), quantidade)
+        return [{'id_excel': str(i), 'new_total': round(rnd.uniform(1, 10000), 2)} for i in ids]
+
+    analise = reverse('analyze_data', args=[file_id])
+    linha, = edicoes(1)
+    edicoes_lote = edicoes(min(lote, linhas))
+    recursos = [
+        ('analise', 'completa', [('get', analise, {'tabela': 'completa'})]),
+        ('analise', 'virtual', [
+            ('get', analise, {'tabela': 'virtual'}),
+            ('get', reverse('analysis_window', args=[file_id]), {'offset': 0, 'limit': 60, 'col_end': 12}),
+        ]),
+        ('analise', 'dados', [
+            ('get', analise, {'tabela': 'dados'}),
+            ('get', reverse('analysis_data', args=[file_id]), {}),
+        ]),
+        ('edicao_linha', 'html', [('post', reverse('update_row_total', args=[file_id]), linha)]),
+        ('edicao_linha', 'dados', [('post', reverse('update_row_total', args=[file_id]), {**linha, 'formato': 'dados'})]),
+        ('edicao_lote', 'html', [('post', reverse('update_rows', args=[file_id]), {'edicoes': edicoes_lote})]),
+        ('edicao_lote', 'dados', [
+            ('post', reverse('update_rows', args=[file_id]), {'edicoes': edicoes_lote, 'formato': 'dados'}),
+        ]),
+    ]
+
+    resultados = []
+    with override_settings(ALLOWED_HOSTS=['testserver'], DEBUG=False):
+        for recurso, modo, pedidos in recursos:
+            medicao = {
+                campo: (
+                    sum(tamanho(pedido, codificacao) for pedido in pedidos)
+                    if codificacao != 'br' or brotli is not None else None
+                )
+                for campo, codificacao in codificacoes.items()
+            }
+            resultados.append({
+                'cenario': 'payload',
+                'recurso': recurso,
+                'modo': modo,
+                'linhas': linhas,
+                'colunas': areas * colunas_por_area,
+                'edicoes': len(edicoes_lote) if recurso == 'edicao_lote' else None,
+                'requisicoes': len(pedidos),
+                **medicao,
+            })
+
+    with transaction.atomic():
+        UploadedFile.objects.all().delete()
+    return resultados
+
+
+def benchmark_comparacao(arquivos=(2, 12, 24), linhas=10000, contas=2000, areas=10, colunas_por_area=4, repeticoes=3):
+    """
+    Comparação entre N análises (uma por mês): tempo e consultas de
+    comparar_arquivos, sobre os agregados empilhados.
+    """
+    from django.test.utils import CaptureQueriesContext
+    from custos.comparacao import comparar_arquivos
+
+    uploads = [
+        ingerir_resultado(
+            f'bench comparação {mes:02d}',
+            gerar_resultado_sintetico(linhas, areas, colunas_por_area, semente=mes, contas=contas),
+            progresso=lambda *a: None,
+        )
+        for mes in range(max(arquivos))
+    ]
+
+    resultados = []
+    for quantidade in arquivos:
+        selecionados = uploads[:quantidade]
+        connection.queries_log.clear()
+        with CaptureQueriesContext(connection) as consultas:
+            comparacao = comparar_arquivos(selecionados)
+        tempo = _medir(lambda: comparar_arquivos(selecionados), repeticoes)
+
+        resultados.append({
+            'cenario': 'comparacao',
+            'arquivos': quantidade,
+            'linhas': linhas,
+            'contas': len(comparacao['contas']['nomes']),
+            'consultas': len(consultas),
+            'tempo_s': round(tempo, 4),
+        })
+
+    with transaction.atomic():
+        UploadedFile.objects.all().delete()
+    return resultados
+
+
+def benchmark_abas(abas=20, linhas=2000, areas=10, colunas_por_area=4, processos=(1, 2, 4), fracao_texto=0.2):
+    """
+    Pasta com várias abas: leitura das abas em sequência (1 processo) x no
+    pool de processos (planilha.ler_abas), e a ingestão completa
+    (ingerir_abas, leitura + gravação). O ganho é o tempo em sequência
+    dividido pelo tempo com N processos; ele depende das CPUs da máquina.
+    """
+    from custos.ingestao import ingerir_abas
+    from custos.planilha import ler_abas, listar_abas
+
+    pasta = tempfile.mkdtemp(prefix='custos_bench_abas_')
+    caminho = gerar_planilha_sintetica(
+        os.path.join(pasta, 'abas.xlsx'), linhas, areas, colunas_por_area, fracao_texto=fracao_texto, abas=abas,
+    )
+    nomes = listar_abas(caminho)
+
+    resultados = []
+    tempo_sequencial = None
+    for quantidade in processos:
+        inicio = time.perf_counter()
+        linhas_lidas = sum(
+            len(ids) for aba in ler_abas(caminho, nomes, quantidade) if 'erro' not in aba for ids, _, _ in aba['lotes']
+        )
+        leitura = time.perf_counter() - inicio
+        if quantidade == 1:
+            tempo_sequencial = leitura
+
+        inicio = time.perf_counter()
+        uploaded_files = ingerir_abas('bench abas', caminho, nomes, progresso=lambda *a: None, processos=quantidade)
+        ingestao = time.perf_counter() - inicio
+
+        resultados.append({
+            'cenario': 'abas',
+            'abas': len(uploaded_files),
+            'linhas': linhas,
+            'colunas': areas * colunas_por_area,
+            'processos': quantidade,
+            'cpus': os.cpu_count(),
+            'linhas_lidas': linhas_lidas,
+            'leitura_s': round(leitura, 3),
+            'ingestao_s': round(ingestao, 3),
+            'ganho_leitura': round(tempo_sequencial / leitura, 2) if tempo_sequencial else None,
+        })
+        with transaction.atomic():
+            UploadedFile.objects.all().delete()
+
+    os.remove(caminho)
+    os.rmdir(pasta)
+    return resultados
+
+
+def benchmark_condicional(linhas=5000, areas=10, colunas_por_area=4, repeticoes=5):
+    """
+    Respostas completas (200) x revalidações com If-None-Match (304) da
+    página de análise (com o contexto já no cache), da API de dados e do
+    download: menor tempo entre as repetições e bytes do corpo, pelo cliente
+    de teste do Django.
+    """
+    from django.test import Client
+    from django.urls import reverse
+
+    resultado = gerar_resultado_sintetico(linhas, areas, colunas_por_area)
+    uploaded_file = ingerir_resultado('bench condicional', resultado, progresso=lambda *a: None)
+    file_id = uploaded_file.file_id
+    cliente = Client()
+
+    recursos = [
+        ('analise', reverse('analyze_data', args=[file_id]), {'tabela': 'completa'}),
+        ('dados', reverse('analysis_data', args=[file_id]), {}),
+        ('download_xlsx', reverse('download_file_view', args=[file_id]), {}),
+        ('download_csv', reverse('download_file_view', args=[file_id]), {'formato': 'csv'}),
+    ]
+
+    resultados = []
+    with override_settings(ALLOWED_HOSTS=['testserver'], DEBUG=False):
+        for recurso, url, dados in recursos:
+            respostas = {}
+
+            def pedir(cabecalhos):
+                response = cliente.get(url, dados, HTTP_ACCEPT_ENCODING='gzip', **cabecalhos)
+                corpo = b''.join(response.streaming_content) if response.streaming else response.content
+                respostas[response.status_code] = len(corpo)
+                return response
+
+            # A primeira requisição aquece o cache da análise e traz a ETag.
+            etag = pedir({})['ETag']
+            tempo_completo = _medir(lambda: pedir({}), repeticoes)
+            tempo_304 = _medir(lambda: pedir({'HTTP_IF_NONE_MATCH': etag}), repeticoes)
+            if set(respostas) != {200, 304}:
+                raise RuntimeError(f"{url} respondeu {sorted(respostas)}")
+            resultados.append({
+                'cenario': 'condicional',
+                'recurso': recurso,
+                'linhas': linhas,
+                'colunas': areas * colunas_por_area,
+                'completo_ms': round(tempo_completo * 1000, 2),
+                'nao_modificado_ms': round(tempo_304 * 1000, 2),
+                'ganho': round(tempo_completo / tempo_304, 1) if tempo_304 else None,
+                'completo_bytes': respostas[200],
+                'nao_modificado_bytes': respostas[304],
+            })
+
+    with transaction.atomic():
+        UploadedFile.objects.all().delete()
+    return resultados
+
+
+def benchmark_artefatos(linhas=5000, areas=10, colunas_por_area=4, repeticoes=5):
+    """
+    Download da planilha reconstruída (.xlsx e .csv): gerada a cada
+    requisição (sem CUSTOS_ARTEFATOS) x primeiro download, que grava o
+    artefato, x downloads seguintes, enviados do disco. Menor tempo entre
+    as repetições, pelo cliente de teste do Django.
+    """
+    from django.test import Client
+    from django.urls import reverse
+    from custos.artefatos import remover_artefatos
+
+    resultado = gerar_resultado_sintetico(linhas, areas, colunas_por_area)
+    uploaded_file = ingerir_resultado('bench artefatos', resultado, progresso=lambda *a: None)
+    file_id = uploaded_file.file_id
+    url = reverse('download_file_view', args=[file_id])
+    cliente = Client()
+
+    def baixar(formato):
+        response = cliente.get(url, {'formato': formato})
+        if response.status_code != 200:
+            raise RuntimeError(f"{url} respondeu {response.status_code}")
+        return len(b''.join(response.streaming_content) if response.streaming else response.content)
+
+    def primeiro_download(formato):
+        remover_artefatos(file_id)
+        return baixar(formato)
+
+    resultados = []
+    with override_settings(ALLOWED_HOSTS=['testserver'], DEBUG=False):
+        for formato in ('xlsx', 'csv'):
+            with override_settings(CUSTOS_ARTEFATOS=False):
+                sem_artefato = _medir(lambda: baixar(formato), repeticoes)
+            primeiro = _medir(lambda: primeiro_download(formato), repeticoes)
+            do_disco = _medir(lambda: baixar(formato), repeticoes)
+            resultados.append({
+                'cenario': 'artefatos',
+                'formato': formato,
+                'linhas': linhas,
+                'colunas': areas * colunas_por_area,
+                'sem_artefato_ms': round(sem_artefato * 1000, 2),
+                'primeiro_ms': round(primeiro * 1000, 2),
+                'do_disco_ms': round(do_disco * 1000, 2),
+                'ganho': round(sem_artefato / do_disco, 1) if do_disco else None,
+                'bytes': baixar(formato),
+            })
+
+    with transaction.atomic():
+        UploadedFile.objects.all().delete()
+    return resultados
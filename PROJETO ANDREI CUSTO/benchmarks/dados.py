@@ -0,0 +1,113 @@
+"""
+Dados sintéticos dos benchmarks (e dos testes do app custos): o resultado
+de processar_arquivo_excel, o DataFrame da tabela principal e planilhas
+.xlsx no formato esperado pelo upload.
+"""
+import random
+
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+
+def gerar_resultado_sintetico(linhas, areas=10, colunas_por_area=4, semente=42, contas=500):
+    """
+    Gera um dicionário no mesmo formato retornado por processar_arquivo_excel,
+    com valores aleatórios (cerca de metade das células zeradas) distribuídos
+    entre 'contas' contas.
+    """
+    rnd = random.Random(semente)
+    colunas_dados = [
+        f'AREA {a:03d} - {c}' for a in range(areas) for c in range(colunas_por_area)
+    ]
+
+    tabela_principal = []
+    df_despesas_only = []
+    for i in range(linhas):
+        valores = {
+            col: (round(rnd.uniform(1, 10000), 2) if rnd.random() < 0.5 else 0.0)
+            for col in colunas_dados
+        }
+        total = sum(valores.values())
+        valores['TOTAL (LINHA)'] = total
+        df_despesas_only.append(valores)
+        tabela_principal.append({'ID': str(i + 1), 'CONTA': f'CONTA {i % contas:04d}', 'TOTAL (LINHA)': total})
+
+    return {
+        'tabela_principal': tabela_principal,
+        'colunas_dados': colunas_dados,
+        'df_despesas_only': df_despesas_only,
+    }
+
+
+def gerar_tabela_sintetica(linhas, colunas, semente=42):
+    """
+    Gera o DataFrame de entrada de preparar_tabela_principal_html
+    (ID, CONTA, colunas de dados e TOTAL (LINHA)), com metade das células zeradas.
+    """
+    rng = np.random.default_rng(semente)
+    valores = np.round(rng.uniform(1, 10000, (linhas, colunas)), 2)
+    valores[rng.random((linhas, colunas)) < 0.5] = 0.0
+    colunas_dados = [f'AREA {c // 4:03d} - {c % 4}' for c in range(colunas)]
+
+    df = pd.DataFrame(valores, columns=colunas_dados)
+    df.insert(0, 'ID', [str(i + 1) for i in range(linhas)])
+    df.insert(1, 'CONTA', [f'CONTA {i % 500:04d}' for i in range(linhas)])
+    df['TOTAL (LINHA)'] = valores.sum(axis=1)
+    return df, colunas_dados
+
+
+def moeda_suja(valor, rnd):
+    """
+    'valor' escrito como texto, em um dos formatos que aparecem nas planilhas
+    reais: 'R$ 1.234,56', 'R$ 123,45', ' 123,45 ' ou '-' para zero.
+    """
+    if valor == 0:
+        return rnd.choice(('-', 'R$ 0,00', ' '))
+    brasileiro = f'{valor:,.2f}'.replace(',', '_').replace('.', ',').replace('_', '.')
+    return rnd.choice((
+        f'R$ {brasileiro}',
+        f'R$ {valor:.2f}'.replace('.', ','),
+        f' {valor:.2f} '.replace('.', ','),
+    ))
+
+
+def gerar_planilha_sintetica(caminho, linhas, areas=10, colunas_por_area=4, semente=42, total_a_cada=1000,
+                             fracao_texto=0.2, abas=1):
+    """
+    Grava em 'caminho' um .xlsx no formato esperado pelo upload: cabeçalho em
+    duas linhas (área e ID), uma linha de TOTAL a cada 'total_a_cada' linhas
+    (0 para nenhuma) e uma fração 'fracao_texto' dos valores como texto em
+    moeda (ver moeda_suja). Com abas > 1, cada aba ('CC 01', 'CC 02'...)
+    recebe uma planilha dessas, com valores diferentes.
+    """
+    rnd = random.Random(semente)
+    workbook = xlsxwriter.Workbook(caminho, {'constant_memory': True})
+    for aba in range(abas):
+        worksheet = workbook.add_worksheet(f'CC {aba + 1:02d}' if abas > 1 else None)
+        _escrever_aba_sintetica(worksheet, rnd, linhas, areas, colunas_por_area, total_a_cada, fracao_texto)
+    workbook.close()
+    return caminho
+
+
+def _escrever_aba_sintetica(worksheet, rnd, linhas, areas, colunas_por_area, total_a_cada, fracao_texto):
+    areas_cabecalho = ['', '']
+    ids_cabecalho = ['ID', 'CONTA']
+    for a in range(areas):
+        for c in range(colunas_por_area):
+            areas_cabecalho.append(f'AREA {a:03d}' if c == 0 else None)
+            ids_cabecalho.append(f'C{c}')
+    worksheet.write_row(0, 0, areas_cabecalho)
+    worksheet.write_row(1, 0, ids_cabecalho)
+
+    linha_planilha = 2
+    for i in range(linhas):
+        valores = [str(i + 1), f'CONTA {i % 500:04d}']
+        for _ in range(areas * colunas_por_area):
+            valor = round(rnd.uniform(1, 9999), 2) if rnd.random() < 0.5 else 0
+            valores.append(moeda_suja(valor, rnd) if rnd.random() < fracao_texto else valor)
+        worksheet.write_row(linha_planilha, 0, valores)
+        linha_planilha += 1
+        if total_a_cada and (i + 1) % total_a_cada == 0:
+            worksheet.write_row(linha_planilha, 0, ['', 'TOTAL'])
+            linha_planilha += 1
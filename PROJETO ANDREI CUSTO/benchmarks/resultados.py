@@ -0,0 +1,94 @@
+"""
+Gravação dos resultados dos benchmarks em JSON e comparação entre duas
+execuções (por exemplo, antes e depois de uma mudança).
+"""
+import json
+import time
+
+import numpy as np
+import pandas as pd
+from django.db import connection
+
+# Campos que identificam uma linha de resultado ao comparar duas execuções,
+# além dos textuais (cenario, etapa, modo...). Os demais números são métricas.
+CAMPOS_CHAVE = ('linhas', 'colunas', 'contas', 'edicoes', 'clientes', 'arquivos', 'abas', 'processos')
+
+
+def ambiente():
+    """
+    Versões e plataforma da execução, gravadas junto com os resultados.
+    """
+    import platform
+
+    import django
+
+    return {
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'processador': platform.processor() or platform.machine(),
+        'django': django.get_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'banco': connection.vendor,
+    }
+
+
+def salvar_resultados(caminho, cenario, parametros, resultados):
+    """
+    Grava os resultados de um cenário em JSON, com os parâmetros usados, a
+    data e o ambiente, para comparar execuções (ver comparar_resultados).
+    """
+    with open(caminho, 'w', encoding='utf-8') as arquivo:
+        json.dump({
+            'cenario': cenario,
+            'data': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'ambiente': ambiente(),
+            'parametros': parametros,
+            'resultados': resultados,
+        }, arquivo, ensure_ascii=False, indent=2, default=str)
+
+
+def carregar_resultados(caminho):
+    """
+    Lê um arquivo gravado por salvar_resultados.
+    """
+    with open(caminho, encoding='utf-8') as arquivo:
+        return json.load(arquivo)
+
+
+def _chave_resultado(resultado):
+    return tuple(
+        (campo, valor) for campo, valor in resultado.items()
+        if isinstance(valor, (str, bool)) or campo in CAMPOS_CHAVE
+    )
+
+
+def comparar_resultados(anteriores, atuais):
+    """
+    Compara duas listas de resultados: para cada linha presente nas duas
+    (mesma chave, ver CAMPOS_CHAVE) e cada métrica numérica, o valor
+    anterior, o atual e a variação em %.
+    """
+    por_chave = {_chave_resultado(resultado): resultado for resultado in anteriores}
+    comparacao = []
+    for atual in atuais:
+        chave = _chave_resultado(atual)
+        anterior = por_chave.get(chave)
+        if anterior is None:
+            continue
+        campos_chave = dict(chave)
+        for metrica, valor in atual.items():
+            if metrica in campos_chave or not isinstance(valor, (int, float)):
+                continue
+            valor_anterior = anterior.get(metrica)
+            if not isinstance(valor_anterior, (int, float)) or isinstance(valor_anterior, bool):
+                continue
+            variacao = (valor - valor_anterior) / valor_anterior * 100 if valor_anterior else None
+            comparacao.append({
+                'linha': ' '.join(str(v) for campo, v in chave if campo != 'cenario'),
+                'metrica': metrica,
+                'anterior': valor_anterior,
+                'atual': valor,
+                'variacao_%': round(variacao, 1) if variacao is not None else '-',
+            })
+    return comparacao
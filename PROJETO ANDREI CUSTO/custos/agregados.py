@@ -0,0 +1,237 @@
+"""
+Somas acumuladas por arquivo (FileAggregates, ColumnTotal, AreaTotal e
+AccountTotal).
+
+Os agregados são calculados uma vez a partir da matriz do arquivo e, a
+cada lote de edições, recebem apenas o delta das linhas editadas. Assim o
+custo de uma edição depende do número de colunas, e não do número de linhas, e
+os resumos da análise (totais por área, por coluna e o total geral) saem
+de consultas pequenas a essas tabelas, sem carregar a matriz.
+"""
+from django.db import transaction
+from django.db.models import Max
+
+from .armazenamento import carregar_matriz
+from .models import AccountTotal, AreaTotal, ColumnTotal, FileAggregates
+
+
+def area_da_coluna(coluna):
+    """
+    Nome da área de uma coluna de dados ('AREA - ID' -> 'AREA').
+    """
+    return coluna.rsplit(' - ', 1)[0].strip()
+
+
+def valor_numerico(valor):
+    """
+    Converte um valor de célula para float, tratando não numéricos como 0
+    (mesma regra usada na análise).
+    """
+    try:
+        valor = float(valor)
+    except (ValueError, TypeError):
+        return 0.0
+    return 0.0 if valor != valor else valor
+
+
+def calcular_agregados(matriz):
+    """
+    Calcula os agregados a partir de uma matriz no formato de carregar_matriz.
+    """
+    colunas = list(matriz['colunas'])
+    valores = matriz['valores']
+    totais_colunas = valores.sum(axis=0).tolist()
+    somas_linhas = valores.sum(axis=1).tolist()
+
+    area_totals = {}
+    for coluna, total in zip(colunas, totais_colunas):
+        area = area_da_coluna(coluna)
+        area_totals[area] = area_totals.get(area, 0.0) + total
+
+    account_totals = {}
+    for conta, soma in zip(matriz['contas'], somas_linhas):
+        conta = str(conta)
+        account_totals[conta] = account_totals.get(conta, 0.0) + soma
+
+    return {
+        'columns': colunas,
+        'column_totals': totais_colunas,
+        'area_totals': area_totals,
+        'account_totals': account_totals,
+        'grand_total': float(matriz['totais'].sum()),
+    }
+
+
+def somar_agregados(agregados, outros):
+    """
+    Soma dois agregados no formato de calcular_agregados (por exemplo, de
+    lotes diferentes do mesmo arquivo). 'agregados' pode ser None.
+    """
+    if agregados is None:
+        return outros
+
+    posicoes = {coluna: i for i, coluna in enumerate(agregados['columns'])}
+    for coluna, total in zip(outros['columns'], outros['column_totals']):
+        if coluna in posicoes:
+            agregados['column_totals'][posicoes[coluna]] += total
+        else:
+            posicoes[coluna] = len(agregados['columns'])
+            agregados['columns'].append(coluna)
+            agregados['column_totals'].append(total)
+    for chave in ('area_totals', 'account_totals'):
+        for nome, total in outros[chave].items():
+            agregados[chave][nome] = agregados[chave].get(nome, 0.0) + total
+    agregados['grand_total'] += outros['grand_total']
+    return agregados
+
+
+@transaction.atomic
+def salvar_agregados(uploaded_file, agregados):
+    """
+    Grava (ou substitui) os agregados do arquivo, no formato de
+    calcular_agregados: o total geral no FileAggregates e os totais por
+    coluna, área e conta nas respectivas tabelas.
+    """
+    FileAggregates.objects.update_or_create(file=uploaded_file, defaults={'grand_total': agregados['grand_total']})
+    for modelo in (ColumnTotal, AreaTotal, AccountTotal):
+        modelo.objects.filter(file=uploaded_file).delete()
+
+    ColumnTotal.objects.bulk_create([
+        ColumnTotal(file=uploaded_file, position=i, column=coluna, total=total)
+        for i, (coluna, total) in enumerate(zip(agregados['columns'], agregados['column_totals']))
+    ])
+    AreaTotal.objects.bulk_create([
+        AreaTotal(file=uploaded_file, position=i, area=area, total=total)
+        for i, (area, total) in enumerate(agregados['area_totals'].items())
+    ])
+    AccountTotal.objects.bulk_create([
+        AccountTotal(file=uploaded_file, account=conta, total=total)
+        for conta, total in agregados['account_totals'].items()
+    ])
+
+
+def obter_agregados(uploaded_file, para_atualizar=False):
+    """
+    Retorna o FileAggregates do arquivo, calculando-o a partir da matriz se
+    ainda não existir (arquivos enviados antes dos agregados existirem).
+    Com para_atualizar=True a linha fica bloqueada até o fim da transação.
+    """
+    consulta = FileAggregates.objects.filter(file=uploaded_file)
+    if para_atualizar:
+        consulta = consulta.select_for_update()
+
+    agregados = consulta.first()
+    if agregados is None:
+        matriz = carregar_matriz(uploaded_file)
+        if matriz is None:
+            return None
+        salvar_agregados(uploaded_file, calcular_agregados(matriz))
+        agregados = consulta.first()
+    return agregados
+
+
+def colunas_do_arquivo(uploaded_file):
+    """
+    Nomes das colunas de dados do arquivo, na ordem da planilha.
+    """
+    return list(ColumnTotal.objects.filter(file=uploaded_file).order_by('position').values_list('column', flat=True))
+
+
+def contar_colunas(uploaded_file):
+    return ColumnTotal.objects.filter(file=uploaded_file).count()
+
+
+def totais_das_colunas(uploaded_file, inicio=0, fim=None):
+    """
+    Retorna (colunas, totais) das colunas de dados nas posições [inicio, fim).
+    """
+    consulta = ColumnTotal.objects.filter(file=uploaded_file, position__gte=inicio)
+    if fim is not None:
+        consulta = consulta.filter(position__lt=fim)
+    linhas = list(consulta.order_by('position').values_list('column', 'total'))
+    return [coluna for coluna, _ in linhas], [total for _, total in linhas]
+
+
+def totais_das_areas(uploaded_file):
+    """
+    Lista de (área, total), na ordem em que as áreas aparecem na planilha.
+    """
+    return list(AreaTotal.objects.filter(file=uploaded_file).order_by('position').values_list('area', 'total'))
+
+
+def _somar_deltas(modelo, file_id, campo, deltas, com_posicao=True):
+    """
+    Soma os deltas {nome: delta} às linhas de 'modelo' (identificadas por
+    'campo') e cria, depois da última posição, as que ainda não existem.
+    """
+    if not deltas:
+        return
+    existentes = {
+        getattr(objeto, campo): objeto
+        for objeto in modelo.objects.filter(file_id=file_id, **{f'{campo}__in': list(deltas)})
+    }
+    for nome, objeto in existentes.items():
+        objeto.total += deltas[nome]
+    modelo.objects.bulk_update(existentes.values(), ['total'])
+
+    novos = [nome for nome in deltas if nome not in existentes]
+    proxima = None
+    if novos and com_posicao:
+        ultima = modelo.objects.filter(file_id=file_id).aggregate(ultima=Max('position'))['ultima']
+        proxima = 0 if ultima is None else ultima + 1
+    for nome in novos:
+        campos = {campo: nome, 'total': deltas[nome]}
+        if com_posicao:
+            campos['position'] = proxima
+            proxima += 1
+        modelo.objects.create(file_id=file_id, **campos)
+
+
+def _gravar_deltas(agregados, deltas_colunas, deltas_areas, deltas_contas, delta_total):
+    """
+    Soma os deltas por coluna, área e conta e o delta do total geral aos agregados.
+    """
+    _somar_deltas(ColumnTotal, agregados.file_id, 'column', deltas_colunas)
+    _somar_deltas(AreaTotal, agregados.file_id, 'area', deltas_areas)
+    _somar_deltas(AccountTotal, agregados.file_id, 'account', deltas_contas, com_posicao=False)
+
+    agregados.grand_total += delta_total
+    agregados.save(update_fields=['grand_total'])
+    return agregados
+
+
+def aplicar_deltas_linhas(agregados, colunas, contas, deltas, delta_total):
+    """
+    Aplica aos agregados a diferença entre os valores antigos e novos de
+    um lote de linhas e grava o resultado. 'deltas' é uma matriz (linhas x
+    colunas) com essas diferenças, 'contas' a conta de cada linha e
+    'delta_total' a soma das diferenças dos totais das linhas; cada tabela
+    de agregados recebe uma única atualização para o lote inteiro.
+    Retorna o FileAggregates atualizado. Deve ser chamada dentro de uma
+    transação, com 'agregados' bloqueado.
+    """
+    deltas_colunas = {coluna: delta for coluna, delta in zip(colunas, deltas.sum(axis=0).tolist()) if delta}
+    deltas_areas = {}
+    for coluna, delta in deltas_colunas.items():
+        area = area_da_coluna(coluna)
+        deltas_areas[area] = deltas_areas.get(area, 0.0) + delta
+
+    deltas_contas = {}
+    for conta, delta in zip(contas, deltas.sum(axis=1).tolist()):
+        if delta:
+            deltas_contas[str(conta)] = deltas_contas.get(str(conta), 0.0) + delta
+
+    return _gravar_deltas(agregados, deltas_colunas, deltas_areas, deltas_contas, float(delta_total))
+
+
+@transaction.atomic
+def recalcular_agregados(uploaded_file):
+    """
+    Recalcula os agregados do zero a partir da matriz do arquivo.
+    """
+    matriz = carregar_matriz(uploaded_file)
+    if matriz is None:
+        FileAggregates.objects.filter(file=uploaded_file).delete()
+        return None
+    salvar_agregados(uploaded_file, calcular_agregados(matriz))
+    return FileAggregates.objects.get(file=uploaded_file)
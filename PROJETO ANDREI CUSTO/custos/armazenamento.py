@@ -0,0 +1,475 @@
+"""
+Acesso aos valores das despesas de um arquivo, independente do layout.
+
+Há dois layouts de armazenamento:
+
+- 'json': cada ExpenseData guarda seus valores em ExpenseData.data (padrão);
+- 'colunar': os valores do arquivo inteiro ficam em um único ExpenseMatrix
+  e ExpenseData.data fica vazio.
+
+O layout de novos uploads é definido por CUSTOS_ARMAZENAMENTO. O layout de
+um arquivo existente é determinado pela presença do ExpenseMatrix, então os
+dois podem coexistir no mesmo banco.
+
+A posição de cada linha na matriz é ExpenseData.position, gravada na
+ingestão. Uma edição no layout colunar lê e grava só as linhas editadas,
+direto no blob (E/S incremental de blobs do SQLite); nos outros bancos o
+blob inteiro é regravado a cada lote de edições.
+"""
+import os
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .instrumentacao import medido
+from .models import ExpenseData, ExpenseMatrix
+
+ARMAZENAMENTO_JSON = 'json'
+ARMAZENAMENTO_COLUNAR = 'colunar'
+
+# Formato binário dos blobs da matriz: float64 little-endian.
+DTYPE_MATRIZ = np.dtype('<f8')
+
+# Bytes copiados de cada vez de um arquivo para o blob (salvar_matriz_de_arquivos).
+TAMANHO_TRECHO_BLOB = 1 << 20
+
+
+def armazenamento_configurado():
+    """
+    Retorna o layout configurado para novos uploads.
+    """
+    armazenamento = getattr(settings, 'CUSTOS_ARMAZENAMENTO', ARMAZENAMENTO_JSON)
+    if armazenamento not in (ARMAZENAMENTO_JSON, ARMAZENAMENTO_COLUNAR):
+        raise ValueError(f"CUSTOS_ARMAZENAMENTO inválido: '{armazenamento}'. Use 'json' ou 'colunar'.")
+    return armazenamento
+
+
+def usa_armazenamento_colunar(uploaded_file):
+    """
+    Indica se os valores do arquivo estão em um ExpenseMatrix.
+    """
+    return ExpenseMatrix.objects.filter(file=uploaded_file).exists()
+
+
+def matriz_do_resultado(resultado):
+    """
+    Monta a matriz a partir do resultado de processar_arquivo_excel.
+    """
+    colunas = resultado['colunas_dados']
+    valores = np.array(
+        [[linha[col] for col in colunas] for linha in resultado['df_despesas_only']],
+        dtype=DTYPE_MATRIZ,
+    ).reshape(len(resultado['df_despesas_only']), len(colunas))
+
+    return {
+        'ids': [linha.get('ID', '') for linha in resultado['tabela_principal']],
+        'contas': [linha.get('CONTA', '') for linha in resultado['tabela_principal']],
+        'colunas': list(colunas),
+        'valores': valores,
+        'totais': np.array(
+            [linha.get('TOTAL (LINHA)', 0) for linha in resultado['tabela_principal']],
+            dtype=DTYPE_MATRIZ,
+        ),
+    }
+
+
+def salvar_matriz(uploaded_file, matriz):
+    """
+    Grava (ou substitui) o ExpenseMatrix do arquivo.
+    """
+    ExpenseMatrix.objects.update_or_create(
+        file=uploaded_file,
+        defaults={
+            'columns': list(matriz['colunas']),
+            'row_ids': [str(i) for i in matriz['ids']],
+            'accounts': [str(c) for c in matriz['contas']],
+            'values': np.ascontiguousarray(matriz['valores'], dtype=DTYPE_MATRIZ).tobytes(),
+            'row_totals': np.ascontiguousarray(matriz['totais'], dtype=DTYPE_MATRIZ).tobytes(),
+        },
+    )
+
+
+def salvar_matriz_de_arquivos(uploaded_file, colunas, ids, contas, valores, totais):
+    """
+    Grava (ou substitui) o ExpenseMatrix do arquivo a partir de arquivos
+    binários ('valores' e 'totais', já em DTYPE_MATRIZ), sem montar a matriz
+    em memória. No SQLite os blobs são reservados com zeroblob() e copiados
+    dos arquivos em trechos; nos outros bancos cada blob é lido do arquivo
+    de uma vez só.
+    """
+    campos = {'values': valores, 'row_totals': totais}
+    defaults = {
+        'columns': list(colunas),
+        'row_ids': [str(i) for i in ids],
+        'accounts': [str(c) for c in contas],
+    }
+    if connection.vendor != 'sqlite':
+        for campo, arquivo in campos.items():
+            arquivo.seek(0)
+            defaults[campo] = arquivo.read()
+        ExpenseMatrix.objects.update_or_create(file=uploaded_file, defaults=defaults)
+        return
+
+    expense_matrix, _ = ExpenseMatrix.objects.update_or_create(
+        file=uploaded_file, defaults={**defaults, 'values': b'', 'row_totals': b''},
+    )
+    quote = connection.ops.quote_name
+    reservas = ', '.join(f'{quote(ExpenseMatrix._meta.get_field(campo).column)} = zeroblob(%s)' for campo in campos)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {quote(ExpenseMatrix._meta.db_table)} SET {reservas} '
+            f'WHERE {quote(ExpenseMatrix._meta.pk.column)} = %s',
+            [*(arquivo.seek(0, os.SEEK_END) for arquivo in campos.values()),
+             ExpenseMatrix._meta.pk.get_db_prep_value(expense_matrix.pk, connection)],
+        )
+    for campo, arquivo in campos.items():
+        arquivo.seek(0)
+        with _blob(expense_matrix, campo) as blob:
+            while trecho := arquivo.read(TAMANHO_TRECHO_BLOB):
+                blob.write(trecho)
+
+
+def _carregar_matriz_colunar(expense_matrix):
+    """
+    Lê a matriz de um ExpenseMatrix sem copiar os bytes do blob.
+    Os arrays retornados são somente leitura.
+    """
+    colunas = expense_matrix.columns
+    linhas = len(expense_matrix.row_ids)
+    valores = np.frombuffer(expense_matrix.values, dtype=DTYPE_MATRIZ).reshape(linhas, len(colunas))
+    totais = np.frombuffer(expense_matrix.row_totals, dtype=DTYPE_MATRIZ)
+
+    return {
+        'ids': expense_matrix.row_ids,
+        'contas': expense_matrix.accounts,
+        'colunas': colunas,
+        'valores': valores,
+        'totais': totais,
+    }
+
+
+def _carregar_matriz_json(uploaded_file):
+    """
+    Monta a matriz a partir do campo JSON de cada ExpenseData.
+    """
+    linhas = list(
+        uploaded_file.expenses.order_by('position').values_list('id_excel', 'account', 'row_total', 'data')
+    )
+    if not linhas:
+        return None
+
+    ids, contas, totais, dados = zip(*linhas)
+    # Mesma ordem de colunas que o DataFrame montado a partir dos dicts teria.
+    colunas = list(dict.fromkeys(col for linha in dados for col in linha))
+    valores = (
+        pd.DataFrame.from_records(list(dados), columns=colunas)
+        .apply(pd.to_numeric, errors='coerce')
+        .fillna(0)
+        .to_numpy(dtype=DTYPE_MATRIZ)
+        .reshape(len(linhas), len(colunas))
+    )
+
+    return {
+        'ids': list(ids),
+        'contas': list(contas),
+        'colunas': colunas,
+        'valores': valores,
+        'totais': np.array(totais, dtype=DTYPE_MATRIZ),
+    }
+
+
+@medido
+def carregar_matriz(uploaded_file):
+    """
+    Retorna os dados do arquivo como um dicionário com as chaves
+    'ids', 'contas', 'colunas', 'valores' (ndarray linhas x colunas) e
+    'totais' (ndarray com o total de cada linha), ou None se não houver dados.
+    """
+    expense_matrix = ExpenseMatrix.objects.filter(file=uploaded_file).first()
+    if expense_matrix is not None:
+        if not expense_matrix.row_ids:
+            return None
+        return _carregar_matriz_colunar(expense_matrix)
+    return _carregar_matriz_json(uploaded_file)
+
+
+def _filtrar_posicoes(ids, contas, busca):
+    """
+    Posições das linhas cujo ID ou conta contém 'busca' (sem diferenciar maiúsculas).
+    """
+    busca = busca.lower()
+    return [
+        i for i, (id_excel, conta) in enumerate(zip(ids, contas))
+        if busca in str(id_excel).lower() or busca in str(conta).lower()
+    ]
+
+
+@medido
+def ler_janela(uploaded_file, colunas, offset, limite, busca=''):
+    """
+    Lê uma janela de linhas da tabela principal, restrita às 'colunas'
+    informadas. As linhas seguem a ordem da planilha (position) e podem ser filtradas por
+    'busca' (ID ou conta). Retorna um dicionário com 'total_linhas' (após o
+    filtro), 'ids', 'contas', 'totais' e 'valores' (lista de listas).
+    """
+    expense_matrix = ExpenseMatrix.objects.filter(file=uploaded_file).first()
+    if expense_matrix is not None:
+        matriz = _carregar_matriz_colunar(expense_matrix)
+        posicoes = (
+            _filtrar_posicoes(matriz['ids'], matriz['contas'], busca) if busca
+            else range(len(matriz['ids']))
+        )
+        selecionadas = np.asarray(posicoes[offset:offset + limite], dtype=np.intp)
+        indices_colunas = {col: i for i, col in enumerate(matriz['colunas'])}
+        valores = np.zeros((len(selecionadas), len(colunas)), dtype=DTYPE_MATRIZ)
+        for j, col in enumerate(colunas):
+            if col in indices_colunas:
+                valores[:, j] = matriz['valores'][selecionadas, indices_colunas[col]]
+        return {
+            'total_linhas': len(posicoes),
+            'ids': [matriz['ids'][i] for i in selecionadas.tolist()],
+            'contas': [matriz['contas'][i] for i in selecionadas.tolist()],
+            'totais': matriz['totais'][selecionadas].tolist(),
+            'valores': valores.tolist(),
+        }
+
+    consulta = uploaded_file.expenses.order_by('position')
+    if busca:
+        consulta = consulta.filter(Q(id_excel__icontains=busca) | Q(account__icontains=busca))
+    linhas = list(consulta[offset:offset + limite].values_list('id_excel', 'account', 'row_total', 'data'))
+    valores = (
+        pd.DataFrame.from_records([linha[3] for linha in linhas], columns=list(colunas))
+        .apply(pd.to_numeric, errors='coerce')
+        .fillna(0)
+        .to_numpy(dtype=DTYPE_MATRIZ)
+        .reshape(len(linhas), len(colunas))
+    )
+    return {
+        'total_linhas': consulta.count(),
+        'ids': [linha[0] for linha in linhas],
+        'contas': [linha[1] for linha in linhas],
+        'totais': [linha[2] for linha in linhas],
+        'valores': valores.tolist(),
+    }
+
+
+def somar_colunas_da_conta(uploaded_file, conta):
+    """
+    Soma, coluna a coluna, as linhas de uma única conta.
+    Retorna um dicionário {coluna: soma} na ordem das colunas do arquivo,
+    vazio se a conta não existir.
+    """
+    expense_matrix = ExpenseMatrix.objects.filter(file=uploaded_file).first()
+    if expense_matrix is not None:
+        matriz = _carregar_matriz_colunar(expense_matrix)
+        mascara = np.asarray(matriz['contas'], dtype=object) == str(conta)
+        if not mascara.any():
+            return {}
+        somas = matriz['valores'][mascara].sum(axis=0)
+        return dict(zip(matriz['colunas'], somas.tolist()))
+
+    dados = list(uploaded_file.expenses.filter(account=conta).order_by('position').values_list('data', flat=True))
+    if not dados:
+        return {}
+    colunas = list(dict.fromkeys(col for linha in dados for col in linha))
+    somas = (
+        pd.DataFrame.from_records(dados, columns=colunas)
+        .apply(pd.to_numeric, errors='coerce')
+        .fillna(0)
+        .sum(axis=0)
+    )
+    return somas.to_dict()
+
+
+def _posicoes_linhas(entradas):
+    """
+    Posições de várias linhas na matriz (ExpenseData.position), na ordem de 'entradas'.
+    """
+    return np.array([entrada.position for entrada in entradas], dtype=np.intp)
+
+
+def _trechos(posicoes):
+    """
+    Ordem que ordena as posições e os trechos contíguos [inicio, fim) que
+    elas formam, para ler ou gravar várias linhas seguidas de uma vez.
+    """
+    ordem = np.argsort(posicoes, kind='stable')
+    ordenadas = posicoes[ordem]
+    quebras = np.flatnonzero(np.diff(ordenadas) != 1) + 1
+    inicios = ordenadas[np.concatenate(([0], quebras))]
+    fins = ordenadas[np.concatenate((quebras - 1, [len(ordenadas) - 1]))] + 1
+    return ordem, list(zip(inicios.tolist(), fins.tolist()))
+
+
+@contextmanager
+def _blob(expense_matrix, campo):
+    """
+    Blob de um campo do ExpenseMatrix aberto para leitura e escrita no
+    lugar (sqlite3.Blob), sem carregar o valor inteiro. Só no SQLite.
+    """
+    tabela = ExpenseMatrix._meta.db_table
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {quote(tabela)} WHERE {quote(ExpenseMatrix._meta.pk.column)} = %s',
+            [ExpenseMatrix._meta.pk.get_db_prep_value(expense_matrix.pk, connection)],
+        )
+        rowid = cursor.fetchone()[0]
+    with connection.connection.blobopen(tabela, ExpenseMatrix._meta.get_field(campo).column, rowid) as blob:
+        yield blob
+
+
+def _ler_linhas_colunares(expense_matrix, posicoes):
+    colunas = len(expense_matrix.columns)
+    if connection.vendor != 'sqlite':
+        return np.frombuffer(expense_matrix.values, dtype=DTYPE_MATRIZ).reshape(-1, colunas)[posicoes]
+
+    ordem, trechos = _trechos(posicoes)
+    tamanho_linha = colunas * DTYPE_MATRIZ.itemsize
+    lidas = bytearray()
+    with _blob(expense_matrix, 'values') as blob:
+        for inicio, fim in trechos:
+            blob.seek(inicio * tamanho_linha)
+            lidas += blob.read((fim - inicio) * tamanho_linha)
+    valores = np.empty((len(posicoes), colunas), dtype=DTYPE_MATRIZ)
+    valores[ordem] = np.frombuffer(lidas, dtype=DTYPE_MATRIZ).reshape(-1, colunas)
+    return valores
+
+
+def _gravar_no_blob(expense_matrix, campo, posicoes, linhas):
+    """
+    Grava 'linhas' (uma por posição) nas posições do blob, no lugar.
+    """
+    ordem, trechos = _trechos(posicoes)
+    ordenadas = np.ascontiguousarray(linhas[ordem], dtype=DTYPE_MATRIZ)
+    tamanho_linha = ordenadas[:1].nbytes
+    gravadas = 0
+    with _blob(expense_matrix, campo) as blob:
+        for inicio, fim in trechos:
+            blob.seek(inicio * tamanho_linha)
+            blob.write(ordenadas[gravadas:gravadas + fim - inicio].tobytes())
+            gravadas += fim - inicio
+
+
+def _gravar_linhas_colunares(expense_matrix, posicoes, valores, totais):
+    if connection.vendor == 'sqlite':
+        _gravar_no_blob(expense_matrix, 'values', posicoes, valores)
+        _gravar_no_blob(expense_matrix, 'row_totals', posicoes, totais)
+        return
+
+    # Nos outros bancos o blob é regravado inteiro, a partir de uma única cópia.
+    todos_valores = bytearray(expense_matrix.values)
+    todos_totais = bytearray(expense_matrix.row_totals)
+    np.frombuffer(todos_valores, dtype=DTYPE_MATRIZ).reshape(-1, valores.shape[1])[posicoes] = valores
+    np.frombuffer(todos_totais, dtype=DTYPE_MATRIZ)[posicoes] = totais
+    expense_matrix.values = todos_valores
+    expense_matrix.row_totals = todos_totais
+    expense_matrix.save(update_fields=['values', 'row_totals'])
+
+
+def ler_linhas(uploaded_file, entradas):
+    """
+    Lê de uma vez os valores de várias linhas (ExpenseData) do arquivo.
+    Retorna um dicionário com 'colunas', 'valores' (ndarray linhas x colunas,
+    com não numéricos como 0) e 'numericas' (ndarray booleano com as células
+    numéricas, as únicas que uma edição pode alterar no layout JSON), além
+    do que gravar_linhas precisa para gravá-las de volta.
+
+    No layout colunar, no SQLite, só as linhas pedidas são lidas do blob.
+    Deve ser chamada dentro de uma transação: no layout colunar a matriz
+    fica bloqueada até o fim dela.
+    """
+    expense_matrix = (
+        ExpenseMatrix.objects.select_for_update().filter(file=uploaded_file)
+        .defer('values', 'row_totals', 'row_ids', 'accounts').first()
+    )
+    if expense_matrix is not None:
+        posicoes = _posicoes_linhas(entradas)
+        valores = _ler_linhas_colunares(expense_matrix, posicoes)
+        return {
+            'colunas': list(expense_matrix.columns),
+            'valores': valores,
+            'numericas': np.ones(valores.shape, dtype=bool),
+            'expense_matrix': expense_matrix,
+            'posicoes': posicoes,
+        }
+
+    dados = [entrada.data for entrada in entradas]
+    colunas = list(dict.fromkeys(col for linha in dados for col in linha))
+    numeros = pd.DataFrame.from_records(dados, columns=colunas).apply(pd.to_numeric, errors='coerce')
+    return {
+        'colunas': colunas,
+        'valores': numeros.fillna(0).to_numpy(dtype=DTYPE_MATRIZ).reshape(len(dados), len(colunas)),
+        'numericas': numeros.notna().to_numpy().reshape(len(dados), len(colunas)),
+        'expense_matrix': None,
+        'posicoes': None,
+    }
+
+
+def gravar_linhas(uploaded_file, entradas, linhas, valores, totais, numericas):
+    """
+    Grava os novos valores e totais de várias linhas lidas com ler_linhas:
+    um único bulk_update dos ExpenseData e, no layout colunar, só as linhas
+    alteradas da matriz (no SQLite, no próprio blob; nos outros bancos o
+    blob é regravado). No layout JSON só as células marcadas em
+    'numericas' são alteradas; as demais mantêm o valor original.
+    """
+    with transaction.atomic():
+        for entrada, total in zip(entradas, totais.tolist()):
+            entrada.row_total = total
+
+        expense_matrix = linhas['expense_matrix']
+        if expense_matrix is None:
+            for entrada, linha, mascara in zip(entradas, valores.tolist(), numericas.tolist()):
+                entrada.data = {
+                    **entrada.data,
+                    **{col: valor for col, valor, numerica in zip(linhas['colunas'], linha, mascara) if numerica},
+                }
+            ExpenseData.objects.bulk_update(entradas, ['data', 'row_total'], batch_size=500)
+            return
+
+        ExpenseData.objects.bulk_update(entradas, ['row_total'], batch_size=500)
+        _gravar_linhas_colunares(
+            expense_matrix, linhas['posicoes'],
+            np.asarray(valores, dtype=DTYPE_MATRIZ), np.asarray(totais, dtype=DTYPE_MATRIZ),
+        )
+
+
+def converter_para_colunar(uploaded_file):
+    """
+    Move os valores de um arquivo do layout JSON para o colunar.
+    Retorna False se o arquivo já estiver no layout colunar ou não tiver dados.
+    """
+    if usa_armazenamento_colunar(uploaded_file):
+        return False
+
+    with transaction.atomic():
+        matriz = _carregar_matriz_json(uploaded_file)
+        if matriz is None:
+            return False
+        salvar_matriz(uploaded_file, matriz)
+        uploaded_file.expenses.update(data={})
+    return True
+
+
+def converter_para_json(uploaded_file):
+    """
+    Move os valores de um arquivo do layout colunar de volta para o JSON.
+    Retorna False se o arquivo já estiver no layout JSON.
+    """
+    expense_matrix = ExpenseMatrix.objects.filter(file=uploaded_file).first()
+    if expense_matrix is None:
+        return False
+
+    with transaction.atomic():
+        matriz = _carregar_matriz_colunar(expense_matrix)
+        despesas = list(uploaded_file.expenses.order_by('position'))
+        for despesa, linha in zip(despesas, matriz['valores'].tolist()):
+            despesa.data = dict(zip(matriz['colunas'], linha))
+        ExpenseData.objects.bulk_update(despesas, ['data'], batch_size=500)
+        expense_matrix.delete()
+    return True
@@ -0,0 +1,205 @@
+"""
+Artefatos de exportação: os downloads gerados uma vez e guardados em disco.
+
+A planilha reconstruída (.xlsx, .csv e, com o pyarrow instalado, .parquet)
+é gerada no primeiro download, ou pelo trabalhador da fila logo depois do
+upload (CUSTOS_ARTEFATOS_APOS_UPLOAD), e gravada em CUSTOS_ARTEFATOS_DIR
+como '<file_id>-v<data_version>-<CUSTOS_ETAG_VERSAO>.<formato>'. Os
+downloads seguintes enviam o arquivo direto do disco: FileResponse (que
+usa o wsgi.file_wrapper, o sendfile do servidor, quando existe) ou, com
+CUSTOS_ARTEFATOS_X_ACCEL_REDIRECT, só o cabeçalho X-Accel-Redirect para o
+nginx enviar o arquivo.
+
+A versão dos dados faz parte do nome: uma edição torna os artefatos
+anteriores inalcançáveis, cache_analise.invalidar_contexto os remove e o
+próximo download gera o novo. O diretório é limitado a
+CUSTOS_ARTEFATOS_TAMANHO_MAXIMO bytes; a cada artefato gravado, os usados
+há mais tempo (data de modificação, renovada a cada envio) são removidos
+até o total caber no limite.
+"""
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.utils.http import content_disposition_header
+
+from .exportacao import escrever_csv, escrever_parquet, escrever_xlsx, pyarrow
+from .models import UploadedFile
+
+logger = logging.getLogger(__name__)
+
+FORMATO_PADRAO = 'xlsx'
+
+# Função que grava cada formato e o Content-Type do download.
+FORMATOS_ARTEFATO = {
+    'xlsx': (escrever_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'csv': (escrever_csv, 'text/csv; charset=utf-8'),
+    'parquet': (escrever_parquet, 'application/vnd.apache.parquet'),
+}
+
+# Artefatos ainda sendo gravados (renomeados ao terminar); ignorados na limpeza.
+PREFIXO_TEMPORARIO = '.gerando-'
+
+
+def usar_artefatos():
+    return getattr(settings, 'CUSTOS_ARTEFATOS', False)
+
+
+def formato_download(valor):
+    """
+    Formato pedido em ?formato=, com o .xlsx no lugar de valores desconhecidos.
+    """
+    return valor if valor in FORMATOS_ARTEFATO else FORMATO_PADRAO
+
+
+def _diretorio():
+    diretorio = Path(getattr(settings, 'CUSTOS_ARTEFATOS_DIR', Path(settings.BASE_DIR) / 'artefatos'))
+    diretorio.mkdir(parents=True, exist_ok=True)
+    return diretorio
+
+
+def _tamanho_maximo():
+    return int(getattr(settings, 'CUSTOS_ARTEFATOS_TAMANHO_MAXIMO', 1024 ** 3))
+
+
+def nome_artefato(file_id, data_version, formato):
+    sistema = getattr(settings, 'CUSTOS_ETAG_VERSAO', '') or '0'
+    return f'{file_id}-v{data_version}-{sistema}.{formato}'
+
+
+def caminho_artefato(uploaded_file, formato):
+    return _diretorio() / nome_artefato(uploaded_file.file_id, uploaded_file.data_version, formato)
+
+
+def gerar_artefato(uploaded_file, formato):
+    """
+    Gera o artefato da versão atual dos dados e retorna o caminho. O arquivo
+    é escrito com outro nome e renomeado no final, então um download nunca
+    lê um artefato pela metade. Remove os artefatos de versões anteriores do
+    arquivo e aplica o limite de tamanho do diretório.
+    """
+    if formato == 'parquet' and pyarrow is None:
+        raise ValueError("O download em Parquet requer o pacote pyarrow.")
+
+    escrever, _ = FORMATOS_ARTEFATO[formato]
+    caminho = caminho_artefato(uploaded_file, formato)
+    descritor, temporario = tempfile.mkstemp(prefix=PREFIXO_TEMPORARIO, suffix=f'.{formato}', dir=caminho.parent)
+    os.close(descritor)
+    try:
+        escrever(uploaded_file, temporario)
+        os.replace(temporario, caminho)
+    except BaseException:
+        os.remove(temporario)
+        raise
+
+    remover_artefatos(uploaded_file.file_id, manter_versao=uploaded_file.data_version)
+    aplicar_limite(manter=caminho)
+    return caminho
+
+
+def gerar_artefato_por_id(file_id, formato):
+    """
+    gerar_artefato para o pool de processos (recebe apenas o file_id).
+    """
+    return str(gerar_artefato(UploadedFile.objects.get(file_id=file_id), formato))
+
+
+def gerar_artefatos_apos_upload(uploaded_file):
+    """
+    Gera os formatos de CUSTOS_ARTEFATOS_APOS_UPLOAD. Uma falha só é
+    registrada no log: o artefato será gerado no primeiro download.
+    """
+    if not usar_artefatos():
+        return
+    for formato in getattr(settings, 'CUSTOS_ARTEFATOS_APOS_UPLOAD', ()):
+        try:
+            gerar_artefato(uploaded_file, formato)
+        except Exception as e:
+            logger.error(f"Erro ao gerar o artefato {formato} do arquivo {uploaded_file.file_id}: {str(e)}")
+
+
+def remover_artefatos(file_id, manter_versao=None):
+    """
+    Remove os artefatos do arquivo, de todas as versões menos 'manter_versao'.
+    """
+    prefixo = f'{file_id}-v'
+    mantidos = nome_artefato(file_id, manter_versao, '') if manter_versao is not None else None
+    for entrada in os.scandir(_diretorio()):
+        if entrada.name.startswith(prefixo) and not (mantidos and entrada.name.startswith(mantidos)):
+            try:
+                os.remove(entrada.path)
+            except FileNotFoundError:
+                pass
+
+
+def aplicar_limite(manter=None):
+    """
+    Remove os artefatos usados há mais tempo até o diretório caber em
+    CUSTOS_ARTEFATOS_TAMANHO_MAXIMO, sem remover 'manter'. Retorna quantos
+    foram removidos.
+    """
+    entradas = []
+    total = 0
+    for entrada in os.scandir(_diretorio()):
+        if entrada.name.startswith(PREFIXO_TEMPORARIO) or not entrada.is_file():
+            continue
+        try:
+            estado = entrada.stat()
+        except FileNotFoundError:
+            continue
+        total += estado.st_size
+        entradas.append((estado.st_mtime, estado.st_size, entrada.path))
+
+    limite = _tamanho_maximo()
+    removidos = 0
+    for _, tamanho, caminho in sorted(entradas):
+        if total <= limite:
+            break
+        if manter is not None and caminho == str(manter):
+            continue
+        try:
+            os.remove(caminho)
+        except FileNotFoundError:
+            pass
+        total -= tamanho
+        removidos += 1
+    return removidos
+
+
+def _marcar_uso(caminho):
+    # A data de modificação é a ordem da remoção (LRU); o atime nem sempre é atualizado.
+    try:
+        os.utime(caminho)
+    except FileNotFoundError:
+        pass
+
+
+def resposta_artefato(uploaded_file, formato):
+    """
+    Resposta de download do artefato, gerado antes se ainda não existir.
+    """
+    formato = formato_download(formato)
+    _, content_type = FORMATOS_ARTEFATO[formato]
+    filename = f"{uploaded_file.name}_reconstruido.{formato}"
+    caminho = caminho_artefato(uploaded_file, formato)
+
+    prefixo_interno = getattr(settings, 'CUSTOS_ARTEFATOS_X_ACCEL_REDIRECT', '')
+    if prefixo_interno:
+        if not caminho.exists():
+            gerar_artefato(uploaded_file, formato)
+        _marcar_uso(caminho)
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = prefixo_interno.rstrip('/') + '/' + caminho.name
+        response['Content-Disposition'] = content_disposition_header(True, filename)
+        return response
+
+    try:
+        arquivo = open(caminho, 'rb')
+    except FileNotFoundError:
+        gerar_artefato(uploaded_file, formato)
+        arquivo = open(caminho, 'rb')
+    _marcar_uso(caminho)
+    return FileResponse(arquivo, as_attachment=True, filename=filename, content_type=content_type)
@@ -0,0 +1,144 @@
+"""
+Cache do contexto da análise (saída de _get_analysis_context).
+
+A chave inclui o file_id e o UploadedFile.data_version. Toda alteração
+nos dados incrementa a versão (e atualiza UploadedFile.data_modified), o
+que torna a entrada antiga inalcançável; a entrada antiga também é
+removida para liberar memória. A mesma versão identifica as respostas
+HTTP do arquivo (ver custos.condicional) e, com CUSTOS_ARTEFATOS, os
+artefatos de exportação em disco, removidos junto com o contexto (ver
+custos.artefatos).
+
+O alias de cache usado é definido por CUSTOS_CACHE_ANALISE (padrão:
+'default'). Os contadores de acertos e falhas ficam na memória do processo
+(custos.instrumentacao), e não no cache, onde poderiam ser descartados
+junto com os contextos quando ele enche. Com vários workers, cada um conta
+os seus.
+"""
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .instrumentacao import contar, valor_contador
+from .models import UploadedFile
+
+METRICA_CACHE = 'custos_cache_analise_total'
+ACERTO = (('resultado', 'acerto'),)
+FALHA = (('resultado', 'falha'),)
+
+# Variantes do contexto: com a tabela principal completa ou sem ela
+# (modo virtual, em que a tabela é carregada em janelas pelo navegador),
+# e os dados sem formatação da API de dados (analysis_data_view).
+VARIANTE_COMPLETA = 'completa'
+VARIANTE_VIRTUAL = 'virtual'
+VARIANTE_DADOS = 'dados'
+VARIANTES_CONTEXTO = (VARIANTE_COMPLETA, VARIANTE_VIRTUAL, VARIANTE_DADOS)
+
+
+def _cache():
+    return caches[getattr(settings, 'CUSTOS_CACHE_ANALISE', 'default')]
+
+
+def chave_contexto(file_id, data_version, variante=VARIANTE_COMPLETA):
+    """
+    Chave do contexto de análise de uma versão dos dados de um arquivo.
+    """
+    return f'custos:analise:{file_id}:v{data_version}:{variante}'
+
+
+def _chaves_da_versao(file_id, data_version):
+    return [chave_contexto(file_id, data_version, variante) for variante in VARIANTES_CONTEXTO]
+
+
+def obter_contexto_analise(uploaded_file, gerar_contexto, variante=VARIANTE_COMPLETA):
+    """
+    Retorna o contexto da análise do cache ou, em caso de falha, gera com
+    gerar_contexto(uploaded_file) e guarda no cache. Sempre retorna uma
+    cópia rasa, que pode ser alterada pela view.
+    """
+    cache = _cache()
+    chave = chave_contexto(uploaded_file.file_id, uploaded_file.data_version, variante)
+
+    contexto = cache.get(chave)
+    if contexto is not None:
+        contar(METRICA_CACHE, ACERTO)
+        return dict(contexto)
+
+    contar(METRICA_CACHE, FALHA)
+    contexto = gerar_contexto(uploaded_file)
+    if contexto is not None:
+        cache.set(chave, contexto)
+        return dict(contexto)
+    return None
+
+
+async def aobter_contexto_analise(uploaded_file, gerar_contexto, variante=VARIANTE_COMPLETA):
+    """
+    Versão assíncrona de obter_contexto_analise, em que gerar_contexto é uma
+    corrotina (ex.: o contexto gerado no pool de processos).
+    """
+    cache = _cache()
+    chave = chave_contexto(uploaded_file.file_id, uploaded_file.data_version, variante)
+
+    contexto = await cache.aget(chave)
+    if contexto is not None:
+        contar(METRICA_CACHE, ACERTO)
+        return dict(contexto)
+
+    contar(METRICA_CACHE, FALHA)
+    contexto = await gerar_contexto(uploaded_file)
+    if contexto is not None:
+        await cache.aset(chave, contexto)
+        return dict(contexto)
+    return None
+
+
+def invalidar_contexto(uploaded_file):
+    """
+    Incrementa a versão dos dados do arquivo, atualiza a data da alteração e
+    remove os contextos e os artefatos da versão anterior (após o commit, se
+    houver transação aberta).
+    """
+    versao_anterior = uploaded_file.data_version
+    UploadedFile.objects.filter(pk=uploaded_file.pk).update(
+        data_version=F('data_version') + 1, data_modified=timezone.now(),
+    )
+    uploaded_file.refresh_from_db(fields=['data_version', 'data_modified'])
+
+    chaves = _chaves_da_versao(uploaded_file.file_id, versao_anterior)
+    transaction.on_commit(lambda: _cache().delete_many(chaves))
+    transaction.on_commit(partial(_remover_artefatos, uploaded_file.file_id))
+
+
+def remover_contexto(uploaded_file):
+    """
+    Remove do cache os contextos da versão atual e os artefatos do arquivo
+    (usado na exclusão do arquivo).
+    """
+    _cache().delete_many(_chaves_da_versao(uploaded_file.file_id, uploaded_file.data_version))
+    _remover_artefatos(uploaded_file.file_id)
+
+
+def _remover_artefatos(file_id):
+    # Sem CUSTOS_ARTEFATOS não há artefatos, e o módulo nem é carregado.
+    if getattr(settings, 'CUSTOS_ARTEFATOS', False):
+        from .artefatos import remover_artefatos
+        remover_artefatos(file_id)
+
+
+def estatisticas_cache():
+    """
+    Retorna os contadores de acertos e falhas do cache da análise (deste processo).
+    """
+    acertos = valor_contador(METRICA_CACHE, ACERTO)
+    falhas = valor_contador(METRICA_CACHE, FALHA)
+    total = acertos + falhas
+    return {
+        'acertos': acertos,
+        'falhas': falhas,
+        'taxa_acerto': round(acertos / total, 4) if total else None,
+    }
@@ -0,0 +1,152 @@
+"""
+Comparação entre análises (por exemplo, uma planilha por mês).
+
+comparar_arquivos alinha pelo nome as áreas e as contas de N arquivos e
+calcula a variação de cada uma de um arquivo para o seguinte e o ranking de
+crescimento no período. Os totais saem dos agregados materializados
+(FileAggregates, AreaTotal e AccountTotal), com uma consulta por tabela
+para todos os arquivos, e são empilhados em uma matriz (arquivos x nomes);
+as variações são calculadas de uma vez sobre essa matriz, sem montar a
+análise de cada arquivo.
+"""
+import numpy as np
+import pandas as pd
+
+from .agregados import obter_agregados
+from .instrumentacao import medido
+from .models import AccountTotal, AreaTotal, FileAggregates
+
+# Itens em cada lista do ranking de crescimento (maiores altas e maiores quedas).
+LIMITE_RANKING = 20
+
+
+def normalizar_nomes(nomes):
+    """
+    Chave de alinhamento de cada nome: em maiúsculas, sem espaços nas pontas
+    e com espaços repetidos reduzidos a um ('Conta  x ' e 'CONTA X' se alinham).
+    """
+    return pd.Series(nomes, dtype=object).astype(str).str.split().str.join(' ').str.upper()
+
+
+def empilhar_totais(modelo, campo, arquivos, ordem):
+    """
+    Empilha os totais de 'campo' ('area' ou 'account') dos arquivos em uma
+    matriz (arquivos x nomes), alinhados pelo nome normalizado. Um nome que
+    não aparece em um arquivo vale 0 nele. Retorna (nomes, matriz), com cada
+    nome escrito como aparece na primeira vez, na ordem de 'ordem'.
+    """
+    posicoes = {arquivo.pk: i for i, arquivo in enumerate(arquivos)}
+    linhas = list(
+        modelo.objects.filter(file__in=list(posicoes)).order_by(ordem).values_list('file_id', campo, 'total')
+    )
+    if not linhas:
+        return [], np.zeros((len(arquivos), 0))
+
+    file_ids, nomes, totais = zip(*linhas)
+    # Os nomes se repetem entre os arquivos: só os distintos são normalizados.
+    codigos_nomes, distintos = pd.factorize(np.asarray(nomes, dtype=object))
+    codigos_chaves, _ = pd.factorize(normalizar_nomes(distintos))
+    codigos = codigos_chaves[codigos_nomes]
+    # factorize numera as chaves na ordem em que aparecem pela primeira vez.
+    _, primeiros = np.unique(codigos, return_index=True)
+    indices_arquivos = np.fromiter((posicoes[file_id] for file_id in file_ids), dtype=np.intp, count=len(file_ids))
+
+    matriz = np.zeros((len(arquivos), len(primeiros)))
+    # add.at soma os nomes que só diferem na escrita dentro do mesmo arquivo.
+    np.add.at(matriz, (indices_arquivos, codigos), np.asarray(totais, dtype=float))
+    return [nomes[i] for i in primeiros], matriz
+
+
+def variacoes(matriz):
+    """
+    Variação absoluta e percentual de cada linha da matriz para a seguinte
+    (um arquivo para o próximo). O percentual é NaN quando o valor anterior é 0.
+    """
+    anteriores = matriz[:-1]
+    deltas = np.diff(matriz, axis=0)
+    crescimento = np.full_like(deltas, np.nan)
+    np.divide(deltas, np.abs(anteriores), out=crescimento, where=anteriores != 0)
+    return deltas, crescimento * 100
+
+
+def _lista(valores):
+    """
+    Array arredondado em 2 casas como lista, com None no lugar de NaN (JSON).
+    """
+    valores = np.asarray(valores, dtype=float)
+    return np.where(np.isnan(valores), None, np.round(valores, 2)).tolist()
+
+
+def ranking_crescimento(nomes, matriz, limite=LIMITE_RANKING):
+    """
+    Maiores altas e maiores quedas entre o primeiro e o último arquivo, pela
+    variação em reais.
+    """
+    if len(matriz) < 2 or not nomes:
+        return {'altas': [], 'quedas': []}
+
+    inicial, final = matriz[0], matriz[-1]
+    _, crescimento = variacoes(np.vstack([inicial, final]))
+    delta = final - inicial
+    ordem = np.argsort(-delta, kind='stable')
+
+    def item(i):
+        return {
+            'nome': nomes[i],
+            'inicial': round(float(inicial[i]), 2),
+            'final': round(float(final[i]), 2),
+            'delta': round(float(delta[i]), 2),
+            'crescimento': _lista(crescimento[0, i]),
+        }
+
+    return {
+        'altas': [item(i) for i in ordem[:limite] if delta[i] > 0],
+        'quedas': [item(i) for i in ordem[::-1][:limite] if delta[i] < 0],
+    }
+
+
+def _dimensao(nomes, matriz, limite):
+    deltas, crescimento = variacoes(matriz)
+    return {
+        'nomes': nomes,
+        'totais': _lista(matriz),
+        'deltas': _lista(deltas),
+        'crescimento': _lista(crescimento),
+        'ranking': ranking_crescimento(nomes, matriz, limite),
+    }
+
+
+@medido
+def comparar_arquivos(arquivos, limite=LIMITE_RANKING):
+    """
+    Compara os arquivos na ordem recebida (a ordem dos meses). Para as áreas
+    e para as contas retorna os nomes alinhados, os totais (arquivos x
+    nomes), as variações de cada arquivo para o seguinte ('deltas' e
+    'crescimento' em %, com arquivos - 1 linhas) e o ranking de crescimento
+    do período.
+    """
+    arquivos = list(arquivos)
+    totais_gerais = dict(
+        FileAggregates.objects.filter(file__in=[arquivo.pk for arquivo in arquivos]).values_list('file_id', 'grand_total')
+    )
+    for arquivo in arquivos:
+        # Arquivos enviados antes dos agregados existirem: calculados uma vez aqui.
+        if arquivo.pk not in totais_gerais:
+            agregados = obter_agregados(arquivo)
+            totais_gerais[arquivo.pk] = agregados.grand_total if agregados is not None else 0.0
+
+    total_geral = np.array([totais_gerais[arquivo.pk] for arquivo in arquivos], dtype=float)
+    deltas, crescimento = variacoes(total_geral[:, np.newaxis])
+    return {
+        'arquivos': [
+            {'file_id': str(arquivo.file_id), 'nome': arquivo.name, 'data': arquivo.upload_date.isoformat()}
+            for arquivo in arquivos
+        ],
+        'total_geral': {
+            'totais': _lista(total_geral),
+            'deltas': _lista(deltas[:, 0]),
+            'crescimento': _lista(crescimento[:, 0]),
+        },
+        'areas': _dimensao(*empilhar_totais(AreaTotal, 'area', arquivos, 'position'), limite),
+        'contas': _dimensao(*empilhar_totais(AccountTotal, 'account', arquivos, 'account'), limite),
+    }
@@ -0,0 +1,68 @@
+"""
+Compressão das respostas (gzip e brotli).
+
+CompressaoMiddleware estende o GZipMiddleware do Django: respostas JSON são
+comprimidas com brotli quando o navegador aceita 'br' e o pacote brotli
+está instalado; as demais (e as JSON, sem brotli) seguem com gzip. O brotli
+fica restrito ao JSON porque as páginas HTML levam o token CSRF, e só o
+gzip do Django tem a proteção contra o ataque BREACH. Arquivos que já são
+comprimidos (.xlsx, .parquet) passam sem alteração.
+"""
+import re
+
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Qualidade do brotli (0 a 11): 5 comprime quase como o máximo em uma fração do tempo.
+QUALIDADE_BROTLI = 5
+
+# Tipos de conteúdo que já são comprimidos e não ganham nada com gzip.
+TIPOS_COMPRIMIDOS = frozenset((
+    'application/zip',
+    'application/gzip',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'application/vnd.apache.parquet',
+))
+
+_aceita_brotli = re.compile(r'\bbr\b')
+
+
+def _tipo(response):
+    return response.get('Content-Type', '').split(';', 1)[0].strip().lower()
+
+
+class CompressaoMiddleware(GZipMiddleware):
+    """
+    GZipMiddleware com brotli para JSON e sem compressão para arquivos já
+    comprimidos.
+    """
+
+    def process_response(self, request, response):
+        tipo = _tipo(response)
+        if tipo in TIPOS_COMPRIMIDOS:
+            return response
+        if (
+            brotli is not None and tipo == 'application/json' and not response.streaming
+            and len(response.content) >= 200 and not response.has_header('Content-Encoding')
+            and _aceita_brotli.search(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        ):
+            return self.comprimir_brotli(response)
+        return super().process_response(request, response)
+
+    def comprimir_brotli(self, response):
+        patch_vary_headers(response, ('Accept-Encoding',))
+        comprimido = brotli.compress(response.content, quality=QUALIDADE_BROTLI)
+        if len(comprimido) >= len(response.content):
+            return response
+        response.content = comprimido
+        response.headers['Content-Length'] = str(len(comprimido))
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = 'br'
+        return response
@@ -0,0 +1,90 @@
+"""
+Respostas condicionais (ETag e Last-Modified) das views de um arquivo.
+
+O decorador condicional lê só o data_version e o data_modified do
+UploadedFile. Se o navegador (ou um proxy) envia If-None-Match ou
+If-Modified-Since com a versão atual, a resposta é 304 Not Modified e a
+view nem é chamada: nada de pandas, de xlsxwriter ou de consulta às linhas.
+Toda alteração dos dados passa por cache_analise.invalidar_contexto, que
+incrementa a versão e atualiza a data, então a ETag muda com o conteúdo.
+
+As respostas levam Cache-Control: no-cache, que permite guardá-las mas
+exige a revalidação a cada uso. As públicas (API de dados e download)
+podem ficar em proxies; a página de análise, que leva o token CSRF, só no
+navegador. CUSTOS_ETAG_VERSAO entra na ETag e deve mudar quando uma nova
+versão do sistema altera as respostas para os mesmos dados (templates,
+formato da planilha exportada).
+"""
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from .models import UploadedFile
+
+CAMPOS_VERSAO = ('data_version', 'data_modified')
+
+
+def etag_do_arquivo(file_id, data_version, variante=''):
+    """
+    ETag de uma versão dos dados do arquivo. A variante distingue
+    representações diferentes do mesmo arquivo (ex.: 'xlsx' e 'csv').
+    """
+    partes = [getattr(settings, 'CUSTOS_ETAG_VERSAO', ''), str(file_id), f'v{data_version}', variante]
+    return quote_etag('-'.join(parte for parte in partes if parte))
+
+
+def _validadores(file_id, versao, variante):
+    if versao is None:
+        return None, None
+    data_version, data_modified = versao
+    return etag_do_arquivo(file_id, data_version, variante), int(data_modified.timestamp())
+
+
+def _completar(request, response, etag, modificado, publico):
+    # Redirecionamentos e erros da view seguem sem os validadores.
+    if etag is None or request.method not in ('GET', 'HEAD') or response.status_code not in (200, 304):
+        return response
+    response.headers.setdefault('ETag', etag)
+    response.headers.setdefault('Last-Modified', http_date(modificado))
+    patch_cache_control(response, no_cache=True, **({'public': True} if publico else {'private': True}))
+    return response
+
+
+def condicional(variante=None, publico=True):
+    """
+    Decorador das views (síncronas ou assíncronas) que recebem file_id:
+    ETag e Last-Modified pela versão dos dados do arquivo e 304 quando o
+    cliente já tem essa versão. variante(request) retorna a parte da ETag
+    que depende da requisição. Arquivos inexistentes seguem para a view
+    (que responde 404).
+    """
+    def decorador(view):
+        def preparar(request, file_id, versao):
+            etag, modificado = _validadores(file_id, versao, variante(request) if variante else '')
+            if etag is None:
+                return None, None, None
+            return get_conditional_response(request, etag=etag, last_modified=modificado), etag, modificado
+
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def view_condicional(request, file_id, *args, **kwargs):
+                versao = await UploadedFile.objects.filter(file_id=file_id).values_list(*CAMPOS_VERSAO).afirst()
+                response, etag, modificado = preparar(request, file_id, versao)
+                if response is None:
+                    response = await view(request, file_id, *args, **kwargs)
+                return _completar(request, response, etag, modificado, publico)
+        else:
+            @wraps(view)
+            def view_condicional(request, file_id, *args, **kwargs):
+                versao = UploadedFile.objects.filter(file_id=file_id).values_list(*CAMPOS_VERSAO).first()
+                response, etag, modificado = preparar(request, file_id, versao)
+                if response is None:
+                    response = view(request, file_id, *args, **kwargs)
+                return _completar(request, response, etag, modificado, publico)
+
+        return view_condicional
+
+    return decorador
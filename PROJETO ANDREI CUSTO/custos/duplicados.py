@@ -0,0 +1,138 @@
+"""
+Reaproveitamento de uploads repetidos.
+
+Cada upload guarda o SHA-256 do arquivo em UploadedFile.content_hash. Quando
+o mesmo arquivo é enviado de novo, o upload pode abrir a análise existente ou
+criar uma cópia dela com o novo nome (clonar_arquivo), sem ler e converter a
+planilha outra vez.
+
+A cópia é feita no próprio banco, com um INSERT ... SELECT por tabela: as
+linhas não passam pelo Python. O hash é apagado quando os dados de uma
+análise são editados (ver edicao), então só análises que ainda correspondem
+ao arquivo enviado são oferecidas para reaproveitamento.
+
+Uma pasta com várias abas vira uma análise por aba, todas com o hash do
+arquivo e o mesmo upload_group. Elas são tratadas juntas: o upload repetido
+abre a primeira aba, a cópia copia todas e a edição de qualquer uma apaga o
+hash de todas.
+"""
+import hashlib
+import uuid
+
+from django.db import connection, models, transaction
+
+from .instrumentacao import medido
+from .models import (
+    AccountTotal, AreaTotal, ColumnTotal, ExpenseData, ExpenseMatrix, FileAggregates, UploadedFile,
+)
+
+# Bytes lidos por vez ao calcular o hash de um arquivo que não é um UploadedFile do Django.
+TAMANHO_BLOCO_HASH = 1024 * 1024
+
+# Tabelas copiadas por clonar_arquivo, todas com uma chave estrangeira 'file'.
+MODELOS_DO_ARQUIVO = (ExpenseData, ExpenseMatrix, FileAggregates, ColumnTotal, AreaTotal, AccountTotal)
+
+
+def calcular_hash(arquivo):
+    """
+    SHA-256 (em hexadecimal) do conteúdo do arquivo, lido em blocos. O
+    arquivo volta para o início ao final.
+    """
+    sha256 = hashlib.sha256()
+    arquivo.seek(0)
+    if hasattr(arquivo, 'chunks'):
+        blocos = arquivo.chunks()
+    else:
+        blocos = iter(lambda: arquivo.read(TAMANHO_BLOCO_HASH), b'')
+    for bloco in blocos:
+        sha256.update(bloco)
+    arquivo.seek(0)
+    return sha256.hexdigest()
+
+
+def analises_do_upload(uploaded_file):
+    """
+    Análises criadas pelo mesmo upload que 'uploaded_file': as abas do seu
+    upload_group, na ordem da pasta, ou só ela mesma.
+    """
+    if uploaded_file.upload_group is None:
+        return [uploaded_file]
+    return list(UploadedFile.objects.filter(upload_group=uploaded_file.upload_group).order_by('upload_date', 'pk'))
+
+
+def buscar_duplicado(content_hash):
+    """
+    Análise mais recente criada a partir de um arquivo com este hash (e ainda
+    não editada), ou None. Em uma pasta com várias abas, a da primeira aba.
+    """
+    if not content_hash:
+        return None
+    encontrada = UploadedFile.objects.filter(content_hash=content_hash).order_by('-upload_date').first()
+    return analises_do_upload(encontrada)[0] if encontrada is not None else None
+
+
+def descartar_hash(uploaded_file):
+    """
+    Apaga o hash da análise (e das outras abas do mesmo upload), que deixa
+    de corresponder ao arquivo enviado.
+    """
+    if not uploaded_file.content_hash:
+        return
+    analises = UploadedFile.objects.filter(pk=uploaded_file.pk)
+    if uploaded_file.upload_group is not None:
+        analises = UploadedFile.objects.filter(upload_group=uploaded_file.upload_group)
+    analises.update(content_hash='')
+    uploaded_file.content_hash = ''
+
+
+def _copiar_linhas(modelo, origem, destino):
+    """
+    Copia as linhas de 'modelo' do arquivo de origem para o de destino com
+    um único INSERT ... SELECT, na ordem de pk.
+    """
+    quote = connection.ops.quote_name
+    coluna_arquivo = modelo._meta.get_field('file').column
+    colunas = [
+        campo.column for campo in modelo._meta.concrete_fields
+        if campo.column != coluna_arquivo and not isinstance(campo, models.AutoField)
+    ]
+    tabela = quote(modelo._meta.db_table)
+    lista = ', '.join(quote(coluna) for coluna in colunas)
+    sql = (
+        f'INSERT INTO {tabela} ({quote(coluna_arquivo)}, {lista}) '
+        f'SELECT %s, {lista} FROM {tabela} WHERE {quote(coluna_arquivo)} = %s '
+        f'ORDER BY {quote(modelo._meta.pk.column)}'
+    )
+    pk_arquivo = UploadedFile._meta.pk
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [
+            pk_arquivo.get_db_prep_value(destino.pk, connection),
+            pk_arquivo.get_db_prep_value(origem.pk, connection),
+        ])
+        return cursor.rowcount
+
+
+@medido
+def clonar_arquivo(origem, nome):
+    """
+    Cria uma nova análise chamada 'nome' com uma cópia dos dados de
+    'origem' (linhas, matriz colunar e agregados), em uma única transação.
+    Se 'origem' é uma aba de uma pasta, todas as abas do upload são
+    copiadas, como '<nome> - <aba>' em um novo upload_group. Retorna o
+    UploadedFile criado (o da primeira aba).
+    """
+    analises = analises_do_upload(origem)
+    upload_group = uuid.uuid4() if origem.upload_group is not None else None
+    copias = []
+    with transaction.atomic():
+        for analise in analises:
+            destino = UploadedFile.objects.create(
+                name=f'{nome} - {analise.sheet_name}' if upload_group else nome,
+                content_hash=analise.content_hash,
+                upload_group=upload_group,
+                sheet_name=analise.sheet_name,
+            )
+            for modelo in MODELOS_DO_ARQUIVO:
+                _copiar_linhas(modelo, analise, destino)
+            copias.append(destino)
+    return copias[0]
@@ -0,0 +1,237 @@
+"""
+Edição de linhas da planilha em lote.
+
+Cada edição é {'id_excel', 'new_total'}, em que o novo total é redistribuído
+entre as colunas da linha (por padrão na mesma proporção dos valores atuais;
+ver redistribuicao), ou {'id_excel', 'coluna', 'valor'}, que altera uma única
+célula. O lote inteiro é aplicado em uma transação: as linhas editadas são
+lidas e gravadas de uma vez (bulk_update), a redistribuição é feita com NumPy
+sobre a matriz dessas linhas e os agregados recebem uma única atualização com
+a soma dos deltas.
+"""
+import math
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .agregados import aplicar_deltas_linhas, obter_agregados
+from .armazenamento import gravar_linhas, ler_linhas
+from .duplicados import descartar_hash
+from .instrumentacao import medido
+from .models import ExpenseData
+from .redistribuicao import (
+    ESTRATEGIA_PESOS, ESTRATEGIA_PROPORCIONAL, ESTRATEGIAS, pesos_por_area, proporcoes, ratear, redistribuir,
+)
+
+
+def _numero(valor):
+    valor = float(valor)
+    if not math.isfinite(valor):
+        raise ValueError(valor)
+    return valor
+
+
+def _estrategia(dados):
+    """
+    Estratégia e pesos por área de uma edição (ou de uma redistribuição do
+    arquivo), validados. Os pesos só são usados com a estratégia 'pesos'.
+    """
+    estrategia = dados.get('estrategia') or ESTRATEGIA_PROPORCIONAL
+    if estrategia not in ESTRATEGIAS:
+        raise ValueError(f"Estratégia de redistribuição inválida: '{estrategia}'. Use {', '.join(ESTRATEGIAS)}.")
+    if estrategia != ESTRATEGIA_PESOS:
+        return estrategia, None
+
+    pesos = dados.get('pesos')
+    if not isinstance(pesos, dict) or not pesos:
+        raise ValueError("A estratégia 'pesos' precisa de 'pesos' no formato {área: peso}.")
+    try:
+        pesos = {str(area): _numero(peso) for area, peso in pesos.items()}
+    except (TypeError, ValueError):
+        raise ValueError("Os pesos por área precisam ser números.")
+    if any(peso < 0 for peso in pesos.values()):
+        raise ValueError("Os pesos por área não podem ser negativos.")
+    return estrategia, pesos
+
+
+def validar_edicoes(edicoes):
+    """
+    Confere o formato das edições recebidas e converte os valores.
+    Levanta ValueError com uma mensagem para o usuário.
+    """
+    if not isinstance(edicoes, list) or not edicoes:
+        raise ValueError("Envie uma lista 'edicoes' com ao menos uma edição.")
+
+    limite = getattr(settings, 'CUSTOS_EDICAO_LOTE_MAXIMO', 5000)
+    if len(edicoes) > limite:
+        raise ValueError(f"O lote tem {len(edicoes)} edições; o máximo é {limite}.")
+
+    validadas = []
+    for numero, edicao in enumerate(edicoes, start=1):
+        if not isinstance(edicao, dict) or edicao.get('id_excel') in (None, ''):
+            raise ValueError(f"Edição {numero}: informe 'id_excel'.")
+        try:
+            if 'coluna' in edicao:
+                validadas.append({
+                    'id_excel': str(edicao['id_excel']),
+                    'coluna': str(edicao['coluna']),
+                    'valor': _numero(edicao['valor']),
+                })
+            else:
+                validadas.append({'id_excel': str(edicao['id_excel']), 'new_total': _numero(edicao['new_total'])})
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"Edição {numero}: valor ausente ou não numérico.")
+        if 'new_total' in validadas[-1]:
+            try:
+                validadas[-1]['estrategia'], validadas[-1]['pesos'] = _estrategia(edicao)
+            except ValueError as e:
+                raise ValueError(f"Edição {numero}: {e}")
+    return validadas
+
+
+def _rodadas(edicoes):
+    """
+    Separa as edições em rodadas em que cada linha aparece no máximo uma
+    vez. A n-ésima edição de uma linha vai para a n-ésima rodada, então as
+    edições de uma mesma linha continuam sendo aplicadas na ordem recebida.
+    """
+    rodadas = []
+    vistas = {}
+    for edicao in edicoes:
+        rodada = vistas.get(edicao['id_excel'], 0)
+        vistas[edicao['id_excel']] = rodada + 1
+        if rodada == len(rodadas):
+            rodadas.append([])
+        rodadas[rodada].append(edicao)
+    return rodadas
+
+
+def _gravar(uploaded_file, agregados, entradas, linhas, valores, totais, totais_antigos, numericas):
+    """
+    Grava as linhas editadas e aplica aos agregados a diferença em relação
+    ao que foi lido com ler_linhas. Retorna o FileAggregates atualizado.
+
+    A análise deixa de corresponder ao arquivo enviado, então o seu hash é
+    apagado e ela não é mais oferecida para reaproveitamento (ver duplicados).
+    """
+    gravar_linhas(uploaded_file, entradas, linhas, valores, totais, numericas)
+    descartar_hash(uploaded_file)
+    return aplicar_deltas_linhas(
+        agregados, linhas['colunas'], [entrada.account for entrada in entradas],
+        valores - linhas['valores'], (totais - totais_antigos).sum(),
+    )
+
+
+@medido
+def aplicar_edicoes(uploaded_file, edicoes):
+    """
+    Aplica um lote de edições (ver validar_edicoes) em uma única transação.
+    Retorna um dicionário com 'agregados' (FileAggregates atualizado) e
+    'linhas', uma lista de (ExpenseData, {coluna: novo valor}) com cada
+    linha editada uma vez, na ordem da primeira edição.
+
+    Levanta ValueError para edições inválidas e ExpenseData.DoesNotExist
+    quando algum id_excel não existe no arquivo. Se o ID se repetir na
+    planilha, a primeira linha com ele é a editada.
+    """
+    edicoes = validar_edicoes(edicoes)
+    ids = list(dict.fromkeys(edicao['id_excel'] for edicao in edicoes))
+
+    with transaction.atomic():
+        agregados = obter_agregados(uploaded_file, para_atualizar=True)
+
+        por_id = {}
+        for entrada in ExpenseData.objects.filter(file=uploaded_file, id_excel__in=ids).order_by('position'):
+            por_id.setdefault(entrada.id_excel, entrada)
+        faltando = [id_excel for id_excel in ids if id_excel not in por_id]
+        if agregados is None or faltando:
+            raise ExpenseData.DoesNotExist(f"Entrada de despesa não encontrada: {', '.join(faltando[:10])}.")
+        entradas = [por_id[id_excel] for id_excel in ids]
+
+        linhas = ler_linhas(uploaded_file, entradas)
+        indice_linha = {id_excel: i for i, id_excel in enumerate(ids)}
+        indice_coluna = {coluna: j for j, coluna in enumerate(linhas['colunas'])}
+
+        valores = linhas['valores'].copy()
+        numericas = linhas['numericas'].copy()
+        totais_antigos = np.array([float(entrada.row_total) for entrada in entradas], dtype=float)
+        totais = totais_antigos.copy()
+
+        for rodada in _rodadas(edicoes):
+            por_estrategia = {}
+            for edicao in rodada:
+                if 'new_total' in edicao:
+                    por_estrategia.setdefault(edicao['estrategia'], []).append(edicao)
+            for estrategia, por_total in por_estrategia.items():
+                posicoes = np.array([indice_linha[edicao['id_excel']] for edicao in por_total], dtype=np.intp)
+                novos_totais = np.round([edicao['new_total'] for edicao in por_total], 2)
+                pesos = None
+                if estrategia == ESTRATEGIA_PESOS:
+                    pesos = np.array([pesos_por_area(linhas['colunas'], edicao['pesos']) for edicao in por_total])
+                valores[posicoes] = redistribuir(
+                    valores[posicoes], novos_totais, estrategia, numericas[posicoes], pesos,
+                )
+                totais[posicoes] = novos_totais
+
+            por_celula = [edicao for edicao in rodada if 'coluna' in edicao]
+            if por_celula:
+                desconhecidas = [edicao['coluna'] for edicao in por_celula if edicao['coluna'] not in indice_coluna]
+                if desconhecidas:
+                    raise ValueError(f"Coluna não encontrada no arquivo: '{desconhecidas[0]}'.")
+                posicoes = np.array([indice_linha[edicao['id_excel']] for edicao in por_celula], dtype=np.intp)
+                colunas = np.array([indice_coluna[edicao['coluna']] for edicao in por_celula], dtype=np.intp)
+                novos_valores = np.array([edicao['valor'] for edicao in por_celula], dtype=float)
+                totais[posicoes] += novos_valores - valores[posicoes, colunas]
+                valores[posicoes, colunas] = novos_valores
+                numericas[posicoes, colunas] = True
+
+        agregados = _gravar(uploaded_file, agregados, entradas, linhas, valores, totais, totais_antigos, numericas)
+
+    return {
+        'agregados': agregados,
+        'linhas': [
+            (entrada, dict(zip(linhas['colunas'], linha)))
+            for entrada, linha in zip(entradas, valores.tolist())
+        ],
+    }
+
+
+@medido
+def redistribuir_arquivo(uploaded_file, dados):
+    """
+    Leva o total geral do arquivo a um novo valor, informado em 'dados'
+    como 'novo_total' ou como 'fator' sobre o total atual. O novo total é
+    dividido entre as linhas na proporção dos seus totais atuais e o de cada
+    linha entre as suas colunas com a 'estrategia' (e os 'pesos' por área)
+    de 'dados', sempre em centavos, de modo que as somas fecham exatamente.
+    Retorna o FileAggregates atualizado.
+    """
+    estrategia, pesos_areas = _estrategia(dados)
+    try:
+        if dados.get('novo_total') is not None:
+            novo_total = _numero(dados['novo_total'])
+        else:
+            fator = _numero(dados['fator'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Informe 'novo_total' ou 'fator' com um valor numérico.")
+
+    with transaction.atomic():
+        agregados = obter_agregados(uploaded_file, para_atualizar=True)
+        entradas = list(uploaded_file.expenses.order_by('position'))
+        if agregados is None or not entradas:
+            raise ExpenseData.DoesNotExist("O arquivo não tem linhas de despesa.")
+        if dados.get('novo_total') is None:
+            novo_total = agregados.grand_total * fator
+
+        linhas = ler_linhas(uploaded_file, entradas)
+        totais_antigos = np.array([float(entrada.row_total) for entrada in entradas], dtype=float)
+
+        # O arquivo inteiro é tratado como uma única "linha" cujas colunas são
+        # as linhas da planilha: o mesmo rateio em centavos define o novo total de cada uma.
+        totais = ratear(proporcoes(totais_antigos[None, :]), [novo_total])[0]
+
+        pesos = pesos_por_area(linhas['colunas'], pesos_areas) if pesos_areas is not None else None
+        valores = redistribuir(linhas['valores'], totais, estrategia, linhas['numericas'], pesos)
+
+        return _gravar(uploaded_file, agregados, entradas, linhas, valores, totais, totais_antigos, linhas['numericas'])
@@ -0,0 +1,252 @@
+"""
+Exportação da planilha reconstruída (XLSX ou CSV) com memória constante.
+
+As linhas são lidas do banco em blocos (QuerySet.iterator) e escritas uma a
+uma: o XLSX vai para um arquivo temporário pelo modo constant_memory do
+xlsxwriter e o CSV é gerado sob demanda para um StreamingHttpResponse.
+Nenhum dos dois monta a planilha inteira em memória.
+
+Para as views assíncronas, o .xlsx pode ser gerado em um arquivo nomeado
+(exportar_xlsx_em_caminho, executada no pool de processos) e o CSV tem uma
+versão assíncrona (agerar_csv).
+
+escrever_xlsx, escrever_csv e escrever_parquet (este só com o pyarrow
+instalado) gravam em um caminho; são usadas pelos artefatos de exportação
+guardados em disco (ver custos.artefatos).
+"""
+import asyncio
+import csv
+import io
+import os
+import tempfile
+from itertools import islice
+
+import numpy as np
+import xlsxwriter
+from asgiref.sync import sync_to_async
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from .agregados import colunas_do_arquivo, obter_agregados, valor_numerico
+from .armazenamento import DTYPE_MATRIZ
+from .instrumentacao import medido
+from .models import ExpenseMatrix, UploadedFile
+
+# Linhas lidas do banco por consulta durante a exportação.
+TAMANHO_BLOCO_EXPORTACAO = 2000
+
+
+def colunas_exportacao(uploaded_file):
+    """
+    Colunas de dados do arquivo, na ordem da planilha (vazia se não houver dados).
+    """
+    if obter_agregados(uploaded_file) is None:
+        return []
+    return colunas_do_arquivo(uploaded_file)
+
+
+def cabecalhos_exportacao(colunas):
+    """
+    Divide os nomes 'AREA - ID' nas duas linhas de cabeçalho da planilha original.
+    """
+    area_headers = ['', '']
+    id_headers = ['ID', 'CONTA']
+    for col in colunas:
+        parts = col.rsplit(' - ', 1)
+        if len(parts) > 1:
+            area_headers.append(parts[0].strip())
+            id_headers.append(parts[1].strip())
+        else:
+            area_headers.append(parts[0].strip())
+            id_headers.append('')
+    return area_headers, id_headers
+
+
+def iterar_linhas(uploaded_file, colunas):
+    """
+    Gera [id_excel, conta, *valores] para cada linha do arquivo, na ordem da
+    planilha (position), com os valores alinhados com 'colunas'.
+    """
+    expense_matrix = ExpenseMatrix.objects.filter(file=uploaded_file).first()
+    if expense_matrix is not None:
+        yield from _linhas_da_matriz(expense_matrix, colunas)
+        return
+
+    for id_excel, conta, dados in _consulta_linhas(uploaded_file).iterator(chunk_size=TAMANHO_BLOCO_EXPORTACAO):
+        yield [id_excel, conta, *(valor_numerico(dados.get(col, 0)) for col in colunas)]
+
+
+def _linhas_da_matriz(expense_matrix, colunas):
+    # No layout colunar a matriz já está em memória como um único blob
+    # (sem cópia); as linhas são apenas fatias dela.
+    indices = {col: i for i, col in enumerate(expense_matrix.columns)}
+    valores = np.frombuffer(expense_matrix.values, dtype=DTYPE_MATRIZ).reshape(
+        len(expense_matrix.row_ids), len(expense_matrix.columns)
+    )
+    posicoes = [indices.get(col) for col in colunas]
+    for id_excel, conta, linha in zip(expense_matrix.row_ids, expense_matrix.accounts, valores):
+        yield [id_excel, conta, *(float(linha[i]) if i is not None else 0.0 for i in posicoes)]
+
+
+def _consulta_linhas(uploaded_file):
+    return uploaded_file.expenses.order_by('position').values_list('id_excel', 'account', 'data')
+
+
+@medido
+def escrever_xlsx(uploaded_file, destino):
+    """
+    Escreve a planilha reconstruída em 'destino' (caminho ou arquivo binário)
+    no modo constant_memory do xlsxwriter, que grava cada linha assim que a
+    próxima começa.
+    """
+    colunas = colunas_exportacao(uploaded_file)
+    workbook = xlsxwriter.Workbook(destino, {'constant_memory': True})
+    worksheet = workbook.add_worksheet('Planilha Reconstruída')
+
+    header_format = workbook.add_format({
+        'bold': True, 'align': 'center', 'valign': 'vcenter',
+        'border': 1, 'bg_color': '#D0D0D0'
+    })
+    area_headers, id_headers = cabecalhos_exportacao(colunas)
+    worksheet.write_row('A1', area_headers, header_format)
+    worksheet.write_row('A2', id_headers, header_format)
+
+    for row_num, linha in enumerate(iterar_linhas(uploaded_file, colunas)):
+        worksheet.write_row(row_num + 2, 0, linha)
+
+    workbook.close()
+
+
+def exportar_xlsx_temporario(uploaded_file):
+    """
+    Gera o XLSX em um arquivo temporário (removido ao ser fechado) e o
+    retorna posicionado no início, pronto para um FileResponse.
+    """
+    arquivo = tempfile.TemporaryFile(suffix='.xlsx')
+    try:
+        escrever_xlsx(uploaded_file, arquivo)
+    except Exception:
+        arquivo.close()
+        raise
+    arquivo.seek(0)
+    return arquivo
+
+
+def exportar_xlsx_em_caminho(file_id):
+    """
+    Gera o XLSX do arquivo em um arquivo temporário nomeado e retorna o
+    caminho (quem chama deve removê-lo; ver ArquivoTemporario). Feita para
+    rodar no pool de processos, por isso recebe apenas o file_id.
+    """
+    descritor, caminho = tempfile.mkstemp(suffix='.xlsx')
+    os.close(descritor)
+    try:
+        escrever_xlsx(UploadedFile.objects.get(file_id=file_id), caminho)
+    except Exception:
+        os.remove(caminho)
+        raise
+    return caminho
+
+
+class ArquivoTemporario(io.FileIO):
+    """Arquivo aberto para leitura que é removido do disco ao ser fechado."""
+
+    def __init__(self, caminho):
+        super().__init__(caminho, 'rb')
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        try:
+            os.remove(self.name)
+        except FileNotFoundError:
+            pass
+
+
+class _Eco:
+    """Objeto 'arquivo' que devolve o que recebe, para usar csv.writer em um gerador."""
+
+    def write(self, valor):
+        return valor
+
+
+def gerar_csv(uploaded_file):
+    """
+    Gera o CSV da planilha reconstruída linha a linha (UTF-8 com BOM, para
+    que o Excel reconheça a acentuação). O cabeçalho usa os nomes completos
+    das colunas ('AREA - ID').
+    """
+    colunas = colunas_exportacao(uploaded_file)
+    writer = csv.writer(_Eco())
+    yield '\ufeff' + writer.writerow(['ID', 'CONTA', *colunas])
+    for linha in iterar_linhas(uploaded_file, colunas):
+        yield writer.writerow(linha)
+
+
+@medido
+def escrever_csv(uploaded_file, destino):
+    """
+    Grava em 'destino' (caminho) o mesmo CSV gerado por gerar_csv.
+    """
+    with open(destino, 'w', encoding='utf-8', newline='') as arquivo:
+        arquivo.writelines(gerar_csv(uploaded_file))
+
+
+@medido
+def escrever_parquet(uploaded_file, destino):
+    """
+    Grava a planilha reconstruída em Parquet (ID e CONTA como texto e uma
+    coluna float64 por coluna de dados), um row group a cada
+    TAMANHO_BLOCO_EXPORTACAO linhas. Requer o pacote pyarrow.
+    """
+    if pyarrow is None:
+        raise ValueError("O formato Parquet requer o pacote pyarrow.")
+
+    colunas = colunas_exportacao(uploaded_file)
+    schema = pyarrow.schema(
+        [('ID', pyarrow.string()), ('CONTA', pyarrow.string())] + [(col, pyarrow.float64()) for col in colunas]
+    )
+    writer = pyarrow.parquet.ParquetWriter(destino, schema)
+    try:
+        linhas = iterar_linhas(uploaded_file, colunas)
+        while bloco := list(islice(linhas, TAMANHO_BLOCO_EXPORTACAO)):
+            writer.write_table(pyarrow.Table.from_arrays(
+                [pyarrow.array(valores, type=campo.type) for valores, campo in zip(zip(*bloco), schema)],
+                schema=schema,
+            ))
+    finally:
+        writer.close()
+
+
+async def agerar_csv(uploaded_file):
+    """
+    Versão assíncrona de gerar_csv: as consultas rodam fora do loop de
+    eventos, que é liberado a cada TAMANHO_BLOCO_EXPORTACAO linhas.
+    """
+    colunas = await sync_to_async(colunas_exportacao)(uploaded_file)
+    writer = csv.writer(_Eco())
+    yield '\ufeff' + writer.writerow(['ID', 'CONTA', *colunas])
+
+    expense_matrix = await ExpenseMatrix.objects.filter(file=uploaded_file).afirst()
+    if expense_matrix is not None:
+        for numero, linha in enumerate(_linhas_da_matriz(expense_matrix, colunas), start=1):
+            yield writer.writerow(linha)
+            if numero % TAMANHO_BLOCO_EXPORTACAO == 0:
+                await asyncio.sleep(0)
+        return
+
+    # values_list() com mais de um campo usa ValuesListIterable, cujo
+    # __iter__ executa a consulta assim que é chamado (não é um gerador);
+    # aiterator() faz essa chamada no próprio loop de eventos e o Django a
+    # recusa com SynchronousOnlyOperation. Por isso o iterator() síncrono é
+    # consumido em blocos dentro de uma thread.
+    linhas = _consulta_linhas(uploaded_file).iterator(chunk_size=TAMANHO_BLOCO_EXPORTACAO)
+    proximo_bloco = sync_to_async(lambda: list(islice(linhas, TAMANHO_BLOCO_EXPORTACAO)))
+    while bloco := await proximo_bloco():
+        for id_excel, conta, dados in bloco:
+            yield writer.writerow([id_excel, conta, *(valor_numerico(dados.get(col, 0)) for col in colunas)])
@@ -0,0 +1,317 @@
+"""
+Fila de uploads processados em segundo plano.
+
+A fila é a própria tabela UploadJob: o upload grava o arquivo e cria um job
+pendente; um despachante reserva os jobs em ordem de chegada (com um UPDATE
+condicional, seguro entre processos) e os entrega a um pool de threads com
+no máximo CUSTOS_FILA_TRABALHADORES jobs ao mesmo tempo.
+
+O despachante pode rodar dentro do próprio servidor web (iniciado no
+primeiro upload, com CUSTOS_FILA_TRABALHADOR_INTERNO = True) ou em um
+processo separado, com 'python manage.py processar_fila'.
+
+O progresso de cada job fica no cache: a ingestão roda em uma única
+transação, então atualizações de progresso no banco só ficariam visíveis
+no final. Com um trabalhador em processo separado, o cache 'default'
+precisa ser compartilhado entre os processos (ex.: FileBasedCache).
+"""
+import logging
+import os
+import socket
+import statistics
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, close_old_connections, connection, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .duplicados import analises_do_upload, calcular_hash
+from .ingestao import (
+    abas_para_ingestao, ingerir_abas, ingerir_planilha_streaming, ingerir_resultado, usar_ingestao_streaming,
+)
+from .models import ExpenseData, UploadJob, UploadedFile
+
+logger = logging.getLogger(__name__)
+
+_trava = threading.Lock()
+_despachante = None
+_acordar = threading.Event()
+# Jobs sendo executados por threads deste processo.
+_em_execucao = set()
+
+
+def upload_assincrono():
+    """
+    Indica se os uploads devem ir para a fila (CUSTOS_UPLOAD_ASSINCRONO).
+    """
+    return getattr(settings, 'CUSTOS_UPLOAD_ASSINCRONO', False)
+
+
+def _trabalhadores():
+    return max(1, int(getattr(settings, 'CUSTOS_FILA_TRABALHADORES', 1)))
+
+
+def _intervalo():
+    return float(getattr(settings, 'CUSTOS_FILA_INTERVALO', 1.0))
+
+
+def _nome_trabalhador():
+    return f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+
+
+def chave_progresso(job_id):
+    return f'custos:fila:{job_id}:progresso'
+
+
+def processar_upload(analysis_name, arquivo, progresso=None, content_hash=None):
+    """
+    Processa um arquivo enviado e grava a análise, em streaming quando
+    possível (ver usar_ingestao_streaming). Usada tanto no upload síncrono
+    quanto pelos jobs da fila. O hash do arquivo (calculado aqui se não for
+    informado) é gravado na análise. Retorna o UploadedFile criado.
+
+    Em uma pasta com várias abas (ver abas_para_ingestao) cada aba vira uma
+    análise, todas com o hash do arquivo, e a da primeira aba é retornada
+    (as demais estão em duplicados.analises_do_upload).
+    """
+    if content_hash is None:
+        content_hash = calcular_hash(arquivo)
+
+    abas = abas_para_ingestao(arquivo)
+    if abas:
+        return ingerir_abas(analysis_name, arquivo, abas, progresso=progresso, content_hash=content_hash)[0]
+
+    with transaction.atomic():
+        if usar_ingestao_streaming(arquivo):
+            uploaded_file = ingerir_planilha_streaming(analysis_name, arquivo, progresso=progresso)
+        else:
+            from .views import processar_arquivo_excel
+            resultado = processar_arquivo_excel(arquivo)
+            uploaded_file = ingerir_resultado(analysis_name, resultado, progresso=progresso)
+
+        uploaded_file.content_hash = content_hash
+        UploadedFile.objects.filter(pk=uploaded_file.pk).update(content_hash=content_hash)
+    return uploaded_file
+
+
+def enfileirar_upload(analysis_name, arquivo):
+    """
+    Grava o arquivo enviado, cria um job pendente e acorda o despachante.
+    Retorna o UploadJob.
+    """
+    job = UploadJob(name=analysis_name)
+    job.source_file.save(os.path.basename(arquivo.name), arquivo, save=False)
+    job.save()
+    iniciar_trabalhador_interno()
+    transaction.on_commit(_acordar.set)
+    return job
+
+
+def reservar_proximo_job():
+    """
+    Marca o job pendente mais antigo como 'processando' e retorna seu id,
+    ou None se não houver job pendente. O UPDATE só altera o job se ele
+    ainda estiver pendente, então dois trabalhadores nunca pegam o mesmo.
+    """
+    pendentes = UploadJob.objects.filter(status=UploadJob.STATUS_PENDENTE).values_list('pk', flat=True)[:10]
+    for job_id in pendentes:
+        reservado = UploadJob.objects.filter(pk=job_id, status=UploadJob.STATUS_PENDENTE).update(
+            status=UploadJob.STATUS_PROCESSANDO,
+            started_at=timezone.now(),
+            worker=_nome_trabalhador(),
+        )
+        if reservado:
+            return job_id
+    return None
+
+
+def marcar_jobs_abandonados():
+    """
+    Marca como erro os jobs em processamento há mais de
+    CUSTOS_FILA_TEMPO_LIMITE segundos (ex.: o processo do trabalhador caiu).
+    Os jobs que uma thread deste processo ainda está executando não são
+    marcados: o trabalhador está vivo e vai gravar o resultado.
+    """
+    limite = timezone.now() - timedelta(seconds=getattr(settings, 'CUSTOS_FILA_TEMPO_LIMITE', 1800))
+    with _trava:
+        vivos = list(_em_execucao)
+    abandonados = UploadJob.objects.filter(status=UploadJob.STATUS_PROCESSANDO, started_at__lt=limite)
+    return abandonados.exclude(pk__in=vivos).update(
+        status=UploadJob.STATUS_ERRO,
+        error_message='O processamento excedeu o tempo limite.',
+        finished_at=timezone.now(),
+    )
+
+
+def executar_job(job_id):
+    """
+    Processa um job já reservado e registra o resultado. Nunca levanta
+    exceção: erros ficam em UploadJob.error_message.
+
+    O status final só é gravado se o job ainda estiver 'processando': um job
+    que o trabalhador de outro processo já marcou como abandonado (ver
+    marcar_jobs_abandonados) continua com erro, e as análises criadas por
+    ele são apagadas, pois nenhum job aponta para elas.
+    """
+    job = None
+    with _trava:
+        _em_execucao.add(job_id)
+    try:
+        job = UploadJob.objects.get(pk=job_id)
+
+        def progresso(gravadas, total):
+            cache.set(chave_progresso(job_id), gravadas, timeout=3600)
+
+        with job.source_file.open('rb') as arquivo:
+            uploaded_file = processar_upload(job.name, arquivo, progresso=progresso)
+
+        job.status = UploadJob.STATUS_CONCLUIDO
+        job.uploaded_file = uploaded_file
+        # Em uma pasta com várias abas, as linhas de todas as análises criadas.
+        job.rows_processed = ExpenseData.objects.filter(file__in=analises_do_upload(uploaded_file)).count()
+        job.finished_at = timezone.now()
+        concluido = UploadJob.objects.filter(pk=job_id, status=UploadJob.STATUS_PROCESSANDO).update(
+            status=job.status,
+            uploaded_file=uploaded_file,
+            rows_processed=job.rows_processed,
+            finished_at=job.finished_at,
+        )
+        if not concluido:
+            UploadedFile.objects.filter(pk__in=[analise.pk for analise in analises_do_upload(uploaded_file)]).delete()
+            logger.warning(
+                f"Job de upload '{job.name}' terminou depois de marcado como erro; "
+                f"a análise {uploaded_file.file_id} foi descartada."
+            )
+            return
+        logger.info(
+            f"Job de upload '{job.name}' concluído: {job.rows_processed} linhas, "
+            f"espera {job.tempo_espera:.2f}s, processamento {job.tempo_processamento:.2f}s."
+        )
+        # O job já aparece como concluído; os downloads ficam prontos em seguida.
+        if getattr(settings, 'CUSTOS_ARTEFATOS', False):
+            from .artefatos import gerar_artefatos_apos_upload
+            gerar_artefatos_apos_upload(uploaded_file)
+    except Exception as e:
+        logger.error(f"Erro no processamento do job de upload {job_id}: {str(e)}")
+        UploadJob.objects.filter(pk=job_id, status=UploadJob.STATUS_PROCESSANDO).update(
+            status=UploadJob.STATUS_ERRO, error_message=str(e), finished_at=timezone.now(),
+        )
+    finally:
+        with _trava:
+            _em_execucao.discard(job_id)
+        cache.delete(chave_progresso(job_id))
+        if job is not None and job.source_file:
+            job.source_file.delete(save=False)
+            UploadJob.objects.filter(pk=job_id).update(source_file='')
+        connection.close()
+
+
+def executar_fila(trabalhadores=None, intervalo=None, parar=None, ate_esvaziar=False):
+    """
+    Laço do despachante: reserva jobs enquanto houver vaga no pool e espera
+    'intervalo' segundos (ou até ser acordado por um novo upload) entre as
+    consultas. Termina quando 'parar' (threading.Event) for sinalizado ou,
+    com ate_esvaziar=True, quando não houver mais jobs pendentes nem em execução.
+    """
+    trabalhadores = trabalhadores or _trabalhadores()
+    intervalo = _intervalo() if intervalo is None else intervalo
+    parar = parar or threading.Event()
+
+    with ThreadPoolExecutor(max_workers=trabalhadores, thread_name_prefix='custos-fila') as executor:
+        ativos = set()
+        while not parar.is_set():
+            close_old_connections()
+            ativos = {futuro for futuro in ativos if not futuro.done()}
+
+            # Só consulta a fila com vaga no pool; no SQLite isso também evita
+            # disputar o banco com a transação de uma ingestão em andamento.
+            try:
+                if len(ativos) < trabalhadores:
+                    marcar_jobs_abandonados()
+                while len(ativos) < trabalhadores:
+                    job_id = reservar_proximo_job()
+                    if job_id is None:
+                        break
+                    futuro = executor.submit(executar_job, job_id)
+                    # Ao terminar um job, o despachante acorda para ocupar a vaga.
+                    futuro.add_done_callback(lambda _: _acordar.set())
+                    ativos.add(futuro)
+            except DatabaseError as e:
+                logger.error(f"Erro ao consultar a fila de uploads: {str(e)}")
+
+            if ate_esvaziar and not ativos:
+                break
+            _acordar.wait(intervalo)
+            _acordar.clear()
+    connection.close()
+
+
+def iniciar_trabalhador_interno():
+    """
+    Inicia o despachante em uma thread do próprio processo, se ainda não
+    estiver rodando e CUSTOS_FILA_TRABALHADOR_INTERNO estiver ativo.
+    """
+    global _despachante
+    if not getattr(settings, 'CUSTOS_FILA_TRABALHADOR_INTERNO', True):
+        return
+    with _trava:
+        if _despachante is not None and _despachante.is_alive():
+            return
+        _despachante = threading.Thread(target=executar_fila, name='custos-fila-despachante', daemon=True)
+        _despachante.start()
+
+
+def status_job(job):
+    """
+    Dicionário com a situação de um job, usado pelo endpoint de status.
+    """
+    linhas = job.rows_processed
+    if job.status == UploadJob.STATUS_PROCESSANDO:
+        linhas = cache.get(chave_progresso(job.job_id), 0)
+    return {
+        'status': job.status,
+        'linhas_processadas': linhas,
+        'mensagem': job.error_message,
+        'file_id': str(job.uploaded_file_id) if job.uploaded_file_id else None,
+        'tempo_espera_s': job.tempo_espera,
+        'tempo_processamento_s': job.tempo_processamento,
+    }
+
+
+def metricas_fila():
+    """
+    Quantidade de jobs por status e tempos de espera e de processamento dos
+    últimos CUSTOS_FILA_METRICAS_JANELA jobs concluídos.
+    """
+    janela = getattr(settings, 'CUSTOS_FILA_METRICAS_JANELA', 100)
+    por_status = dict.fromkeys((status for status, _ in UploadJob.STATUS_CHOICES), 0)
+    por_status.update(UploadJob.objects.values_list('status').annotate(total=Count('pk')).order_by())
+
+    concluidos = list(
+        UploadJob.objects.filter(status=UploadJob.STATUS_CONCLUIDO).order_by('-finished_at')[:janela]
+    )
+    esperas = [job.tempo_espera for job in concluidos]
+    processamentos = [job.tempo_processamento for job in concluidos]
+    linhas = sum(job.rows_processed for job in concluidos)
+
+    def resumo(tempos):
+        if not tempos:
+            return None
+        return {
+            'media_s': round(statistics.fmean(tempos), 3),
+            'mediana_s': round(statistics.median(tempos), 3),
+            'max_s': round(max(tempos), 3),
+        }
+
+    return {
+        'trabalhadores': _trabalhadores(),
+        'jobs_por_status': por_status,
+        'janela': len(concluidos),
+        'espera': resumo(esperas),
+        'processamento': resumo(processamentos),
+        'linhas_por_s': round(linhas / sum(processamentos), 1) if processamentos and sum(processamentos) else None,
+    }
@@ -6,3 +6,6 @@ class UploadArquivoForm(forms.Form):
     """
     name = forms.CharField(label='Nome da Análise (opcional)', max_length=255, required=False)
     arquivo_excel = forms.FileField(label='Selecione o arquivo Excel (.xlsx)')
+    reprocessar = forms.BooleanField(
+        label='Processar novamente, mesmo que o arquivo já tenha sido enviado', required=False,
+    )
@@ -0,0 +1,219 @@
+"""
+Importação em lote de planilhas já existentes (comando importar_planilhas).
+
+Cada arquivo é lido em um processo de um pool, pelo mesmo caminho do
+upload: ler_aba (openpyxl em streaming) para .xlsx/.xlsm, uma análise por
+aba nas pastas com várias abas, e processar_arquivo_excel (pandas) para o
+.xls. O processo principal recebe as matrizes já convertidas e as grava com
+ingerir_matriz, vários arquivos por transação; só ele escreve no banco.
+
+Arquivos cujo hash já está em alguma análise são ignorados, assim como, nas
+pastas com várias abas, os arquivos que já têm todas as análises
+'<nome> - <aba>' (importadas quando as abas ainda ficavam sem hash). Assim a
+importação pode ser interrompida e executada de novo.
+"""
+import glob
+import multiprocessing
+import os
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.db import transaction
+
+from .armazenamento import matriz_do_resultado
+from .duplicados import calcular_hash
+from .ingestao import abas_para_ingestao, ingerir_matriz, usar_ingestao_streaming
+from .models import UploadedFile
+from .planilha import ler_aba, ler_aba_ou_erro
+
+EXTENSOES_IMPORTACAO = ('.xlsx', '.xlsm', '.xls')
+
+# Arquivos gravados por transação.
+ARQUIVOS_POR_TRANSACAO = 20
+
+
+def listar_arquivos(caminhos):
+    """
+    Arquivos a importar a partir de diretórios (percorridos recursivamente),
+    padrões glob ('dados/2023-*.xlsx', '**' vale) ou arquivos. Ignora os
+    arquivos de bloqueio do Excel ('~$...') e repetições; retorna os
+    caminhos em ordem alfabética.
+    """
+    encontrados = set()
+    for caminho in caminhos:
+        if os.path.isdir(caminho):
+            candidatos = (
+                os.path.join(pasta, nome) for pasta, _, nomes in os.walk(caminho) for nome in nomes
+            )
+        else:
+            candidatos = glob.glob(caminho, recursive=True) or [caminho]
+        for candidato in candidatos:
+            nome = os.path.basename(candidato)
+            if nome.startswith('~$') or os.path.splitext(nome)[1].lower() not in EXTENSOES_IMPORTACAO:
+                continue
+            if os.path.isfile(candidato):
+                encontrados.add(os.path.abspath(candidato))
+    return sorted(encontrados)
+
+
+def nome_da_analise(caminho):
+    """
+    Nome da análise criada para o arquivo: o nome do arquivo sem a extensão.
+    """
+    return os.path.splitext(os.path.basename(caminho))[0]
+
+
+def ler_arquivo(caminho):
+    """
+    Lê um arquivo e retorna {'caminho', 'matrizes', 'abas', 'leitura_s'} ou,
+    se ele não puder ser lido, {'caminho', 'erro', 'leitura_s'}. 'abas' é a
+    lista das abas lidas quando cada uma vira uma análise, ou None.
+    Executada nos processos do pool.
+    """
+    inicio = time.perf_counter()
+    try:
+        abas = abas_para_ingestao(caminho)
+        if abas:
+            matrizes = [matriz for matriz in map(ler_aba_ou_erro, [caminho] * len(abas), abas) if 'erro' not in matriz]
+            if not matrizes:
+                raise ValueError("Nenhuma aba tem o formato esperado.")
+            abas = [matriz['aba'] for matriz in matrizes]
+        elif usar_ingestao_streaming(caminho):
+            matrizes = [ler_aba(caminho, 0)]
+        else:
+            from .views import processar_arquivo_excel
+            matrizes = [matriz_do_resultado(processar_arquivo_excel(caminho))]
+    except Exception as e:
+        return {'caminho': caminho, 'erro': str(e), 'leitura_s': time.perf_counter() - inicio}
+    return {'caminho': caminho, 'matrizes': matrizes, 'abas': abas, 'leitura_s': time.perf_counter() - inicio}
+
+
+def _ler_em_paralelo(caminhos, processos):
+    """
+    Gera o resultado de ler_arquivo para cada caminho, na ordem recebida.
+    No máximo 2 arquivos por processo ficam lidos e ainda não consumidos, para
+    a memória não crescer quando a gravação é mais lenta que a leitura.
+    """
+    if processos <= 1:
+        yield from map(ler_arquivo, caminhos)
+        return
+
+    # O inicializador é o próprio django.setup: este módulo importa os modelos
+    # e só pode ser carregado nos processos depois do setup.
+    with ProcessPoolExecutor(
+        max_workers=processos, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup,
+    ) as pool:
+        pendentes = deque()
+        for caminho in caminhos:
+            pendentes.append(pool.submit(ler_arquivo, caminho))
+            if len(pendentes) >= processos * 2:
+                yield pendentes.popleft().result()
+        while pendentes:
+            yield pendentes.popleft().result()
+
+
+def _ja_importado(nome, abas):
+    """
+    Pastas com várias abas: todas as análises '<nome> - <aba>' já existem.
+    """
+    nomes = [f"{nome} - {aba}" for aba in abas]
+    return UploadedFile.objects.filter(name__in=nomes).values('name').distinct().count() == len(nomes)
+
+
+def _gravar(leitura, content_hash):
+    """
+    Grava as análises de um arquivo lido e retorna (análises, linhas).
+    """
+    nome = nome_da_analise(leitura['caminho'])
+    upload_group = uuid.uuid4() if leitura['abas'] else None
+    analises = 0
+    linhas = 0
+    for matriz in leitura['matrizes']:
+        ingerir_matriz(
+            f"{nome} - {matriz['aba']}" if leitura['abas'] else nome, matriz,
+            progresso=lambda *a: None, content_hash=content_hash,
+            upload_group=upload_group, sheet_name=matriz['aba'] if leitura['abas'] else '',
+        )
+        analises += 1
+        linhas += len(matriz['ids'])
+    return analises, linhas
+
+
+def importar_arquivos(caminhos, processos=None, arquivos_por_transacao=ARQUIVOS_POR_TRANSACAO, reimportar=False):
+    """
+    Importa os arquivos e gera, para cada um, um relatório com 'caminho',
+    'status' ('importado', 'ignorado' ou 'erro'), 'analises', 'linhas',
+    'leitura_s', 'gravacao_s' e 'mensagem'. Os relatórios de cada grupo de
+    'arquivos_por_transacao' arquivos saem depois que o grupo é gravado.
+    Com reimportar=True os arquivos já importados são importados de novo.
+    """
+    processos = max(1, processos or os.cpu_count() or 1)
+    hashes_existentes = set() if reimportar else set(
+        UploadedFile.objects.exclude(content_hash='').values_list('content_hash', flat=True)
+    )
+
+    # O hash é calculado antes da leitura: arquivos já importados não chegam ao pool.
+    a_ler = {}
+    relatorios_ignorados = []
+    for caminho in caminhos:
+        with open(caminho, 'rb') as arquivo:
+            content_hash = calcular_hash(arquivo)
+        if content_hash in hashes_existentes:
+            relatorios_ignorados.append(_relatorio(caminho, 'ignorado', mensagem='mesmo conteúdo já importado'))
+            continue
+        hashes_existentes.add(content_hash)
+        a_ler[caminho] = content_hash
+    yield from relatorios_ignorados
+
+    grupo = []
+    for leitura in _ler_em_paralelo(list(a_ler), processos):
+        grupo.append(leitura)
+        if len(grupo) >= arquivos_por_transacao:
+            yield from _gravar_grupo(grupo, a_ler, reimportar)
+            grupo = []
+    if grupo:
+        yield from _gravar_grupo(grupo, a_ler, reimportar)
+
+
+def _gravar_grupo(grupo, hashes, reimportar):
+    relatorios = []
+    with transaction.atomic():
+        for leitura in grupo:
+            caminho = leitura['caminho']
+            if 'erro' in leitura:
+                relatorios.append(_relatorio(caminho, 'erro', leitura_s=leitura['leitura_s'], mensagem=leitura['erro']))
+                continue
+            if leitura['abas'] and not reimportar and _ja_importado(nome_da_analise(caminho), leitura['abas']):
+                relatorios.append(_relatorio(
+                    caminho, 'ignorado', leitura_s=leitura['leitura_s'], mensagem='abas já importadas',
+                ))
+                continue
+
+            inicio = time.perf_counter()
+            try:
+                # Cada arquivo tem o seu savepoint: um erro não desfaz os outros do grupo.
+                with transaction.atomic():
+                    analises, linhas = _gravar(leitura, hashes[caminho])
+            except Exception as e:
+                relatorios.append(_relatorio(caminho, 'erro', leitura_s=leitura['leitura_s'], mensagem=str(e)))
+                continue
+            relatorios.append(_relatorio(
+                caminho, 'importado', analises=analises, linhas=linhas,
+                leitura_s=leitura['leitura_s'], gravacao_s=time.perf_counter() - inicio,
+            ))
+    return relatorios
+
+
+def _relatorio(caminho, status, analises=0, linhas=0, leitura_s=0.0, gravacao_s=0.0, mensagem=''):
+    return {
+        'caminho': caminho,
+        'status': status,
+        'analises': analises,
+        'linhas': linhas,
+        'leitura_s': leitura_s,
+        'gravacao_s': gravacao_s,
+        'mensagem': mensagem,
+    }
@@ -0,0 +1,366 @@
+"""
+Gravação das despesas de um upload no banco.
+
+Há três caminhos de ingestão, todos em uma única transação:
+
+- ingerir_resultado: grava o resultado de processar_arquivo_excel (pandas),
+  já inteiro em memória;
+- ingerir_planilha_streaming: lê o .xlsx/.xlsm em lotes (planilha.ler_planilha)
+  e grava cada lote assim que fica pronto (CUSTOS_INGESTAO_STREAMING);
+- ingerir_abas: faz o mesmo para cada aba de uma pasta, como análises
+  separadas (CUSTOS_INGESTAO_ABAS).
+
+Os agregados do arquivo (FileAggregates) são gravados junto com as linhas.
+No layout colunar (ver armazenamento) os valores vão para o ExpenseMatrix;
+no streaming eles são acumulados em arquivos temporários e copiados para o
+blob no final, então só os ids e as contas das linhas ficam em memória.
+"""
+import logging
+import os
+import shutil
+import tempfile
+import uuid
+from contextlib import ExitStack, contextmanager
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .agregados import calcular_agregados, salvar_agregados, somar_agregados
+from .armazenamento import (
+    ARMAZENAMENTO_COLUNAR, DTYPE_MATRIZ, armazenamento_configurado, matriz_do_resultado, salvar_matriz,
+    salvar_matriz_de_arquivos,
+)
+from .instrumentacao import medido
+from .models import UploadedFile, ExpenseData
+from .planilha import EXTENSOES_STREAMING, ler_abas, ler_planilha, listar_abas
+
+logger = logging.getLogger(__name__)
+
+# Quantidade padrão de linhas enviadas ao banco em cada INSERT em lote.
+TAMANHO_LOTE_PADRAO = 2000
+
+
+def obter_tamanho_lote():
+    """
+    Retorna o tamanho do lote de ingestão configurado em
+    CUSTOS_INGESTAO_TAMANHO_LOTE (ou o padrão do módulo).
+    """
+    return int(getattr(settings, 'CUSTOS_INGESTAO_TAMANHO_LOTE', TAMANHO_LOTE_PADRAO))
+
+
+def gerar_despesas(uploaded_file_obj, resultado, incluir_dados=True):
+    """
+    Converte o resultado de processar_arquivo_excel em instâncias
+    (ainda não salvas) de ExpenseData, uma por linha da planilha.
+    Com incluir_dados=False o campo 'data' fica vazio (layout colunar).
+    """
+    colunas_dados = resultado['colunas_dados']
+    linhas = zip(resultado['tabela_principal'], resultado['df_despesas_only'])
+    for posicao, (row_data, cleaned_row_data) in enumerate(linhas):
+        yield ExpenseData(
+            file=uploaded_file_obj,
+            id_excel=row_data.get('ID', ''),
+            account=row_data.get('CONTA', ''),
+            row_total=row_data.get('TOTAL (LINHA)', 0),
+            position=posicao,
+            data={col: cleaned_row_data[col] for col in colunas_dados} if incluir_dados else {},
+        )
+
+
+@medido
+def salvar_despesas(uploaded_file_obj, despesas, total=None, tamanho_lote=None, progresso=None):
+    """
+    Grava as linhas de despesa com bulk_create, em lotes de tamanho_lote.
+
+    'progresso', se informado, é chamado como progresso(gravadas, total)
+    após cada lote. Deve ser executada dentro de uma transação para que
+    a ingestão seja atômica.
+    """
+    tamanho_lote = tamanho_lote or obter_tamanho_lote()
+    gravadas = 0
+    lote = []
+
+    for despesa in despesas:
+        lote.append(despesa)
+        if len(lote) >= tamanho_lote:
+            ExpenseData.objects.bulk_create(lote, batch_size=tamanho_lote)
+            gravadas += len(lote)
+            lote = []
+            if progresso:
+                progresso(gravadas, total)
+
+    if lote:
+        ExpenseData.objects.bulk_create(lote, batch_size=tamanho_lote)
+        gravadas += len(lote)
+        if progresso:
+            progresso(gravadas, total)
+
+    return gravadas
+
+
+def gravar_linhas(uploaded_file_obj, colunas_dados, ids, contas, valores, totais, colunar, tamanho_lote, inicio=0):
+    """
+    Grava um bloco de linhas já convertidas ('valores' é um array linhas x
+    colunas_dados e 'totais' o total de cada linha) com um bulk_create. No
+    layout colunar o campo 'data' fica vazio. 'inicio' é a posição da
+    primeira linha do bloco na planilha.
+    """
+    ExpenseData.objects.bulk_create([
+        ExpenseData(
+            file=uploaded_file_obj,
+            id_excel=id_excel,
+            account=conta,
+            row_total=total,
+            data={} if colunar else dict(zip(colunas_dados, valores_linha)),
+            position=posicao,
+        )
+        for posicao, (id_excel, conta, total, valores_linha) in enumerate(
+            zip(ids, contas, totais.tolist(), valores.tolist()), start=inicio,
+        )
+    ], batch_size=tamanho_lote)
+
+
+def registrar_progresso(uploaded_file_obj):
+    """
+    Retorna um callback de progresso que registra o avanço da ingestão no log.
+    """
+    def progresso(gravadas, total):
+        if total is None:
+            logger.info(f"Ingestão de '{uploaded_file_obj.name}': {gravadas} linhas gravadas.")
+        else:
+            logger.info(f"Ingestão de '{uploaded_file_obj.name}': {gravadas}/{total} linhas gravadas.")
+    return progresso
+
+
+@medido
+def ingerir_resultado(analysis_name, resultado, tamanho_lote=None, progresso=None):
+    """
+    Cria o UploadedFile e grava todas as linhas do resultado em uma única
+    transação. Se qualquer lote falhar, nada é gravado.
+
+    No layout colunar (CUSTOS_ARMAZENAMENTO = 'colunar') os valores vão para
+    um único ExpenseMatrix em vez do JSON de cada linha. Os agregados do
+    arquivo (FileAggregates) são gravados na mesma transação.
+    """
+    total = len(resultado['tabela_principal'])
+    colunar = armazenamento_configurado() == ARMAZENAMENTO_COLUNAR
+
+    with transaction.atomic():
+        uploaded_file_obj = UploadedFile.objects.create(name=analysis_name)
+        salvar_despesas(
+            uploaded_file_obj,
+            gerar_despesas(uploaded_file_obj, resultado, incluir_dados=not colunar),
+            total=total,
+            tamanho_lote=tamanho_lote,
+            progresso=progresso or registrar_progresso(uploaded_file_obj),
+        )
+        matriz = matriz_do_resultado(resultado)
+        salvar_agregados(uploaded_file_obj, calcular_agregados(matriz))
+        if colunar:
+            salvar_matriz(uploaded_file_obj, matriz)
+
+    return uploaded_file_obj
+
+
+def usar_ingestao_streaming(arquivo):
+    """
+    Indica se o arquivo deve ser ingerido em streaming: a opção
+    CUSTOS_INGESTAO_STREAMING precisa estar ativa e o arquivo precisa ser
+    um .xlsx/.xlsm (o .xls continua sendo lido pelo pandas).
+    """
+    if not getattr(settings, 'CUSTOS_INGESTAO_STREAMING', False):
+        return False
+    nome = getattr(arquivo, 'name', None) or str(arquivo)
+    return os.path.splitext(nome)[1].lower() in EXTENSOES_STREAMING
+
+
+@medido
+def ingerir_planilha_streaming(analysis_name, arquivo, tamanho_lote=None, progresso=None):
+    """
+    Lê a planilha linha a linha (planilha.ler_planilha) e grava cada lote
+    assim que ele fica pronto (gravar_lotes), em uma única transação.
+
+    Levanta ValueError se o arquivo não tiver o formato esperado.
+    """
+    planilha = ler_planilha(arquivo)
+    tamanho_lote = tamanho_lote or obter_tamanho_lote()
+
+    with transaction.atomic():
+        uploaded_file_obj = UploadedFile.objects.create(name=analysis_name)
+        gravar_lotes(
+            uploaded_file_obj, planilha['colunas_dados'], planilha['lotes'](tamanho_lote), tamanho_lote,
+            progresso or registrar_progresso(uploaded_file_obj),
+        )
+
+    return uploaded_file_obj
+
+
+def gravar_lotes(uploaded_file_obj, colunas_dados, lotes, tamanho_lote, progresso):
+    """
+    Grava as linhas de 'lotes' (tuplas (ids, contas, valores) como as de
+    planilha.ler_planilha) à medida que chegam, com os agregados somados
+    lote a lote, então a memória depende do tamanho do lote e não do tamanho
+    da planilha. No layout colunar os valores e os totais de cada lote são
+    acrescentados a arquivos temporários, copiados para o ExpenseMatrix no
+    final (armazenamento.salvar_matriz_de_arquivos); só os ids e as contas,
+    que vão para campos JSON, ficam em memória. 'progresso' é chamado como
+    progresso(gravadas, None) após cada lote. Retorna a quantidade de linhas
+    gravadas. Deve ser executada dentro de uma transação.
+    """
+    colunar = armazenamento_configurado() == ARMAZENAMENTO_COLUNAR
+    agregados = None
+    gravadas = 0
+    ids, contas = [], []
+    with ExitStack() as pilha:
+        if colunar:
+            arquivo_valores = pilha.enter_context(tempfile.TemporaryFile(prefix='custos-valores-'))
+            arquivo_totais = pilha.enter_context(tempfile.TemporaryFile(prefix='custos-totais-'))
+
+        for ids_lote, contas_lote, valores in lotes:
+            totais_lote = valores.sum(axis=1)
+            gravar_linhas(
+                uploaded_file_obj, colunas_dados, ids_lote, contas_lote, valores, totais_lote, colunar, tamanho_lote,
+                inicio=gravadas,
+            )
+
+            lote = {'ids': ids_lote, 'contas': contas_lote, 'colunas': colunas_dados, 'valores': valores, 'totais': totais_lote}
+            agregados = somar_agregados(agregados, calcular_agregados(lote))
+            if colunar:
+                ids.extend(ids_lote)
+                contas.extend(contas_lote)
+                arquivo_valores.write(np.ascontiguousarray(valores, dtype=DTYPE_MATRIZ).tobytes())
+                arquivo_totais.write(np.ascontiguousarray(totais_lote, dtype=DTYPE_MATRIZ).tobytes())
+
+            gravadas += len(ids_lote)
+            progresso(gravadas, None)
+
+        if agregados is None:
+            # Planilha só com linhas de TOTAL: arquivo sem linhas, como no caminho com pandas.
+            agregados = calcular_agregados({
+                'contas': [], 'colunas': colunas_dados,
+                'valores': np.zeros((0, len(colunas_dados)), dtype=DTYPE_MATRIZ),
+                'totais': np.zeros(0, dtype=DTYPE_MATRIZ),
+            })
+        salvar_agregados(uploaded_file_obj, agregados)
+        if colunar:
+            salvar_matriz_de_arquivos(uploaded_file_obj, colunas_dados, ids, contas, arquivo_valores, arquivo_totais)
+    return gravadas
+
+
+@medido
+def ingerir_matriz(analysis_name, matriz, tamanho_lote=None, progresso=None, content_hash='', upload_group=None,
+                   sheet_name=''):
+    """
+    Cria o UploadedFile (com o hash, o grupo e a aba informados) e grava uma
+    matriz já lida (formato de ler_aba ou carregar_matriz) em lotes de
+    bulk_create, com os agregados e, no layout colunar, o ExpenseMatrix, em
+    uma única transação.
+    """
+    tamanho_lote = tamanho_lote or obter_tamanho_lote()
+    colunar = armazenamento_configurado() == ARMAZENAMENTO_COLUNAR
+    colunas_dados = matriz['colunas']
+    total = len(matriz['ids'])
+
+    with transaction.atomic():
+        uploaded_file_obj = UploadedFile.objects.create(
+            name=analysis_name, content_hash=content_hash, upload_group=upload_group, sheet_name=sheet_name,
+        )
+        progresso = progresso or registrar_progresso(uploaded_file_obj)
+        for inicio in range(0, total, tamanho_lote):
+            fim = inicio + tamanho_lote
+            gravar_linhas(
+                uploaded_file_obj, colunas_dados, matriz['ids'][inicio:fim], matriz['contas'][inicio:fim],
+                matriz['valores'][inicio:fim], matriz['totais'][inicio:fim], colunar, tamanho_lote, inicio=inicio,
+            )
+            progresso(min(fim, total), total)
+
+        salvar_agregados(uploaded_file_obj, calcular_agregados(matriz))
+        if colunar:
+            salvar_matriz(uploaded_file_obj, matriz)
+
+    return uploaded_file_obj
+
+
+def abas_para_ingestao(arquivo):
+    """
+    Nomes das abas a ingerir separadamente, ou None quando o arquivo deve
+    seguir o caminho de uma aba só: CUSTOS_INGESTAO_ABAS desligado, arquivo
+    que não é .xlsx/.xlsm (o .xls é lido pelo pandas) ou pasta com uma aba.
+    """
+    if not getattr(settings, 'CUSTOS_INGESTAO_ABAS', False) or not usar_ingestao_streaming(arquivo):
+        return None
+    abas = listar_abas(arquivo)
+    return abas if len(abas) > 1 else None
+
+
+@contextmanager
+def arquivo_em_disco(arquivo):
+    """
+    Caminho do arquivo no disco, para ler_abas: o próprio
+    caminho, o arquivo temporário de um upload grande ou uma cópia
+    temporária (removida ao final) de um arquivo em memória.
+    """
+    if isinstance(arquivo, (str, os.PathLike)):
+        yield os.fspath(arquivo)
+        return
+    if hasattr(arquivo, 'temporary_file_path'):
+        yield arquivo.temporary_file_path()
+        return
+
+    extensao = os.path.splitext(getattr(arquivo, 'name', '') or '')[1]
+    descritor, caminho = tempfile.mkstemp(suffix=extensao)
+    try:
+        with os.fdopen(descritor, 'wb') as destino:
+            arquivo.seek(0)
+            shutil.copyfileobj(arquivo, destino)
+        arquivo.seek(0)
+        yield caminho
+    finally:
+        os.remove(caminho)
+
+
+@medido
+def ingerir_abas(analysis_name, arquivo, abas, tamanho_lote=None, progresso=None, processos=None, content_hash=''):
+    """
+    Ingere cada aba de uma pasta com várias abas como uma análise própria,
+    chamada '<analysis_name> - <aba>', em uma única transação. As abas são
+    convertidas em paralelo (planilha.ler_abas, com
+    CUSTOS_INGESTAO_PROCESSOS_ABAS processos) e os lotes de cada uma são
+    gravados à medida que chegam (gravar_lotes), como no upload em
+    streaming de uma aba. Abas sem o formato esperado são ignoradas (e
+    registradas no log); se nenhuma tiver, levanta o ValueError da primeira.
+    Retorna a lista de UploadedFile criados, na ordem das abas.
+
+    Todas as análises recebem o hash do arquivo (content_hash) e o mesmo
+    upload_group, que as identifica como abas de um único upload (ver
+    duplicados).
+    """
+    processos = processos or getattr(settings, 'CUSTOS_INGESTAO_PROCESSOS_ABAS', None)
+    tamanho_lote = tamanho_lote or obter_tamanho_lote()
+    gravadas = 0
+    erros = []
+    uploaded_files = []
+    upload_group = uuid.uuid4()
+    with arquivo_em_disco(arquivo) as caminho, transaction.atomic():
+        for aba in ler_abas(caminho, abas, processos, tamanho_lote):
+            if 'erro' in aba:
+                logger.warning(f"Aba '{aba['aba']}' de '{analysis_name}' ignorada: {aba['erro']}")
+                erros.append(aba)
+                continue
+
+            uploaded_file_obj = UploadedFile.objects.create(
+                name=f"{analysis_name} - {aba['aba']}", content_hash=content_hash,
+                upload_group=upload_group, sheet_name=aba['aba'],
+            )
+
+            def progresso_aba(linhas, _total, inicio=gravadas):
+                if progresso:
+                    progresso(inicio + linhas, None)
+            gravadas += gravar_lotes(uploaded_file_obj, aba['colunas_dados'], aba['lotes'], tamanho_lote, progresso_aba)
+            uploaded_files.append(uploaded_file_obj)
+
+        if not uploaded_files:
+            raise ValueError(f"Nenhuma aba tem o formato esperado. Aba '{erros[0]['aba']}': {erros[0]['erro']}")
+    logger.info(f"'{analysis_name}': {len(uploaded_files)} abas ingeridas ({gravadas} linhas).")
+    return uploaded_files
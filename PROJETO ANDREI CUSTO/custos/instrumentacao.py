@@ -0,0 +1,357 @@
+"""
+Instrumentação das requisições e dos trechos mais pesados do app custos.
+
+Os trechos são marcados com o decorador @medido ou com o bloco
+'with medir(nome)'. Cada medição vai para:
+
+- a requisição em andamento (InstrumentacaoMiddleware), que devolve os
+  tempos no cabeçalho Server-Timing e, ao final, com
+  CUSTOS_LOG_REQUISICOES, registra um log em JSON no logger
+  'custos.instrumentacao', com os trechos e as consultas SQL
+  (contadas e cronometradas por um execute_wrapper instalado em cada
+  conexão, inclusive nas threads do ORM assíncrono);
+- os contadores do processo, expostos no formato de texto do Prometheus
+  por exportar_prometheus (endpoint 'metricas/').
+
+Com DEBUG ativo, ?perfil=cprofile (ou ?perfil=pyinstrument, se o pacote
+estiver instalado) grava o perfil da requisição em CUSTOS_PERFIL_DIR (só no
+modo síncrono). Em respostas em streaming, os tempos e o perfil cobrem só a
+execução da view.
+
+Os contadores são por processo: com vários workers, cada um expõe os seus.
+"""
+import contextvars
+import cProfile
+import json
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connection
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+# Limites (em segundos) dos buckets dos histogramas.
+LIMITES_HISTOGRAMA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+PERFIS = ('cprofile', 'pyinstrument')
+
+_requisicao_atual = contextvars.ContextVar('custos_requisicao_atual', default=None)
+_trava = threading.Lock()
+# {(métrica, rótulos): valor}, com rótulos como tupla de pares (nome, valor).
+_contadores = {}
+# {(métrica, rótulos): [contagem por bucket..., soma, quantidade]}
+_histogramas = {}
+
+_AJUDA = {
+    'custos_requisicoes_total': ('counter', "Requisições atendidas, por view, método e status."),
+    'custos_requisicao_segundos': ('histogram', "Duração das requisições, por view."),
+    'custos_consultas_sql_total': ('counter', "Consultas SQL executadas nas requisições, por view."),
+    'custos_consultas_sql_segundos_total': ('counter', "Tempo gasto em consultas SQL nas requisições, por view."),
+    'custos_trecho_segundos': ('histogram', "Duração dos trechos instrumentados (@medido / medir)."),
+    'custos_cache_analise_total': ('counter', "Consultas ao cache da análise, por resultado (acerto ou falha)."),
+}
+
+
+class MedicoesRequisicao:
+    """
+    Tempos acumulados durante uma requisição: trechos e consultas SQL.
+    """
+
+    def __init__(self):
+        self.trechos = {}
+        self.consultas = 0
+        self.tempo_consultas = 0.0
+
+    def registrar_trecho(self, nome, segundos):
+        total, quantidade = self.trechos.get(nome, (0.0, 0))
+        self.trechos[nome] = (total + segundos, quantidade + 1)
+
+    def registrar_consulta(self, segundos):
+        self.consultas += 1
+        self.tempo_consultas += segundos
+
+    def server_timing(self, duracao):
+        """
+        Valor do cabeçalho Server-Timing (durações em milissegundos).
+        """
+        partes = [
+            f'total;dur={duracao * 1000:.1f}',
+            f'db;dur={self.tempo_consultas * 1000:.1f};desc="{self.consultas} consultas"',
+        ]
+        for nome, (total, quantidade) in self.trechos.items():
+            parte = f'{re.sub(r"[^A-Za-z0-9_.-]", "_", nome)};dur={total * 1000:.1f}'
+            if quantidade > 1:
+                parte += f';desc="{quantidade}x"'
+            partes.append(parte)
+        return ', '.join(partes)
+
+
+def _observar(metrica, rotulos, segundos):
+    chave = (metrica, tuple(rotulos))
+    with _trava:
+        serie = _histogramas.setdefault(chave, [0] * len(LIMITES_HISTOGRAMA) + [0.0, 0])
+        for i, limite in enumerate(LIMITES_HISTOGRAMA):
+            if segundos <= limite:
+                serie[i] += 1
+        serie[-2] += segundos
+        serie[-1] += 1
+
+
+def _incrementar(metrica, rotulos, valor=1):
+    chave = (metrica, tuple(rotulos))
+    with _trava:
+        _contadores[chave] = _contadores.get(chave, 0) + valor
+
+
+def contar(metrica, rotulos=(), valor=1):
+    """
+    Soma 'valor' a um contador do processo (uma das métricas de _AJUDA).
+    """
+    _incrementar(metrica, rotulos, valor)
+
+
+def valor_contador(metrica, rotulos=()):
+    """
+    Valor atual de um contador do processo (0 se ainda não foi incrementado).
+    """
+    with _trava:
+        return _contadores.get((metrica, tuple(rotulos)), 0)
+
+
+def registrar_trecho(nome, segundos):
+    """
+    Registra a duração de um trecho na requisição em andamento (se houver)
+    e no histograma do processo.
+    """
+    medicoes = _requisicao_atual.get()
+    if medicoes is not None:
+        medicoes.registrar_trecho(nome, segundos)
+    _observar('custos_trecho_segundos', (('trecho', nome),), segundos)
+
+
+@contextmanager
+def medir(nome):
+    """
+    Mede a duração do bloco como o trecho 'nome'.
+    """
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        registrar_trecho(nome, time.perf_counter() - inicio)
+
+
+def medido(funcao):
+    """
+    Decorador que mede cada chamada da função como um trecho com o seu nome.
+    """
+    @wraps(funcao)
+    def envoltorio(*args, **kwargs):
+        with medir(funcao.__name__):
+            return funcao(*args, **kwargs)
+    return envoltorio
+
+
+def _cronometrar_consulta(execute, sql, params, many, context):
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        medicoes = _requisicao_atual.get()
+        if medicoes is not None:
+            medicoes.registrar_consulta(time.perf_counter() - inicio)
+
+
+def _instalar_cronometro(sender=None, connection=None, **kwargs):
+    """
+    Instala _cronometrar_consulta na conexão, uma única vez. Fora de uma
+    requisição o wrapper só mede o tempo e descarta.
+    """
+    if _cronometrar_consulta not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_cronometrar_consulta)
+
+
+connection_created.connect(_instalar_cronometro, dispatch_uid='custos_instrumentacao_cronometro')
+
+
+def _nome_view(request):
+    resolver_match = getattr(request, 'resolver_match', None)
+    if resolver_match is None:
+        return 'sem_rota'
+    return resolver_match.url_name or resolver_match.view_name or 'sem_nome'
+
+
+def _perfil_solicitado(request):
+    if not settings.DEBUG:
+        return None
+    perfil = request.GET.get('perfil')
+    return perfil if perfil in PERFIS else None
+
+
+def _executar_com_perfil(perfil, get_response, request):
+    """
+    Executa a requisição sob o profiler escolhido e grava o resultado em
+    CUSTOS_PERFIL_DIR. O caminho do arquivo vai no cabeçalho X-Perfil.
+    """
+    diretorio = Path(getattr(settings, 'CUSTOS_PERFIL_DIR', Path(settings.BASE_DIR) / 'perfis'))
+    diretorio.mkdir(parents=True, exist_ok=True)
+    nome = f"{time.strftime('%Y%m%d-%H%M%S')}-{re.sub(r'[^A-Za-z0-9]+', '-', request.path).strip('-') or 'inicio'}"
+
+    if perfil == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            logger.warning("?perfil=pyinstrument ignorado: o pacote pyinstrument não está instalado.")
+            return get_response(request)
+        profiler = Profiler()
+        profiler.start()
+        try:
+            response = get_response(request)
+        finally:
+            profiler.stop()
+        caminho = diretorio / f'{nome}.html'
+        caminho.write_text(profiler.output_html(), encoding='utf-8')
+    else:
+        profiler = cProfile.Profile()
+        response = profiler.runcall(get_response, request)
+        caminho = diretorio / f'{nome}.prof'
+        profiler.dump_stats(caminho)
+
+    response['X-Perfil'] = str(caminho)
+    logger.info(json.dumps({'evento': 'perfil', 'caminho': request.path, 'arquivo': str(caminho)}, ensure_ascii=False))
+    return response
+
+
+class InstrumentacaoMiddleware:
+    """
+    Mede cada requisição (trechos, consultas SQL e duração total), devolve
+    os tempos em Server-Timing (com CUSTOS_SERVER_TIMING) e registra um
+    log em JSON e os contadores do processo. Funciona nos modos síncrono
+    (WSGI) e assíncrono (ASGI).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.assincrono = iscoroutinefunction(get_response)
+        if self.assincrono:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.assincrono:
+            return self.__acall__(request)
+
+        medicoes = MedicoesRequisicao()
+        token = _requisicao_atual.set(medicoes)
+        perfil = _perfil_solicitado(request)
+        inicio = time.perf_counter()
+        try:
+            _instalar_cronometro(connection=connection)
+            if perfil:
+                response = _executar_com_perfil(perfil, self.get_response, request)
+            else:
+                response = self.get_response(request)
+        finally:
+            _requisicao_atual.reset(token)
+        return self.registrar(request, response, medicoes, time.perf_counter() - inicio)
+
+    async def __acall__(self, request):
+        medicoes = MedicoesRequisicao()
+        token = _requisicao_atual.set(medicoes)
+        if _perfil_solicitado(request):
+            logger.warning("?perfil ignorado: o perfil da requisição só é gravado no modo síncrono.")
+        inicio = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _requisicao_atual.reset(token)
+        return self.registrar(request, response, medicoes, time.perf_counter() - inicio)
+
+    def registrar(self, request, response, medicoes, duracao):
+        """
+        Atualiza os contadores, acrescenta o Server-Timing e, com
+        CUSTOS_LOG_REQUISICOES, grava o log da requisição.
+        """
+        view = _nome_view(request)
+        _incrementar('custos_requisicoes_total', (
+            ('view', view), ('metodo', request.method), ('status', str(response.status_code)),
+        ))
+        _observar('custos_requisicao_segundos', (('view', view),), duracao)
+        _incrementar('custos_consultas_sql_total', (('view', view),), medicoes.consultas)
+        _incrementar('custos_consultas_sql_segundos_total', (('view', view),), medicoes.tempo_consultas)
+
+        if getattr(settings, 'CUSTOS_SERVER_TIMING', True):
+            response['Server-Timing'] = medicoes.server_timing(duracao)
+
+        if not getattr(settings, 'CUSTOS_LOG_REQUISICOES', False):
+            return response
+        logger.info(json.dumps({
+            'evento': 'requisicao',
+            'metodo': request.method,
+            'caminho': request.path,
+            'view': view,
+            'status': response.status_code,
+            'duracao_ms': round(duracao * 1000, 1),
+            'consultas': medicoes.consultas,
+            'consultas_ms': round(medicoes.tempo_consultas * 1000, 1),
+            'trechos_ms': {nome: round(total * 1000, 1) for nome, (total, _) in medicoes.trechos.items()},
+        }, ensure_ascii=False))
+        return response
+
+
+def _escapar_rotulo(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _formatar_rotulos(rotulos):
+    if not rotulos:
+        return ''
+    return '{' + ','.join(f'{nome}="{_escapar_rotulo(valor)}"' for nome, valor in rotulos) + '}'
+
+
+def _numero_prometheus(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+def exportar_prometheus(extras=()):
+    """
+    Texto no formato de exposição do Prometheus com os contadores e
+    histogramas do processo. 'extras' acrescenta métricas calculadas na
+    hora, como (nome, tipo, ajuda, [(rótulos, valor), ...]).
+    """
+    with _trava:
+        contadores = dict(_contadores)
+        histogramas = {chave: list(serie) for chave, serie in _histogramas.items()}
+
+    linhas = []
+    for metrica, (tipo, ajuda) in _AJUDA.items():
+        linhas += [f'# HELP {metrica} {ajuda}', f'# TYPE {metrica} {tipo}']
+        if tipo == 'counter':
+            for (nome, rotulos), valor in sorted(contadores.items()):
+                if nome == metrica:
+                    linhas.append(f'{metrica}{_formatar_rotulos(rotulos)} {_numero_prometheus(valor)}')
+            continue
+        for (nome, rotulos), serie in sorted(histogramas.items()):
+            if nome != metrica:
+                continue
+            for limite, quantidade in zip(LIMITES_HISTOGRAMA, serie):
+                linhas.append(f'{metrica}_bucket{_formatar_rotulos(rotulos + (("le", limite),))} {quantidade}')
+            linhas.append(f'{metrica}_bucket{_formatar_rotulos(rotulos + (("le", "+Inf"),))} {serie[-1]}')
+            linhas.append(f'{metrica}_sum{_formatar_rotulos(rotulos)} {_numero_prometheus(serie[-2])}')
+            linhas.append(f'{metrica}_count{_formatar_rotulos(rotulos)} {serie[-1]}')
+
+    for metrica, tipo, ajuda, series in extras:
+        linhas += [f'# HELP {metrica} {ajuda}', f'# TYPE {metrica} {tipo}']
+        for rotulos, valor in series:
+            linhas.append(f'{metrica}{_formatar_rotulos(tuple(rotulos))} {_numero_prometheus(valor)}')
+
+    return '\n'.join(linhas) + '\n'
@@ -0,0 +1,80 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from custos.importacao import ARQUIVOS_POR_TRANSACAO, importar_arquivos, listar_arquivos
+
+
+class Command(BaseCommand):
+    help = (
+        "Importa em lote as planilhas de diretórios, padrões glob ou arquivos (.xlsx, .xlsm, .xls), "
+        "lendo os arquivos em processos paralelos. Arquivos já importados são ignorados."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'caminhos', nargs='+',
+            help="Diretórios (percorridos recursivamente), padrões glob entre aspas ou arquivos.",
+        )
+        parser.add_argument(
+            '--processos', type=int, default=None,
+            help="Processos que leem os arquivos (padrão: um por CPU; 1 = sem pool).",
+        )
+        parser.add_argument(
+            '--arquivos-por-transacao', type=int, default=ARQUIVOS_POR_TRANSACAO,
+            help=f"Arquivos gravados em cada transação (padrão: {ARQUIVOS_POR_TRANSACAO}).",
+        )
+        parser.add_argument(
+            '--reimportar', action='store_true',
+            help="Importa de novo os arquivos que já têm análise.",
+        )
+
+    def handle(self, *args, **options):
+        caminhos = listar_arquivos(options['caminhos'])
+        if not caminhos:
+            raise CommandError("Nenhum arquivo .xlsx, .xlsm ou .xls encontrado.")
+        if options['arquivos_por_transacao'] < 1:
+            raise CommandError("--arquivos-por-transacao precisa ser pelo menos 1.")
+
+        self.stdout.write(f"{len(caminhos)} arquivo(s) encontrado(s).")
+        contagem = {'importado': 0, 'ignorado': 0, 'erro': 0}
+        analises = 0
+        linhas = 0
+        inicio = time.perf_counter()
+
+        relatorios = importar_arquivos(
+            caminhos,
+            processos=options['processos'],
+            arquivos_por_transacao=options['arquivos_por_transacao'],
+            reimportar=options['reimportar'],
+        )
+        for numero, relatorio in enumerate(relatorios, start=1):
+            contagem[relatorio['status']] += 1
+            analises += relatorio['analises']
+            linhas += relatorio['linhas']
+            self.stdout.write(self.linha_relatorio(numero, len(caminhos), relatorio))
+
+        duracao = time.perf_counter() - inicio
+        lidos = contagem['importado'] + contagem['erro']
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(
+            f"{contagem['importado']} importado(s) ({analises} análise(s), {linhas} linhas), "
+            f"{contagem['ignorado']} ignorado(s), {contagem['erro']} com erro em {duracao:.1f}s."
+        ))
+        if duracao > 0 and lidos:
+            self.stdout.write(
+                f"Vazão: {lidos / duracao:.2f} arquivos/s, {linhas / duracao:,.0f} linhas/s."
+            )
+
+    def linha_relatorio(self, numero, total, relatorio):
+        nome = os.path.basename(relatorio['caminho'])
+        prefixo = f"[{numero}/{total}] {nome}"
+        if relatorio['status'] == 'importado':
+            return (
+                f"{prefixo}: {relatorio['linhas']} linhas em {relatorio['analises']} análise(s), "
+                f"leitura {relatorio['leitura_s']:.2f}s, gravação {relatorio['gravacao_s']:.2f}s"
+            )
+        if relatorio['status'] == 'ignorado':
+            return self.style.WARNING(f"{prefixo}: ignorado ({relatorio['mensagem']})")
+        return self.style.ERROR(f"{prefixo}: erro - {relatorio['mensagem']}")
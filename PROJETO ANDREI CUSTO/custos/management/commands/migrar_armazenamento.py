@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from custos.armazenamento import (
+    ARMAZENAMENTO_COLUNAR, ARMAZENAMENTO_JSON, converter_para_colunar, converter_para_json,
+)
+from custos.models import UploadedFile
+
+
+class Command(BaseCommand):
+    help = (
+        "Converte os arquivos já enviados entre o layout JSON (ExpenseData.data) "
+        "e o layout colunar (ExpenseMatrix)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--para', choices=[ARMAZENAMENTO_COLUNAR, ARMAZENAMENTO_JSON], default=ARMAZENAMENTO_COLUNAR,
+            help="Layout de destino (padrão: colunar).",
+        )
+        parser.add_argument(
+            '--file-id', nargs='+', default=None,
+            help="Converte apenas os arquivos informados (padrão: todos).",
+        )
+
+    def handle(self, *args, **options):
+        converter = converter_para_colunar if options['para'] == ARMAZENAMENTO_COLUNAR else converter_para_json
+
+        arquivos = UploadedFile.objects.order_by('upload_date')
+        if options['file_id']:
+            arquivos = arquivos.filter(file_id__in=options['file_id'])
+
+        convertidos = 0
+        for uploaded_file in arquivos:
+            if converter(uploaded_file):
+                convertidos += 1
+                self.stdout.write(f"Convertido: {uploaded_file.name} ({uploaded_file.file_id})")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{convertidos} arquivo(s) convertido(s) para o layout {options['para']}."
+        ))
@@ -0,0 +1,43 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from custos.fila import executar_fila
+
+
+class Command(BaseCommand):
+    help = (
+        "Processa a fila de uploads em primeiro plano. Use junto com "
+        "CUSTOS_FILA_TRABALHADOR_INTERNO = False para tirar o processamento do servidor web."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--trabalhadores', type=int, default=None,
+            help="Uploads processados ao mesmo tempo (padrão: CUSTOS_FILA_TRABALHADORES).",
+        )
+        parser.add_argument(
+            '--intervalo', type=float, default=None,
+            help="Segundos entre consultas à fila (padrão: CUSTOS_FILA_INTERVALO).",
+        )
+        parser.add_argument(
+            '--ate-esvaziar', action='store_true',
+            help="Termina quando não houver mais jobs pendentes.",
+        )
+
+    def handle(self, *args, **options):
+        parar = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *a: parar.set())
+
+        self.stdout.write("Processando a fila de uploads (Ctrl+C para sair)...")
+        try:
+            executar_fila(
+                trabalhadores=options['trabalhadores'],
+                intervalo=options['intervalo'],
+                parar=parar,
+                ate_esvaziar=options['ate_esvaziar'],
+            )
+        except KeyboardInterrupt:
+            parar.set()
+        self.stdout.write("Fila encerrada.")
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('custos', '0002_uploadedfile_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExpenseMatrix',
+            fields=[
+                ('file', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='matrix', serialize=False, to='custos.uploadedfile')),
+                ('columns', models.JSONField()),
+                ('row_ids', models.JSONField()),
+                ('accounts', models.JSONField()),
+                ('values', models.BinaryField()),
+                ('row_totals', models.BinaryField()),
+            ],
+            options={
+                'verbose_name': 'Matriz de Despesas',
+                'verbose_name_plural': 'Matrizes de Despesas',
+            },
+        ),
+    ]
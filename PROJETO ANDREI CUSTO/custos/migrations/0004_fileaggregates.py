@@ -0,0 +1,71 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('custos', '0003_expensematrix'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileAggregates',
+            fields=[
+                ('file', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='aggregates', serialize=False, to='custos.uploadedfile')),
+                ('grand_total', models.FloatField(default=0.0)),
+            ],
+            options={
+                'verbose_name': 'Agregados do Arquivo',
+                'verbose_name_plural': 'Agregados dos Arquivos',
+            },
+        ),
+        migrations.CreateModel(
+            name='AccountTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account', models.CharField(max_length=255)),
+                ('total', models.FloatField(default=0.0)),
+                ('file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='account_totals', to='custos.uploadedfile')),
+            ],
+            options={
+                'verbose_name': 'Total da Conta',
+                'verbose_name_plural': 'Totais das Contas',
+                'constraints': [models.UniqueConstraint(fields=('file', 'account'), name='custos_conta_unica')],
+            },
+        ),
+        migrations.CreateModel(
+            name='AreaTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+                ('area', models.CharField(max_length=255)),
+                ('total', models.FloatField(default=0.0)),
+                ('file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='area_totals', to='custos.uploadedfile')),
+            ],
+            options={
+                'verbose_name': 'Total da Área',
+                'verbose_name_plural': 'Totais das Áreas',
+                'ordering': ['position'],
+                'constraints': [models.UniqueConstraint(fields=('file', 'position'), name='custos_area_posicao_unica'), models.UniqueConstraint(fields=('file', 'area'), name='custos_area_unica')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ColumnTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+                ('column', models.CharField(max_length=255)),
+                ('total', models.FloatField(default=0.0)),
+                ('file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='column_totals', to='custos.uploadedfile')),
+            ],
+            options={
+                'verbose_name': 'Total da Coluna',
+                'verbose_name_plural': 'Totais das Colunas',
+                'ordering': ['position'],
+                'constraints': [models.UniqueConstraint(fields=('file', 'position'), name='custos_coluna_posicao_unica')],
+            },
+        ),
+    ]
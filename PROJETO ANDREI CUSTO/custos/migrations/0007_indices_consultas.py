@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('custos', '0006_uploadjob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='uploadedfile',
+            name='upload_date',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AddIndex(
+            model_name='expensedata',
+            index=models.Index(fields=['file', 'id_excel'], name='custos_despesa_arquivo_id'),
+        ),
+        migrations.AddIndex(
+            model_name='expensedata',
+            index=models.Index(fields=['file', 'account'], name='custos_despesa_arquivo_conta'),
+        ),
+    ]
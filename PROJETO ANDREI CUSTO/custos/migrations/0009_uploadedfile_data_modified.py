@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:49
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('custos', '0008_uploadedfile_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadedfile',
+            name='data_modified',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations
+
+
+def ativar_wal(apps, schema_editor):
+    # O journal_mode=WAL fica gravado no próprio arquivo do banco: basta
+    # ativá-lo uma vez, e não a cada conexão (o que alteraria o arquivo até
+    # em um 'manage.py check').
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite' and not connection.is_in_memory_db():
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode=WAL')
+
+
+class Migration(migrations.Migration):
+
+    # O SQLite não troca o modo do journal dentro de uma transação.
+    atomic = False
+
+    dependencies = [
+        ('custos', '0009_uploadedfile_data_modified'),
+    ]
+
+    operations = [
+        migrations.RunPython(ativar_wal, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:07
+
+from django.db import migrations, models
+
+
+def numerar_linhas(apps, schema_editor):
+    # As linhas já gravadas seguem a ordem de pk, que é a ordem da planilha.
+    ExpenseData = apps.get_model('custos', 'ExpenseData')
+    arquivos = ExpenseData.objects.order_by().values_list('file_id', flat=True).distinct()
+    for file_id in arquivos:
+        pks = ExpenseData.objects.filter(file_id=file_id).order_by('pk').values_list('pk', flat=True)
+        ExpenseData.objects.bulk_update(
+            [ExpenseData(pk=pk, position=posicao) for posicao, pk in enumerate(pks)], ['position'], batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('custos', '0010_sqlite_wal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expensedata',
+            name='position',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(numerar_linhas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('custos', '0011_expensedata_position'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadedfile',
+            name='sheet_name',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='uploadedfile',
+            name='upload_group',
+            field=models.UUIDField(blank=True, db_index=True, null=True),
+        ),
+    ]
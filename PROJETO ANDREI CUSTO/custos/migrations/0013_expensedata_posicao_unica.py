@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('custos', '0012_uploadedfile_upload_group'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='expensedata',
+            constraint=models.UniqueConstraint(fields=('file', 'position'), name='custos_despesa_posicao_unica'),
+        ),
+    ]
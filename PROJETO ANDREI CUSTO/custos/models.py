@@ -1,5 +1,6 @@
 import uuid
 from django.db import models
+from django.utils import timezone
 
 class UploadedFile(models.Model):
     """
@@ -7,7 +8,16 @@ class UploadedFile(models.Model):
     """
     file_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=255, default="Arquivo sem nome")
-    upload_date = models.DateTimeField(auto_now_add=True)
+    upload_date = models.DateTimeField(auto_now_add=True, db_index=True)
+    data_version = models.PositiveIntegerField(default=0) # Incrementado a cada alteração dos dados
+    data_modified = models.DateTimeField(default=timezone.now) # Data da última alteração dos dados
+    # SHA-256 do arquivo enviado. Fica vazio depois que os dados são editados,
+    # pois a análise deixa de corresponder ao arquivo (ver custos.duplicados).
+    content_hash = models.CharField(max_length=64, blank=True, default='', db_index=True)
+    # As análises das abas de uma mesma pasta (ver ingestao.ingerir_abas)
+    # compartilham o upload_group; sheet_name é o nome da aba de cada uma.
+    upload_group = models.UUIDField(null=True, blank=True, db_index=True)
+    sheet_name = models.CharField(max_length=255, blank=True, default='')
 
     def __str__(self):
         return f"{self.name} - {self.upload_date.strftime('%Y-%m-%d %H:%M')}"
@@ -25,10 +35,184 @@ class ExpenseData(models.Model):
     account = models.CharField(max_length=255)
     data = models.JSONField() # Armazena os valores das colunas dinâmicas (áreas)
     row_total = models.FloatField(default=0.0)
+    position = models.PositiveIntegerField(default=0) # Ordem da linha na planilha (e na matriz colunar)
 
     class Meta:
         verbose_name = "Dados de Despesa"
         verbose_name_plural = "Dados de Despesas"
+        indexes = [
+            # Busca de uma linha pelo ID da planilha (edição do total da linha).
+            models.Index(fields=['file', 'id_excel'], name='custos_despesa_arquivo_id'),
+            # Linhas de uma conta (valores por área do modal de detalhes).
+            models.Index(fields=['file', 'account'], name='custos_despesa_arquivo_conta'),
+        ]
+        constraints = [
+            # Ordem das linhas ao montar a matriz; também é a linha da matriz colunar.
+            models.UniqueConstraint(fields=['file', 'position'], name='custos_despesa_posicao_unica'),
+        ]
         
     def __str__(self):
         return f"{self.account} - {self.row_total}"
+
+
+class ExpenseMatrix(models.Model):
+    """
+    Armazenamento colunar opcional dos valores de um arquivo.
+
+    Guarda a matriz numérica (linhas x colunas de área) como um único blob
+    float64 little-endian em ordem C, junto com os índices de colunas e de
+    linhas. A análise carrega a matriz com uma única leitura, sem copiar os
+    bytes (np.frombuffer). Nesse modo o campo ExpenseData.data fica vazio.
+    """
+    file = models.OneToOneField(UploadedFile, on_delete=models.CASCADE, primary_key=True, related_name='matrix')
+    columns = models.JSONField() # Nomes das colunas de dados, na ordem da matriz
+    row_ids = models.JSONField() # id_excel de cada linha, na ordem da matriz
+    accounts = models.JSONField() # Conta de cada linha, na ordem da matriz
+    values = models.BinaryField() # Matriz float64 (linhas x colunas)
+    row_totals = models.BinaryField() # Vetor float64 com o total de cada linha
+
+    class Meta:
+        verbose_name = "Matriz de Despesas"
+        verbose_name_plural = "Matrizes de Despesas"
+
+    def __str__(self):
+        return f"{self.file.name} - {len(self.row_ids)} x {len(self.columns)}"
+
+
+class FileAggregates(models.Model):
+    """
+    Cabeçalho dos agregados de um arquivo, com o total geral.
+
+    Os totais por coluna, por área e por conta ficam materializados em
+    ColumnTotal, AreaTotal e AccountTotal. Todos são calculados na ingestão
+    e atualizados com o delta de cada edição de linha, para que nem a edição
+    nem os resumos da análise precisem reprocessar a planilha inteira.
+    """
+    file = models.OneToOneField(UploadedFile, on_delete=models.CASCADE, primary_key=True, related_name='aggregates')
+    grand_total = models.FloatField(default=0.0) # Soma dos totais das linhas
+
+    class Meta:
+        verbose_name = "Agregados do Arquivo"
+        verbose_name_plural = "Agregados dos Arquivos"
+
+    def __str__(self):
+        return f"{self.file.name} - {self.grand_total}"
+
+
+class ColumnTotal(models.Model):
+    """
+    Total de uma coluna de dados de um arquivo. 'position' é a ordem da
+    coluna na planilha.
+    """
+    file = models.ForeignKey(UploadedFile, on_delete=models.CASCADE, related_name='column_totals')
+    position = models.PositiveIntegerField()
+    column = models.CharField(max_length=255)
+    total = models.FloatField(default=0.0)
+
+    class Meta:
+        verbose_name = "Total da Coluna"
+        verbose_name_plural = "Totais das Colunas"
+        ordering = ['position']
+        constraints = [
+            models.UniqueConstraint(fields=['file', 'position'], name='custos_coluna_posicao_unica'),
+        ]
+
+    def __str__(self):
+        return f"{self.column} - {self.total}"
+
+
+class AreaTotal(models.Model):
+    """
+    Total de uma área (soma das suas colunas) de um arquivo. 'position' é a
+    ordem em que a área aparece na planilha.
+    """
+    file = models.ForeignKey(UploadedFile, on_delete=models.CASCADE, related_name='area_totals')
+    position = models.PositiveIntegerField()
+    area = models.CharField(max_length=255)
+    total = models.FloatField(default=0.0)
+
+    class Meta:
+        verbose_name = "Total da Área"
+        verbose_name_plural = "Totais das Áreas"
+        ordering = ['position']
+        constraints = [
+            models.UniqueConstraint(fields=['file', 'position'], name='custos_area_posicao_unica'),
+            models.UniqueConstraint(fields=['file', 'area'], name='custos_area_unica'),
+        ]
+
+    def __str__(self):
+        return f"{self.area} - {self.total}"
+
+
+class AccountTotal(models.Model):
+    """
+    Total de uma conta (soma das suas linhas) de um arquivo.
+    """
+    file = models.ForeignKey(UploadedFile, on_delete=models.CASCADE, related_name='account_totals')
+    account = models.CharField(max_length=255)
+    total = models.FloatField(default=0.0)
+
+    class Meta:
+        verbose_name = "Total da Conta"
+        verbose_name_plural = "Totais das Contas"
+        constraints = [
+            models.UniqueConstraint(fields=['file', 'account'], name='custos_conta_unica'),
+        ]
+
+    def __str__(self):
+        return f"{self.account} - {self.total}"
+
+
+class UploadJob(models.Model):
+    """
+    Upload aguardando processamento em segundo plano (fila no próprio banco).
+
+    O arquivo enviado fica em 'source_file' até o job terminar. Um
+    trabalhador (custos.fila) reserva os jobs pendentes em ordem de chegada,
+    executa a ingestão e registra o resultado e os tempos de espera e de
+    processamento.
+    """
+    STATUS_PENDENTE = 'pendente'
+    STATUS_PROCESSANDO = 'processando'
+    STATUS_CONCLUIDO = 'concluido'
+    STATUS_ERRO = 'erro'
+    STATUS_CHOICES = [
+        (STATUS_PENDENTE, 'Pendente'),
+        (STATUS_PROCESSANDO, 'Processando'),
+        (STATUS_CONCLUIDO, 'Concluído'),
+        (STATUS_ERRO, 'Erro'),
+    ]
+
+    job_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    name = models.CharField(max_length=255) # Nome da análise a ser criada
+    source_file = models.FileField(upload_to='fila_uploads/', blank=True) # Removido ao fim do job
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDENTE, db_index=True)
+    rows_processed = models.PositiveIntegerField(default=0)
+    error_message = models.TextField(blank=True, default='')
+    worker = models.CharField(max_length=255, blank=True, default='') # Trabalhador que reservou o job
+    uploaded_file = models.ForeignKey(UploadedFile, on_delete=models.SET_NULL, null=True, blank=True, related_name='jobs')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Job de Upload"
+        verbose_name_plural = "Jobs de Upload"
+        ordering = ['created_at']
+
+    def __str__(self):
+        return f"{self.name} - {self.status}"
+
+    @property
+    def tempo_espera(self):
+        """Segundos entre a criação do job e o início do processamento."""
+        if self.started_at is None:
+            return None
+        return (self.started_at - self.created_at).total_seconds()
+
+    @property
+    def tempo_processamento(self):
+        """Segundos de processamento (None enquanto o job não terminar)."""
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return (self.finished_at - self.started_at).total_seconds()
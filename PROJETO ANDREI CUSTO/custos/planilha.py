@@ -0,0 +1,524 @@
+"""
+Leitura de planilhas .xlsx linha a linha, com o openpyxl em modo read-only.
+
+É a alternativa em streaming a processar_arquivo_excel: em vez de carregar a
+planilha inteira em um DataFrame (e fazer várias cópias dele), as duas linhas
+de cabeçalho são lidas uma vez e as linhas de dados são limpas à medida que
+são lidas e entregues em lotes. A memória usada depende do tamanho do lote,
+e não do tamanho da planilha.
+
+As regras são as mesmas de processar_arquivo_excel: nomes de coluna
+'AREA - ID', linhas com 'TOTAL' na conta descartadas e valores convertidos
+por converter_valores, que os dois caminhos usam.
+
+Pastas com várias abas (uma por centro de custo) são lidas por ler_abas:
+cada aba é convertida, com as mesmas regras, em um pool de processos e
+entregue em lotes, como a de ler_planilha.
+"""
+import logging
+import math
+import multiprocessing
+import os
+import pickle
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import numpy as np
+from numpy.dtypes import StringDType
+from openpyxl import load_workbook
+
+logger = logging.getLogger(__name__)
+
+COLUNAS_FIXAS = ('ID', 'CONTA')
+
+# Extensões que o openpyxl consegue ler (o .xls antigo continua no pandas).
+EXTENSOES_STREAMING = ('.xlsx', '.xlsm')
+
+_CARACTERES_NAO_NUMERICOS = re.compile(r'[^\d,\.-]')
+
+# Prefixo de moeda e espaços removidos das pontas sem o regex ('R$ 1.234,56').
+_PREFIXO_MOEDA = 'R$ \xa0'
+
+
+def nomear_colunas(areas, ids):
+    """
+    Monta os nomes das colunas a partir das duas linhas de cabeçalho: a
+    linha de áreas (já preenchida para a direita) e a linha de IDs.
+    """
+    nomes = []
+    for i, (area, id_val) in enumerate(zip(areas, ids)):
+        area = str(area).strip() if not _vazio(area) else ''
+        id_val = str(id_val).strip() if not _vazio(id_val) else ''
+
+        if id_val in COLUNAS_FIXAS:
+            nomes.append(id_val)
+        elif area and id_val:
+            nomes.append(f"{area} - {id_val}")
+        elif area:
+            nomes.append(area)
+        elif id_val:
+            nomes.append(id_val)
+        else:
+            nomes.append(f'Coluna_Vazia_{i+1}')
+    return nomes
+
+
+def _vazio(valor):
+    return valor is None or (isinstance(valor, float) and math.isnan(valor))
+
+
+def _valor_celula(valor):
+    """
+    Converte o valor lido pelo openpyxl como o pandas faz: célula vazia vira
+    NaN e número inteiro gravado como float vira int (1.0 -> 1).
+    """
+    if valor is None or valor == '':
+        return math.nan
+    if isinstance(valor, float) and valor.is_integer():
+        return int(valor)
+    return valor
+
+
+# Tipos de célula usados diretamente como número, sem passar pelo texto.
+_TIPOS_NUMERICOS = frozenset((float, int, np.float64, np.int64))
+
+
+def textos_para_numeros(textos, colunas=None, ponto_decimal=None):
+    """
+    Converte textos de células em float64, todos de uma vez, com as funções
+    vetorizadas de np.strings. Ignora tudo que não for dígito, vírgula,
+    ponto ou sinal e decide o separador decimal pelo último que aparece: uma
+    vírgula depois de todos os pontos é decimal ('1.234,56', 'R$ 123,45'),
+    assim como um ponto depois de todas as vírgulas ('1,234.56', '123.45').
+    Um separador repetido é de milhar ('1.234.567'). O separador de milhar
+    só é aceito em grupos de três dígitos: '1,5,6' e '12.34,5' viram 0.
+
+    Um ponto único seguido de exatamente três dígitos, sem vírgula e com
+    parte inteira diferente de zero ('R$ 2.000', '3.141') é ambíguo: é de
+    milhar, a menos que algum texto da mesma coluna use o ponto como decimal
+    ('1.5', '0.125'). 'colunas' dá o índice da coluna de cada texto (por
+    padrão, todos são da mesma coluna) e 'ponto_decimal', se informado, é um
+    array bool por coluna que guarda essa decisão entre chamadas (atualizado
+    no lugar), para a leitura em lotes. O que não puder ser convertido vira 0.
+    """
+    textos = np.asarray(textos, dtype=StringDType())
+    textos = np.strings.rstrip(np.strings.lstrip(textos, _PREFIXO_MOEDA))
+    digitos = _remover(textos, ',.-')
+    # Só os textos com outros caracteres no meio passam pelo regex, um a um.
+    outros = ~_so_digitos(digitos)
+    if outros.any():
+        textos[outros] = [_CARACTERES_NAO_NUMERICOS.sub('', texto) for texto in textos[outros]]
+        digitos[outros] = _remover(textos[outros], ',.-')
+
+    tamanho = np.strings.str_len(textos)
+    virgula = np.strings.rfind(textos, ',')
+    ponto = np.strings.rfind(textos, '.')
+    virgulas = np.strings.count(textos, ',')
+    pontos = np.strings.count(textos, '.')
+    # O sinal só vale no início; a parte inteira começa depois dele.
+    negativo = np.strings.startswith(textos, '-')
+    inicio = negativo.astype(np.int64)
+    tem_digitos = np.strings.str_len(digitos) > 0
+
+    ultima_virgula = virgula > ponto
+    repeticoes = np.where(ultima_virgula, virgulas, pontos)
+    ponto_unico = ~ultima_virgula & (pontos == 1)
+    digitos_antes = ponto - inicio
+    ambiguo = (
+        ponto_unico & (virgulas == 0) & (tamanho - ponto == 4)
+        & (digitos_antes >= 1) & (digitos_antes <= 3) & ~np.strings.startswith(textos, '0', inicio)
+    )
+
+    if colunas is None:
+        colunas = np.zeros(textos.shape, dtype=np.int64)
+    if ponto_decimal is None:
+        ponto_decimal = np.zeros(int(colunas.max()) + 1 if colunas.size else 0, dtype=bool)
+    ponto_decimal[colunas[ponto_unico & ~ambiguo & tem_digitos]] = True
+    milhar_ponto = ambiguo & ~ponto_decimal[colunas]
+
+    tem_separador = (virgula >= 0) | (ponto >= 0)
+    decimal = np.where(
+        tem_separador & (repeticoes == 1) & ~milhar_ponto, np.where(ultima_virgula, virgula, ponto), -1,
+    )
+    # Sem decimal, o último separador é o de milhar e o outro não pode aparecer.
+    so_milhar = tem_separador & (decimal < 0)
+    milhar = np.where(ultima_virgula != (decimal >= 0), ',', '.').astype(StringDType())
+    fim_inteiro = np.where(decimal >= 0, decimal, tamanho)
+    grupos = np.strings.count(textos, milhar, 0, fim_inteiro)
+    primeiro_grupo = fim_inteiro - inicio - 4 * grupos
+    grupos_validos = (grupos == 0) | ((primeiro_grupo >= 1) & (primeiro_grupo <= 3))
+    for grupo in range(1, int(grupos.max(initial=0)) + 1):
+        checar = grupos_validos & (grupos >= grupo)
+        grupos_validos[checar] = np.strings.startswith(
+            textos[checar], milhar[checar], fim_inteiro[checar] - 4 * grupo,
+        )
+    decimais = np.where(decimal >= 0, tamanho - decimal - 1, 0)
+
+    validos = (
+        (np.strings.count(textos, '-') == negativo)
+        & tem_digitos
+        & grupos_validos
+        & ~(so_milhar & (np.where(ultima_virgula, pontos, virgulas) > 0))
+    )
+    numeros = np.zeros(textos.shape, dtype=np.float64)
+    # A divisão por 10**decimais é exata como o float() do texto com o ponto decimal.
+    numeros[validos] = digitos[validos].astype(np.float64) / 10.0 ** decimais[validos]
+    numeros[negativo] *= -1
+    # Sem -0.0 (de '-' ou '-0,00') nem infinitos.
+    numeros[~np.isfinite(numeros) | (numeros == 0)] = 0.0
+    return numeros
+
+
+def _remover(textos, caracteres):
+    for caractere in caracteres:
+        textos = np.strings.replace(textos, caractere, '')
+    return textos
+
+
+def _so_digitos(textos):
+    # isdecimal é falso para o texto vazio, que aqui conta como só dígitos.
+    return np.strings.isdecimal(textos) | (np.strings.str_len(textos) == 0)
+
+
+def converter_valores(celulas, ponto_decimal=None):
+    """
+    Converte um bloco de células de dados (array-like 2D, como o que vem do
+    pandas ou do openpyxl) em um array float64 de mesmo formato, de uma vez.
+    Números são usados diretamente e os textos passam, em um único bloco, por
+    textos_para_numeros, que decide o ponto ambíguo coluna a coluna
+    ('ponto_decimal' é repassado para ele); vazios e qualquer outro tipo de
+    célula viram 0.
+    """
+    celulas = np.asarray(celulas)
+    if celulas.dtype.kind in 'iuf':
+        valores = celulas.astype(np.float64)
+    else:
+        largura = celulas.shape[-1] if celulas.ndim > 1 else 1
+        plano = celulas.astype(object).ravel()
+        tipos = list(map(type, plano))
+        numeros = np.fromiter(map(_TIPOS_NUMERICOS.__contains__, tipos), dtype=bool, count=plano.size)
+        textos = np.fromiter((tipo is str for tipo in tipos), dtype=bool, count=plano.size)
+
+        valores = np.zeros(plano.size, dtype=np.float64)
+        valores[numeros] = plano[numeros].astype(np.float64)
+        if textos.any():
+            colunas = np.flatnonzero(textos) % largura
+            if ponto_decimal is None:
+                ponto_decimal = np.zeros(largura, dtype=bool)
+            valores[textos] = textos_para_numeros(plano[textos], colunas, ponto_decimal)
+        valores = valores.reshape(celulas.shape)
+    valores[~np.isfinite(valores)] = 0.0
+    return valores
+
+
+def converter_dataframe(df):
+    """
+    Converte as colunas de dados de um DataFrame lido pelo pandas em um array
+    float64 (linhas x colunas). As colunas já numéricas são copiadas direto;
+    as demais são empilhadas em um único bloco para converter_valores.
+    """
+    valores = np.zeros(df.shape, dtype=np.float64)
+    numericas = [j for j, dtype in enumerate(df.dtypes) if dtype.kind in 'iuf']
+    demais = [j for j, dtype in enumerate(df.dtypes) if dtype.kind not in 'iuf']
+    if numericas:
+        valores[:, numericas] = converter_valores(df.iloc[:, numericas].to_numpy(dtype=np.float64))
+    if demais:
+        valores[:, demais] = converter_valores(df.iloc[:, demais].to_numpy(dtype=object))
+    return valores
+
+
+def limpar_valor(valor):
+    """
+    Converte uma única célula de dados em float, com as mesmas regras de
+    converter_valores.
+    """
+    if type(valor) in _TIPOS_NUMERICOS:
+        valor = float(valor)
+        return valor if math.isfinite(valor) else 0.0
+    if isinstance(valor, str):
+        return float(textos_para_numeros([valor])[0])
+    return 0.0
+
+
+def _linha_vazia(linha):
+    return all(valor is None or valor == '' for valor in linha)
+
+
+def _ajustar_largura(linha, largura):
+    linha = tuple(linha[:largura])
+    if len(linha) < largura:
+        linha += (None,) * (largura - len(linha))
+    return linha
+
+
+def _largura_preenchida(linha):
+    largura = len(linha)
+    while largura and (linha[largura - 1] is None or linha[largura - 1] == ''):
+        largura -= 1
+    return largura
+
+
+def _linhas_sem_vazias_finais(linhas):
+    """
+    Repassa as linhas da planilha, descartando as linhas vazias do final
+    (como o pandas). As vazias do meio são mantidas.
+    """
+    vazias = []
+    for linha in linhas:
+        if _linha_vazia(linha):
+            vazias.append(linha)
+            continue
+        yield from vazias
+        vazias = []
+        yield linha
+
+
+def listar_abas(arquivo):
+    """
+    Nomes das abas de planilha do arquivo (.xlsx/.xlsm), na ordem da pasta.
+    Um arquivo aberto volta para o início ao final.
+    """
+    try:
+        workbook = load_workbook(arquivo, read_only=True, keep_links=False)
+    except Exception as e:
+        raise ValueError(f"Não foi possível ler o arquivo. Certifique-se de que é um arquivo Excel válido (.xlsx ou .xls). Erro: {e}")
+    try:
+        return [worksheet.title for worksheet in workbook.worksheets]
+    finally:
+        workbook.close()
+        if hasattr(arquivo, 'seek'):
+            arquivo.seek(0)
+
+
+def ler_planilha(arquivo, aba=0):
+    """
+    Abre uma aba do arquivo (a primeira, ou a de índice ou nome 'aba') e lê
+    as duas linhas de cabeçalho.
+
+    Retorna um dicionário com 'colunas_dados' e 'lotes', uma função
+    lotes(tamanho) que gera tuplas (ids, contas, valores), em que 'valores'
+    é um array float64 de tamanho x len(colunas_dados). As linhas de TOTAL
+    já vêm descartadas. Levanta ValueError nos mesmos casos de
+    processar_arquivo_excel.
+
+    A largura da planilha é a das linhas de cabeçalho; células de dados além
+    dela são ignoradas (e registradas no log). O ponto ambíguo ('3.141', ver
+    textos_para_numeros) é decidido com as linhas lidas até o lote: os lotes
+    já entregues antes de a coluna mostrar um ponto decimal o leram como
+    separador de milhar.
+    """
+    try:
+        workbook = load_workbook(arquivo, read_only=True, data_only=True, keep_links=False)
+    except Exception as e:
+        raise ValueError(f"Não foi possível ler o arquivo. Certifique-se de que é um arquivo Excel válido (.xlsx ou .xls). Erro: {e}")
+
+    try:
+        worksheet = workbook.worksheets[aba] if isinstance(aba, int) else workbook[aba]
+        linhas = _linhas_sem_vazias_finais(worksheet.iter_rows(values_only=True))
+        cabecalho = list(islice(linhas, 2))
+        primeira_linha = next(linhas, None)
+        if len(cabecalho) < 2 or primeira_linha is None:
+            raise ValueError("O arquivo precisa ter pelo menos 3 linhas (2 para cabeçalhos e 1 para dados).")
+
+        largura = max(_largura_preenchida(linha) for linha in cabecalho)
+        areas, ids = ([_valor_celula(valor) for valor in _ajustar_largura(linha, largura)] for linha in cabecalho)
+        # Mesmo efeito do ffill na linha de áreas.
+        areas_preenchidas = []
+        anterior = math.nan
+        for area in areas:
+            if not _vazio(area):
+                anterior = area
+            areas_preenchidas.append(anterior)
+        colunas = nomear_colunas(areas_preenchidas, ids)
+    except Exception:
+        workbook.close()
+        raise
+
+    if not all(col in colunas for col in COLUNAS_FIXAS):
+        workbook.close()
+        raise ValueError(
+            f"O arquivo deve conter as colunas: {', '.join(COLUNAS_FIXAS)}. "
+            "Verifique se elas estão na segunda linha do cabeçalho e formatadas corretamente."
+        )
+
+    posicao_id = colunas.index('ID')
+    posicao_conta = colunas.index('CONTA')
+    posicoes_dados = [i for i, col in enumerate(colunas) if col not in COLUNAS_FIXAS]
+
+    def lotes(tamanho):
+        ignoradas = 0
+        ids, contas, valores = [], [], []
+        # Colunas que já usaram o ponto como decimal, mantidas de um lote para o outro.
+        ponto_decimal = np.zeros(len(posicoes_dados), dtype=bool)
+        try:
+            for linha in _encadear(primeira_linha, linhas):
+                if len(linha) > largura and _largura_preenchida(linha) > largura:
+                    ignoradas += 1
+                linha = _ajustar_largura(linha, largura)
+
+                conta = _valor_celula(linha[posicao_conta])
+                if 'total' in str(conta).lower():
+                    continue
+                ids.append(_valor_celula(linha[posicao_id]))
+                contas.append(conta)
+                valores.append([linha[i] for i in posicoes_dados])
+
+                if len(ids) >= tamanho:
+                    yield ids, contas, _matriz_do_lote(valores, ponto_decimal)
+                    ids, contas, valores = [], [], []
+            if ids:
+                yield ids, contas, _matriz_do_lote(valores, ponto_decimal)
+        finally:
+            workbook.close()
+            if ignoradas:
+                logger.warning(f"{ignoradas} linhas têm células além das colunas do cabeçalho; esses valores foram ignorados.")
+
+    return {
+        'colunas_dados': [colunas[i] for i in posicoes_dados],
+        'lotes': lotes,
+    }
+
+
+def _encadear(primeira_linha, linhas):
+    yield primeira_linha
+    yield from linhas
+
+
+def _matriz_do_lote(valores, ponto_decimal):
+    celulas = np.empty((len(valores), len(ponto_decimal)), dtype=object)
+    celulas[:] = valores
+    return converter_valores(celulas, ponto_decimal)
+
+
+def ler_aba(caminho, aba, tamanho_lote=2000):
+    """
+    Lê uma aba inteira do arquivo em 'caminho' e retorna a matriz no formato
+    de carregar_matriz ('ids', 'contas', 'colunas', 'valores', 'totais'),
+    mais o nome da aba. Levanta ValueError se a aba não tiver o formato
+    esperado. Executada nos processos de ler_abas.
+    """
+    planilha = ler_planilha(caminho, aba)
+    colunas = planilha['colunas_dados']
+    ids, contas, blocos = [], [], []
+    for ids_lote, contas_lote, valores in planilha['lotes'](tamanho_lote):
+        ids.extend(ids_lote)
+        contas.extend(contas_lote)
+        blocos.append(valores)
+    valores = np.vstack(blocos) if blocos else np.zeros((0, len(colunas)), dtype=np.float64)
+    return {
+        'aba': aba,
+        'ids': ids,
+        'contas': contas,
+        'colunas': colunas,
+        'valores': valores,
+        'totais': valores.sum(axis=1),
+    }
+
+
+def ler_aba_ou_erro(caminho, aba):
+    # O erro de uma aba (ex.: uma aba de resumo sem ID e CONTA) não interrompe as demais.
+    try:
+        return ler_aba(caminho, aba)
+    except ValueError as e:
+        return {'aba': aba, 'erro': str(e)}
+
+
+def converter_aba(caminho, aba, tamanho_lote=2000):
+    """
+    Lê uma aba do arquivo em 'caminho' em lotes e grava cada lote convertido
+    (ids, contas, valores) em um arquivo temporário, com o pickle. Retorna
+    {'aba', 'colunas_dados', 'arquivo_lotes', 'linhas'} ou, se a aba não
+    tiver o formato esperado, {'aba', 'erro'}. Executada nos processos de
+    ler_abas: a memória do processo depende do tamanho do lote.
+    """
+    try:
+        planilha = ler_planilha(caminho, aba)
+    except ValueError as e:
+        return {'aba': aba, 'erro': str(e)}
+
+    descritor, arquivo_lotes = tempfile.mkstemp(prefix='custos-aba-', suffix='.lotes')
+    linhas = 0
+    try:
+        with os.fdopen(descritor, 'wb') as destino:
+            for lote in planilha['lotes'](tamanho_lote):
+                pickle.dump(lote, destino, protocol=pickle.HIGHEST_PROTOCOL)
+                linhas += len(lote[0])
+    except BaseException:
+        os.remove(arquivo_lotes)
+        raise
+    return {'aba': aba, 'colunas_dados': planilha['colunas_dados'], 'arquivo_lotes': arquivo_lotes, 'linhas': linhas}
+
+
+def ler_lotes_gravados(arquivo_lotes):
+    """
+    Gera os lotes gravados por converter_aba, um de cada vez, e remove o
+    arquivo ao final.
+    """
+    try:
+        with open(arquivo_lotes, 'rb') as origem:
+            while True:
+                try:
+                    yield pickle.load(origem)
+                except EOFError:
+                    return
+    finally:
+        _remover_arquivo(arquivo_lotes)
+
+
+def _remover_arquivo(caminho):
+    try:
+        os.remove(caminho)
+    except FileNotFoundError:
+        pass
+
+
+def ler_abas(caminho, abas, processos=None, tamanho_lote=2000):
+    """
+    Lê as abas do arquivo em 'caminho' e gera, na ordem de 'abas',
+    {'aba', 'colunas_dados', 'lotes'} para cada aba, em que 'lotes' gera as
+    tuplas (ids, contas, valores) de ler_planilha, ou {'aba', 'erro'} para
+    as abas que não têm o formato esperado. Os lotes de uma aba devem ser
+    consumidos antes de pedir a próxima.
+
+    As abas são convertidas em um pool de até 'processos' processos (padrão:
+    um por CPU), com converter_aba, enquanto as anteriores são consumidas.
+    Com um processo (ou uma aba) cada aba é lida no próprio processo, direto
+    do arquivo, sem o custo de iniciar o pool.
+    """
+    processos = min(processos or os.cpu_count() or 1, len(abas))
+    if processos <= 1:
+        for aba in abas:
+            try:
+                planilha = ler_planilha(caminho, aba)
+            except ValueError as e:
+                yield {'aba': aba, 'erro': str(e)}
+                continue
+            yield {'aba': aba, 'colunas_dados': planilha['colunas_dados'], 'lotes': planilha['lotes'](tamanho_lote)}
+        return
+
+    with ProcessPoolExecutor(max_workers=processos, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futuros = [pool.submit(converter_aba, caminho, aba, tamanho_lote) for aba in abas]
+        try:
+            for futuro in futuros:
+                resultado = futuro.result()
+                if 'erro' in resultado:
+                    yield resultado
+                    continue
+                yield {
+                    'aba': resultado['aba'],
+                    'colunas_dados': resultado['colunas_dados'],
+                    'lotes': ler_lotes_gravados(resultado['arquivo_lotes']),
+                }
+        finally:
+            # Remove os lotes das abas não consumidas (ex.: a gravação falhou no meio).
+            for futuro in futuros:
+                if futuro.cancel():
+                    continue
+                try:
+                    resultado = futuro.result()
+                except Exception:
+                    continue
+                if 'arquivo_lotes' in resultado:
+                    _remover_arquivo(resultado['arquivo_lotes'])
@@ -0,0 +1,139 @@
+"""
+Pool de processos para o trabalho pesado das views assíncronas.
+
+As views assíncronas (CUSTOS_VIEWS_ASSINCRONAS) fazem as consultas com o ORM
+assíncrono e mandam o que usa a CPU por bastante tempo (pandas, geração do
+.xlsx) para um pool com CUSTOS_PROCESSOS_TRABALHADORES processos. Assim uma
+análise grande não segura o loop de eventos nem o GIL do servidor, e as
+outras requisições continuam sendo atendidas.
+
+O pool é limitado: além dos processos, no máximo CUSTOS_PROCESSOS_FILA_MAXIMA
+tarefas podem estar em andamento ou aguardando; acima disso executar_em_processo levanta
+PoolOcupado e a view responde 503. Os processos são criados com 'spawn' e
+configurados com o Django e com os mesmos bancos do servidor (inclusive o
+banco de teste, nos benchmarks); cada tarefa abre e fecha a sua conexão.
+
+Com CUSTOS_PROCESSOS_TRABALHADORES = 0, ou com um banco SQLite em memória
+(que outro processo não enxerga), as tarefas rodam em uma thread.
+"""
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+from .instrumentacao import medir
+
+_trava = threading.Lock()
+_pool = None
+_pendentes = 0
+
+
+class PoolOcupado(Exception):
+    """Há tarefas demais em andamento ou aguardando o pool de processos."""
+
+
+def _trabalhadores():
+    return max(0, int(getattr(settings, 'CUSTOS_PROCESSOS_TRABALHADORES', 2)))
+
+
+def _fila_maxima():
+    return getattr(settings, 'CUSTOS_PROCESSOS_FILA_MAXIMA', None) or max(1, _trabalhadores()) * 4
+
+
+def _bancos():
+    """
+    Nome de cada banco como está na conexão do servidor neste momento.
+    """
+    return {alias: str(connections[alias].settings_dict['NAME']) for alias in connections}
+
+
+def _usar_processos():
+    if not _trabalhadores():
+        return False
+    return not any(
+        connections[alias].vendor == 'sqlite' and connections[alias].is_in_memory_db()
+        for alias in connections
+    )
+
+
+def _iniciar_processo(bancos):
+    """
+    Inicializador de cada processo do pool: configura o Django e aponta as
+    conexões para os mesmos bancos do servidor.
+    """
+    import django
+    django.setup()
+    for alias, nome in bancos.items():
+        settings.DATABASES[alias]['NAME'] = nome
+        connections[alias].settings_dict['NAME'] = nome
+
+
+def _executar_no_processo(funcao, *args):
+    close_old_connections()
+    try:
+        return funcao(*args)
+    finally:
+        close_old_connections()
+
+
+def obter_pool():
+    """
+    Pool de processos do servidor, criado no primeiro uso.
+    """
+    global _pool
+    with _trava:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=_trabalhadores(),
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_iniciar_processo,
+                initargs=(_bancos(),),
+            )
+        return _pool
+
+
+def encerrar_pool():
+    """
+    Encerra o pool (se existir) e espera os processos terminarem.
+    """
+    global _pool
+    with _trava:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+async def executar_em_processo(funcao, *args):
+    """
+    Executa funcao(*args) no pool de processos e retorna o resultado. A
+    função e os argumentos precisam poder ser serializados com pickle (uma
+    função de módulo; instâncias de modelo servem). O tempo de espera mais o
+    de execução aparece como o trecho 'processo.<função>'.
+    """
+    global _pendentes
+    with _trava:
+        if _pendentes >= _fila_maxima():
+            raise PoolOcupado(f"O servidor está ocupado ({_pendentes} tarefas em andamento). Tente novamente.")
+        _pendentes += 1
+
+    try:
+        with medir(f'processo.{funcao.__name__}'):
+            if not _usar_processos():
+                return await sync_to_async(funcao, thread_sensitive=False)(*args)
+            try:
+                return await asyncio.get_running_loop().run_in_executor(
+                    obter_pool(), partial(_executar_no_processo, funcao, *args),
+                )
+            except BrokenProcessPool:
+                # Um processo morreu (ex.: falta de memória); o próximo uso cria um pool novo.
+                encerrar_pool()
+                raise
+    finally:
+        with _trava:
+            _pendentes -= 1
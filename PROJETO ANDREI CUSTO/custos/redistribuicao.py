@@ -0,0 +1,133 @@
+"""
+Redistribuição de totais entre as colunas de uma ou mais linhas.
+
+Dado o novo total de cada linha, calcula os novos valores das colunas com
+uma das estratégias:
+
+- 'proporcional': mantém a proporção dos valores atuais da linha;
+- 'igual': divide o total igualmente entre as colunas;
+- 'pesos': usa um peso por coluna (ver pesos_por_area para montá-los a
+  partir de pesos por área).
+
+Linhas em que a estratégia não define proporções (ex.: 'proporcional' com
+soma atual <= 0) recebem a divisão igual. Tudo é feito com NumPy sobre a
+matriz das linhas, então o mesmo código atende uma linha, um conjunto de
+linhas ou o arquivo inteiro.
+
+Por padrão os valores são arredondados em centavos pelo método dos
+maiores restos: cada coluna recebe o piso da sua parte e os centavos que
+sobram vão para as colunas com as maiores frações, de modo que a soma da
+linha é exatamente o novo total.
+"""
+import numpy as np
+
+from .agregados import area_da_coluna
+
+ESTRATEGIA_PROPORCIONAL = 'proporcional'
+ESTRATEGIA_IGUAL = 'igual'
+ESTRATEGIA_PESOS = 'pesos'
+ESTRATEGIAS = (ESTRATEGIA_PROPORCIONAL, ESTRATEGIA_IGUAL, ESTRATEGIA_PESOS)
+
+# Casas decimais do arredondamento (centavos).
+CASAS_DECIMAIS = 2
+
+
+def pesos_por_area(colunas, pesos_areas):
+    """
+    Peso de cada coluna a partir de {área: peso}: o peso da área é dividido
+    igualmente entre as suas colunas. Áreas ausentes têm peso 0.
+    """
+    areas = [area_da_coluna(coluna) for coluna in colunas]
+    quantidade = {}
+    for area in areas:
+        quantidade[area] = quantidade.get(area, 0) + 1
+    return np.array([float(pesos_areas.get(area, 0)) / quantidade[area] for area in areas], dtype=float)
+
+
+def proporcoes(valores, estrategia=ESTRATEGIA_PROPORCIONAL, numericas=None, pesos=None):
+    """
+    Parte de cada coluna no total de cada linha (linhas x colunas). Cada
+    linha com ao menos uma coluna numérica soma 1; as demais ficam zeradas.
+    'pesos' (usado com 'pesos') tem um peso por coluna, ou um por célula.
+    """
+    valores = np.asarray(valores, dtype=float)
+    if numericas is None:
+        numericas = np.ones(valores.shape, dtype=bool)
+
+    if estrategia == ESTRATEGIA_PROPORCIONAL:
+        base = np.where(numericas, valores, 0.0)
+    elif estrategia == ESTRATEGIA_IGUAL:
+        base = numericas.astype(float)
+    elif estrategia == ESTRATEGIA_PESOS:
+        if pesos is None:
+            raise ValueError("A estratégia 'pesos' precisa dos pesos das colunas.")
+        base = np.where(numericas, np.broadcast_to(np.asarray(pesos, dtype=float), valores.shape), 0.0)
+    else:
+        raise ValueError(f"Estratégia de redistribuição inválida: '{estrategia}'. Use {', '.join(ESTRATEGIAS)}.")
+
+    somas = base.sum(axis=1)
+    sem_base = ~(somas > 0)
+    if sem_base.any():
+        base = base.copy()
+        base[sem_base] = numericas[sem_base]
+        somas = base.sum(axis=1)
+
+    return np.divide(base, somas[:, None], out=np.zeros_like(base), where=somas[:, None] > 0)
+
+
+def ratear(proporcoes_linhas, totais, numericas=None, casas=CASAS_DECIMAIS):
+    """
+    Divide o total de cada linha conforme as proporções, com arredondamento
+    em 'casas' decimais pelo método dos maiores restos. Empates vão para as
+    primeiras colunas. Com casas=None não há arredondamento.
+    """
+    totais = np.asarray(totais, dtype=float)
+    if casas is None:
+        return proporcoes_linhas * totais[:, None]
+
+    if numericas is None:
+        numericas = np.ones(proporcoes_linhas.shape, dtype=bool)
+    escala = 10 ** casas
+    unidades = np.round(totais * escala)
+
+    brutos = proporcoes_linhas * unidades[:, None]
+    base = np.floor(brutos)
+    # Só as colunas numéricas podem receber as unidades que sobram.
+    restos = np.where(numericas, brutos - base, -np.inf)
+    faltam = np.clip(np.round(unidades - base.sum(axis=1)), 0, numericas.sum(axis=1))
+
+    # Cada linha recebe uma unidade nas 'faltam' colunas de maior resto. Em vez
+    # de ordenar os índices (argsort), acha o menor resto contemplado em cada
+    # linha; entre restos iguais a ele, ganham as primeiras colunas.
+    if proporcoes_linhas.shape[1]:
+        decrescentes = -np.sort(-restos, axis=1)
+        contempladas = faltam > 0
+        limiar = np.full(len(restos), np.inf)
+        limiar[contempladas] = decrescentes[contempladas, faltam[contempladas].astype(np.intp) - 1]
+        acima = restos > limiar[:, None]
+        empatados = restos == limiar[:, None]
+        vagas = faltam - acima.sum(axis=1)
+        base += acima | (empatados & (np.cumsum(empatados, axis=1) <= vagas[:, None]))
+    return base / escala
+
+
+def redistribuir(valores, totais_novos, estrategia=ESTRATEGIA_PROPORCIONAL, numericas=None, pesos=None,
+                 casas=CASAS_DECIMAIS):
+    """
+    Novos valores das colunas para que cada linha some o seu novo total.
+    'valores' é uma linha (vetor) ou uma matriz (linhas x colunas) e
+    'totais_novos' um número ou um vetor com um total por linha. Células
+    fora de 'numericas' mantêm o valor atual. Retorna um novo array com o
+    formato de 'valores'.
+    """
+    valores = np.asarray(valores, dtype=float)
+    uma_linha = valores.ndim == 1
+    matriz = np.atleast_2d(valores)
+    totais = np.broadcast_to(np.asarray(totais_novos, dtype=float), (matriz.shape[0],))
+    if numericas is None:
+        numericas = np.ones(matriz.shape, dtype=bool)
+    numericas = np.atleast_2d(numericas)
+
+    novos = ratear(proporcoes(matriz, estrategia, numericas, pesos), totais, numericas, casas)
+    novos = np.where(numericas, novos, matriz)
+    return novos[0] if uma_linha else novos
@@ -1,3 +1,1422 @@
-from django.test import TestCase
+import gzip
+import json
+import math
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import openpyxl
+import pandas as pd
+from asgiref.sync import sync_to_async
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db.models import Count
+from django.test import AsyncRequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from benchmarks.dados import gerar_planilha_sintetica
+
+from . import artefatos, compressao, fila, views
+from .agregados import aplicar_deltas_linhas, calcular_agregados, obter_agregados
+from .armazenamento import ARMAZENAMENTO_COLUNAR, ARMAZENAMENTO_JSON, carregar_matriz, ler_janela
+from .cache_analise import VARIANTE_DADOS, _cache, estatisticas_cache, invalidar_contexto, obter_contexto_analise
+from .condicional import etag_do_arquivo
+from .duplicados import analises_do_upload, buscar_duplicado, calcular_hash, clonar_arquivo
+from .edicao import aplicar_edicoes, redistribuir_arquivo
+from .exportacao import agerar_csv, gerar_csv, iterar_linhas
+from .ingestao import ingerir_abas, ingerir_planilha_streaming, ingerir_resultado
+from .models import (
+    AccountTotal, AreaTotal, ColumnTotal, ExpenseData, ExpenseMatrix, FileAggregates, UploadJob, UploadedFile,
+)
+from .planilha import converter_valores, ler_planilha, limpar_valor
+from .processos import PoolOcupado
+from .redistribuicao import (
+    ESTRATEGIA_IGUAL, ESTRATEGIA_PESOS, pesos_por_area, proporcoes, ratear, redistribuir,
+)
+from .views import (
+    _linha_tabela_html, formatar_botao_total_html, formatar_celula_html, preparar_patch_linhas,
+    preparar_tabela_principal_html, processar_arquivo_excel,
+)
+
+COLUNAS_TESTE = ['ADM - 1', 'ADM - 2', 'TI - 1']
+
+
+def resultado_teste():
+    """
+    Resultado no formato de processar_arquivo_excel, com três linhas e duas áreas.
+    """
+    linhas = [('1', 'A', [10.0, 20.0, 30.0]), ('2', 'B', [5.0, 0.0, 5.0]), ('3', 'A', [1.0, 1.0, 1.0])]
+    return {
+        'colunas_dados': COLUNAS_TESTE,
+        'tabela_principal': [
+            {'ID': id_excel, 'CONTA': conta, 'TOTAL (LINHA)': sum(valores)} for id_excel, conta, valores in linhas
+        ],
+        'df_despesas_only': [
+            {**dict(zip(COLUNAS_TESTE, valores)), 'TOTAL (LINHA)': sum(valores)} for _, _, valores in linhas
+        ],
+    }
+
+
+def ingerir_teste(armazenamento=ARMAZENAMENTO_JSON, nome='Teste'):
+    with override_settings(CUSTOS_ARMAZENAMENTO=armazenamento):
+        return ingerir_resultado(nome, resultado_teste())
+
+
+def conteudo_planilha(linhas, **opcoes):
+    """
+    Bytes de um .xlsx sintético (gerar_planilha_sintetica) com 'linhas' linhas de dados.
+    """
+    pasta = tempfile.mkdtemp()
+    caminho = gerar_planilha_sintetica(os.path.join(pasta, 'custos.xlsx'), linhas, **opcoes)
+    try:
+        with open(caminho, 'rb') as arquivo:
+            return arquivo.read()
+    finally:
+        os.remove(caminho)
+        os.rmdir(pasta)
+
+
+class ConverterValoresTests(TestCase):
+    def test_separador_decimal_pelo_ultimo(self):
+        casos = {
+            'R$ 1.234,56': 1234.56,
+            'R$ 123,45': 123.45,
+            ' 123,45 ': 123.45,
+            '1,234.56': 1234.56,
+            '123.45': 123.45,
+            '0,5': 0.5,
+            '- R$ 1.234,56': -1234.56,
+            'R$ -0,50': -0.5,
+        }
+        for texto, esperado in casos.items():
+            with self.subTest(texto=texto):
+                self.assertEqual(limpar_valor(texto), esperado)
+
+    def test_separador_de_milhar(self):
+        casos = {
+            'R$ 2.000': 2000.0,
+            '1.500': 1500.0,
+            'R$ 1.234': 1234.0,
+            '-1.500': -1500.0,
+            '1.234.567': 1234567.0,
+            '1,234,567': 1234567.0,
+            '1.234.567,89': 1234567.89,
+            'R$\xa01.000,00': 1000.0,
+        }
+        for texto, esperado in casos.items():
+            with self.subTest(texto=texto):
+                self.assertEqual(limpar_valor(texto), esperado)
+
+    def test_separador_de_milhar_fora_dos_grupos_de_tres(self):
+        for texto in ('1,5,6', '12.34,5', '1.234.5678', '1.2345.678'):
+            with self.subTest(texto=texto):
+                self.assertEqual(limpar_valor(texto), 0.0)
+
+    def test_ponto_sem_tres_digitos_e_decimal(self):
+        casos = {'1.5': 1.5, '1.50': 1.5, '12345.678': 12345.678, '1.2345': 1.2345}
+        for texto, esperado in casos.items():
+            with self.subTest(texto=texto):
+                self.assertEqual(limpar_valor(texto), esperado)
+
+    def test_parte_inteira_zero_e_decimal(self):
+        casos = {'0.125': 0.125, '-0.125': -0.125, 'R$ 0.500': 0.5}
+        for texto, esperado in casos.items():
+            with self.subTest(texto=texto):
+                self.assertEqual(limpar_valor(texto), esperado)
+
+    def test_ponto_ambiguo_decidido_pela_coluna(self):
+        celulas = np.array([
+            ['3.141', '3.141'],
+            ['1.5', '2.000'],
+        ], dtype=object)
+        np.testing.assert_array_equal(converter_valores(celulas), [[3.141, 3141.0], [1.5, 2000.0]])
+
+    def test_ponto_decimal_vale_para_os_lotes_seguintes(self):
+        ponto_decimal = np.zeros(1, dtype=bool)
+        converter_valores(np.array([['1.5']], dtype=object), ponto_decimal)
+        valores = converter_valores(np.array([['3.141']], dtype=object), ponto_decimal)
+        np.testing.assert_array_equal(valores, [[3.141]])
+
+    def test_textos_invalidos_viram_zero(self):
+        for texto in ('', ' ', '-', 'abc', '.', '1-2', '--5', '1,2.3.4'):
+            with self.subTest(texto=texto):
+                self.assertEqual(limpar_valor(texto), 0.0)
+
+    def test_sem_zero_negativo(self):
+        for texto in ('-', '-0', '-0,00', 'R$ -0.000'):
+            with self.subTest(texto=texto):
+                self.assertEqual(math.copysign(1.0, limpar_valor(texto)), 1.0)
+
+    def test_bloco_misto(self):
+        celulas = np.array([
+            [1.5, 'R$ 2.000', None],
+            ['1.234,56', 7, 'x'],
+        ], dtype=object)
+        valores = converter_valores(celulas)
+        self.assertEqual(valores.dtype, np.float64)
+        np.testing.assert_array_equal(valores, [[1.5, 2000.0, 0.0], [1234.56, 7.0, 0.0]])
+
+    def test_bloco_numerico_sem_finitos(self):
+        valores = converter_valores(np.array([[1.0, np.inf], [np.nan, -2.0]]))
+        np.testing.assert_array_equal(valores, [[1.0, 0.0], [0.0, -2.0]])
+
+
+class ProcessarArquivoExcelTests(TestCase):
+    def test_mesmo_resultado_da_leitura_em_streaming(self):
+        pasta = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, pasta)
+        caminho = gerar_planilha_sintetica(os.path.join(pasta, 'planilha.xlsx'), 30, areas=2, total_a_cada=10)
+        self.addCleanup(os.remove, caminho)
+
+        resultado = processar_arquivo_excel(caminho)
+        planilha = ler_planilha(caminho)
+        ids, _, valores = next(planilha['lotes'](100))
+        self.assertEqual(resultado['colunas_dados'], planilha['colunas_dados'])
+        self.assertEqual([str(linha['ID']) for linha in resultado['tabela_principal']], [str(i) for i in ids])
+        np.testing.assert_allclose([linha['TOTAL (LINHA)'] for linha in resultado['tabela_principal']], valores.sum(axis=1))
+
+    def test_streaming_colunar_sem_montar_a_matriz(self):
+        pasta = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, pasta)
+        caminho = gerar_planilha_sintetica(os.path.join(pasta, 'planilha.xlsx'), 30, areas=2, total_a_cada=10)
+        self.addCleanup(os.remove, caminho)
+
+        json_ = ingerir_planilha_streaming('JSON', caminho, tamanho_lote=7)
+        with override_settings(CUSTOS_ARMAZENAMENTO=ARMAZENAMENTO_COLUNAR), \
+                mock.patch('custos.ingestao.salvar_matriz') as salvar_matriz:
+            colunar = ingerir_planilha_streaming('Colunar', caminho, tamanho_lote=7)
+        salvar_matriz.assert_not_called()
+
+        esperado, obtido = carregar_matriz(json_), carregar_matriz(colunar)
+        self.assertTrue(ExpenseMatrix.objects.filter(file=colunar).exists())
+        self.assertEqual(list(obtido['ids']), list(esperado['ids']))
+        self.assertEqual(list(obtido['contas']), list(esperado['contas']))
+        np.testing.assert_array_equal(obtido['valores'], esperado['valores'])
+        np.testing.assert_array_equal(obtido['totais'], esperado['totais'])
+
+
+@override_settings(CUSTOS_INGESTAO_STREAMING=False, CUSTOS_INGESTAO_TAMANHO_LOTE=10)
+class UploadEmLotesTests(TestCase):
+    def test_linhas_gravadas_em_lotes(self):
+        arquivo = SimpleUploadedFile('custos.xlsx', conteudo_planilha(25, areas=2, colunas_por_area=2, total_a_cada=10))
+        with mock.patch.object(ExpenseData.objects, 'bulk_create', wraps=ExpenseData.objects.bulk_create) as bulk_create:
+            response = self.client.post(reverse('upload_file'), {'name': 'Custos', 'arquivo_excel': arquivo})
+
+        uploaded_file = UploadedFile.objects.get()
+        self.assertRedirects(
+            response, reverse('analyze_data', kwargs={'file_id': uploaded_file.file_id}), fetch_redirect_response=False,
+        )
+        self.assertEqual([len(chamada.args[0]) for chamada in bulk_create.call_args_list], [10, 10, 5])
+        self.assertEqual(
+            list(uploaded_file.expenses.order_by('position').values_list('id_excel', flat=True)),
+            [str(i) for i in range(1, 26)],
+        )
+
+    def test_falha_em_um_lote_desfaz_o_upload(self):
+        def progresso(gravadas, total):
+            if gravadas > 1:
+                raise RuntimeError('falha no segundo lote')
+
+        with self.assertRaises(RuntimeError):
+            ingerir_resultado('Teste', resultado_teste(), tamanho_lote=1, progresso=progresso)
+        self.assertFalse(UploadedFile.objects.exists())
+        self.assertFalse(ExpenseData.objects.exists())
+
+
+@override_settings(CUSTOS_INGESTAO_TAMANHO_LOTE=7)
+class UploadStreamingTests(TestCase):
+    def test_upload_em_streaming_igual_ao_pandas(self):
+        conteudo = conteudo_planilha(25, areas=2, colunas_por_area=2, total_a_cada=10)
+        esperado = carregar_matriz(ingerir_resultado('Pandas', processar_arquivo_excel(ContentFile(conteudo, 'custos.xlsx'))))
+
+        for armazenamento in (ARMAZENAMENTO_JSON, ARMAZENAMENTO_COLUNAR):
+            with self.subTest(armazenamento=armazenamento), \
+                    override_settings(CUSTOS_ARMAZENAMENTO=armazenamento), \
+                    mock.patch('custos.views.processar_arquivo_excel', side_effect=AssertionError):
+                response = self.client.post(reverse('upload_file'), {
+                    'name': armazenamento, 'reprocessar': 'on',
+                    'arquivo_excel': SimpleUploadedFile('custos.xlsx', conteudo),
+                })
+                uploaded_file = UploadedFile.objects.get(name=armazenamento)
+                self.assertRedirects(
+                    response, reverse('analyze_data', kwargs={'file_id': uploaded_file.file_id}),
+                    fetch_redirect_response=False,
+                )
+
+                obtido = carregar_matriz(uploaded_file)
+                self.assertEqual(list(obtido['ids']), [str(i) for i in range(1, 26)])
+                self.assertEqual(list(obtido['ids']), list(esperado['ids']))
+                self.assertEqual(list(obtido['contas']), list(esperado['contas']))
+                np.testing.assert_allclose(obtido['valores'], esperado['valores'])
+                np.testing.assert_allclose(obtido['totais'], esperado['totais'])
+
+
+class ImportarPlanilhasTests(TestCase):
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.pasta)
+        for nome, linhas in (('janeiro', 12), ('fevereiro', 15)):
+            with open(os.path.join(self.pasta, f'{nome}.xlsx'), 'wb') as arquivo:
+                arquivo.write(conteudo_planilha(linhas, areas=2, total_a_cada=5))
+        with open(os.path.join(self.pasta, 'leia-me.txt'), 'w') as arquivo:
+            arquivo.write('não é uma planilha')
+
+    def importar(self, *argumentos):
+        saida = StringIO()
+        call_command('importar_planilhas', self.pasta, '--processos', '1', *argumentos, stdout=saida)
+        return saida.getvalue()
+
+    def test_importa_e_ignora_os_ja_importados(self):
+        saida = self.importar()
+        self.assertIn('2 arquivo(s) encontrado(s).', saida)
+        self.assertIn('2 importado(s) (2 análise(s), 27 linhas), 0 ignorado(s), 0 com erro', saida)
+        contagem = dict(UploadedFile.objects.annotate(linhas=Count('expenses')).values_list('name', 'linhas'))
+        self.assertEqual(contagem, {'janeiro': 12, 'fevereiro': 15})
+        self.assertFalse(UploadedFile.objects.filter(content_hash='').exists())
+
+        self.assertIn('0 importado(s) (0 análise(s), 0 linhas), 2 ignorado(s)', self.importar())
+        self.assertEqual(UploadedFile.objects.count(), 2)
+
+        self.importar('--reimportar')
+        self.assertEqual(UploadedFile.objects.count(), 4)
+
+    def test_arquivo_com_erro(self):
+        with open(os.path.join(self.pasta, 'corrompido.xlsx'), 'wb') as arquivo:
+            arquivo.write(b'isto nao e um xlsx')
+        self.assertIn('2 importado(s) (2 análise(s), 27 linhas), 0 ignorado(s), 1 com erro', self.importar())
+
+    def test_sem_planilhas(self):
+        with self.assertRaises(CommandError):
+            call_command('importar_planilhas', os.path.join(self.pasta, 'leia-me.txt'), stdout=StringIO())
+
+
+class ArmazenamentoColunarTests(TestCase):
+    def dados_da_analise(self, uploaded_file):
+        _cache().clear()
+        response = self.client.get(reverse('analysis_data', kwargs={'file_id': uploaded_file.file_id}))
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_analise_igual_nos_dois_layouts(self):
+        em_json = ingerir_teste(ARMAZENAMENTO_JSON)
+        colunar = ingerir_teste(ARMAZENAMENTO_COLUNAR)
+        self.assertTrue(ExpenseMatrix.objects.filter(file=colunar).exists())
+        self.assertEqual(self.dados_da_analise(colunar), self.dados_da_analise(em_json))
+
+        response = self.client.get(reverse('analyze_data', kwargs={'file_id': colunar.file_id}))
+        self.assertEqual(response.status_code, 200)
+
+    def test_migrar_armazenamento_ida_e_volta(self):
+        uploaded_file = ingerir_teste(ARMAZENAMENTO_JSON)
+        esperado = self.dados_da_analise(uploaded_file)
+
+        saida = StringIO()
+        call_command('migrar_armazenamento', stdout=saida)
+        self.assertIn('1 arquivo(s) convertido(s) para o layout colunar', saida.getvalue())
+        self.assertTrue(ExpenseMatrix.objects.filter(file=uploaded_file).exists())
+        self.assertFalse(uploaded_file.expenses.exclude(data={}).exists())
+        self.assertEqual(self.dados_da_analise(uploaded_file), esperado)
+
+        call_command('migrar_armazenamento', '--para', 'json', '--file-id', str(uploaded_file.file_id), stdout=StringIO())
+        self.assertFalse(ExpenseMatrix.objects.filter(file=uploaded_file).exists())
+        self.assertEqual(
+            uploaded_file.expenses.get(id_excel='1').data, {'ADM - 1': 10.0, 'ADM - 2': 20.0, 'TI - 1': 30.0},
+        )
+        self.assertEqual(self.dados_da_analise(uploaded_file), esperado)
+
+
+class AgregadosViewTests(TestCase):
+    def agregados(self, uploaded_file):
+        return {
+            'total': FileAggregates.objects.get(file=uploaded_file).grand_total,
+            'colunas': dict(ColumnTotal.objects.filter(file=uploaded_file).values_list('column', 'total')),
+            'areas': dict(AreaTotal.objects.filter(file=uploaded_file).values_list('area', 'total')),
+            'contas': dict(AccountTotal.objects.filter(file=uploaded_file).values_list('account', 'total')),
+        }
+
+    def test_agregados_da_ingestao_e_da_edicao(self):
+        for armazenamento in (ARMAZENAMENTO_JSON, ARMAZENAMENTO_COLUNAR):
+            with self.subTest(armazenamento=armazenamento):
+                uploaded_file = ingerir_teste(armazenamento)
+                self.assertEqual(self.agregados(uploaded_file), {
+                    'total': 73.0,
+                    'colunas': {'ADM - 1': 16.0, 'ADM - 2': 21.0, 'TI - 1': 36.0},
+                    'areas': {'ADM': 37.0, 'TI': 36.0},
+                    'contas': {'A': 63.0, 'B': 10.0},
+                })
+
+                response = self.client.post(
+                    reverse('update_row_total', kwargs={'file_id': uploaded_file.file_id}),
+                    {'id_excel': '2', 'new_total': 20}, content_type='application/json',
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(self.agregados(uploaded_file), {
+                    'total': 83.0,
+                    'colunas': {'ADM - 1': 21.0, 'ADM - 2': 21.0, 'TI - 1': 41.0},
+                    'areas': {'ADM': 42.0, 'TI': 41.0},
+                    'contas': {'A': 63.0, 'B': 20.0},
+                })
+
+    def test_exclusao_remove_os_agregados(self):
+        uploaded_file = ingerir_teste()
+        response = self.client.post(reverse('delete_file', kwargs={'file_id': uploaded_file.file_id}))
+        self.assertRedirects(response, reverse('upload_file'), fetch_redirect_response=False)
+        for modelo in (FileAggregates, ColumnTotal, AreaTotal, AccountTotal):
+            self.assertFalse(modelo.objects.filter(file_id=uploaded_file.file_id).exists())
+
+
+class EdicaoLoteViewTests(TestCase):
+    def editar(self, uploaded_file, edicoes, **dados):
+        return self.client.post(
+            reverse('update_rows', kwargs={'file_id': uploaded_file.file_id}),
+            {'edicoes': edicoes, **dados}, content_type='application/json',
+        )
+
+    def test_lote_com_patch_de_dados(self):
+        for armazenamento in (ARMAZENAMENTO_JSON, ARMAZENAMENTO_COLUNAR):
+            with self.subTest(armazenamento=armazenamento):
+                uploaded_file = ingerir_teste(armazenamento)
+                response = self.editar(uploaded_file, [
+                    {'id_excel': '1', 'new_total': 120},
+                    {'id_excel': '2', 'coluna': 'TI - 1', 'valor': 15},
+                ], formato='dados')
+                self.assertEqual(response.status_code, 200)
+                patch = response.json()['patch']
+                self.assertEqual(patch['formato'], 'dados')
+                self.assertEqual(patch['linhas']['ids'], ['1', '2'])
+                self.assertEqual(patch['linhas']['totais'], [120.0, 20.0])
+                self.assertEqual(patch['linhas']['valores'], [[20.0, 40.0, 60.0], [5.0, 0.0, 15.0]])
+                self.assertEqual(patch['total_geral'], 143.0)
+                self.assertEqual(patch['contas_alteradas'], ['A', 'B'])
+
+    def test_lote_com_patch_html(self):
+        uploaded_file = ingerir_teste()
+        response = self.editar(uploaded_file, [{'id_excel': '3', 'new_total': 6}])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('1 linha(s) atualizada(s)', response.json()['message'])
+        self.assertNotEqual(response.json()['patch'].get('formato'), 'dados')
+
+    def test_edicao_invalida_desfaz_o_lote(self):
+        uploaded_file = ingerir_teste()
+        for edicoes, status in (
+            ([{'id_excel': '1', 'new_total': 120}, {'id_excel': '2', 'new_total': 'dez'}], 400),
+            ([{'id_excel': '1', 'new_total': 120}, {'id_excel': '99', 'new_total': 5}], 404),
+            ([], 400),
+        ):
+            with self.subTest(edicoes=edicoes):
+                response = self.editar(uploaded_file, edicoes)
+                self.assertEqual(response.status_code, status)
+                self.assertFalse(response.json()['success'])
+                np.testing.assert_allclose(carregar_matriz(uploaded_file)['totais'], [60, 10, 3])
+                self.assertAlmostEqual(obter_agregados(uploaded_file).grand_total, 73)
+
+    @override_settings(CUSTOS_EDICAO_LOTE_MAXIMO=1)
+    def test_lote_acima_do_maximo(self):
+        response = self.editar(ingerir_teste(), [{'id_excel': '1', 'new_total': 1}, {'id_excel': '2', 'new_total': 2}])
+        self.assertEqual(response.status_code, 400)
+
+
+class TabelaPrincipalTests(TestCase):
+    def test_pagina_com_a_tabela_completa(self):
+        uploaded_file = ingerir_teste()
+        response = self.client.get(
+            reverse('analyze_data', kwargs={'file_id': uploaded_file.file_id}), {'tabela': 'completa'},
+        )
+        self.assertEqual(response.status_code, 200)
+        tabela = response.context['df_original']
+        self.assertIn(formatar_celula_html(10.0, 60.0), tabela)
+        self.assertIn(formatar_celula_html(0.0, 10.0), tabela)
+        self.assertIn('<td>TOTAL GERAL</td>', tabela)
+        self.assertContains(response, formatar_botao_total_html(60.0, '1'))
+
+    def test_igual_as_celulas_formatadas_uma_a_uma(self):
+        colunas = ['ADM - 1', 'ADM - 2']
+        df = pd.DataFrame({
+            'ID': ['1', '2', '3', '4'],
+            'CONTA': ['A', 'B', 'C', 'D'],
+            'TOTAL (LINHA)': [30.0, 0.0, -5.0, 10.0],
+            'ADM - 1': [10.0, 3.0, -5.0, float('nan')],
+            'ADM - 2': [20.0, -0.0, 0.0, 10.0],
+        })
+        esperado = ''.join(
+            _linha_tabela_html([
+                linha['ID'], linha['CONTA'],
+                *(formatar_celula_html(linha[col], linha['TOTAL (LINHA)']) for col in colunas),
+                formatar_botao_total_html(linha['TOTAL (LINHA)'], linha['ID']),
+            ])
+            for _, linha in df.iterrows()
+        )
+        self.assertIn(esperado, preparar_tabela_principal_html(df, colunas))
+
+
+class JanelaAnaliseTests(TestCase):
+    def janela(self, uploaded_file, **parametros):
+        return self.client.get(reverse('analysis_window', kwargs={'file_id': uploaded_file.file_id}), parametros)
+
+    def test_linhas_e_colunas_da_janela(self):
+        for armazenamento in (ARMAZENAMENTO_JSON, ARMAZENAMENTO_COLUNAR):
+            with self.subTest(armazenamento=armazenamento):
+                response = self.janela(ingerir_teste(armazenamento), offset=1, limit=1, col_start=1, col_end=3)
+                self.assertEqual(response.status_code, 200)
+                dados = response.json()
+                self.assertEqual((dados['total_linhas'], dados['total_colunas'], dados['offset']), (3, 3, 1))
+                self.assertEqual(dados['colunas'], ['ADM - 2', 'TI - 1'])
+                self.assertEqual(dados['linhas'], [{'id_excel': '2', 'conta': 'B', 'total': 10.0, 'valores': [0.0, 5.0]}])
+                self.assertEqual(dados['totais_colunas'], [21.0, 36.0])
+                self.assertEqual(dados['total_geral'], 73.0)
+
+    def test_busca_por_conta(self):
+        for armazenamento in (ARMAZENAMENTO_JSON, ARMAZENAMENTO_COLUNAR):
+            with self.subTest(armazenamento=armazenamento):
+                dados = self.janela(ingerir_teste(armazenamento), search='a').json()
+                self.assertEqual(dados['total_linhas'], 2)
+                self.assertEqual([linha['id_excel'] for linha in dados['linhas']], ['1', '3'])
+
+    @override_settings(CUSTOS_JANELA_MAX_LINHAS=2, CUSTOS_JANELA_MAX_COLUNAS=2)
+    def test_parametros_limitados_aos_maximos(self):
+        dados = self.janela(ingerir_teste(), offset=-1, limit=50, col_end=50).json()
+        self.assertEqual(dados['offset'], 0)
+        self.assertEqual([linha['id_excel'] for linha in dados['linhas']], ['1', '2'])
+        self.assertEqual(dados['colunas'], ['ADM - 1', 'ADM - 2'])
+
+    def test_parametros_invalidos(self):
+        uploaded_file = ingerir_teste()
+        for parametros in ({'offset': 'um'}, {'limit': 'dez'}, {'col_start': '1.5'}):
+            with self.subTest(parametros=parametros):
+                response = self.janela(uploaded_file, **parametros)
+                self.assertEqual(response.status_code, 400)
+                self.assertFalse(response.json()['success'])
+
+    def test_arquivo_sem_dados(self):
+        response = self.janela(UploadedFile.objects.create(name='Vazio'))
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.json()['success'])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), CUSTOS_ARTEFATOS=False)
+class ExecutarJobTests(TestCase):
+    def criar_job(self):
+        job = UploadJob(name='Teste')
+        job.source_file.save('teste.xlsx', ContentFile(b'conteudo'), save=False)
+        job.save()
+        self.assertEqual(fila.reservar_proximo_job(), job.pk)
+        return job
+
+    def test_conclui_job_reservado(self):
+        job = self.criar_job()
+        uploaded_file = UploadedFile.objects.create(name='Teste')
+        with mock.patch.object(fila, 'processar_upload', return_value=uploaded_file):
+            fila.executar_job(job.pk)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, UploadJob.STATUS_CONCLUIDO)
+        self.assertEqual(job.uploaded_file, uploaded_file)
+        self.assertFalse(job.source_file)
+
+    def test_nao_sobrescreve_job_marcado_como_erro(self):
+        job = self.criar_job()
+
+        def abandonado(*args, **kwargs):
+            # Outro processo marca o job como abandonado enquanto a ingestão ainda roda.
+            UploadJob.objects.filter(pk=job.pk).update(status=UploadJob.STATUS_ERRO, error_message='Tempo limite.')
+            return ingerir_teste()
+
+        with mock.patch.object(fila, 'processar_upload', side_effect=abandonado), self.assertLogs('custos.fila'):
+            fila.executar_job(job.pk)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, UploadJob.STATUS_ERRO)
+        self.assertEqual(job.error_message, 'Tempo limite.')
+        self.assertIsNone(job.uploaded_file)
+        # A análise gravada sem job é descartada.
+        self.assertFalse(UploadedFile.objects.exists())
+
+    def test_tempo_limite_ignora_job_em_execucao_neste_processo(self):
+        job = self.criar_job()
+        antigo = timezone.now() - timedelta(days=1)
+        UploadJob.objects.filter(pk=job.pk).update(started_at=antigo)
+
+        def lento(*args, **kwargs):
+            self.assertEqual(fila.marcar_jobs_abandonados(), 0)
+            return ingerir_teste()
+
+        with mock.patch.object(fila, 'processar_upload', side_effect=lento):
+            fila.executar_job(job.pk)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, UploadJob.STATUS_CONCLUIDO)
+        self.assertTrue(UploadedFile.objects.filter(pk=job.uploaded_file_id).exists())
+
+    def test_marca_job_abandonado(self):
+        job = self.criar_job()
+        UploadJob.objects.filter(pk=job.pk).update(started_at=timezone.now() - timedelta(days=1))
+
+        self.assertEqual(fila.marcar_jobs_abandonados(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, UploadJob.STATUS_ERRO)
+
+    def test_erro_nao_sobrescreve_mensagem_do_tempo_limite(self):
+        job = self.criar_job()
+
+        def abandonado(*args, **kwargs):
+            UploadJob.objects.filter(pk=job.pk).update(status=UploadJob.STATUS_ERRO, error_message='Tempo limite.')
+            raise ValueError('falhou')
+
+        with mock.patch.object(fila, 'processar_upload', side_effect=abandonado), self.assertLogs('custos.fila'):
+            fila.executar_job(job.pk)
+
+        job.refresh_from_db()
+        self.assertEqual(job.error_message, 'Tempo limite.')
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(), CUSTOS_ARTEFATOS=False,
+    CUSTOS_UPLOAD_ASSINCRONO=True, CUSTOS_FILA_TRABALHADOR_INTERNO=False,
+)
+class UploadFilaViewTests(TestCase):
+    def status(self, job):
+        response = self.client.get(reverse('upload_status', kwargs={'job_id': job.job_id}))
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_upload_enfileirado_ate_a_analise(self):
+        response = self.client.post(reverse('upload_file'), {
+            'name': 'Fila', 'arquivo_excel': SimpleUploadedFile('custos.xlsx', conteudo_planilha(12, areas=2)),
+        })
+        job = UploadJob.objects.get()
+        self.assertRedirects(response, f"{reverse('upload_file')}?job={job.job_id}", fetch_redirect_response=False)
+        self.assertFalse(UploadedFile.objects.exists())
+        status = self.status(job)
+        self.assertTrue(status['success'])
+        self.assertEqual(status['status'], UploadJob.STATUS_PENDENTE)
+
+        self.assertEqual(fila.reservar_proximo_job(), job.pk)
+        fila.executar_job(job.pk)
+
+        status = self.status(job)
+        uploaded_file = UploadedFile.objects.get(name='Fila')
+        self.assertEqual(status['status'], UploadJob.STATUS_CONCLUIDO)
+        self.assertEqual(status['file_id'], str(uploaded_file.file_id))
+        self.assertEqual(status['url_analise'], reverse('analyze_data', kwargs={'file_id': uploaded_file.file_id}))
+        self.assertEqual(status['linhas_processadas'], 12)
+
+        metricas = self.client.get(reverse('upload_queue_metrics')).json()
+        self.assertEqual(metricas['jobs_por_status'][UploadJob.STATUS_CONCLUIDO], 1)
+        self.assertEqual(metricas['janela'], 1)
+        self.assertIsNotNone(metricas['processamento'])
+
+    def test_job_inexistente(self):
+        self.assertEqual(self.client.get(reverse('upload_status', kwargs={'job_id': uuid.uuid4()})).status_code, 404)
+
+
+class EdicaoAgregadosTests(TestCase):
+    def conferir_agregados(self, uploaded_file):
+        # Os agregados acumulados pelos deltas têm de bater com um recálculo completo.
+        esperado = calcular_agregados(carregar_matriz(uploaded_file))
+        self.assertAlmostEqual(obter_agregados(uploaded_file).grand_total, esperado['grand_total'])
+        colunas = dict(ColumnTotal.objects.filter(file=uploaded_file).values_list('column', 'total'))
+        for coluna, total in zip(esperado['columns'], esperado['column_totals']):
+            self.assertAlmostEqual(colunas[coluna], total)
+        areas = dict(AreaTotal.objects.filter(file=uploaded_file).values_list('area', 'total'))
+        self.assertEqual(areas.keys(), esperado['area_totals'].keys())
+        for area, total in esperado['area_totals'].items():
+            self.assertAlmostEqual(areas[area], total)
+        contas = dict(AccountTotal.objects.filter(file=uploaded_file).values_list('account', 'total'))
+        for conta, total in esperado['account_totals'].items():
+            self.assertAlmostEqual(contas[conta], total)
+
+    def test_posicao_gravada_na_ingestao(self):
+        for armazenamento in (ARMAZENAMENTO_JSON, ARMAZENAMENTO_COLUNAR):
+            with self.subTest(armazenamento=armazenamento):
+                uploaded_file = ingerir_teste(armazenamento)
+                self.assertEqual(
+                    list(uploaded_file.expenses.order_by('pk').values_list('position', flat=True)), [0, 1, 2],
+                )
+
+    def test_deltas_de_um_lote(self):
+        for armazenamento in (ARMAZENAMENTO_JSON, ARMAZENAMENTO_COLUNAR):
+            with self.subTest(armazenamento=armazenamento):
+                uploaded_file = ingerir_teste(armazenamento)
+                aplicar_edicoes(uploaded_file, [
+                    {'id_excel': '1', 'new_total': 120},
+                    {'id_excel': '2', 'coluna': 'TI - 1', 'valor': 15},
+                ])
+
+                matriz = carregar_matriz(uploaded_file)
+                np.testing.assert_allclose(matriz['valores'], [[20, 40, 60], [5, 0, 15], [1, 1, 1]])
+                np.testing.assert_allclose(matriz['totais'], [120, 20, 3])
+                self.assertAlmostEqual(obter_agregados(uploaded_file).grand_total, 143)
+                self.assertEqual(
+                    dict(AreaTotal.objects.filter(file=uploaded_file).values_list('area', 'total')),
+                    {'ADM': 67.0, 'TI': 76.0},
+                )
+                self.conferir_agregados(uploaded_file)
+
+    def test_edicoes_da_mesma_linha_em_ordem(self):
+        uploaded_file = ingerir_teste(ARMAZENAMENTO_COLUNAR)
+        aplicar_edicoes(uploaded_file, [
+            {'id_excel': '3', 'new_total': 30},
+            {'id_excel': '3', 'coluna': 'ADM - 1', 'valor': 0},
+        ])
+        np.testing.assert_allclose(carregar_matriz(uploaded_file)['valores'][2], [0, 10, 10])
+        self.conferir_agregados(uploaded_file)
+
+    def test_linhas_lidas_pela_posicao(self):
+        # A ordem da planilha é a de position, mesmo quando difere da ordem de pk.
+        uploaded_file = ingerir_teste()
+        despesas = {despesa.id_excel: despesa for despesa in uploaded_file.expenses.all()}
+        for id_excel, posicao in (('1', 10), ('3', 0), ('1', 2)):
+            despesas[id_excel].position = posicao
+            despesas[id_excel].save(update_fields=['position'])
+
+        self.assertEqual(carregar_matriz(uploaded_file)['ids'], ['3', '2', '1'])
+        self.assertEqual(ler_janela(uploaded_file, COLUNAS_TESTE, 0, 2)['ids'], ['3', '2'])
+        self.assertEqual([linha[0] for linha in iterar_linhas(uploaded_file, COLUNAS_TESTE)], ['3', '2', '1'])
+
+        redistribuir_arquivo(uploaded_file, {'fator': 2})
+        np.testing.assert_allclose(carregar_matriz(uploaded_file)['totais'], [6, 20, 120])
+
+    def test_deltas_criam_coluna_e_conta_novas(self):
+        uploaded_file = ingerir_teste()
+        agregados = obter_agregados(uploaded_file, para_atualizar=True)
+        aplicar_deltas_linhas(agregados, ['RH - 1'], ['C'], np.array([[7.0]]), 7.0)
+
+        self.assertEqual(ColumnTotal.objects.get(file=uploaded_file, column='RH - 1').position, 3)
+        self.assertEqual(AreaTotal.objects.get(file=uploaded_file, area='RH').total, 7.0)
+        self.assertEqual(AccountTotal.objects.get(file=uploaded_file, account='C').total, 7.0)
+        self.assertAlmostEqual(obter_agregados(uploaded_file).grand_total, 80.0)
+
+    def test_coluna_nova_depois_da_ultima_posicao(self):
+        uploaded_file = ingerir_teste()
+        ColumnTotal.objects.filter(file=uploaded_file, column='ADM - 2').delete()
+        agregados = obter_agregados(uploaded_file, para_atualizar=True)
+        aplicar_deltas_linhas(agregados, ['RH - 1'], ['C'], np.array([[7.0]]), 7.0)
+
+        self.assertEqual(ColumnTotal.objects.get(file=uploaded_file, column='RH - 1').position, 3)
+
+    def test_patch_linhas(self):
+        uploaded_file = ingerir_teste()
+        edicao = aplicar_edicoes(uploaded_file, [{'id_excel': '2', 'new_total': 30}])
+        patch = preparar_patch_linhas(uploaded_file, edicao['linhas'], edicao['agregados'])
+
+        self.assertEqual(patch['total_geral_valor'], 93.0)
+        self.assertEqual([linha['id_excel'] for linha in patch['linhas']], ['2'])
+        self.assertEqual(len(patch['linhas'][0]['celulas']), len(COLUNAS_TESTE))
+        self.assertEqual(len(patch['totais_colunas']), len(COLUNAS_TESTE))
+        self.assertEqual(patch['contas'], [{**patch['contas'][0], 'id_excel': '2', 'valor': 30.0}])
+        self.assertEqual(patch['contas_alteradas'], ['B'])
+        self.assertIn('ADM', patch['df_analise'])
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(), CUSTOS_ARTEFATOS=False, CUSTOS_INGESTAO_STREAMING=True,
+    CUSTOS_INGESTAO_ABAS=True, CUSTOS_INGESTAO_PROCESSOS_ABAS=1,
+)
+class UploadAbasTests(TestCase):
+    LINHAS_POR_ABA = 20
+
+    def setUp(self):
+        pasta = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, pasta)
+        self.caminho = gerar_planilha_sintetica(
+            os.path.join(pasta, 'abas.xlsx'), self.LINHAS_POR_ABA, areas=2, colunas_por_area=2, abas=3,
+        )
+        self.addCleanup(os.remove, self.caminho)
+        with open(self.caminho, 'rb') as arquivo:
+            self.content_hash = calcular_hash(arquivo)
+
+    def test_todas_as_abas_com_hash_e_grupo(self):
+        with open(self.caminho, 'rb') as arquivo:
+            primeira = fila.processar_upload('Pasta', arquivo)
+
+        analises = analises_do_upload(primeira)
+        self.assertEqual([analise.sheet_name for analise in analises], ['CC 01', 'CC 02', 'CC 03'])
+        self.assertEqual({analise.content_hash for analise in analises}, {self.content_hash})
+        self.assertEqual(analises[0], primeira)
+        self.assertEqual(buscar_duplicado(self.content_hash), primeira)
+
+    def test_copia_e_edicao_de_uma_pasta(self):
+        with open(self.caminho, 'rb') as arquivo:
+            primeira = fila.processar_upload('Pasta', arquivo)
+
+        copia = clonar_arquivo(primeira, 'Cópia')
+        copias = analises_do_upload(copia)
+        self.assertEqual([analise.name for analise in copias], ['Cópia - CC 01', 'Cópia - CC 02', 'Cópia - CC 03'])
+        self.assertNotEqual(copia.upload_group, primeira.upload_group)
+        for origem, destino in zip(analises_do_upload(primeira), copias):
+            self.assertEqual(destino.expenses.count(), origem.expenses.count())
+
+        # Editar uma aba tira todas as abas daquele upload do reaproveitamento.
+        segunda = analises_do_upload(primeira)[1]
+        id_excel = segunda.expenses.order_by('pk').values_list('id_excel', flat=True).first()
+        aplicar_edicoes(segunda, [{'id_excel': id_excel, 'new_total': 10}])
+        self.assertFalse(UploadedFile.objects.filter(upload_group=primeira.upload_group).exclude(content_hash=''))
+        self.assertEqual(buscar_duplicado(self.content_hash), copia)
+
+    def test_job_conta_as_linhas_de_todas_as_abas(self):
+        job = UploadJob(name='Pasta')
+        with open(self.caminho, 'rb') as arquivo:
+            job.source_file.save('abas.xlsx', ContentFile(arquivo.read()), save=False)
+        job.save()
+        fila.reservar_proximo_job()
+        fila.executar_job(job.pk)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, UploadJob.STATUS_CONCLUIDO)
+        self.assertEqual(job.rows_processed, 3 * self.LINHAS_POR_ABA)
+
+    def test_abas_lidas_no_pool_em_lotes(self):
+        temporarios = set(os.listdir(tempfile.gettempdir()))
+        with open(self.caminho, 'rb') as arquivo:
+            em_sequencia = ingerir_abas('Sequência', arquivo, ['CC 01', 'CC 02', 'CC 03'], tamanho_lote=7, processos=1)
+            no_pool = ingerir_abas('Pool', arquivo, ['CC 01', 'CC 02', 'CC 03'], tamanho_lote=7, processos=2)
+
+        for esperado, obtido in zip(em_sequencia, no_pool):
+            self.assertEqual(obtido.sheet_name, esperado.sheet_name)
+            matriz_esperada, matriz = carregar_matriz(esperado), carregar_matriz(obtido)
+            self.assertEqual(matriz['ids'], matriz_esperada['ids'])
+            np.testing.assert_array_equal(matriz['valores'], matriz_esperada['valores'])
+            self.assertEqual(
+                list(obtido.expenses.order_by('position').values_list('position', flat=True)),
+                list(range(self.LINHAS_POR_ABA)),
+            )
+        # Os lotes gravados pelos processos são removidos depois de consumidos.
+        self.assertFalse({
+            nome for nome in set(os.listdir(tempfile.gettempdir())) - temporarios if nome.startswith('custos-aba-')
+        })
+
+    @override_settings(CUSTOS_INGESTAO_ABAS=False)
+    def test_so_a_primeira_aba_sem_a_opcao(self):
+        with open(self.caminho, 'rb') as arquivo:
+            uploaded_file = fila.processar_upload('Pasta', arquivo)
+
+        self.assertEqual(UploadedFile.objects.count(), 1)
+        self.assertIsNone(uploaded_file.upload_group)
+        self.assertEqual(uploaded_file.expenses.count(), self.LINHAS_POR_ABA)
+
+
+class EstatisticasCacheTests(TestCase):
+    def test_contadores_sobrevivem_ao_cache(self):
+        uploaded_file = UploadedFile.objects.create(name='Teste')
+        antes = estatisticas_cache()
+
+        obter_contexto_analise(uploaded_file, lambda _: {'total': 1})
+        obter_contexto_analise(uploaded_file, lambda _: {'total': 1})
+        # Contextos descartados (cache cheio ou limpo) não levam os contadores junto.
+        _cache().clear()
+        obter_contexto_analise(uploaded_file, lambda _: {'total': 1})
+
+        depois = estatisticas_cache()
+        self.assertEqual(depois['acertos'] - antes['acertos'], 1)
+        self.assertEqual(depois['falhas'] - antes['falhas'], 2)
+        self.assertIsNotNone(depois['taxa_acerto'])
+
+
+def centavos(valores):
+    return np.round(np.asarray(valores) * 100).astype(np.int64)
+
+
+class RedistribuicaoTests(TestCase):
+    def assertFechaNoCentavo(self, novos, totais, numericas=None):
+        novos = np.atleast_2d(novos)
+        if numericas is None:
+            numericas = np.ones(novos.shape, dtype=bool)
+        # Cada valor tem no máximo duas casas e a soma da linha é o total exato.
+        np.testing.assert_allclose(novos[numericas], centavos(novos[numericas]) / 100, rtol=0, atol=1e-9)
+        np.testing.assert_array_equal(
+            np.where(numericas, centavos(novos), 0).sum(axis=1), centavos(np.atleast_1d(totais)),
+        )
+
+    def test_fecha_no_centavo(self):
+        valores = np.array([[1.0, 1.0, 1.0], [10.0, 20.0, 30.0], [0.5, 0.25, 0.25]])
+        totais = np.array([100.0, 0.07, 33.33])
+        self.assertFechaNoCentavo(redistribuir(valores, totais), totais)
+
+    def test_totais_negativos(self):
+        novos = redistribuir([1.0, 1.0, 1.0], -10.0)
+        self.assertFechaNoCentavo(novos, -10.0)
+        np.testing.assert_array_equal(centavos(novos), [-333, -333, -334])
+
+    def test_linhas_com_sinais_misturados(self):
+        novos = redistribuir(np.array([[7.0, -4.0]]), [1.0])
+        self.assertFechaNoCentavo(novos, [1.0])
+        np.testing.assert_array_equal(centavos(novos), [[233, -133]])
+
+        novos = redistribuir([100.0, -50.0, 0.3], -12.34)
+        self.assertFechaNoCentavo(novos, -12.34)
+
+    def test_aleatorio_fecha_no_centavo(self):
+        rnd = np.random.default_rng(7)
+        valores = np.round(rnd.uniform(-1000, 1000, (500, 12)), 2)
+        totais = np.round(rnd.uniform(-50000, 50000, 500), 2)
+        numericas = rnd.random((500, 12)) < 0.9
+        self.assertFechaNoCentavo(redistribuir(valores, totais, numericas=numericas), totais, numericas)
+
+    def test_empates_vao_para_as_primeiras_colunas(self):
+        np.testing.assert_array_equal(centavos(redistribuir([1.0, 1.0, 1.0], 0.01)), [1, 0, 0])
+        np.testing.assert_array_equal(centavos(redistribuir([1.0, 1.0, 1.0], 0.02)), [1, 1, 0])
+        np.testing.assert_array_equal(centavos(redistribuir([1.0, 1.0, 1.0], 1.00)), [34, 33, 33])
+        # O empate só decide entre restos iguais: o maior resto ganha antes.
+        np.testing.assert_array_equal(centavos(redistribuir([1.0, 2.0, 2.0], 0.02)), [0, 1, 1])
+
+    def test_divisao_igual_quando_a_base_nao_e_positiva(self):
+        for valores in ([0.0, 0.0, 0.0], [-10.0, 4.0, 0.0], [-5.0, 5.0, 0.0]):
+            with self.subTest(valores=valores):
+                np.testing.assert_array_equal(centavos(redistribuir(valores, 3.0)), [100, 100, 100])
+        # Só as linhas sem base caem na divisão igual.
+        np.testing.assert_allclose(proporcoes([[0.0, 0.0], [3.0, 1.0]]), [[0.5, 0.5], [0.75, 0.25]])
+        # Pesos todos zerados também.
+        pesos = pesos_por_area(COLUNAS_TESTE, {'RH': 1.0})
+        np.testing.assert_array_equal(
+            centavos(redistribuir([1.0, 2.0, 3.0], 0.03, ESTRATEGIA_PESOS, pesos=pesos)), [1, 1, 1],
+        )
+
+    def test_celulas_nao_numericas_ficam_intactas(self):
+        valores = np.array([[10.0, 99.0, 30.0]])
+        numericas = np.array([[True, False, True]])
+        novos = redistribuir(valores, [8.0], numericas=numericas)
+        self.assertEqual(novos[0, 1], 99.0)
+        np.testing.assert_array_equal(centavos(novos[0, [0, 2]]), [200, 600])
+        self.assertFechaNoCentavo(novos, [8.0], numericas)
+
+        # Sem base, a divisão igual também ignora a célula não numérica.
+        novos = redistribuir([0.0, 99.0, 0.0], 0.03, ESTRATEGIA_IGUAL, numericas=[False, False, True])
+        np.testing.assert_array_equal(novos, [0.0, 99.0, 0.03])
+
+    def test_ratear_sem_arredondamento(self):
+        np.testing.assert_allclose(ratear(np.array([[0.5, 0.5]]), [0.01], casas=None), [[0.005, 0.005]])
+
+    def test_pesos_por_area(self):
+        np.testing.assert_allclose(pesos_por_area(COLUNAS_TESTE, {'ADM': 1.0, 'TI': 2.0}), [0.5, 0.5, 2.0])
+
+
+class DuplicadosTests(TestCase):
+    def ingerir_com_hash(self, armazenamento=ARMAZENAMENTO_JSON, content_hash='abc'):
+        uploaded_file = ingerir_teste(armazenamento)
+        UploadedFile.objects.filter(pk=uploaded_file.pk).update(content_hash=content_hash)
+        uploaded_file.refresh_from_db()
+        return uploaded_file
+
+    def test_calcular_hash(self):
+        arquivo = ContentFile(b'planilha', name='a.xlsx')
+        arquivo.read(3)
+        content_hash = calcular_hash(arquivo)
+        self.assertEqual(content_hash, calcular_hash(ContentFile(b'planilha')))
+        self.assertNotEqual(content_hash, calcular_hash(ContentFile(b'outra')))
+        # O arquivo volta para o início, pronto para ser processado.
+        self.assertEqual(arquivo.read(), b'planilha')
+
+    def test_buscar_duplicado(self):
+        self.assertIsNone(buscar_duplicado(''))
+        self.assertIsNone(buscar_duplicado('abc'))
+
+        self.ingerir_com_hash()
+        recente = self.ingerir_com_hash()
+        self.ingerir_com_hash(content_hash='outro')
+        self.assertEqual(buscar_duplicado('abc'), recente)
+
+    def test_analise_editada_nao_e_duplicado(self):
+        uploaded_file = self.ingerir_com_hash()
+        aplicar_edicoes(uploaded_file, [{'id_excel': '1', 'new_total': 1}])
+        self.assertIsNone(buscar_duplicado('abc'))
+
+    def test_clonar_arquivo(self):
+        for armazenamento in (ARMAZENAMENTO_JSON, ARMAZENAMENTO_COLUNAR):
+            with self.subTest(armazenamento=armazenamento):
+                origem = self.ingerir_com_hash(armazenamento)
+                copia = clonar_arquivo(origem, 'Cópia')
+
+                self.assertNotEqual(copia.pk, origem.pk)
+                self.assertEqual((copia.name, copia.content_hash), ('Cópia', 'abc'))
+                campos = ('id_excel', 'account', 'row_total', 'data', 'position')
+                self.assertEqual(
+                    list(copia.expenses.order_by('pk').values_list(*campos)),
+                    list(origem.expenses.order_by('pk').values_list(*campos)),
+                )
+                self.assertEqual(
+                    ExpenseMatrix.objects.filter(file=copia).exists(), armazenamento == ARMAZENAMENTO_COLUNAR,
+                )
+                np.testing.assert_array_equal(carregar_matriz(copia)['valores'], carregar_matriz(origem)['valores'])
+                self.assertEqual(obter_agregados(copia).grand_total, obter_agregados(origem).grand_total)
+                self.assertEqual(
+                    dict(AccountTotal.objects.filter(file=copia).values_list('account', 'total')),
+                    dict(AccountTotal.objects.filter(file=origem).values_list('account', 'total')),
+                )
+
+    def test_copia_independente(self):
+        origem = self.ingerir_com_hash(ARMAZENAMENTO_COLUNAR)
+        copia = clonar_arquivo(origem, 'Cópia')
+        aplicar_edicoes(copia, [{'id_excel': '1', 'new_total': 600}])
+
+        np.testing.assert_allclose(carregar_matriz(origem)['valores'][0], [10, 20, 30])
+        np.testing.assert_allclose(carregar_matriz(copia)['valores'][0], [100, 200, 300])
+        self.assertAlmostEqual(obter_agregados(origem).grand_total, 73.0)
+        self.assertEqual(UploadedFile.objects.get(pk=origem.pk).content_hash, 'abc')
+        self.assertEqual(buscar_duplicado('abc'), origem)
+
+
+@override_settings(
+    CUSTOS_UPLOAD_ASSINCRONO=False, CUSTOS_INGESTAO_STREAMING=True, CUSTOS_INGESTAO_ABAS=False,
+    CUSTOS_ARTEFATOS=False,
+)
+class UploadDuplicadoViewTests(TestCase):
+    def setUp(self):
+        pasta = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, pasta)
+        caminho = gerar_planilha_sintetica(os.path.join(pasta, 'custos.xlsx'), 10, areas=2, colunas_por_area=2)
+        with open(caminho, 'rb') as arquivo:
+            self.conteudo = arquivo.read()
+        os.remove(caminho)
+
+    def enviar(self, **dados):
+        arquivo = SimpleUploadedFile('custos.xlsx', self.conteudo)
+        return self.client.post(reverse('upload_file'), {'name': 'Custos', 'arquivo_excel': arquivo, **dados})
+
+    def test_upload_repetido_oferece_a_analise_existente(self):
+        self.assertEqual(self.enviar().status_code, 302)
+        original = UploadedFile.objects.get()
+
+        response = self.enviar(name='Custos 2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['duplicado'], original)
+        self.assertEqual(response.context['nome_copia'], 'Custos 2')
+        self.assertEqual(UploadedFile.objects.count(), 1)
+
+        response = self.client.post(reverse('clone_file', kwargs={'file_id': original.file_id}), {'name': 'Custos 2'})
+        copia = UploadedFile.objects.get(name='Custos 2')
+        self.assertRedirects(
+            response, reverse('analyze_data', kwargs={'file_id': copia.file_id}), fetch_redirect_response=False,
+        )
+        self.assertEqual(copia.expenses.count(), original.expenses.count())
+
+    def test_reprocessar_ignora_o_duplicado(self):
+        self.enviar()
+        self.assertEqual(self.enviar(reprocessar='on').status_code, 302)
+        self.assertEqual(UploadedFile.objects.count(), 2)
+
+
+@override_settings(CUSTOS_ARTEFATOS=True, CUSTOS_ARTEFATOS_DIR=tempfile.mkdtemp())
+class RespostasCondicionaisTests(TestCase):
+    def setUp(self):
+        self.uploaded_file = ingerir_teste()
+        self.url_dados = reverse('analysis_data', kwargs={'file_id': self.uploaded_file.file_id})
+        self.url_download = reverse('download_file_view', kwargs={'file_id': self.uploaded_file.file_id})
+
+    def test_validadores_na_resposta(self):
+        response = self.client.get(self.url_dados)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['ETag'])
+        self.assertTrue(response['Last-Modified'])
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertIn('public', response['Cache-Control'])
+
+    def test_304_com_a_etag_atual(self):
+        etag = self.client.get(self.url_dados)['ETag']
+        response = self.client.get(self.url_dados, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+
+    def test_304_com_a_data_atual(self):
+        modificado = self.client.get(self.url_dados)['Last-Modified']
+        self.assertEqual(self.client.get(self.url_dados, HTTP_IF_MODIFIED_SINCE=modificado).status_code, 304)
+
+    def test_200_depois_de_invalidar_contexto(self):
+        etag = self.client.get(self.url_dados)['ETag']
+        invalidar_contexto(self.uploaded_file)
+
+        response = self.client.get(self.url_dados, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(
+            response['ETag'], etag_do_arquivo(self.uploaded_file.file_id, self.uploaded_file.data_version, VARIANTE_DADOS),
+        )
+
+    def test_200_depois_de_uma_edicao(self):
+        etag = self.client.get(self.url_dados)['ETag']
+        response = self.client.post(
+            reverse('update_rows', kwargs={'file_id': self.uploaded_file.file_id}),
+            {'edicoes': [{'id_excel': '1', 'new_total': 90}]}, content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(self.url_dados, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_download_por_formato(self):
+        xlsx = self.client.get(self.url_download)
+        csv = self.client.get(self.url_download, {'formato': 'csv'})
+        self.assertEqual((xlsx.status_code, csv.status_code), (200, 200))
+        self.assertNotEqual(xlsx['ETag'], csv['ETag'])
+
+        response = self.client.get(self.url_download, {'formato': 'csv'}, HTTP_IF_NONE_MATCH=csv['ETag'])
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(self.url_download, HTTP_IF_NONE_MATCH=csv['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+        invalidar_contexto(self.uploaded_file)
+        response = self.client.get(self.url_download, {'formato': 'csv'}, HTTP_IF_NONE_MATCH=csv['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_pagina_da_analise_privada(self):
+        response = self.client.get(reverse('analyze_data', kwargs={'file_id': self.uploaded_file.file_id}))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertEqual(
+            self.client.get(
+                reverse('analyze_data', kwargs={'file_id': self.uploaded_file.file_id}),
+                HTTP_IF_NONE_MATCH=response['ETag'],
+            ).status_code,
+            304,
+        )
+
+    def test_arquivo_inexistente(self):
+        response = self.client.get(reverse('analysis_data', kwargs={'file_id': uuid.uuid4()}))
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.has_header('ETag'))
+
+
+class InstrumentacaoTests(TestCase):
+    def setUp(self):
+        self.uploaded_file = ingerir_teste()
+        self.url = reverse('analysis_data', kwargs={'file_id': self.uploaded_file.file_id})
+
+    def test_server_timing_sem_log_por_padrao(self):
+        with self.assertNoLogs('custos.instrumentacao', 'INFO'):
+            response = self.client.get(self.url)
+        self.assertIn('total;dur=', response['Server-Timing'])
+
+    @override_settings(CUSTOS_LOG_REQUISICOES=True)
+    def test_log_em_json_com_a_opcao(self):
+        with self.assertLogs('custos.instrumentacao', 'INFO') as logs:
+            self.client.get(self.url)
+        registro = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(registro['evento'], 'requisicao')
+        self.assertEqual((registro['view'], registro['status']), ('analysis_data', 200))
+        self.assertGreater(registro['consultas'], 0)
+
+    def test_metricas_prometheus(self):
+        self.client.get(self.url)
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        texto = response.content.decode()
+        self.assertIn('# TYPE custos_requisicoes_total counter', texto)
+        self.assertIn('custos_requisicoes_total{view="analysis_data",metodo="GET",status="200"} ', texto)
+        self.assertIn('custos_requisicao_segundos_bucket{view="analysis_data",le="+Inf"}', texto)
+        self.assertIn('custos_fila_jobs{status="pendente"} 0', texto)
+
+    def test_metricas_apenas_locais(self):
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 403)
+
+
+class ValoresPorContaTests(TestCase):
+    def contas(self, uploaded_file, **parametros):
+        return self.client.get(reverse('analysis_account', kwargs={'file_id': uploaded_file.file_id}), parametros)
+
+    def test_valores_de_uma_conta(self):
+        for armazenamento in (ARMAZENAMENTO_JSON, ARMAZENAMENTO_COLUNAR):
+            with self.subTest(armazenamento=armazenamento):
+                response = self.contas(ingerir_teste(armazenamento), conta='B')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json(), {
+                    'success': True, 'conta': 'B',
+                    'valores': [{'Area': 'ADM - 1', 'Valor (R$)': 5.0}, {'Area': 'TI - 1', 'Valor (R$)': 5.0}],
+                })
+
+    def test_conta_inexistente(self):
+        for armazenamento in (ARMAZENAMENTO_JSON, ARMAZENAMENTO_COLUNAR):
+            with self.subTest(armazenamento=armazenamento):
+                response = self.contas(ingerir_teste(armazenamento), conta='Z')
+                self.assertEqual(response.status_code, 404)
+                self.assertFalse(response.json()['success'])
+
+    def test_todas_as_contas(self):
+        for armazenamento in (ARMAZENAMENTO_JSON, ARMAZENAMENTO_COLUNAR):
+            with self.subTest(armazenamento=armazenamento):
+                response = self.contas(ingerir_teste(armazenamento))
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()['contas'], {
+                    'A': [
+                        {'Area': 'ADM - 1', 'Valor (R$)': 11.0}, {'Area': 'ADM - 2', 'Valor (R$)': 21.0},
+                        {'Area': 'TI - 1', 'Valor (R$)': 31.0},
+                    ],
+                    'B': [{'Area': 'ADM - 1', 'Valor (R$)': 5.0}, {'Area': 'TI - 1', 'Valor (R$)': 5.0}],
+                })
+
+    def test_arquivo_sem_dados(self):
+        self.assertEqual(self.contas(UploadedFile.objects.create(name='Vazio')).status_code, 404)
+
+
+@override_settings(CUSTOS_ARTEFATOS=False)
+class DownloadTests(TestCase):
+    def baixar(self, uploaded_file, **parametros):
+        return self.client.get(reverse('download_file_view', kwargs={'file_id': uploaded_file.file_id}), parametros)
+
+    def test_csv_em_streaming(self):
+        for armazenamento in (ARMAZENAMENTO_JSON, ARMAZENAMENTO_COLUNAR):
+            with self.subTest(armazenamento=armazenamento):
+                response = self.baixar(ingerir_teste(armazenamento), formato='csv')
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.streaming)
+                self.assertIn('Teste_reconstruido.csv', response['Content-Disposition'])
+                linhas = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+                self.assertEqual(
+                    linhas, ['ID,CONTA,ADM - 1,ADM - 2,TI - 1', '1,A,10.0,20.0,30.0', '2,B,5.0,0.0,5.0', '3,A,1.0,1.0,1.0'],
+                )
+
+    def test_xlsx_reconstruido(self):
+        for armazenamento in (ARMAZENAMENTO_JSON, ARMAZENAMENTO_COLUNAR):
+            with self.subTest(armazenamento=armazenamento):
+                response = self.baixar(ingerir_teste(armazenamento))
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('Teste_reconstruido.xlsx', response['Content-Disposition'])
+                workbook = openpyxl.load_workbook(BytesIO(b''.join(response.streaming_content)), read_only=True)
+                linhas = [list(linha) for linha in workbook.active.iter_rows(values_only=True)]
+                workbook.close()
+                self.assertEqual(linhas[:2], [[None, None, 'ADM', 'ADM', 'TI'], ['ID', 'CONTA', '1', '2', '1']])
+                self.assertEqual(linhas[2:], [['1', 'A', 10, 20, 30], ['2', 'B', 5, 0, 5], ['3', 'A', 1, 1, 1]])
+
+    def test_arquivo_sem_dados(self):
+        response = self.baixar(UploadedFile.objects.create(name='Vazio'))
+        self.assertRedirects(response, reverse('upload_file'), fetch_redirect_response=False)
+
+
+class ComparacaoViewTests(TestCase):
+    def setUp(self):
+        self.janeiro = ingerir_teste(nome='Janeiro')
+        self.fevereiro = ingerir_teste(ARMAZENAMENTO_COLUNAR, nome='Fevereiro')
+        aplicar_edicoes(self.fevereiro, [{'id_excel': '2', 'new_total': 20}])
+        # Os arquivos são comparados na ordem de upload.
+        UploadedFile.objects.filter(pk=self.janeiro.pk).update(upload_date=timezone.now() - timedelta(days=30))
+        self.ids = [str(self.janeiro.file_id), str(self.fevereiro.file_id)]
+
+    def test_dados_da_comparacao(self):
+        response = self.client.get(reverse('comparison_data'), {'arquivos': self.ids, 'limite': 1})
+        self.assertEqual(response.status_code, 200)
+        dados = response.json()
+        self.assertEqual([arquivo['nome'] for arquivo in dados['arquivos']], ['Janeiro', 'Fevereiro'])
+        self.assertEqual(dados['total_geral']['totais'], [73.0, 83.0])
+        self.assertEqual(dados['areas']['nomes'], ['ADM', 'TI'])
+        self.assertEqual(dados['areas']['totais'], [[37.0, 36.0], [42.0, 41.0]])
+        altas = dados['contas']['ranking']['altas']
+        self.assertEqual([(conta['nome'], conta['delta']) for conta in altas], [('B', 10.0)])
+
+    def test_pagina_da_comparacao(self):
+        response = self.client.get(reverse('comparison'), {'arquivos': self.ids})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Fevereiro')
+        self.assertIn(reverse('comparison_data'), response.context['dados_url'])
+
+    def test_selecao_invalida(self):
+        url = reverse('comparison_data')
+        self.assertEqual(self.client.get(url, {'arquivos': self.ids[:1]}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'arquivos': [self.ids[0], 'abc']}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'arquivos': [self.ids[0], str(uuid.uuid4())]}).status_code, 404)
+        with override_settings(CUSTOS_COMPARACAO_MAX_ARQUIVOS=1):
+            self.assertEqual(self.client.get(url, {'arquivos': self.ids}).status_code, 400)
+
+        response = self.client.get(reverse('comparison'), {'arquivos': self.ids[:1]})
+        self.assertRedirects(response, reverse('upload_file'), fetch_redirect_response=False)
+
+
+class ApiDadosTests(TestCase):
+    def setUp(self):
+        self.uploaded_file = ingerir_teste()
+        self.url = reverse('analysis_data', kwargs={'file_id': self.uploaded_file.file_id})
+
+    def test_formato_dos_dados(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(b', ', response.content)
+        self.assertEqual(response.json(), {
+            'success': True,
+            'total_geral': 73.0,
+            'colunas': COLUNAS_TESTE,
+            'linhas': {
+                'ids': ['1', '2', '3'],
+                'contas': ['A', 'B', 'A'],
+                'totais': [60.0, 10.0, 3.0],
+                'valores': [[10.0, 20.0, 30.0], [5.0, 0.0, 5.0], [1.0, 1.0, 1.0]],
+            },
+            'totais_colunas': [16.0, 21.0, 36.0],
+            'areas': {'nomes': ['ADM', 'TI'], 'valores': [37.0, 36.0]},
+        })
+
+    def test_gzip(self):
+        esperado = self.client.get(self.url).json()
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(json.loads(gzip.decompress(response.content)), esperado)
+
+    @unittest.skipIf(compressao.brotli is None, "pacote brotli não instalado")
+    def test_brotli_so_no_json(self):
+        esperado = self.client.get(self.url).json()
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(json.loads(compressao.brotli.decompress(response.content)), esperado)
+
+        pagina = self.client.get(
+            reverse('analyze_data', kwargs={'file_id': self.uploaded_file.file_id}), HTTP_ACCEPT_ENCODING='gzip, br',
+        )
+        self.assertEqual(pagina['Content-Encoding'], 'gzip')
+
+    @override_settings(CUSTOS_ARTEFATOS=False)
+    def test_xlsx_sem_compressao(self):
+        response = self.client.get(
+            reverse('download_file_view', kwargs={'file_id': self.uploaded_file.file_id}), HTTP_ACCEPT_ENCODING='gzip, br',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(response.streaming_content)[:2], b'PK')
+
+
+# As tarefas do pool (aqui em uma thread, com CUSTOS_PROCESSOS_TRABALHADORES = 0)
+# abrem outra conexão, que só enxerga dados já gravados: por isso TransactionTestCase.
+@override_settings(CUSTOS_PROCESSOS_TRABALHADORES=0, CUSTOS_ARTEFATOS=False)
+class ViewsAssincronasTests(TransactionTestCase):
+    def setUp(self):
+        self.factory = AsyncRequestFactory()
+        self.uploaded_file = ingerir_teste()
+        _cache().clear()
+
+    async def analisar(self, **parametros):
+        request = self.factory.get('/', parametros)
+        return await views.analyze_data_async_view(request, file_id=self.uploaded_file.file_id)
+
+    async def baixar(self, **parametros):
+        request = self.factory.get('/', parametros)
+        return await views.download_file_async_view(request, file_id=self.uploaded_file.file_id)
+
+    async def test_analise(self):
+        response = await self.analisar(tabela='completa')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'TOTAL GERAL')
+
+    async def test_edicao_de_uma_linha(self):
+        request = self.factory.post(
+            '/', {'id_excel': '2', 'new_total': 20, 'formato': 'dados'}, content_type='application/json',
+        )
+        request._dont_enforce_csrf_checks = True
+        response = await views.update_row_total_async_view(request, file_id=self.uploaded_file.file_id)
+        self.assertEqual(response.status_code, 200)
+        patch = json.loads(response.content)['patch']
+        self.assertEqual(patch['linhas']['valores'], [[10.0, 0.0, 10.0]])
+        self.assertEqual(patch['total_geral'], 83.0)
+
+    async def test_download(self):
+        response = await self.baixar(formato='csv')
+        self.assertEqual(response.status_code, 200)
+        csv = ''.join([parte.decode() async for parte in response.streaming_content])
+        self.assertEqual(csv.lstrip('\ufeff').splitlines()[1], '1,A,10.0,20.0,30.0')
+
+        response = await self.baixar()
+        self.assertEqual(response.status_code, 200)
+        try:
+            workbook = openpyxl.load_workbook(BytesIO(b''.join(response.streaming_content)), read_only=True)
+            self.assertEqual(list(next(workbook.active.iter_rows(min_row=3, values_only=True))), ['1', 'A', 10, 20, 30])
+            workbook.close()
+        finally:
+            response.close()
+
+    @override_settings(CUSTOS_PROCESSOS_RETRY_AFTER=7)
+    async def test_503_com_o_pool_ocupado(self):
+        with mock.patch('custos.views.executar_em_processo', side_effect=PoolOcupado('Servidor ocupado.')):
+            for response in (await self.analisar(), await self.baixar()):
+                self.assertEqual(response.status_code, 503)
+                self.assertEqual(response['Retry-After'], '7')
+                self.assertEqual(response.content.decode(), 'Servidor ocupado.')
+
+
+class ArtefatosTests(TestCase):
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.pasta, ignore_errors=True)
+        self.enterContext(override_settings(CUSTOS_ARTEFATOS=True, CUSTOS_ARTEFATOS_DIR=self.pasta))
+
+    def baixar_csv(self, uploaded_file):
+        response = self.client.get(
+            reverse('download_file_view', kwargs={'file_id': uploaded_file.file_id}), {'formato': 'csv'},
+        )
+        self.assertEqual(response.status_code, 200)
+        b''.join(response.streaming_content)
+        response.close()
+        return artefatos.caminho_artefato(uploaded_file, 'csv')
+
+    def envelhecer(self, caminho, segundos):
+        instante = timezone.now().timestamp() - segundos
+        os.utime(caminho, (instante, instante))
+
+    def test_artefato_removido_depois_de_uma_edicao(self):
+        uploaded_file = ingerir_teste()
+        caminho = self.baixar_csv(uploaded_file)
+        self.assertTrue(caminho.exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('update_rows', kwargs={'file_id': uploaded_file.file_id}),
+                {'edicoes': [{'id_excel': '1', 'new_total': 90}]}, content_type='application/json',
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(caminho.exists())
+
+        uploaded_file.refresh_from_db()
+        self.assertTrue(self.baixar_csv(uploaded_file).exists())
+
+    def test_remove_os_usados_ha_mais_tempo(self):
+        primeiro, segundo, terceiro = (ingerir_teste(nome=nome) for nome in ('Primeiro', 'Segundo', 'Terceiro'))
+        caminhos = [self.baixar_csv(primeiro), self.baixar_csv(segundo)]
+        self.envelhecer(caminhos[0], 300)
+        self.envelhecer(caminhos[1], 200)
+        # Um novo download do primeiro renova o uso dele; o segundo passa a ser o mais antigo.
+        self.baixar_csv(primeiro)
+
+        tamanho = caminhos[0].stat().st_size
+        with override_settings(CUSTOS_ARTEFATOS_TAMANHO_MAXIMO=2 * tamanho):
+            caminhos.append(self.baixar_csv(terceiro))
+        self.assertEqual([caminho.exists() for caminho in caminhos], [True, False, True])
+
+    def test_limite_preserva_o_artefato_novo_e_os_temporarios(self):
+        caminhos = []
+        for i, nome in enumerate(('a.csv', 'b.csv', artefatos.PREFIXO_TEMPORARIO + 'c.csv')):
+            caminho = os.path.join(self.pasta, nome)
+            with open(caminho, 'wb') as arquivo:
+                arquivo.write(b'x' * 100)
+            self.envelhecer(caminho, 300 - i * 100)
+            caminhos.append(caminho)
+
+        with override_settings(CUSTOS_ARTEFATOS_TAMANHO_MAXIMO=150):
+            self.assertEqual(artefatos.aplicar_limite(manter=caminhos[0]), 1)
+        self.assertEqual([os.path.exists(caminho) for caminho in caminhos], [True, False, True])
+
+    def test_sem_artefatos_nao_cria_o_diretorio(self):
+        diretorio = os.path.join(self.pasta, 'artefatos')
+        with override_settings(CUSTOS_ARTEFATOS=False, CUSTOS_ARTEFATOS_DIR=diretorio):
+            uploaded_file = ingerir_teste()
+            response = self.client.get(
+                reverse('download_file_view', kwargs={'file_id': uploaded_file.file_id}), {'formato': 'csv'},
+            )
+            self.assertEqual(response.status_code, 200)
+            with self.captureOnCommitCallbacks(execute=True):
+                invalidar_contexto(uploaded_file)
+            self.client.post(reverse('delete_file', kwargs={'file_id': uploaded_file.file_id}))
+        self.assertFalse(os.path.exists(diretorio))
+
+
+class ExportacaoCsvTests(TestCase):
+    async def test_csv_assincrono_igual_ao_sincrono(self):
+        for armazenamento in (ARMAZENAMENTO_JSON, ARMAZENAMENTO_COLUNAR):
+            with self.subTest(armazenamento=armazenamento):
+                uploaded_file = await sync_to_async(ingerir_teste)(armazenamento)
+                esperado = await sync_to_async(lambda: ''.join(gerar_csv(uploaded_file)))()
+                obtido = ''.join([linha async for linha in agerar_csv(uploaded_file)])
+                self.assertEqual(obtido, esperado)
+                self.assertEqual(obtido.splitlines()[1:], ['1,A,10.0,20.0,30.0', '2,B,5.0,0.0,5.0', '3,A,1.0,1.0,1.0'])
@@ -1,6 +1,18 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# Com CUSTOS_VIEWS_ASSINCRONAS (servidor ASGI), a análise, a edição de uma
+# linha e o download usam as versões assíncronas das views.
+if getattr(settings, 'CUSTOS_VIEWS_ASSINCRONAS', False):
+    analyze_data = views.analyze_data_async_view
+    update_row_total = views.update_row_total_async_view
+    download_file = views.download_file_async_view
+else:
+    analyze_data = views.analyze_data_view
+    update_row_total = views.update_row_total_view
+    download_file = views.download_file_view
+
 urlpatterns = [
     # Rota para o upload de arquivos.
     path('', views.upload_file_view, name='upload_file'),
@@ -8,21 +20,53 @@ urlpatterns = [
     # Rota para a análise dos dados. Note a adição de <uuid:file_id>
     # Esta parte do padrão diz ao Django para esperar um UUID na URL
     # e passá-lo para a view como a variável 'file_id'.
-    path('analise/<uuid:file_id>/', views.analyze_data_view, name='analyze_data'),
+    path('analise/<uuid:file_id>/', analyze_data, name='analyze_data'),
+
+    # Janela (linhas e colunas) da tabela principal em JSON, usada no modo virtual
+    path('analise/<uuid:file_id>/janela/', views.analysis_window_view, name='analysis_window'),
+
+    # Dados da análise sem formatação (JSON compacto), usados pelo modo 'dados' da página
+    path('analise/<uuid:file_id>/dados/', views.analysis_data_view, name='analysis_data'),
+
+    # Valores por área de uma conta (modal de detalhes), carregados sob demanda
+    path('analise/<uuid:file_id>/contas/', views.analysis_account_view, name='analysis_account'),
     
+    # Comparação entre análises (?arquivos=<id>&arquivos=<id>...): página e API em JSON
+    path('comparar/', views.comparison_view, name='comparison'),
+    path('comparar/dados/', views.comparison_data_view, name='comparison_data'),
+
     # Rota para a edição do nome do arquivo
     path('edit/<uuid:file_id>/', views.edit_file_name_view, name='edit_file_name'),
     
     # Rota para a exclusão do arquivo
     path('delete/<uuid:file_id>/', views.delete_file_view, name='delete_file'),
     
+    # Cópia de uma análise com outro nome (upload repetido do mesmo arquivo)
+    path('clonar/<uuid:file_id>/', views.clone_file_view, name='clone_file'),
+    
     # Rota para download do arquivo Excel
-    path('download/<uuid:file_id>/', views.download_file_view, name='download_file_view'),
+    path('download/<uuid:file_id>/', download_file, name='download_file_view'),
     
     # Rota para limpar a sessão (manter por compatibilidade)
     path('limpar-sessao/', views.clear_session_view, name='clear_session'),
 
 
-    path('update_row_total/<uuid:file_id>/', views.update_row_total_view, name='update_row_total'),
+    path('update_row_total/<uuid:file_id>/', update_row_total, name='update_row_total'),
+
+    # Edição de várias linhas em um único lote (fila de edições da página de análise)
+    path('update_rows/<uuid:file_id>/', views.update_rows_view, name='update_rows'),
+
+    # Redistribuição do total geral do arquivo entre todas as linhas
+    path('redistribuir/<uuid:file_id>/', views.redistribute_file_view, name='redistribute_file'),
+
+    # Situação de um upload enviado para a fila e métricas da fila
+    path('upload/status/<uuid:job_id>/', views.upload_status_view, name='upload_status'),
+    path('upload/metricas/', views.upload_queue_metrics_view, name='upload_queue_metrics'),
+
+    # Contadores de acertos e falhas do cache da análise
+    path('cache/estatisticas/', views.cache_stats_view, name='cache_stats'),
+
+    # Métricas do processo no formato do Prometheus (apenas acesso local)
+    path('metricas/', views.metrics_view, name='metrics'),
 
 ]
@@ -3,86 +3,303 @@ import numpy as np
 import json
 import logging
 import uuid
-from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse, JsonResponse
+from functools import partial
+from django.conf import settings
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
+from django.urls import reverse
+from django.http import FileResponse, HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
 from django.contrib import messages
+from django.db import transaction
 from django.views.decorators.csrf import csrf_protect
 from django.views.decorators.http import require_POST
 from .forms import UploadArquivoForm
-from .models import UploadedFile, ExpenseData
-import io
-import xlsxwriter
+from .models import UploadedFile, ExpenseData, UploadJob
+from .planilha import converter_dataframe, nomear_colunas
+from .fila import (
+    processar_upload, upload_assincrono, enfileirar_upload, iniciar_trabalhador_interno, status_job, metricas_fila,
+)
+from .armazenamento import carregar_matriz, somar_colunas_da_conta, ler_janela
+from .duplicados import buscar_duplicado, calcular_hash, clonar_arquivo
+from .edicao import aplicar_edicoes, redistribuir_arquivo
+from .exportacao import (
+    exportar_xlsx_temporario, gerar_csv, agerar_csv, exportar_xlsx_em_caminho, ArquivoTemporario,
+)
+from .agregados import (
+    valor_numerico, obter_agregados, contar_colunas, totais_das_colunas, totais_das_areas,
+)
+from .instrumentacao import medido, medir, exportar_prometheus
+from .cache_analise import (
+    obter_contexto_analise, aobter_contexto_analise, invalidar_contexto, remover_contexto, estatisticas_cache,
+    VARIANTE_COMPLETA, VARIANTE_VIRTUAL, VARIANTE_DADOS,
+)
+from .processos import PoolOcupado, executar_em_processo
+from .comparacao import comparar_arquivos, LIMITE_RANKING
+from .condicional import condicional
+from .artefatos import usar_artefatos, formato_download, caminho_artefato, resposta_artefato, gerar_artefato_por_id
 
 # Configuração de logging para registrar erros de forma mais detalhada
 logger = logging.getLogger(__name__)
 
+# Modo da tabela principal em que a matriz inteira é buscada em
+# analysis_data_view e formatada pelo navegador (ver _modo_tabela).
+TABELA_DADOS = 'dados'
+
+# Formato dos patches das edições sem HTML, só com números (ver preparar_patch_dados).
+FORMATO_DADOS = 'dados'
+
+# Respostas JSON da API de dados sem espaços entre os separadores.
+JSON_COMPACTO = {'separators': (',', ':')}
+
 
 # --- NOVA FUNÇÃO AUXILIAR ---
-def _get_analysis_context(uploaded_file):
+@medido
+def _get_analysis_context(uploaded_file, tabela_principal=True):
     """
     Função auxiliar para buscar dados e gerar o contexto de análise.
     Centraliza a lógica de processamento para ser reutilizada.
+
+    Os resumos (total geral, análises por área e por conta) saem dos
+    agregados materializados e dos totais das linhas, sem carregar a matriz.
+    A matriz só é lida para a tabela principal, que com tabela_principal=False
+    não é gerada (modo virtual, em que ela é carregada em janelas pelo navegador).
     """
-    expense_data = uploaded_file.expenses.all()
+    agregados = obter_agregados(uploaded_file)
+    linhas = list(uploaded_file.expenses.order_by('position').values_list('id_excel', 'account', 'row_total'))
 
-    if not expense_data:
+    if agregados is None or not linhas:
         return None
 
-    df_despesas_list = []
-    for item in expense_data:
-        row = {'id_excel': item.id_excel, 'account': item.account, 'row_total': item.row_total}
-        row.update(item.data)
-        df_despesas_list.append(row)
-    
-    df_despesas = pd.DataFrame(df_despesas_list)
-    
-    if 'data' in df_despesas.columns:
-        df_despesas = df_despesas.drop(columns=['data'])
+    total_geral = agregados.grand_total
+    colunas_dados, totais_colunas = totais_das_colunas(uploaded_file)
 
-    if df_despesas.empty:
-        return None
+    analise_area_html, analise_area_df = renderizar_analise_area(_somas_das_areas(uploaded_file), total_geral)
+    ids, contas, totais_linhas = (list(coluna) for coluna in zip(*linhas))
+    analise_conta_html = renderizar_analise_conta(ids, contas, totais_linhas, total_geral)
+    areas_zeradas_html, _ = preparar_areas_zeradas(analise_area_df)
+
+    tabela_principal_html = None
+    if tabela_principal:
+        # Monta o DataFrame direto da matriz numérica, sem percorrer linha a linha.
+        matriz = carregar_matriz(uploaded_file)
+        df_original_reconstruido = pd.concat([
+            pd.DataFrame({'ID': matriz['ids'], 'CONTA': matriz['contas'], 'TOTAL (LINHA)': matriz['totais']}),
+            pd.DataFrame(matriz['valores'], columns=matriz['colunas'], copy=False),
+        ], axis=1)
+        totais_por_coluna = dict(zip(colunas_dados, totais_colunas))
+        tabela_principal_html = preparar_tabela_principal_html(
+            df_original_reconstruido, matriz['colunas'],
+            totais_colunas=[totais_por_coluna.get(col, 0.0) for col in matriz['colunas']],
+        )
+
+    return {
+        'total_geral': formatar_moeda(total_geral),
+        'df_analise': analise_area_html,
+        'df_zeradas': areas_zeradas_html,
+        'df_original': tabela_principal_html,
+        'df_por_conta': analise_conta_html,
+    }
 
-    colunas_dados = [col for col in df_despesas.columns if col not in ['id_excel', 'account', 'row_total']]
-    df_despesas_only = df_despesas[colunas_dados].apply(pd.to_numeric, errors='coerce').fillna(0)
-    total_geral = df_despesas['row_total'].sum()
 
-    analise_area_html, analise_area_df = preparar_analise_area(df_despesas_only, colunas_dados, total_geral)
-    analise_conta_html, modal_data = preparar_analise_conta(
-        df_despesas.rename(columns={'id_excel': 'ID', 'account': 'CONTA'}), 
-        df_despesas_only, 
-        colunas_dados, 
-        total_geral
+def _somas_das_areas(uploaded_file):
+    """
+    Total de cada área (AreaTotal) como uma Series indexada pelo nome da área.
+    """
+    areas = totais_das_areas(uploaded_file)
+    return pd.Series(
+        [total for _, total in areas],
+        index=pd.Index([area for area, _ in areas], name='Area'),
+        dtype=float,
     )
+
+
+def _centavos(valores):
+    """
+    Valores arredondados em centavos, como listas (para um JSON compacto).
+    """
+    return np.round(np.nan_to_num(np.asarray(valores, dtype=float)), 2).tolist()
+
+
+@medido
+def _get_analysis_data(uploaded_file):
+    """
+    Dados da análise sem formatação: a matriz com os índices das linhas
+    (ids, contas e totais) e das colunas, os totais das colunas e os das
+    áreas. A formatação fica com o navegador (modo 'dados' da página) ou com
+    quem consumir a API.
+    """
+    agregados = obter_agregados(uploaded_file)
+    matriz = carregar_matriz(uploaded_file)
+    if agregados is None or matriz is None or not len(matriz['ids']):
+        return None
+
+    totais_por_coluna = dict(zip(*totais_das_colunas(uploaded_file)))
+    areas = totais_das_areas(uploaded_file)
+    return {
+        'total_geral': round(agregados.grand_total, 2),
+        'colunas': list(matriz['colunas']),
+        'linhas': {
+            'ids': list(matriz['ids']),
+            'contas': list(matriz['contas']),
+            'totais': _centavos(matriz['totais']),
+            'valores': _centavos(matriz['valores']),
+        },
+        'totais_colunas': _centavos([totais_por_coluna.get(col, 0.0) for col in matriz['colunas']]),
+        'areas': {
+            'nomes': [area for area, _ in areas],
+            'valores': _centavos([total for _, total in areas]),
+        },
+    }
+
+
+@medido
+def preparar_patch_dados(uploaded_file, linhas, agregados):
+    """
+    Versão sem HTML de preparar_patch_linhas: só os números que mudaram,
+    com as colunas na ordem de totais_das_colunas. Os totais das áreas vão
+    inteiros (uma posição por área, na ordem da planilha) e o navegador
+    monta as tabelas por área e reposiciona as contas.
+    """
+    colunas, totais_colunas = totais_das_colunas(uploaded_file)
+    areas = totais_das_areas(uploaded_file)
+    valores = [[valor_numerico(new_data.get(col, 0)) for col in colunas] for _, new_data in linhas]
+
+    return {
+        'formato': FORMATO_DADOS,
+        'total_geral': round(agregados.grand_total, 2),
+        'linhas': {
+            'ids': [expense_entry.id_excel for expense_entry, _ in linhas],
+            'totais': _centavos([float(expense_entry.row_total) for expense_entry, _ in linhas]),
+            'valores': _centavos(valores) if valores else [],
+            # Valor da linha na análise por conta (soma das colunas).
+            'contas': _centavos([sum(linha) for linha in valores]),
+        },
+        'totais_colunas': _centavos(totais_colunas),
+        'areas': {
+            'nomes': [area for area, _ in areas],
+            'valores': _centavos([total for _, total in areas]),
+        },
+        'contas_alteradas': list(dict.fromkeys(str(expense_entry.account) for expense_entry, _ in linhas)),
+    }
+
+
+def _formato_patch(request, data):
+    """
+    Formato do patch pedido pelo navegador: FORMATO_DADOS em ?formato= ou
+    em 'formato' no corpo; sem ele, o patch com fragmentos HTML.
+    """
+    formato = request.GET.get('formato') or (data.get('formato') if isinstance(data, dict) else None)
+    return FORMATO_DADOS if formato == FORMATO_DADOS else None
+
+
+@medido
+def preparar_patch_linhas(uploaded_file, linhas, agregados):
+    """
+    Monta o patch com apenas o que muda na página após a edição de um lote
+    de linhas: as células de cada linha, a linha de totais, as linhas das
+    contas e as tabelas por área (que têm uma linha por área, não por linha
+    da planilha). Tudo é calculado a partir dos agregados acumulados.
+
+    'linhas' é uma lista de (ExpenseData, {coluna: novo valor}). Os valores
+    do modal das contas alteradas não vão no patch: o navegador descarta os
+    que já tinha e os busca de novo quando o modal for aberto.
+    """
+    total_geral = agregados.grand_total
+    colunas, totais_colunas = totais_das_colunas(uploaded_file)
+
+    analise_area_html, analise_area_df = renderizar_analise_area(_somas_das_areas(uploaded_file), total_geral)
     areas_zeradas_html, _ = preparar_areas_zeradas(analise_area_df)
 
-    df_original_reconstruido = df_despesas.rename(
-        columns={'id_excel': 'ID', 'account': 'CONTA', 'row_total': 'TOTAL (LINHA)'}
-    )
-    
-    tabela_principal_html = preparar_tabela_principal_html(
-        df_original_reconstruido, colunas_dados
-    )
+    patch_linhas = []
+    patch_contas = []
+    for expense_entry, new_data in linhas:
+        total_linha = float(expense_entry.row_total)
+        valores_linha = [valor_numerico(new_data.get(col, 0)) for col in colunas]
+        valor_conta = sum(valores_linha)
+        percentual_conta = (valor_conta / total_geral) * 100 if total_geral > 0 else 0
+
+        patch_linhas.append({
+            'id_excel': expense_entry.id_excel,
+            'celulas': [formatar_celula_html(valor, total_linha) for valor in valores_linha],
+            'total': formatar_botao_total_html(total_linha, expense_entry.id_excel),
+        })
+        patch_contas.append({
+            'id_excel': expense_entry.id_excel,
+            'valor': round(valor_conta, 2),
+            'valor_html': formatar_moeda(valor_conta),
+            'percentual_html': formatar_percentual_html(percentual_conta, valor_conta),
+        })
 
     return {
         'total_geral': formatar_moeda(total_geral),
+        'total_geral_valor': round(total_geral, 2),
+        'linhas': patch_linhas,
+        'totais_colunas': [formatar_celula_total_html(total, total_geral) for total in totais_colunas],
+        'total_geral_html': formatar_total_geral_html(total_geral),
+        'contas': patch_contas,
+        'contas_alteradas': list(dict.fromkeys(str(expense_entry.account) for expense_entry, _ in linhas)),
+        'total_contas_html': formatar_moeda(sum(totais_colunas)),
         'df_analise': analise_area_html,
         'df_zeradas': areas_zeradas_html,
-        'df_original': tabela_principal_html,
-        'df_por_conta': analise_conta_html,
-        'modal_data': json.dumps(modal_data),
     }
 
 
+def preparar_patch_linha(uploaded_file, expense_entry, new_data, agregados):
+    """
+    Patch de uma única linha, no formato original de update_row_total
+    ('linha', 'conta' e 'modal_conta' com os valores por área da conta).
+    """
+    patch = preparar_patch_linhas(uploaded_file, [(expense_entry, new_data)], agregados)
+    patch['linha'] = patch.pop('linhas')[0]
+    patch['conta'] = patch.pop('contas')[0]
+    del patch['contas_alteradas']
+
+    somas_conta = pd.Series(somar_colunas_da_conta(uploaded_file, expense_entry.account), dtype=float)
+    patch['modal_conta'] = {
+        'conta': expense_entry.account,
+        'valores': formatar_valores_da_conta(somas_conta),
+    }
+    return patch
+
+
+def _editar_linha(uploaded_file, data):
+    """
+    Aplica a edição do total de uma linha enviada pela página e invalida o
+    contexto da análise em cache, em uma única transação.
+    """
+    with transaction.atomic():
+        edicao = aplicar_edicoes(uploaded_file, [{
+            'id_excel': data.get('id_excel'),
+            'new_total': data.get('new_total'),
+            'estrategia': data.get('estrategia'),
+            'pesos': data.get('pesos'),
+        }])
+        invalidar_contexto(uploaded_file)
+    return edicao
+
+
+def _resposta_ocupado(mensagem):
+    """
+    Resposta 503 (com Retry-After) para quando o pool de processos está cheio.
+    """
+    response = HttpResponse(mensagem, status=503, content_type='text/plain; charset=utf-8')
+    response['Retry-After'] = str(getattr(settings, 'CUSTOS_PROCESSOS_RETRY_AFTER', 5))
+    return response
+
+
 # --- VIEW MODIFICADA ---
 @csrf_protect
 @require_POST
 def update_row_total_view(request, file_id):
     """
-    Atualiza o valor total de uma linha de despesa, recalcula TODAS as
-    análises e retorna os novos dados e HTMLs para a interface.
+    Atualiza o valor total de uma linha de despesa e retorna um patch com
+    apenas as células e totais que mudaram.
 
-    O JavaScript no frontend deve ser responsável por receber este JSON
-    e atualizar o conteúdo das tabelas na página.
+    O novo total é redistribuído entre as colunas da linha em centavos, na
+    mesma proporção dos valores atuais ou com a 'estrategia' informada (ver
+    redistribuicao), e só o delta da linha é aplicado aos agregados do
+    arquivo. Para várias linhas de uma vez, use update_rows_view. Com
+    'formato': 'dados', o patch vem só com números (preparar_patch_dados).
     """
     try:
         # Busca o arquivo correspondente
@@ -90,68 +307,131 @@ def update_row_total_view(request, file_id):
         
         # Carrega os dados enviados pelo JavaScript
         data = json.loads(request.body)
-        id_excel = data.get('id_excel')
-        new_total = float(data.get('new_total'))
 
-        # Encontra a linha de despesa específica no banco de dados
-        expense_entry = get_object_or_404(ExpenseData, file=uploaded_file, id_excel=id_excel)
-        
-        old_total = float(expense_entry.row_total)
-        original_data = expense_entry.data
-
-        # Recalcula os valores de cada área com base no novo total
-        new_data = {}
-        if old_total > 0:
-            for key, value in original_data.items():
-                try:
-                    old_value = float(value)
-                    # Recalcula o novo valor mantendo a mesma proporção
-                    new_value = (old_value / old_total) * new_total
-                    new_data[key] = new_value
-                except (ValueError, TypeError):
-                    # Se o valor não for numérico, mantém o original
-                    new_data[key] = value
+        edicao = _editar_linha(uploaded_file, data)
+        if _formato_patch(request, data) == FORMATO_DADOS:
+            patch = preparar_patch_dados(uploaded_file, edicao['linhas'], edicao['agregados'])
         else:
-            # Se o total antigo for 0, distribui o novo valor igualmente entre as colunas de dados.
-            # (Ou outra lógica de sua preferência)
-            data_columns_count = len([k for k,v in original_data.items() if isinstance(v, (int, float))])
-            if data_columns_count > 0:
-                split_value = new_total / data_columns_count
-                for key, value in original_data.items():
-                    try:
-                        float(value) # Verifica se é numérico
-                        new_data[key] = split_value
-                    except (ValueError, TypeError):
-                        new_data[key] = value
-            else:
-                 new_data = original_data
-
-        # Salva os novos valores no banco de dados
-        expense_entry.row_total = new_total
-        expense_entry.data = new_data
-        expense_entry.save()
-        
-        # --- MUDANÇA PRINCIPAL: RECALCULA TODA A ANÁLISE ---
-        # Após salvar, busca todos os dados atualizados e gera o novo contexto.
-        updated_context = _get_analysis_context(uploaded_file)
-        
-        if updated_context:
-            response_data = {
-                'success': True,
-                'message': 'Total da linha atualizado e análises recalculadas com sucesso.',
-                'analysis_data': updated_context
-            }
-            return JsonResponse(response_data)
+            expense_entry, new_data = edicao['linhas'][0]
+            patch = preparar_patch_linha(uploaded_file, expense_entry, new_data, edicao['agregados'])
+        response_data = {
+            'success': True,
+            'message': 'Total da linha atualizado e análises recalculadas com sucesso.',
+            'patch': patch,
+        }
+        return JsonResponse(response_data, json_dumps_params=JSON_COMPACTO)
+
+    except ExpenseData.DoesNotExist:
+        return JsonResponse({'success': False, 'message': 'Entrada de despesa não encontrada.'}, status=404)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+    except Exception as e:
+        logger.error(f"Erro ao atualizar o total da linha: {str(e)}")
+        return JsonResponse({'success': False, 'message': f'Erro interno do servidor: {str(e)}'}, status=500)
+
+
+@csrf_protect
+@require_POST
+async def update_row_total_async_view(request, file_id):
+    """
+    Versão assíncrona de update_row_total_view (CUSTOS_VIEWS_ASSINCRONAS).
+    A edição e o patch tocam só uma linha e rodam em uma thread; mandá-los
+    para o pool de processos os deixaria na fila atrás de análises e
+    downloads grandes.
+    """
+    try:
+        uploaded_file = await aget_object_or_404(UploadedFile, file_id=file_id)
+        data = json.loads(request.body)
+
+        edicao = await sync_to_async(_editar_linha)(uploaded_file, data)
+        if _formato_patch(request, data) == FORMATO_DADOS:
+            patch = await sync_to_async(preparar_patch_dados)(uploaded_file, edicao['linhas'], edicao['agregados'])
         else:
-            return JsonResponse({'success': False, 'message': 'Falha ao recalcular a análise após a atualização.'}, status=500)
+            expense_entry, new_data = edicao['linhas'][0]
+            patch = await sync_to_async(preparar_patch_linha)(
+                uploaded_file, expense_entry, new_data, edicao['agregados'],
+            )
+        return JsonResponse({
+            'success': True,
+            'message': 'Total da linha atualizado e análises recalculadas com sucesso.',
+            'patch': patch,
+        }, json_dumps_params=JSON_COMPACTO)
 
     except ExpenseData.DoesNotExist:
         return JsonResponse({'success': False, 'message': 'Entrada de despesa não encontrada.'}, status=404)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
     except Exception as e:
         logger.error(f"Erro ao atualizar o total da linha: {str(e)}")
         return JsonResponse({'success': False, 'message': f'Erro interno do servidor: {str(e)}'}, status=500)
 
 
+@csrf_protect
+@require_POST
+def update_rows_view(request, file_id):
+    """
+    Aplica um lote de edições de linhas ({'edicoes': [...]}, ver
+    edicao.validar_edicoes) em uma única transação e retorna um único patch
+    para todas elas, com HTML ou, com 'formato': 'dados', só com números.
+    É o endpoint usado pela fila de edições da página.
+    """
+    try:
+        uploaded_file = get_object_or_404(UploadedFile, file_id=file_id)
+        data = json.loads(request.body)
+
+        with transaction.atomic():
+            edicao = aplicar_edicoes(uploaded_file, data.get('edicoes') if isinstance(data, dict) else None)
+            invalidar_contexto(uploaded_file)
+
+        quantidade = len(edicao['linhas'])
+        preparar = preparar_patch_dados if _formato_patch(request, data) == FORMATO_DADOS else preparar_patch_linhas
+        return JsonResponse({
+            'success': True,
+            'message': f'{quantidade} linha(s) atualizada(s) e análises recalculadas com sucesso.',
+            'patch': preparar(uploaded_file, edicao['linhas'], edicao['agregados']),
+        }, json_dumps_params=JSON_COMPACTO)
+
+    except ExpenseData.DoesNotExist as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=404)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+    except Exception as e:
+        logger.error(f"Erro ao atualizar as linhas em lote: {str(e)}")
+        return JsonResponse({'success': False, 'message': f'Erro interno do servidor: {str(e)}'}, status=500)
+
+
+@csrf_protect
+@require_POST
+def redistribute_file_view(request, file_id):
+    """
+    Leva o total geral do arquivo a um novo valor ({'novo_total'} ou
+    {'fator'}), redistribuindo-o entre as linhas e as colunas com a
+    'estrategia' informada (ver edicao.redistribuir_arquivo). A página é
+    recarregada pelo navegador depois da resposta.
+    """
+    try:
+        uploaded_file = get_object_or_404(UploadedFile, file_id=file_id)
+        data = json.loads(request.body)
+
+        with transaction.atomic():
+            agregados = redistribuir_arquivo(uploaded_file, data if isinstance(data, dict) else {})
+            invalidar_contexto(uploaded_file)
+
+        return JsonResponse({
+            'success': True,
+            'message': f'Total geral redistribuído: {formatar_moeda(agregados.grand_total)}.',
+            'total_geral_valor': round(agregados.grand_total, 2),
+        })
+
+    except ExpenseData.DoesNotExist as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=404)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+    except Exception as e:
+        logger.error(f"Erro ao redistribuir o total do arquivo: {str(e)}")
+        return JsonResponse({'success': False, 'message': f'Erro interno do servidor: {str(e)}'}, status=500)
+
+
 @csrf_protect
 def upload_file_view(request):
     """
@@ -159,7 +439,11 @@ def upload_file_view(request):
     
     Lida com o método POST para processar o arquivo enviado e, se bem-sucedido,
     salva os dados no banco de dados e redireciona para a página de análise.
+    Se o mesmo arquivo já tiver sido enviado (mesmo hash), a página oferece
+    abrir a análise existente ou copiá-la com o novo nome, em vez de
+    processar a planilha de novo (a menos que 'reprocessar' esteja marcado).
     """
+    duplicado = None
     if request.method == 'POST':
         form = UploadArquivoForm(request.POST, request.FILES)
         if form.is_valid():
@@ -169,25 +453,25 @@ def upload_file_view(request):
             analysis_name = file_name_from_form if file_name_from_form else uploaded_file.name
             
             try:
-                resultado = processar_arquivo_excel(uploaded_file)
-                
-                uploaded_file_obj = UploadedFile.objects.create(name=analysis_name)
-                
-                for i, row_data in enumerate(resultado['tabela_principal']):
-                    cleaned_row_data = resultado['df_despesas_only'][i]
-                    data_dict = {col: cleaned_row_data[col] for col in resultado['colunas_dados']}
-                    
-                    expense_data = ExpenseData(
-                        file=uploaded_file_obj,
-                        id_excel=row_data.get('ID', ''),
-                        account=row_data.get('CONTA', ''),
-                        row_total=row_data.get('TOTAL (LINHA)', 0),
-                        data=data_dict
+                content_hash = calcular_hash(uploaded_file)
+                if not form.cleaned_data.get('reprocessar'):
+                    duplicado = buscar_duplicado(content_hash)
+                if duplicado is not None:
+                    messages.warning(
+                        request,
+                        f"Este arquivo já foi enviado na análise '{duplicado.name}'. "
+                        "Abra a análise existente ou crie uma cópia com o novo nome.",
                     )
-                    expense_data.save()
+                elif upload_assincrono():
+                    # O arquivo vai para a fila; a página acompanha o job e abre a análise ao final.
+                    job = enfileirar_upload(analysis_name, uploaded_file)
+                    return redirect(f"{reverse('upload_file')}?job={job.job_id}")
+                else:
+                    # Grava todas as linhas em uma única transação, com bulk_create em lotes.
+                    uploaded_file_obj = processar_upload(analysis_name, uploaded_file, content_hash=content_hash)
 
-                messages.success(request, f"Análise '{analysis_name}' processada e salva com sucesso!")
-                return redirect('analyze_data', file_id=uploaded_file_obj.file_id)
+                    messages.success(request, f"Análise '{analysis_name}' processada e salva com sucesso!")
+                    return redirect('analyze_data', file_id=uploaded_file_obj.file_id)
                 
             except Exception as e:
                 logger.error(f"Erro no processamento do arquivo: {str(e)}")
@@ -202,20 +486,122 @@ def upload_file_view(request):
 
     context = {
         'form': form,
-        'uploaded_files': uploaded_files
+        'uploaded_files': uploaded_files,
+        'job_pendente': _job_pendente(request),
+        'duplicado': duplicado,
+        'nome_copia': analysis_name if duplicado is not None else '',
     }
     return render(request, 'upload.html', context)
 
 
+@csrf_protect
+@require_POST
+def clone_file_view(request, file_id):
+    """
+    Cria uma cópia da análise com o nome informado (upload repetido do mesmo
+    arquivo) e redireciona para a análise criada.
+    """
+    origem = get_object_or_404(UploadedFile, file_id=file_id)
+    nome = (request.POST.get('name') or '').strip() or origem.name
+    try:
+        copia = clonar_arquivo(origem, nome)
+    except Exception as e:
+        logger.error(f"Erro ao copiar a análise: {str(e)}")
+        messages.error(request, f"Erro ao copiar a análise: {str(e)}")
+        return redirect('upload_file')
+
+    messages.success(request, f"Análise '{nome}' criada a partir de '{origem.name}', sem processar o arquivo novamente.")
+    return redirect('analyze_data', file_id=copia.file_id)
+
+
+def _job_pendente(request):
+    """
+    Job de upload informado em ?job=, se ainda não tiver terminado.
+    """
+    try:
+        job_id = uuid.UUID(request.GET.get('job', ''))
+    except ValueError:
+        return None
+    return UploadJob.objects.filter(
+        job_id=job_id, status__in=[UploadJob.STATUS_PENDENTE, UploadJob.STATUS_PROCESSANDO]
+    ).first()
+
+
+def upload_status_view(request, job_id):
+    """
+    Retorna a situação de um job de upload. Quando o job termina, inclui a
+    URL da análise criada.
+    """
+    job = get_object_or_404(UploadJob, job_id=job_id)
+    if job.status == UploadJob.STATUS_PENDENTE:
+        # Garante que há um despachante rodando (ex.: após reiniciar o servidor).
+        iniciar_trabalhador_interno()
+
+    status = status_job(job)
+    if job.status == UploadJob.STATUS_CONCLUIDO and job.uploaded_file_id:
+        status['url_analise'] = reverse('analyze_data', kwargs={'file_id': job.uploaded_file_id})
+    return JsonResponse({'success': job.status != UploadJob.STATUS_ERRO, **status})
+
+
+def upload_queue_metrics_view(request):
+    """
+    Retorna as métricas da fila de uploads (jobs por status e tempos).
+    """
+    return JsonResponse(metricas_fila())
+
+
+def _modo_tabela(request, uploaded_file):
+    """
+    Decide como a tabela principal é exibida: 'completa' (HTML gerado no
+    servidor), 'virtual' (janelas buscadas em analysis_window) ou 'dados'
+    (matriz inteira buscada em analysis_data e formatada no navegador). O
+    parâmetro ?tabela= tem prioridade; sem ele, o modo virtual é usado
+    quando a planilha passa de CUSTOS_TABELA_VIRTUAL_CELULAS células.
+    """
+    modo = request.GET.get('tabela')
+    if modo in (VARIANTE_VIRTUAL, VARIANTE_COMPLETA, TABELA_DADOS):
+        return modo
+
+    agregados = obter_agregados(uploaded_file)
+    if agregados is None:
+        return VARIANTE_COMPLETA
+    celulas = uploaded_file.expenses.count() * contar_colunas(uploaded_file)
+    if celulas > getattr(settings, 'CUSTOS_TABELA_VIRTUAL_CELULAS', 200000):
+        return VARIANTE_VIRTUAL
+    return VARIANTE_COMPLETA
+
+
+def _variante_pagina(request):
+    """
+    Parte da ETag da página de análise: o modo da tabela pedido em ?tabela=
+    (o modo automático depende só dos dados, que a versão já cobre).
+    """
+    modo = request.GET.get('tabela')
+    return 'pagina-' + modo if modo in (VARIANTE_VIRTUAL, VARIANTE_COMPLETA, TABELA_DADOS) else 'pagina'
+
+
+def _variante_download(request):
+    return formato_download(request.GET.get('formato'))
+
+
 # --- VIEW MODIFICADA ---
+@condicional(_variante_pagina, publico=False)
 def analyze_data_view(request, file_id):
     """
     Visualização para a página de análise dos dados processados.
-    Agora utiliza a função auxiliar para obter os dados.
+    O contexto vem do cache enquanto os dados do arquivo não mudarem, e o
+    navegador que já tem a versão atual recebe 304 (ver condicional).
     """
     uploaded_file = get_object_or_404(UploadedFile, file_id=file_id)
-    
-    context = _get_analysis_context(uploaded_file)
+
+    # Fora do modo completo a tabela principal não vai no HTML (mesmo contexto do modo virtual).
+    tabela_modo = _modo_tabela(request, uploaded_file)
+    tabela_principal = tabela_modo == VARIANTE_COMPLETA
+    context = obter_contexto_analise(
+        uploaded_file,
+        partial(_get_analysis_context, tabela_principal=tabela_principal),
+        VARIANTE_COMPLETA if tabela_principal else VARIANTE_VIRTUAL,
+    )
 
     if context is None:
         messages.warning(request, "Nenhum dado encontrado para este arquivo.")
@@ -225,10 +611,282 @@ def analyze_data_view(request, file_id):
     context['form'] = UploadArquivoForm()
     context['file_id'] = file_id
     context['analysis_name'] = uploaded_file.name
+    context['tabela_modo'] = tabela_modo
 
     return render(request, 'analise.html', context)
 
 
+def _contexto_analise_em_processo(file_id, tabela_principal):
+    """
+    Gera o contexto da análise dentro do pool de processos (ver processos).
+    """
+    return _get_analysis_context(UploadedFile.objects.get(file_id=file_id), tabela_principal=tabela_principal)
+
+
+@condicional(_variante_pagina, publico=False)
+async def analyze_data_async_view(request, file_id):
+    """
+    Versão assíncrona de analyze_data_view (CUSTOS_VIEWS_ASSINCRONAS). Em
+    caso de falha no cache, o contexto é gerado no pool de processos.
+    """
+    uploaded_file = await aget_object_or_404(UploadedFile, file_id=file_id)
+
+    tabela_modo = await sync_to_async(_modo_tabela)(request, uploaded_file)
+    tabela_principal = tabela_modo == VARIANTE_COMPLETA
+
+    async def gerar_contexto(arquivo):
+        return await executar_em_processo(_contexto_analise_em_processo, arquivo.file_id, tabela_principal)
+
+    try:
+        context = await aobter_contexto_analise(
+            uploaded_file, gerar_contexto, VARIANTE_COMPLETA if tabela_principal else VARIANTE_VIRTUAL,
+        )
+    except PoolOcupado as e:
+        return _resposta_ocupado(str(e))
+
+    if context is None:
+        messages.warning(request, "Nenhum dado encontrado para este arquivo.")
+        return redirect('upload_file')
+
+    context['form'] = UploadArquivoForm()
+    context['file_id'] = file_id
+    context['analysis_name'] = uploaded_file.name
+    context['tabela_modo'] = tabela_modo
+
+    return await sync_to_async(render)(request, 'analise.html', context)
+
+
+def _parametro_inteiro(request, nome, padrao, minimo, maximo):
+    """
+    Lê um parâmetro inteiro da query string, limitado a [minimo, maximo].
+    Levanta ValueError se o valor não for um inteiro.
+    """
+    valor = request.GET.get(nome)
+    valor = padrao if valor in (None, '') else int(valor)
+    return max(minimo, min(valor, maximo))
+
+
+def analysis_window_view(request, file_id):
+    """
+    Retorna em JSON uma janela da tabela principal: as linhas a partir de
+    'offset' (no máximo 'limit') e as colunas de dados no intervalo
+    [col_start, col_end). O parâmetro opcional 'search' filtra por ID ou conta.
+    Os totais por coluna e o total geral vêm dos agregados do arquivo, de modo
+    que o custo da resposta depende do tamanho da janela, e não da planilha.
+    """
+    uploaded_file = get_object_or_404(UploadedFile, file_id=file_id)
+    agregados = obter_agregados(uploaded_file)
+    if agregados is None:
+        return JsonResponse({'success': False, 'message': 'Nenhum dado encontrado para este arquivo.'}, status=404)
+
+    max_linhas = getattr(settings, 'CUSTOS_JANELA_MAX_LINHAS', 500)
+    max_colunas = getattr(settings, 'CUSTOS_JANELA_MAX_COLUNAS', 100)
+    total_colunas = contar_colunas(uploaded_file)
+    try:
+        offset = _parametro_inteiro(request, 'offset', 0, 0, 2 ** 31)
+        limite = _parametro_inteiro(request, 'limit', 100, 1, max_linhas)
+        col_inicio = _parametro_inteiro(request, 'col_start', 0, 0, total_colunas)
+        col_fim = _parametro_inteiro(request, 'col_end', col_inicio + max_colunas, col_inicio, col_inicio + max_colunas)
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'Parâmetros de janela inválidos.'}, status=400)
+    col_fim = min(col_fim, total_colunas)
+
+    try:
+        colunas, totais_colunas = totais_das_colunas(uploaded_file, col_inicio, col_fim)
+        janela = ler_janela(uploaded_file, colunas, offset, limite, busca=request.GET.get('search', '').strip())
+    except Exception as e:
+        logger.error(f"Erro ao ler a janela da tabela principal: {str(e)}")
+        return JsonResponse({'success': False, 'message': 'Erro interno ao carregar os dados.'}, status=500)
+
+    return JsonResponse({
+        'success': True,
+        'total_linhas': janela['total_linhas'],
+        'total_colunas': total_colunas,
+        'offset': offset,
+        'col_inicio': col_inicio,
+        'colunas': colunas,
+        'linhas': [
+            {'id_excel': id_excel, 'conta': conta, 'total': total, 'valores': valores}
+            for id_excel, conta, total, valores in zip(janela['ids'], janela['contas'], janela['totais'], janela['valores'])
+        ],
+        'totais_colunas': totais_colunas,
+        'total_geral': agregados.grand_total,
+    })
+
+
+def analysis_account_view(request, file_id):
+    """
+    Retorna em JSON os valores por área de uma conta (parâmetro 'conta'),
+    usados no modal de detalhes. Sem o parâmetro, retorna os valores de
+    todas as contas, calculados com um único agrupamento.
+    """
+    uploaded_file = get_object_or_404(UploadedFile, file_id=file_id)
+    conta = request.GET.get('conta')
+
+    try:
+        if conta is not None:
+            somas = somar_colunas_da_conta(uploaded_file, conta)
+            if not somas:
+                return JsonResponse({'success': False, 'message': 'Conta não encontrada.'}, status=404)
+            return JsonResponse({
+                'success': True,
+                'conta': conta,
+                'valores': formatar_valores_da_conta(pd.Series(somas, dtype=float)),
+            })
+
+        matriz = carregar_matriz(uploaded_file)
+        if matriz is None:
+            return JsonResponse({'success': False, 'message': 'Nenhum dado encontrado para este arquivo.'}, status=404)
+        df_despesas_only = pd.DataFrame(matriz['valores'], columns=matriz['colunas'], copy=False)
+        return JsonResponse({
+            'success': True,
+            'contas': agrupar_valores_por_conta(matriz['contas'], df_despesas_only, matriz['colunas']),
+        })
+    except Exception as e:
+        logger.error(f"Erro ao carregar os valores por conta: {str(e)}")
+        return JsonResponse({'success': False, 'message': 'Erro interno ao carregar os dados.'}, status=500)
+
+
+@condicional(lambda request: VARIANTE_DADOS)
+def analysis_data_view(request, file_id):
+    """
+    API de dados da análise: números sem formatação, com os índices das
+    linhas e das colunas (ver _get_analysis_data), em JSON compacto. Usada
+    pelo modo 'dados' da página; vem do cache enquanto os dados não mudarem
+    e responde 304 quando o cliente já tem a versão atual.
+    """
+    uploaded_file = get_object_or_404(UploadedFile, file_id=file_id)
+    try:
+        dados = obter_contexto_analise(uploaded_file, _get_analysis_data, VARIANTE_DADOS)
+    except Exception as e:
+        logger.error(f"Erro ao carregar os dados da análise: {str(e)}")
+        return JsonResponse({'success': False, 'message': 'Erro interno ao carregar os dados.'}, status=500)
+
+    if dados is None:
+        return JsonResponse({'success': False, 'message': 'Nenhum dado encontrado para este arquivo.'}, status=404)
+    return JsonResponse({'success': True, **dados}, json_dumps_params=JSON_COMPACTO)
+
+
+def _arquivos_comparados(request):
+    """
+    Arquivos escolhidos em ?arquivos=<id>&arquivos=<id>..., em ordem de
+    upload (a ordem dos meses). Levanta ValueError se houver menos de 2 ou
+    mais de CUSTOS_COMPARACAO_MAX_ARQUIVOS ids, ou um id inválido, e
+    UploadedFile.DoesNotExist se algum arquivo não existir.
+    """
+    ids = list(dict.fromkeys(request.GET.getlist('arquivos')))
+    maximo = getattr(settings, 'CUSTOS_COMPARACAO_MAX_ARQUIVOS', 60)
+    if not 2 <= len(ids) <= maximo:
+        raise ValueError(f"Selecione de 2 a {maximo} análises para comparar.")
+    try:
+        ids = [uuid.UUID(file_id) for file_id in ids]
+    except ValueError:
+        raise ValueError("Identificador de análise inválido.")
+
+    arquivos = list(UploadedFile.objects.filter(file_id__in=ids).order_by('upload_date', 'name'))
+    if len(arquivos) != len(ids):
+        raise UploadedFile.DoesNotExist("Uma das análises selecionadas não foi encontrada.")
+    return arquivos
+
+
+def formatar_variacao_html(percentual):
+    """
+    Formata a variação percentual de um custo: em vermelho se subiu, em
+    verde se caiu e um traço quando não há base de comparação (None).
+    """
+    if percentual is None:
+        return '<span class="text-xs text-gray-400">—</span>'
+    cor_classe = "text-red-600" if percentual > 0 else "text-green-600" if percentual < 0 else "text-gray-400"
+    return f'<span class="text-xs font-semibold {cor_classe}">({percentual:+.2f}%)</span>'
+
+
+def _contexto_comparacao(resultado):
+    """
+    Formata o resultado de comparar_arquivos para o template comparacao.html.
+    """
+    def celulas(totais, crescimento):
+        # O primeiro arquivo não tem variação; os demais, a variação em relação ao anterior.
+        variacoes = [None, *crescimento]
+        return [
+            {'valor': formatar_moeda(total), 'variacao': formatar_variacao_html(variacao) if i else ''}
+            for i, (total, variacao) in enumerate(zip(totais, variacoes))
+        ]
+
+    areas = resultado['areas']
+    # As listas vêm por arquivo (arquivos x áreas); a tabela tem uma linha por área.
+    totais_areas = zip(*areas['totais'])
+    crescimento_areas = zip(*areas['crescimento'])
+
+    def ranking(itens):
+        return [
+            {
+                'nome': item['nome'],
+                'inicial': formatar_moeda(item['inicial']),
+                'final': formatar_moeda(item['final']),
+                'delta': formatar_moeda(item['delta']),
+                'variacao': formatar_variacao_html(item['crescimento']),
+            }
+            for item in itens
+        ]
+
+    total_geral = resultado['total_geral']
+    return {
+        'arquivos': resultado['arquivos'],
+        'total_geral': celulas(total_geral['totais'], total_geral['crescimento']),
+        'areas': [
+            {'nome': nome, 'celulas': celulas(totais, crescimento)}
+            for nome, totais, crescimento in zip(areas['nomes'], totais_areas, crescimento_areas)
+        ],
+        'rankings': [
+            ('Contas que mais cresceram', 'fa-arrow-trend-up text-red-500', ranking(resultado['contas']['ranking']['altas'])),
+            ('Contas que mais caíram', 'fa-arrow-trend-down text-green-500', ranking(resultado['contas']['ranking']['quedas'])),
+        ],
+    }
+
+
+def comparison_view(request):
+    """
+    Página de comparação entre análises (uma por mês): totais por área em
+    cada arquivo, com a variação em relação ao anterior, e as contas que mais
+    cresceram e mais caíram no período.
+    """
+    try:
+        arquivos = _arquivos_comparados(request)
+        resultado = comparar_arquivos(arquivos)
+    except (ValueError, UploadedFile.DoesNotExist) as e:
+        messages.error(request, str(e))
+        return redirect('upload_file')
+    except Exception as e:
+        logger.error(f"Erro ao comparar as análises: {str(e)}")
+        messages.error(request, "Erro interno ao comparar as análises.")
+        return redirect('upload_file')
+
+    context = _contexto_comparacao(resultado)
+    context['dados_url'] = f"{reverse('comparison_data')}?{request.GET.urlencode()}"
+    return render(request, 'comparacao.html', context)
+
+
+def comparison_data_view(request):
+    """
+    API da comparação entre análises: o resultado de comparar_arquivos em
+    JSON compacto. ?limite= define o tamanho dos rankings de crescimento.
+    """
+    try:
+        arquivos = _arquivos_comparados(request)
+        limite = _parametro_inteiro(request, 'limite', LIMITE_RANKING, 1, 1000)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+    except UploadedFile.DoesNotExist as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=404)
+
+    try:
+        resultado = comparar_arquivos(arquivos, limite)
+    except Exception as e:
+        logger.error(f"Erro ao comparar as análises: {str(e)}")
+        return JsonResponse({'success': False, 'message': 'Erro interno ao comparar as análises.'}, status=500)
+    return JsonResponse({'success': True, **resultado}, json_dumps_params=JSON_COMPACTO)
+
+
 # -----------------------------------------------------------------------------
 # DEMAIS FUNÇÕES (sem alterações significativas, incluídas para completude)
 # -----------------------------------------------------------------------------
@@ -240,6 +898,7 @@ def delete_file_view(request, file_id):
     """
     try:
         file = get_object_or_404(UploadedFile, file_id=file_id)
+        remover_contexto(file)
         file.delete()
         messages.success(request, f"Análise '{file.name}' excluída com sucesso.")
     except Exception as e:
@@ -258,6 +917,7 @@ def edit_file_name_view(request, file_id):
         if new_name and new_name.strip() != "":
             file.name = new_name.strip()
             file.save()
+            invalidar_contexto(file)
             return JsonResponse({'success': True, 'message': 'Nome da análise atualizado com sucesso.'})
         else:
             return JsonResponse({'success': False, 'message': 'O novo nome não pode ser vazio.'}, status=400)
@@ -266,13 +926,41 @@ def edit_file_name_view(request, file_id):
         return JsonResponse({'success': False, 'message': 'Erro interno ao editar o nome.'}, status=500)
 
 
+def cache_stats_view(request):
+    """
+    Retorna os contadores de acertos e falhas do cache da análise.
+    """
+    return JsonResponse(estatisticas_cache())
+
+
+def metrics_view(request):
+    """
+    Métricas do processo no formato de texto do Prometheus: requisições,
+    consultas SQL, trechos instrumentados, cache da análise e fila de
+    uploads. Só responde para os IPs de CUSTOS_METRICAS_IPS.
+    """
+    if request.META.get('REMOTE_ADDR') not in getattr(settings, 'CUSTOS_METRICAS_IPS', ['127.0.0.1', '::1']):
+        return HttpResponseForbidden("Métricas disponíveis apenas localmente.")
+
+    # Os acertos e falhas do cache da análise já estão nos contadores do processo.
+    jobs = metricas_fila()['jobs_por_status']
+    extras = [
+        ('custos_fila_jobs', 'gauge', "Jobs de upload por status.", [
+            ((('status', status),), quantidade) for status, quantidade in jobs.items()
+        ]),
+    ]
+    return HttpResponse(exportar_prometheus(extras), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@medido
 def processar_arquivo_excel(uploaded_file):
     """
     Processa o arquivo Excel, lê os dados, limpa e organiza as tabelas.
     Retorna um dicionário com os dados prontos para uso.
     """
     try:
-        df_original = pd.read_excel(uploaded_file, header=None)
+        with medir('leitura_excel'):
+            df_original = pd.read_excel(uploaded_file, header=None)
     except Exception as e:
         raise ValueError(f"Não foi possível ler o arquivo. Certifique-se de que é um arquivo Excel válido (.xlsx ou .xls). Erro: {e}")
 
@@ -282,25 +970,7 @@ def processar_arquivo_excel(uploaded_file):
     header_areas = df_original.iloc[0, :].ffill()
     header_ids = df_original.iloc[1, :]
     
-    new_columns = []
-    for i in range(len(df_original.columns)):
-        area = str(header_areas.iloc[i]).strip() if pd.notna(header_areas.iloc[i]) else ''
-        id_val = str(header_ids.iloc[i]).strip() if pd.notna(header_ids.iloc[i]) else ''
-        
-        if id_val in ['ID', 'CONTA']:
-            new_columns.append(id_val)
-            continue
-
-        if area and id_val:
-            new_columns.append(f"{area} - {id_val}")
-        elif area:
-            new_columns.append(area)
-        elif id_val:
-            new_columns.append(id_val)
-        else:
-            new_columns.append(f'Coluna_Vazia_{i+1}')
-            
-    df_original.columns = new_columns
+    df_original.columns = nomear_colunas(header_areas.tolist(), header_ids.tolist())
     df_dados = df_original.iloc[2:].reset_index(drop=True)
     
     colunas_necessarias = ['ID', 'CONTA']
@@ -315,48 +985,32 @@ def processar_arquivo_excel(uploaded_file):
     ].copy()
     
     colunas_dados = [col for col in df_despesas.columns if col not in ['ID', 'CONTA']]
-    df_despesas_only = df_despesas[colunas_dados].copy()
     
-    for col in colunas_dados:
-        df_despesas_only[col] = (
-            df_despesas_only[col]
-            .astype(str)
-            .str.replace(r'[^\d,\.-]', '', regex=True)
-            .str.replace(',', '.', regex=False)
-            .apply(pd.to_numeric, errors='coerce')
-            .fillna(0)
+    # Todas as colunas de dados são convertidas de uma vez (ver planilha.converter_dataframe).
+    with medir('limpeza_colunas'):
+        df_despesas_only = pd.DataFrame(
+            converter_dataframe(df_despesas[colunas_dados]), columns=colunas_dados, index=df_despesas.index,
         )
     
     df_despesas_only['TOTAL (LINHA)'] = df_despesas_only[colunas_dados].sum(axis=1)
     
-    total_geral = df_despesas_only['TOTAL (LINHA)'].sum()
-    
     tabela_principal_df = df_despesas.copy()
     tabela_principal_df['TOTAL (LINHA)'] = df_despesas_only['TOTAL (LINHA)']
     
-    analise_area_html, analise_area_df = preparar_analise_area(df_despesas_only, colunas_dados, total_geral)
-    analise_conta_html, modal_data = preparar_analise_conta(df_despesas, df_despesas_only, colunas_dados, total_geral)
-    areas_zeradas_html, areas_zeradas_df = preparar_areas_zeradas(analise_area_df)
-
+    # Os resumos (por área, por conta e áreas zeradas) não são montados aqui:
+    # a ingestão grava os agregados e a análise os lê (ver agregados).
     return {
         'tabela_principal': tabela_principal_df.to_dict('records'),
         'colunas_dados': colunas_dados,
         'df_despesas_only': df_despesas_only.to_dict('records'),
     }
 
-def preparar_analise_area(df_despesas_only, colunas_dados, total_geral):
+@medido
+def renderizar_analise_area(area_sums, total_geral):
     """
-    Prepara a análise por área.
+    Gera a tabela de análise por área a partir da soma de cada área (dos
+    agregados gravados).
     """
-    area_sums = pd.Series(0, index=pd.Index([], name='Area'))
-    for col in colunas_dados:
-        parts = col.rsplit(' - ', 1)
-        area_name = parts[0].strip()
-        if area_name in area_sums.index:
-            area_sums[area_name] += df_despesas_only[col].sum()
-        else:
-            area_sums[area_name] = df_despesas_only[col].sum()
-
     df_analise = area_sums.reset_index()
     df_analise.columns = ['Area', 'Valor Total (R$)']
     df_analise.sort_values(by='Valor Total (R$)', ascending=False, inplace=True)
@@ -368,50 +1022,68 @@ def preparar_analise_area(df_despesas_only, colunas_dados, total_geral):
     df_analise_html = pd.concat([df_analise_html, total_row], ignore_index=True)
     
     df_analise_html['Valor Total (R$)'] = df_analise_html['Valor Total (R$)'].apply(lambda x: formatar_moeda(x))
-    df_analise_html['Percentual (%)'] = df_analise_html['Percentual (%)'].apply(
-        lambda x: f'<span class="text-sm font-semibold text-blue-600">({x:.2f}%)</span>' if x > 0 else f'<span class="text-sm font-semibold text-gray-400">({x:.2f}%)</span>'
-    )
+    df_analise_html['Percentual (%)'] = df_analise_html['Percentual (%)'].apply(formatar_percentual_html)
     
     return df_analise_html.to_html(classes='table table-bordered table-hover', index=False, escape=False), df_analise
 
-def preparar_analise_conta(df_despesas, df_despesas_only, colunas_dados, total_geral):
+@medido
+def renderizar_analise_conta(ids, contas, valores, total_geral):
     """
-    Prepara a análise por conta e os dados para os modais.
+    Gera a tabela de análise por conta a partir do valor de cada linha (os
+    totais gravados das linhas). Os valores por área de cada conta (modal de
+    detalhes) não vão na página: são buscados em analysis_account_view.
     """
-    df_por_conta = df_despesas[['ID', 'CONTA']].copy()
-    df_por_conta['Valor Total (R$)'] = df_despesas_only[colunas_dados].sum(axis=1)
+    df_por_conta = pd.DataFrame({'ID': ids, 'CONTA': contas, 'Valor Total (R$)': valores})
     df_por_conta['Percentual (%)'] = (df_por_conta['Valor Total (R$)'] / total_geral) * 100 if total_geral > 0 else 0
-    df_por_conta.sort_values(by='Valor Total (R$)', ascending=False, inplace=True)
-
-    modal_data = {}
-    for conta_name in df_por_conta['CONTA'].unique():
-        conta_rows_mask = df_despesas['CONTA'] == conta_name
-        conta_rows = df_despesas_only.loc[conta_rows_mask, colunas_dados]
-        area_sums = conta_rows.sum(axis=0)
-        area_data = area_sums[area_sums != 0].reset_index().rename(
-            columns={'index': 'Area', 0: 'Valor (R$)'}
-        )
-        area_data['Valor (R$)'] = area_data['Valor (R$)'].apply(lambda x: round(x, 2))
-        modal_data[conta_name] = area_data.to_dict('records')
+    df_por_conta.sort_values(by='Valor Total (R$)', ascending=False, inplace=True, kind='stable')
 
     total_row = pd.DataFrame([{'CONTA': 'TOTAL GERAL', 'ID': '', 'Valor Total (R$)': df_por_conta['Valor Total (R$)'].sum(), 'Percentual (%)': 100.0, 'Ações': ''}])
     
     df_completo = pd.concat([df_por_conta, total_row], ignore_index=True)
     
+    # O percentual das contas leva o valor em data-value para que o frontend
+    # recalcule os percentuais quando o total geral mudar.
+    df_completo['Percentual (%)'] = [
+        formatar_percentual_html(percentual, valor if conta != 'TOTAL GERAL' else None)
+        for conta, valor, percentual in zip(
+            df_completo['CONTA'], df_completo['Valor Total (R$)'], df_completo['Percentual (%)']
+        )
+    ]
     df_completo['Valor Total (R$)'] = df_completo['Valor Total (R$)'].apply(lambda x: formatar_moeda(x))
-    # --- AJUSTE APLICADO AQUI ---
-    df_completo['Percentual (%)'] = df_completo['Percentual (%)'].apply(
-        lambda x: f'<span class="text-sm font-semibold text-blue-600">({x:.2f}%)</span>' if x > 0 else f'<span class="text-sm font-semibold text-gray-400">({x:.2f}%)</span>'
-    )
     
-    df_completo['Ações'] = df_completo['CONTA'].apply(
-        lambda x: f'<button class="view-details-btn bg-indigo-500 hover:bg-indigo-700 text-white font-bold py-1 px-3 rounded-full text-xs transition-colors duration-200" data-conta="{x}">Ver valores por Area</button>' if x != 'TOTAL GERAL' else ''
-    )
+    df_completo['Ações'] = [
+        formatar_botao_conta_html(conta, id_excel) if conta != 'TOTAL GERAL' else ''
+        for conta, id_excel in zip(df_completo['CONTA'], df_completo['ID'])
+    ]
     
     return df_completo[['CONTA', 'Valor Total (R$)', 'Percentual (%)', 'Ações']].to_html(
         classes='table table-bordered table-hover', index=False, escape=False
-    ), modal_data
+    )
+
+def formatar_valores_da_conta(area_sums):
+    """
+    Formata as somas por coluna de uma conta para o modal de detalhes,
+    descartando as colunas zeradas.
+    """
+    return _registros_da_conta(area_sums.index, area_sums.to_numpy(dtype=float))
 
+def _registros_da_conta(colunas, somas):
+    return [
+        {'Area': colunas[i], 'Valor (R$)': round(float(somas[i]), 2)}
+        for i in np.flatnonzero(somas)
+    ]
+
+@medido
+def agrupar_valores_por_conta(contas, df_despesas_only, colunas_dados):
+    """
+    Soma as colunas de dados por conta com um único groupby e retorna
+    {conta: valores formatados como em formatar_valores_da_conta}.
+    """
+    somas = df_despesas_only[colunas_dados].groupby(np.asarray(contas, dtype=object), sort=False).sum()
+    valores = somas.to_numpy(dtype=float)
+    return {conta: _registros_da_conta(colunas_dados, valores[i]) for i, conta in enumerate(somas.index)}
+
+@medido
 def preparar_areas_zeradas(df_analise_data):
     """
     Prepara a tabela de áreas com despesas zeradas.
@@ -429,43 +1101,87 @@ def preparar_areas_zeradas(df_analise_data):
         )
         return df_zeradas_html.to_html(classes='table table-bordered table-hover', index=False, escape=False), df_zeradas
 
-def preparar_tabela_principal_html(df_completo, colunas_dados):
+@medido
+def preparar_tabela_principal_html(df_completo, colunas_dados, totais_colunas=None):
     """
-    Prepara a tabela principal formatada para HTML.
+    Prepara a tabela principal formatada para HTML. A linha de totais usa
+    'totais_colunas' (agregados do arquivo) quando informado.
+
+    As células são geradas em lote: os percentuais são calculados com NumPy
+    sobre a matriz inteira, cada valor distinto é formatado uma única vez e o
+    HTML é montado com join, no mesmo formato produzido por DataFrame.to_html.
     """
-    df_html = df_completo[['ID', 'CONTA']].copy()
-    
-    for col in colunas_dados:
-        df_html[col] = df_completo.apply(
-            lambda row: formatar_celula_html(row.get(col, 0), row.get('TOTAL (LINHA)', 0)), 
-            axis=1
-        )
-    
-    df_html['TOTAL (LINHA)'] = df_completo.apply(
-        lambda row: (
-            f'<button class="update-total-btn bg-blue-500 hover:bg-blue-700 text-white font-bold '
-            f'py-1 px-3 rounded-full text-xs transition-colors duration-200" '
-            f'data-row-total="{row.get("TOTAL (LINHA)", 0):.2f}" '
-            f'data-id-excel="{row.get("ID", "")}">'
-            f'{formatar_moeda(row.get("TOTAL (LINHA)", 0))}'
-            f'</button>'
-        ),
-        axis=1
-    )
-    
-    total_row_dict = {'CONTA': 'TOTAL GERAL', 'ID': ''}
+    ids = df_completo['ID'].tolist()
+    contas = df_completo['CONTA'].tolist()
+    totais_linhas = df_completo['TOTAL (LINHA)'].to_numpy(dtype=float)
+    valores = df_completo[colunas_dados].to_numpy(dtype=float).reshape(len(df_completo), len(colunas_dados))
+
+    # Mesma regra de formatar_celula_html: sem total positivo, a célula fica zerada.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percentuais = (valores / totais_linhas[:, None]) * 100
+    validas = ~np.isnan(valores) & (totais_linhas > 0)[:, None]
+
+    celulas = np.full(valores.shape, formatar_celula_html(0, 0), dtype=object)
+    valores_validos = valores[validas]
+    textos_valores = formatar_em_lote(valores_validos, '{:.2f}'.format)
+    textos_percentuais = formatar_em_lote(percentuais[validas], '{:.2f}'.format)
+    textos_moeda = formatar_em_lote(valores_validos, formatar_moeda)
+    cores = np.where(valores_validos > 0, 'text-blue-600', 'text-gray-400').tolist()
+    # Mesmo HTML de formatar_celula_html, montado com f-string (bem mais rápido que str.format).
+    celulas[validas] = [
+        f'<div class="flex flex-col items-center"><span class="font-semibold" data-value="{valor}" '
+        f'data-percentage="{percentual}">{moeda}</span><span class="text-sm font-semibold {cor}">({percentual}%)</span></div>'
+        for valor, percentual, moeda, cor in zip(textos_valores, textos_percentuais, textos_moeda, cores)
+    ]
+
+    botoes_total = [
+        formatar_botao_total_html(total, id_excel) for total, id_excel in zip(totais_linhas.tolist(), ids)
+    ]
+
     total_geral = df_completo['TOTAL (LINHA)'].sum()
-    
-    for col in colunas_dados:
-        total_value_col = df_completo[col].sum()
-        total_row_dict[col] = formatar_celula_total_html(total_value_col, total_geral)
-    
-    total_row_dict['TOTAL (LINHA)'] = f'<div class="font-bold">{formatar_moeda(total_geral)}</div>'
-    
-    total_row_df = pd.DataFrame([total_row_dict])
-    df_final = pd.concat([df_html, total_row_df], ignore_index=True)
-    
-    return df_final.to_html(classes='w-full text-sm', index=False, escape=False, border=0)
+    if totais_colunas is None:
+        totais_colunas = [df_completo[col].sum() for col in colunas_dados]
+    linha_totais = [formatar_celula_total_html(total, total_geral) for total in totais_colunas]
+
+    linhas_html = [
+        _linha_tabela_html([id_excel, conta, *celulas_linha, botao])
+        for id_excel, conta, celulas_linha, botao in zip(ids, contas, celulas.tolist(), botoes_total)
+    ]
+    linhas_html.append(_linha_tabela_html(['', 'TOTAL GERAL', *linha_totais, formatar_total_geral_html(total_geral)]))
+
+    cabecalho = ''.join(f'      <th>{col}</th>\n' for col in ['ID', 'CONTA', *colunas_dados, 'TOTAL (LINHA)'])
+
+    return (
+        '<table class="dataframe w-full text-sm">\n'
+        '  <thead>\n'
+        '    <tr style="text-align: right;">\n'
+        f'{cabecalho}'
+        '    </tr>\n'
+        '  </thead>\n'
+        '  <tbody>\n'
+        f'{"".join(linhas_html)}'
+        '  </tbody>\n'
+        '</table>'
+    )
+
+def _linha_tabela_html(celulas):
+    """
+    Monta uma linha <tr> no formato de DataFrame.to_html.
+    """
+    return '    <tr>\n      <td>' + '</td>\n      <td>'.join(map(str, celulas)) + '</td>\n    </tr>\n'
+
+def formatar_em_lote(valores, formatar):
+    """
+    Aplica 'formatar' uma única vez a cada valor distinto de 'valores' e
+    devolve a lista de textos na ordem original. Os valores são comparados
+    pelos bits, para que 0.0 e -0.0 continuem sendo formatados à parte.
+    """
+    valores = np.ascontiguousarray(valores, dtype=np.float64).ravel()
+    if valores.size == 0:
+        return []
+    bits, inverso = np.unique(valores.view(np.int64), return_inverse=True)
+    textos = np.array([formatar(valor) for valor in bits.view(np.float64).tolist()], dtype=object)
+    return textos[inverso.ravel()].tolist()
 
 def formatar_celula_html(valor, total_linha):
     """
@@ -495,6 +1211,44 @@ def formatar_celula_total_html(valor, total_geral):
     else:
         return f'<div class="flex flex-col font-bold"><span class="text-gray-800" data-value="0.00" data-percentage="0.00">{formatar_moeda(0)}</span><span class="text-sm font-semibold text-gray-400">(0.00%)</span></div>'
 
+def formatar_botao_total_html(total_linha, id_excel):
+    """
+    Formata o botão com o total da linha, que abre o modal de atualização.
+    """
+    return (
+        f'<button class="update-total-btn bg-blue-500 hover:bg-blue-700 text-white font-bold '
+        f'py-1 px-3 rounded-full text-xs transition-colors duration-200" '
+        f'data-row-total="{total_linha:.2f}" '
+        f'data-id-excel="{id_excel}">'
+        f'{formatar_moeda(total_linha)}'
+        f'</button>'
+    )
+
+def formatar_total_geral_html(total_geral):
+    """
+    Formata a célula do total geral na linha de totais da tabela principal.
+    """
+    return f'<div class="font-bold">{formatar_moeda(total_geral)}</div>'
+
+def formatar_botao_conta_html(conta, id_excel):
+    """
+    Formata o botão que abre o modal com os valores por área de uma conta.
+    """
+    return (
+        f'<button class="view-details-btn bg-indigo-500 hover:bg-indigo-700 text-white font-bold '
+        f'py-1 px-3 rounded-full text-xs transition-colors duration-200" '
+        f'data-conta="{conta}" data-id-excel="{id_excel}">Ver valores por Area</button>'
+    )
+
+def formatar_percentual_html(percentual, valor=None):
+    """
+    Formata um percentual entre parênteses, em azul se positivo.
+    Se 'valor' for informado, ele vai no atributo data-value.
+    """
+    cor_classe = "text-blue-600" if percentual > 0 else "text-gray-400"
+    data_value = f' data-value="{valor:.2f}"' if valor is not None else ''
+    return f'<span class="text-sm font-semibold {cor_classe}"{data_value}>({percentual:.2f}%)</span>'
+
 def formatar_moeda(valor):
     """
     Formata um valor numérico como moeda brasileira (R$).
@@ -513,64 +1267,100 @@ def clear_session_view(request):
     messages.info(request, "Dados da sessão limpos com sucesso. Faça upload de um novo arquivo.")
     return redirect('upload_file')
 
+@condicional(_variante_download)
 def download_file_view(request, file_id):
     """
-    Visualização para permitir o download do arquivo Excel reconstruído.
+    Visualização para permitir o download do arquivo reconstruído.
+    Por padrão um .xlsx; com ?formato=csv, um CSV, e com ?formato=parquet
+    (pyarrow instalado), um Parquet. Com CUSTOS_ARTEFATOS o arquivo é gerado
+    uma vez por versão dos dados e enviado do disco (ver artefatos); sem
+    ele, o .xlsx é gerado a cada download e o CSV enviado em streaming.
+    Quando o cliente já tem a versão atual, responde 304 sem gerar o arquivo.
     """
     uploaded_file = get_object_or_404(UploadedFile, file_id=file_id)
-    expense_data = uploaded_file.expenses.all()
 
-    if not expense_data.exists():
+    if not uploaded_file.expenses.exists():
         messages.warning(request, "Não há dados para este arquivo. Não é possível fazer o download.")
         return redirect('upload_file')
 
-    rows = []
-    data_columns = list(expense_data.first().data.keys()) if expense_data else []
+    formato = request.GET.get('formato', 'xlsx')
+    if usar_artefatos():
+        try:
+            return resposta_artefato(uploaded_file, formato)
+        except ValueError as e:
+            messages.error(request, str(e))
+        except Exception as e:
+            logger.error(f"Erro ao gerar a planilha do arquivo {file_id}: {str(e)}")
+            messages.error(request, "Não foi possível gerar a planilha para download.")
+        return redirect('upload_file')
 
-    for item in expense_data:
-        row_dict = {'ID': item.id_excel, 'CONTA': item.account}
-        row_dict.update(item.data)
-        rows.append(row_dict)
+    if formato == 'csv':
+        response = StreamingHttpResponse(gerar_csv(uploaded_file), content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="{uploaded_file.name}_reconstruido.csv"'
+        return response
 
-    df_reconstruido = pd.DataFrame(rows)
-    
-    output = io.BytesIO()
-    
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        workbook = writer.book
-        worksheet = workbook.add_worksheet('Planilha Reconstruída')
+    try:
+        arquivo = exportar_xlsx_temporario(uploaded_file)
+    except Exception as e:
+        logger.error(f"Erro ao gerar a planilha do arquivo {file_id}: {str(e)}")
+        messages.error(request, "Não foi possível gerar a planilha para download.")
+        return redirect('upload_file')
 
-        header_format = workbook.add_format({
-            'bold': True, 'align': 'center', 'valign': 'vcenter', 
-            'border': 1, 'bg_color': '#D0D0D0'
-        })
-        
-        area_headers = ['', '']
-        id_headers = ['ID', 'CONTA']
-
-        for col in data_columns:
-            parts = col.rsplit(' - ', 1)
-            if len(parts) > 1:
-                area_headers.append(parts[0].strip())
-                id_headers.append(parts[1].strip())
-            else:
-                area_headers.append(parts[0].strip())
-                id_headers.append('')
-
-        worksheet.write_row('A1', area_headers, header_format)
-        worksheet.write_row('A2', id_headers, header_format)
-        
-        data_to_write_df = df_reconstruido[['ID', 'CONTA'] + data_columns]
-        for row_num, row_data in enumerate(data_to_write_df.values.tolist()):
-            worksheet.write_row(row_num + 2, 0, row_data)
-            
-    output.seek(0)
-    file_name = f"{uploaded_file.name}_reconstruido.xlsx"
-    response = HttpResponse(
-        output.getvalue(),
+    # O FileResponse envia o arquivo temporário em dados e o fecha (e apaga) no final.
+    return FileResponse(
+        arquivo,
+        as_attachment=True,
+        filename=f"{uploaded_file.name}_reconstruido.xlsx",
         content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
     )
-    response['Content-Disposition'] = f'attachment; filename="{file_name}"'
-    
-    return response
 
+
+@condicional(_variante_download)
+async def download_file_async_view(request, file_id):
+    """
+    Versão assíncrona de download_file_view (CUSTOS_VIEWS_ASSINCRONAS). Os
+    artefatos que ainda não existem são gerados no pool de processos. Sem
+    CUSTOS_ARTEFATOS, o CSV é gerado com o ORM assíncrono e o .xlsx no pool,
+    em um arquivo temporário apagado depois do envio.
+    """
+    uploaded_file = await aget_object_or_404(UploadedFile, file_id=file_id)
+
+    if not await uploaded_file.expenses.aexists():
+        messages.warning(request, "Não há dados para este arquivo. Não é possível fazer o download.")
+        return redirect('upload_file')
+
+    formato = request.GET.get('formato', 'xlsx')
+    if usar_artefatos():
+        try:
+            if not caminho_artefato(uploaded_file, formato_download(formato)).exists():
+                await executar_em_processo(gerar_artefato_por_id, file_id, formato_download(formato))
+            return await sync_to_async(resposta_artefato)(uploaded_file, formato)
+        except PoolOcupado as e:
+            return _resposta_ocupado(str(e))
+        except ValueError as e:
+            messages.error(request, str(e))
+        except Exception as e:
+            logger.error(f"Erro ao gerar a planilha do arquivo {file_id}: {str(e)}")
+            messages.error(request, "Não foi possível gerar a planilha para download.")
+        return redirect('upload_file')
+
+    if formato == 'csv':
+        response = StreamingHttpResponse(agerar_csv(uploaded_file), content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="{uploaded_file.name}_reconstruido.csv"'
+        return response
+
+    try:
+        caminho = await executar_em_processo(exportar_xlsx_em_caminho, file_id)
+    except PoolOcupado as e:
+        return _resposta_ocupado(str(e))
+    except Exception as e:
+        logger.error(f"Erro ao gerar a planilha do arquivo {file_id}: {str(e)}")
+        messages.error(request, "Não foi possível gerar a planilha para download.")
+        return redirect('upload_file')
+
+    return FileResponse(
+        ArquivoTemporario(caminho),
+        as_attachment=True,
+        filename=f"{uploaded_file.name}_reconstruido.xlsx",
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    )